@@ -1,131 +1,278 @@
 -- AgentWall ClickHouse Schema
 -- Time-series logs for agent requests/responses
+--
+-- Written by fastapi/services/clickhouse_client.py:
+--   request_logs   <- RequestLog (batched)
+--   messages       <- request messages, once per team (services/message_store.py)
+--   run_summary    <- RunSummary (coalesced per run, see run_summary_totals)
+--   loop_patterns  <- LoopPattern
+-- Maintained at insert time by materialized views over request_logs:
+--   run_rollup, agent_logs_hourly, agent_logs_daily
+--
+-- Existing deployments (agent_logs schema): see clickhouse/migrations/
 
 -- Create database
 CREATE DATABASE IF NOT EXISTS agentwall;
 
 USE agentwall;
 
--- Main logs table (partitioned by month)
-CREATE TABLE IF NOT EXISTS agent_logs (
+-- Main request log: one row per proxied request, columns match RequestLog
+CREATE TABLE IF NOT EXISTS request_logs (
     -- Identifiers
-    log_id UUID DEFAULT generateUUIDv4(),
     run_id String,
-    user_id String,
+    step_number UInt32,
+    request_id String,
     team_id String,
-    agent_id String,
+    user_id String,
     api_key_id String,
-    
+    agent_id String,
+    agent_name String,
+
     -- Timestamps (partitioning key)
     timestamp DateTime64(3) DEFAULT now64(3),
     date Date DEFAULT toDate(timestamp),
-    
+
     -- Request metadata
-    request_method String,
-    request_path String,
-    request_model String,
-    request_stream Bool,
-    
-    -- Request/Response content (compressed)
-    request_messages String CODEC(ZSTD(3)),
-    response_content String CODEC(ZSTD(3)),
-    
-    -- Response metadata
-    response_status UInt16,
-    response_finish_reason String,
-    
+    model LowCardinality(String),
+    provider LowCardinality(String),
+    endpoint LowCardinality(String),
+
     -- Metrics
-    latency_ms UInt32,
-    tokens_prompt UInt32,
-    tokens_completion UInt32,
-    tokens_total UInt32,
+    prompt_tokens UInt32,
+    completion_tokens UInt32,
+    total_tokens UInt32,
     cost_usd Float64,
-    
-    -- Agent Firewall specific
-    step_number UInt16,
-    is_streaming Bool,
-    
-    -- Loop Detection
-    is_loop_detected Bool DEFAULT false,
-    loop_reason String,
-    loop_similarity Float32,
-    
-    -- DLP (Data Loss Prevention)
-    is_sensitive_detected Bool DEFAULT false,
-    sensitive_types Array(String),
-    is_redacted Bool DEFAULT false,
-    redaction_mode String,
-    
-    -- Budget & Limits
-    is_budget_exceeded Bool DEFAULT false,
-    is_step_limit_exceeded Bool DEFAULT false,
-    is_timeout_exceeded Bool DEFAULT false,
-    
-    -- Tool calls (if any)
-    tool_calls_count UInt16,
-    tool_names Array(String),
-    
-    -- Error tracking
-    is_error Bool DEFAULT false,
-    error_type String,
+    latency_ms UInt32,
+    overhead_ms Int32,
+    ttfb_ms UInt32,
+
+    -- Stage timing breakdown (ms, see services.stage_timer)
+    auth_ms Float32,
+    admission_ms Float32,
+    loop_check_ms Float32,
+    queue_ms Float32,
+    upstream_connect_ms Float32,
+    upstream_ttfb_ms Float32,
+    upstream_ms Float32,
+    dlp_ms Float32,
+    post_check_ms Float32,
+
+    -- Outcome (499 = client disconnected mid-stream)
+    status_code UInt16,
     error_message String,
-    
+
+    -- Agent Firewall
+    loop_detected Bool DEFAULT false,
+    similarity_score Float32,
+    dlp_triggered Bool DEFAULT false,
+    dlp_action LowCardinality(String),
+
+    -- Request/Response content (compressed). The request's messages are
+    -- stored once each in `messages`; message_hashes lists them in order.
+    -- request_messages is only set on rows logged before that.
+    message_hashes Array(FixedString(32)) CODEC(ZSTD(3)),
+    request_messages String CODEC(ZSTD(3)),
+    response_content String CODEC(ZSTD(3)),
+
+    -- Client
+    ip_address String,
+    user_agent String,
+    metadata String,
+
     -- Indexes for fast lookups
     INDEX idx_run_id run_id TYPE bloom_filter GRANULARITY 1,
     INDEX idx_user_id user_id TYPE bloom_filter GRANULARITY 1,
-    INDEX idx_team_id team_id TYPE bloom_filter GRANULARITY 1,
     INDEX idx_agent_id agent_id TYPE bloom_filter GRANULARITY 1,
-    INDEX idx_loop_detected is_loop_detected TYPE set(2) GRANULARITY 1,
-    INDEX idx_sensitive_detected is_sensitive_detected TYPE set(2) GRANULARITY 1
+    INDEX idx_loop_detected loop_detected TYPE set(2) GRANULARITY 1,
+
+    -- "All steps of run X, in order": a copy of the rows sorted by run,
+    -- picked automatically for WHERE run_id = ... ORDER BY step_number
+    PROJECTION p_run_steps (
+        SELECT *
+        ORDER BY run_id, step_number
+    )
 )
 ENGINE = MergeTree()
 PARTITION BY toYYYYMM(date)
-ORDER BY (team_id, user_id, timestamp)
+ORDER BY (team_id, timestamp)
 TTL date + INTERVAL 90 DAY DELETE
 SETTINGS index_granularity = 8192;
 
--- Materialized view for real-time analytics
+-- Conversation messages, content-addressed: message_hash is the blake2b-128
+-- of the message's canonical JSON (`message`). Each worker skips messages it
+-- wrote recently; other duplicates collapse on merge (read with GROUP BY
+-- message_hash or FINAL). Messages still in use are rewritten daily, which
+-- refreshes last_seen, so the TTL only drops messages no log references.
+CREATE TABLE IF NOT EXISTS messages (
+    team_id String,
+    message_hash FixedString(32),
+    role LowCardinality(String),
+    message String CODEC(ZSTD(3)),
+    last_seen DateTime DEFAULT now()
+)
+ENGINE = ReplacingMergeTree(last_seen)
+PARTITION BY toYYYYMM(last_seen)
+ORDER BY (team_id, message_hash)
+TTL last_seen + INTERVAL 91 DAY DELETE;
+
+-- Per-run totals, maintained at insert time (one row per run after merges).
+-- Read with GROUP BY team_id, run_id (or FINAL): parts are merged lazily.
+CREATE TABLE IF NOT EXISTS run_rollup (
+    team_id String,
+    run_id String,
+    user_id SimpleAggregateFunction(any, String),
+    agent_id SimpleAggregateFunction(anyLast, String),
+    started_at SimpleAggregateFunction(min, DateTime64(3)),
+    last_activity SimpleAggregateFunction(max, DateTime64(3)),
+
+    request_count SimpleAggregateFunction(sum, UInt64),
+    last_step SimpleAggregateFunction(max, UInt32),
+    total_prompt_tokens SimpleAggregateFunction(sum, UInt64),
+    total_completion_tokens SimpleAggregateFunction(sum, UInt64),
+    total_cost_usd SimpleAggregateFunction(sum, Float64),
+    total_latency_ms SimpleAggregateFunction(sum, UInt64),
+    total_overhead_ms SimpleAggregateFunction(sum, Int64),
+    error_count SimpleAggregateFunction(sum, UInt64),
+    loop_detected SimpleAggregateFunction(max, Bool),
+    dlp_triggered SimpleAggregateFunction(max, Bool),
+    models SimpleAggregateFunction(groupUniqArrayArray, Array(String)),
+
+    -- Status of the last step and latency percentiles (-Merge to read)
+    last_status AggregateFunction(argMax, UInt16, UInt32),
+    latency_quantiles AggregateFunction(quantiles(0.5, 0.95, 0.99), UInt32),
+
+    INDEX idx_run_id run_id TYPE bloom_filter GRANULARITY 1
+)
+ENGINE = AggregatingMergeTree()
+ORDER BY (team_id, run_id);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS run_rollup_mv TO run_rollup
+AS SELECT
+    team_id,
+    run_id,
+    any(user_id) AS user_id,
+    anyLast(agent_id) AS agent_id,
+    min(timestamp) AS started_at,
+    max(timestamp) AS last_activity,
+    toUInt64(count()) AS request_count,
+    max(step_number) AS last_step,
+    toUInt64(sum(prompt_tokens)) AS total_prompt_tokens,
+    toUInt64(sum(completion_tokens)) AS total_completion_tokens,
+    sum(cost_usd) AS total_cost_usd,
+    toUInt64(sum(latency_ms)) AS total_latency_ms,
+    toInt64(sum(overhead_ms)) AS total_overhead_ms,
+    toUInt64(countIf(status_code >= 400)) AS error_count,
+    max(loop_detected) AS loop_detected,
+    max(dlp_triggered) AS dlp_triggered,
+    groupUniqArray(toString(model)) AS models,
+    argMaxState(status_code, step_number) AS last_status,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) AS latency_quantiles
+FROM request_logs
+GROUP BY team_id, run_id;
+
+-- Hourly / daily team rollups, read by the analytics API (services/analytics.py).
+-- SummingMergeTree: numeric columns are summed and latency_quantiles (an
+-- aggregate state) is merged. Parts are merged lazily: read with GROUP BY,
+-- sum() and quantilesMerge().
 CREATE MATERIALIZED VIEW IF NOT EXISTS agent_logs_hourly
 ENGINE = SummingMergeTree()
 PARTITION BY toYYYYMM(date)
-ORDER BY (team_id, user_id, date, hour)
+ORDER BY (team_id, date, hour, agent_id, model, provider, user_id)
 AS SELECT
     team_id,
-    user_id,
-    agent_id,
     date,
     toHour(timestamp) as hour,
+    agent_id,
+    model,
+    provider,
+    user_id,
     count() as request_count,
-    sum(tokens_total) as total_tokens,
+    sum(prompt_tokens) as total_prompt_tokens,
+    sum(completion_tokens) as total_completion_tokens,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
     sum(cost_usd) as total_cost,
     sum(latency_ms) as total_latency,
-    avg(latency_ms) as avg_latency,
-    countIf(is_loop_detected) as loop_count,
-    countIf(is_sensitive_detected) as sensitive_count,
-    countIf(is_error) as error_count
-FROM agent_logs
-GROUP BY team_id, user_id, agent_id, date, hour;
-
--- Materialized view for daily summaries
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) as latency_quantiles
+FROM request_logs
+GROUP BY team_id, date, hour, agent_id, model, provider, user_id;
+
 CREATE MATERIALIZED VIEW IF NOT EXISTS agent_logs_daily
 ENGINE = SummingMergeTree()
 PARTITION BY toYYYYMM(date)
-ORDER BY (team_id, user_id, date)
+ORDER BY (team_id, date, agent_id, model, provider, user_id)
 AS SELECT
     team_id,
-    user_id,
-    agent_id,
     date,
+    agent_id,
+    model,
+    provider,
+    user_id,
     count() as request_count,
-    sum(tokens_total) as total_tokens,
+    sum(prompt_tokens) as total_prompt_tokens,
+    sum(completion_tokens) as total_completion_tokens,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
     sum(cost_usd) as total_cost,
-    avg(latency_ms) as avg_latency,
-    countIf(is_loop_detected) as loop_count,
-    countIf(is_sensitive_detected) as sensitive_count,
-    countIf(is_error) as error_count,
-    max(timestamp) as last_request_time
-FROM agent_logs
-GROUP BY team_id, user_id, agent_id, date;
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) as latency_quantiles
+FROM request_logs
+GROUP BY team_id, date, agent_id, model, provider, user_id;
+
+-- Run summary snapshots from the proxy (services/run_summary.py). Each
+-- worker coalesces steps in memory and writes its running totals for a run
+-- once per flush interval under its own segment_id: the latest row per
+-- segment wins, and a run's totals are the sum over its segments
+-- (see run_summary_totals).
+CREATE TABLE IF NOT EXISTS run_summary (
+    run_id String,
+    segment_id String,
+    team_id String,
+    user_id String,
+    agent_id String,
+    started_at DateTime64(3),
+    updated_at DateTime64(3) DEFAULT now64(3),
+    total_steps UInt32,
+    total_tokens UInt64,
+    total_cost_usd Float64,
+    total_latency_ms UInt64,
+    status LowCardinality(String), -- 'running', 'completed', 'killed'
+    kill_reason String,
+    loop_detected Bool,
+    dlp_triggered Bool,
+    budget_exceeded Bool,
+
+    INDEX idx_run_id run_id TYPE bloom_filter GRANULARITY 1
+)
+ENGINE = ReplacingMergeTree(updated_at)
+PARTITION BY toYYYYMM(started_at)
+ORDER BY (team_id, run_id, segment_id)
+TTL toDate(started_at) + INTERVAL 90 DAY DELETE;
+
+-- Live run totals: run_summary segments summed per run
+CREATE VIEW IF NOT EXISTS run_summary_totals AS
+SELECT
+    team_id,
+    run_id,
+    any(user_id) AS user_id,
+    max(agent_id) AS agent_id,
+    min(started_at) AS started_at,
+    max(updated_at) AS last_update,
+    sum(total_steps) AS total_steps,
+    sum(total_tokens) AS total_tokens,
+    sum(total_cost_usd) AS total_cost_usd,
+    sum(total_latency_ms) AS total_latency_ms,
+    if(countIf(status = 'killed') > 0, 'killed', argMax(status, updated_at)) AS status,
+    max(kill_reason) AS kill_reason,
+    max(loop_detected) AS loop_detected,
+    max(dlp_triggered) AS dlp_triggered,
+    max(budget_exceeded) AS budget_exceeded
+FROM run_summary FINAL
+GROUP BY team_id, run_id;
 
 -- Table for loop detection patterns (for analysis)
 CREATE TABLE IF NOT EXISTS loop_patterns (
@@ -133,20 +280,20 @@ CREATE TABLE IF NOT EXISTS loop_patterns (
     run_id String,
     team_id String,
     detected_at DateTime64(3) DEFAULT now64(3),
-    
+
     -- Pattern details
-    pattern_type String, -- 'repetitive_prompt', 'tool_spam', 'state_oscillation'
+    pattern_type String, -- 'repetitive_prompt', 'tool_spam', 'repetitive_tool_call', 'state_oscillation'
     similarity_score Float32,
     repetition_count UInt16,
-    
+
     -- Context
     prompt_hash String,
     tool_name String,
-    
+
     -- Action taken
     action_taken String, -- 'killed', 'warned', 'logged'
     cost_saved Float64,
-    
+
     INDEX idx_run_id run_id TYPE bloom_filter GRANULARITY 1,
     INDEX idx_team_id team_id TYPE bloom_filter GRANULARITY 1
 )
@@ -162,20 +309,20 @@ CREATE TABLE IF NOT EXISTS dlp_incidents (
     team_id String,
     user_id String,
     detected_at DateTime64(3) DEFAULT now64(3),
-    
+
     -- Incident details
     sensitive_type String, -- 'api_key', 'credit_card', 'email', etc.
     pattern_matched String,
     redaction_mode String, -- 'block', 'mask', 'shadow_log'
-    
+
     -- Context (encrypted/hashed)
     request_hash String,
     matched_text_hash String, -- SHA256 hash (not actual text)
-    
+
     -- Action taken
     was_blocked Bool,
     was_alerted Bool,
-    
+
     INDEX idx_run_id run_id TYPE bloom_filter GRANULARITY 1,
     INDEX idx_team_id team_id TYPE bloom_filter GRANULARITY 1,
     INDEX idx_sensitive_type sensitive_type TYPE set(20) GRANULARITY 1
@@ -193,12 +340,12 @@ CREATE TABLE IF NOT EXISTS budget_usage (
     agent_id String,
     date Date,
     hour UInt8,
-    
+
     -- Usage metrics
     request_count UInt32,
     tokens_used UInt32,
     cost_usd Float64,
-    
+
     -- Limits
     daily_limit Float64,
     monthly_limit Float64,
@@ -209,36 +356,41 @@ PARTITION BY toYYYYMM(date)
 ORDER BY (team_id, user_id, date, hour);
 
 -- Insert sample data for testing
-INSERT INTO agent_logs (
-    run_id, user_id, team_id, agent_id, api_key_id,
-    request_method, request_path, request_model,
-    request_messages, response_content,
-    response_status, response_finish_reason,
-    latency_ms, tokens_prompt, tokens_completion, tokens_total, cost_usd,
-    step_number
+INSERT INTO request_logs (
+    run_id, step_number, request_id, team_id, user_id, api_key_id, agent_id,
+    model, provider, endpoint,
+    prompt_tokens, completion_tokens, total_tokens, cost_usd, latency_ms,
+    status_code, message_hashes, response_content
 ) VALUES (
     'test-run-001',
-    'dev-user-1',
+    1,
+    'test-request-001',
     'dev-team-1',
-    'test-agent',
+    'dev-user-1',
     'dev-key-1',
-    'POST',
-    '/v1/chat/completions',
+    'test-agent',
     'gpt-4',
-    '[{"role":"user","content":"Hello"}]',
-    'Hello! How can I help you?',
-    200,
-    'stop',
-    150,
+    'openai',
+    '/v1/chat/completions',
     10,
     20,
     30,
     0.0015,
-    1
+    150,
+    200,
+    ['8ab1623f5a6271ecb6c9cb599896f1be'],
+    'Hello! How can I help you?'
+);
+
+INSERT INTO messages (team_id, message_hash, role, message) VALUES (
+    'dev-team-1',
+    '8ab1623f5a6271ecb6c9cb599896f1be',
+    'user',
+    '{"content":"Hello","role":"user"}'
 );
 
 -- Verify tables created
-SELECT 
+SELECT
     name,
     engine,
     total_rows,
@@ -0,0 +1,322 @@
+-- Migration 001: agent_logs -> request_logs
+--
+-- Moves an existing deployment from the original agent_logs schema to the
+-- one the proxy writes (clickhouse/init/01-create-database.sql):
+--   1. request_logs with columns matching RequestLog, plus the run-ordered
+--      projection p_run_steps (also added to a request_logs created earlier)
+--   2. run_rollup, per-run totals maintained by run_rollup_mv
+--   3. agent_logs_hourly / agent_logs_daily rebuilt over request_logs
+--   4. run_summary for RunSummary snapshots
+--   5. agent_logs rows copied into request_logs, which fills the views
+--
+-- Safe to re-run (run it while log traffic is low: rows inserted while
+-- step 3 rebuilds the hourly/daily views may be counted twice there).
+-- agent_logs is left in place: drop it once the copy is verified (step 6).
+--
+-- Run: make db-migrate
+
+USE agentwall;
+
+-- 1. Request log
+CREATE TABLE IF NOT EXISTS request_logs (
+    -- Identifiers
+    run_id String,
+    step_number UInt32,
+    request_id String,
+    team_id String,
+    user_id String,
+    api_key_id String,
+    agent_id String,
+    agent_name String,
+
+    -- Timestamps (partitioning key)
+    timestamp DateTime64(3) DEFAULT now64(3),
+    date Date DEFAULT toDate(timestamp),
+
+    -- Request metadata
+    model LowCardinality(String),
+    endpoint LowCardinality(String),
+
+    -- Metrics
+    prompt_tokens UInt32,
+    completion_tokens UInt32,
+    total_tokens UInt32,
+    cost_usd Float64,
+    latency_ms UInt32,
+    overhead_ms Int32,
+    ttfb_ms UInt32,
+
+    -- Stage timing breakdown (ms, see services.stage_timer)
+    auth_ms Float32,
+    admission_ms Float32,
+    loop_check_ms Float32,
+    queue_ms Float32,
+    upstream_connect_ms Float32,
+    upstream_ttfb_ms Float32,
+    upstream_ms Float32,
+    dlp_ms Float32,
+    post_check_ms Float32,
+
+    -- Outcome (499 = client disconnected mid-stream)
+    status_code UInt16,
+    error_message String,
+
+    -- Agent Firewall
+    loop_detected Bool DEFAULT false,
+    similarity_score Float32,
+    dlp_triggered Bool DEFAULT false,
+    dlp_action LowCardinality(String),
+
+    -- Request/Response content (compressed)
+    request_messages String CODEC(ZSTD(3)),
+    response_content String CODEC(ZSTD(3)),
+
+    -- Client
+    ip_address String,
+    user_agent String,
+    metadata String,
+
+    -- Indexes for fast lookups
+    INDEX idx_run_id run_id TYPE bloom_filter GRANULARITY 1,
+    INDEX idx_user_id user_id TYPE bloom_filter GRANULARITY 1,
+    INDEX idx_agent_id agent_id TYPE bloom_filter GRANULARITY 1,
+    INDEX idx_loop_detected loop_detected TYPE set(2) GRANULARITY 1,
+
+    -- "All steps of run X, in order": a copy of the rows sorted by run,
+    -- picked automatically for WHERE run_id = ... ORDER BY step_number
+    PROJECTION p_run_steps (
+        SELECT *
+        ORDER BY run_id, step_number
+    )
+)
+ENGINE = MergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (team_id, timestamp)
+TTL date + INTERVAL 90 DAY DELETE
+SETTINGS index_granularity = 8192;
+
+ALTER TABLE request_logs ADD COLUMN IF NOT EXISTS queue_ms Float32 AFTER loop_check_ms;
+ALTER TABLE request_logs ADD PROJECTION IF NOT EXISTS p_run_steps (SELECT * ORDER BY run_id, step_number);
+ALTER TABLE request_logs MATERIALIZE PROJECTION p_run_steps;
+
+-- 2. Run rollup
+CREATE TABLE IF NOT EXISTS run_rollup (
+    team_id String,
+    run_id String,
+    user_id SimpleAggregateFunction(any, String),
+    agent_id SimpleAggregateFunction(anyLast, String),
+    started_at SimpleAggregateFunction(min, DateTime64(3)),
+    last_activity SimpleAggregateFunction(max, DateTime64(3)),
+
+    request_count SimpleAggregateFunction(sum, UInt64),
+    last_step SimpleAggregateFunction(max, UInt32),
+    total_prompt_tokens SimpleAggregateFunction(sum, UInt64),
+    total_completion_tokens SimpleAggregateFunction(sum, UInt64),
+    total_cost_usd SimpleAggregateFunction(sum, Float64),
+    total_latency_ms SimpleAggregateFunction(sum, UInt64),
+    total_overhead_ms SimpleAggregateFunction(sum, Int64),
+    error_count SimpleAggregateFunction(sum, UInt64),
+    loop_detected SimpleAggregateFunction(max, Bool),
+    dlp_triggered SimpleAggregateFunction(max, Bool),
+    models SimpleAggregateFunction(groupUniqArrayArray, Array(String)),
+
+    -- Status of the last step and latency percentiles (-Merge to read)
+    last_status AggregateFunction(argMax, UInt16, UInt32),
+    latency_quantiles AggregateFunction(quantiles(0.5, 0.95, 0.99), UInt32),
+
+    INDEX idx_run_id run_id TYPE bloom_filter GRANULARITY 1
+)
+ENGINE = AggregatingMergeTree()
+ORDER BY (team_id, run_id);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS run_rollup_mv TO run_rollup
+AS SELECT
+    team_id,
+    run_id,
+    any(user_id) AS user_id,
+    anyLast(agent_id) AS agent_id,
+    min(timestamp) AS started_at,
+    max(timestamp) AS last_activity,
+    toUInt64(count()) AS request_count,
+    max(step_number) AS last_step,
+    toUInt64(sum(prompt_tokens)) AS total_prompt_tokens,
+    toUInt64(sum(completion_tokens)) AS total_completion_tokens,
+    sum(cost_usd) AS total_cost_usd,
+    toUInt64(sum(latency_ms)) AS total_latency_ms,
+    toInt64(sum(overhead_ms)) AS total_overhead_ms,
+    toUInt64(countIf(status_code >= 400)) AS error_count,
+    max(loop_detected) AS loop_detected,
+    max(dlp_triggered) AS dlp_triggered,
+    groupUniqArray(toString(model)) AS models,
+    argMaxState(status_code, step_number) AS last_status,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) AS latency_quantiles
+FROM request_logs
+GROUP BY team_id, run_id;
+
+-- Rebuilt from rows already in request_logs (the view only sees new inserts)
+TRUNCATE TABLE run_rollup;
+
+INSERT INTO run_rollup
+SELECT
+    team_id,
+    run_id,
+    any(user_id) AS user_id,
+    anyLast(agent_id) AS agent_id,
+    min(timestamp) AS started_at,
+    max(timestamp) AS last_activity,
+    toUInt64(count()) AS request_count,
+    max(step_number) AS last_step,
+    toUInt64(sum(prompt_tokens)) AS total_prompt_tokens,
+    toUInt64(sum(completion_tokens)) AS total_completion_tokens,
+    sum(cost_usd) AS total_cost_usd,
+    toUInt64(sum(latency_ms)) AS total_latency_ms,
+    toInt64(sum(overhead_ms)) AS total_overhead_ms,
+    toUInt64(countIf(status_code >= 400)) AS error_count,
+    max(loop_detected) AS loop_detected,
+    max(dlp_triggered) AS dlp_triggered,
+    groupUniqArray(toString(model)) AS models,
+    argMaxState(status_code, step_number) AS last_status,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) AS latency_quantiles
+FROM request_logs
+GROUP BY team_id, run_id;
+
+-- 3. Hourly / daily rollups now read request_logs (refilled by step 5)
+DROP VIEW IF EXISTS agent_logs_hourly;
+DROP VIEW IF EXISTS agent_logs_daily;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS agent_logs_hourly
+ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (team_id, user_id, agent_id, date, hour)
+AS SELECT
+    team_id,
+    user_id,
+    agent_id,
+    date,
+    toHour(timestamp) as hour,
+    count() as request_count,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
+    sum(cost_usd) as total_cost,
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count
+FROM request_logs
+GROUP BY team_id, user_id, agent_id, date, hour;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS agent_logs_daily
+ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (team_id, user_id, agent_id, date)
+AS SELECT
+    team_id,
+    user_id,
+    agent_id,
+    date,
+    count() as request_count,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
+    sum(cost_usd) as total_cost,
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count
+FROM request_logs
+GROUP BY team_id, user_id, agent_id, date;
+
+-- Rows already in request_logs (the views only see new inserts)
+INSERT INTO agent_logs_hourly
+SELECT
+    team_id,
+    user_id,
+    agent_id,
+    date,
+    toHour(timestamp) as hour,
+    count() as request_count,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
+    sum(cost_usd) as total_cost,
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count
+FROM request_logs
+GROUP BY team_id, user_id, agent_id, date, hour;
+
+INSERT INTO agent_logs_daily
+SELECT
+    team_id,
+    user_id,
+    agent_id,
+    date,
+    count() as request_count,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
+    sum(cost_usd) as total_cost,
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count
+FROM request_logs
+GROUP BY team_id, user_id, agent_id, date;
+
+-- 4. Run summaries
+CREATE TABLE IF NOT EXISTS run_summary (
+    run_id String,
+    team_id String,
+    user_id String,
+    agent_id String,
+    started_at DateTime64(3),
+    updated_at DateTime64(3) DEFAULT now64(3),
+    total_steps UInt32,
+    total_tokens UInt64,
+    total_cost_usd Float64,
+    total_latency_ms UInt64,
+    status LowCardinality(String), -- 'running', 'completed', 'killed'
+    kill_reason String,
+    loop_detected Bool,
+    dlp_triggered Bool,
+    budget_exceeded Bool,
+
+    INDEX idx_run_id run_id TYPE bloom_filter GRANULARITY 1
+)
+ENGINE = ReplacingMergeTree(updated_at)
+PARTITION BY toYYYYMM(started_at)
+ORDER BY (team_id, run_id)
+TTL toDate(started_at) + INTERVAL 90 DAY DELETE;
+
+-- 5. Copy agent_logs (rows already copied are skipped)
+INSERT INTO request_logs (
+    run_id, step_number, request_id, team_id, user_id, api_key_id, agent_id,
+    timestamp, model, endpoint,
+    prompt_tokens, completion_tokens, total_tokens, cost_usd, latency_ms,
+    status_code, error_message,
+    loop_detected, similarity_score, dlp_triggered, dlp_action,
+    request_messages, response_content
+)
+SELECT
+    run_id,
+    step_number,
+    toString(log_id),
+    team_id,
+    user_id,
+    api_key_id,
+    agent_id,
+    timestamp,
+    request_model,
+    request_path,
+    tokens_prompt,
+    tokens_completion,
+    tokens_total,
+    cost_usd,
+    latency_ms,
+    response_status,
+    error_message,
+    is_loop_detected,
+    loop_similarity,
+    is_sensitive_detected,
+    redaction_mode,
+    request_messages,
+    response_content
+FROM agent_logs
+WHERE toString(log_id) NOT IN (SELECT request_id FROM request_logs);
+
+-- 6. After checking the copy:
+-- DROP TABLE agent_logs;
@@ -0,0 +1,33 @@
+-- Migration 002: run_summary segments
+--
+-- Run summaries are written by every worker that sees a run (each with its
+-- own running totals), so the replacing key gains segment_id and the run
+-- totals are read through the run_summary_totals view.
+--
+-- Safe to re-run. Run: make db-migrate
+
+USE agentwall;
+
+ALTER TABLE run_summary
+    ADD COLUMN IF NOT EXISTS segment_id String AFTER run_id,
+    MODIFY ORDER BY (team_id, run_id, segment_id);
+
+CREATE VIEW IF NOT EXISTS run_summary_totals AS
+SELECT
+    team_id,
+    run_id,
+    any(user_id) AS user_id,
+    max(agent_id) AS agent_id,
+    min(started_at) AS started_at,
+    max(updated_at) AS last_update,
+    sum(total_steps) AS total_steps,
+    sum(total_tokens) AS total_tokens,
+    sum(total_cost_usd) AS total_cost_usd,
+    sum(total_latency_ms) AS total_latency_ms,
+    if(countIf(status = 'killed') > 0, 'killed', argMax(status, updated_at)) AS status,
+    max(kill_reason) AS kill_reason,
+    max(loop_detected) AS loop_detected,
+    max(dlp_triggered) AS dlp_triggered,
+    max(budget_exceeded) AS budget_exceeded
+FROM run_summary FINAL
+GROUP BY team_id, run_id;
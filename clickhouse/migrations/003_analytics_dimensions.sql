@@ -0,0 +1,116 @@
+-- Migration 003: analytics dimensions
+--
+-- The hourly / daily rollups behind the analytics API gain model and
+-- provider dimensions, prompt/completion token totals and latency
+-- quantiles (clickhouse/init/01-create-database.sql):
+--   1. provider on request_logs (rows logged before this keep '')
+--   2. agent_logs_hourly / agent_logs_daily rebuilt and refilled from
+--      request_logs
+--
+-- Safe to re-run (migration 001 recreates the old views: run both, in
+-- order, as make db-migrate does). Rows inserted while step 2 rebuilds
+-- the views may be counted twice there: run it while traffic is low.
+--
+-- Run: make db-migrate
+
+USE agentwall;
+
+-- 1. Provider column
+ALTER TABLE request_logs ADD COLUMN IF NOT EXISTS provider LowCardinality(String) AFTER model;
+
+-- 2. Rollups with model / provider
+DROP VIEW IF EXISTS agent_logs_hourly;
+DROP VIEW IF EXISTS agent_logs_daily;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS agent_logs_hourly
+ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (team_id, date, hour, agent_id, model, provider, user_id)
+AS SELECT
+    team_id,
+    date,
+    toHour(timestamp) as hour,
+    agent_id,
+    model,
+    provider,
+    user_id,
+    count() as request_count,
+    sum(prompt_tokens) as total_prompt_tokens,
+    sum(completion_tokens) as total_completion_tokens,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
+    sum(cost_usd) as total_cost,
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) as latency_quantiles
+FROM request_logs
+GROUP BY team_id, date, hour, agent_id, model, provider, user_id;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS agent_logs_daily
+ENGINE = SummingMergeTree()
+PARTITION BY toYYYYMM(date)
+ORDER BY (team_id, date, agent_id, model, provider, user_id)
+AS SELECT
+    team_id,
+    date,
+    agent_id,
+    model,
+    provider,
+    user_id,
+    count() as request_count,
+    sum(prompt_tokens) as total_prompt_tokens,
+    sum(completion_tokens) as total_completion_tokens,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
+    sum(cost_usd) as total_cost,
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) as latency_quantiles
+FROM request_logs
+GROUP BY team_id, date, agent_id, model, provider, user_id;
+
+-- Rows already in request_logs (the views only see new inserts)
+INSERT INTO agent_logs_hourly
+SELECT
+    team_id,
+    date,
+    toHour(timestamp) as hour,
+    agent_id,
+    model,
+    provider,
+    user_id,
+    count() as request_count,
+    sum(prompt_tokens) as total_prompt_tokens,
+    sum(completion_tokens) as total_completion_tokens,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
+    sum(cost_usd) as total_cost,
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) as latency_quantiles
+FROM request_logs
+GROUP BY team_id, date, hour, agent_id, model, provider, user_id;
+
+INSERT INTO agent_logs_daily
+SELECT
+    team_id,
+    date,
+    agent_id,
+    model,
+    provider,
+    user_id,
+    count() as request_count,
+    sum(prompt_tokens) as total_prompt_tokens,
+    sum(completion_tokens) as total_completion_tokens,
+    sum(prompt_tokens + completion_tokens) as total_tokens,
+    sum(cost_usd) as total_cost,
+    sum(latency_ms) as total_latency,
+    countIf(loop_detected) as loop_count,
+    countIf(dlp_triggered) as sensitive_count,
+    countIf(status_code >= 400) as error_count,
+    quantilesState(0.5, 0.95, 0.99)(latency_ms) as latency_quantiles
+FROM request_logs
+GROUP BY team_id, date, agent_id, model, provider, user_id;
@@ -0,0 +1,25 @@
+-- Migration 004: content-addressed conversation messages
+--
+-- request_logs stops storing a truncated copy of the request's messages:
+-- each message is written once to `messages` (keyed by the hash of its
+-- JSON) and message_hashes lists the request's messages in order. Rows
+-- logged before keep their request_messages.
+--
+-- Safe to re-run. Run: make db-migrate
+
+USE agentwall;
+
+ALTER TABLE request_logs
+    ADD COLUMN IF NOT EXISTS message_hashes Array(FixedString(32)) CODEC(ZSTD(3)) AFTER dlp_action;
+
+CREATE TABLE IF NOT EXISTS messages (
+    team_id String,
+    message_hash FixedString(32),
+    role LowCardinality(String),
+    message String CODEC(ZSTD(3)),
+    last_seen DateTime DEFAULT now()
+)
+ENGINE = ReplacingMergeTree(last_seen)
+PARTITION BY toYYYYMM(last_seen)
+ORDER BY (team_id, message_hash)
+TTL last_seen + INTERVAL 91 DAY DELETE;
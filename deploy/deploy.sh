@@ -38,6 +38,24 @@ echo -e "${GREEN}Images built!${NC}"
 # 3. Stop Old Containers
 # ============================================
 echo -e "${YELLOW}[3/5] Stopping old containers...${NC}"
+
+# Drain the API first: SIGTERM makes each worker fail readiness, refuse new
+# requests, let open streams finish (DRAIN_TIMEOUT) and flush its logs.
+# `stop` waits for that (up to stop_grace_period in docker-compose.yml).
+if [ -n "$(docker-compose ps -q fastapi)" ]; then
+    echo "Draining API (open streams finish, logs flush)..."
+    docker-compose stop fastapi &
+    STOP_PID=$!
+    while kill -0 $STOP_PID 2>/dev/null; do
+        # Progress of whichever worker answers
+        DRAIN=$(curl -s --max-time 2 http://localhost:8000/health/drain || true)
+        [ -n "$DRAIN" ] && echo "   $DRAIN"
+        sleep 5
+    done
+    wait $STOP_PID
+    echo -e "${GREEN}API drained!${NC}"
+fi
+
 docker-compose down
 echo -e "${GREEN}Containers stopped!${NC}"
 
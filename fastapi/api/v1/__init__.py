@@ -1,6 +1,6 @@
 """
 AgentWall API v1 endpoints
 """
-from . import chat, health, status
+from . import chat, health, status, internal
 
-__all__ = ["chat", "health", "status"]
+__all__ = ["chat", "health", "status", "internal"]
@@ -0,0 +1,150 @@
+"""
+Team analytics endpoints
+
+Endpoints:
+- GET /v1/analytics/usage            - Requests, tokens, spend and latency over time
+- GET /v1/analytics/top/{dimension}  - Totals per agent, model, provider or user, by spend
+
+Answered from the hourly/daily rollups (never request_logs) through
+services.analytics, which caches results in Redis and coalesces identical
+concurrent queries. Numbers lag live traffic by the log flush interval.
+
+With pass-through and managed keys the team is shared, so results are
+limited to the caller's own requests.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import logging
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+
+from config import settings
+from middleware.auth import SHARED_TEAMS
+from services.analytics import AnalyticsQuery, AnalyticsUnavailable, DIMENSIONS, analytics_service
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def _invalid(message: str) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail={
+            "error": {
+                "message": message,
+                "type": "invalid_request_error",
+                "code": "invalid_analytics_query",
+            }
+        }
+    )
+
+
+def _unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail={
+            "error": {
+                "message": "Analytics are temporarily unavailable",
+                "type": "service_unavailable",
+                "code": "analytics_unavailable",
+            }
+        },
+        headers={"Retry-After": "5"},
+    )
+
+
+def _range(start: Optional[datetime], end: Optional[datetime]) -> tuple[datetime, datetime]:
+    """Naive UTC bounds (parameters without an offset are taken as UTC)"""
+    if end is None:
+        end = datetime.utcnow()
+    elif end.tzinfo is not None:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    if start is None:
+        start = end - timedelta(days=1)
+    elif start.tzinfo is not None:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    return start, end
+
+
+def _filters(request: Request, agent_id: Optional[str], model: Optional[str], provider: Optional[str]) -> dict:
+    filters = {
+        name: value
+        for name, value in (("agent", agent_id), ("model", model), ("provider", provider))
+        if value
+    }
+    if request.state.team_id in SHARED_TEAMS:
+        filters["user"] = request.state.user_id
+    return filters
+
+
+async def _run(query: AnalyticsQuery) -> Response:
+    try:
+        body = await analytics_service.query(query)
+    except AnalyticsUnavailable as e:
+        logger.warning(f"Analytics query failed for team_id={query.team_id}: {e}")
+        raise _unavailable()
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"Cache-Control": "private, max-age=0"},
+    )
+
+
+def _build(request: Request, start: datetime, end: datetime, **kwargs) -> AnalyticsQuery:
+    try:
+        return AnalyticsQuery.create(request.state.team_id, start, end, **kwargs)
+    except ValueError as e:
+        raise _invalid(str(e))
+
+
+@router.get("/analytics/usage")
+async def usage(
+    request: Request,
+    start: Optional[datetime] = Query(None, description="Range start (default: end - 24h); widened to the hour"),
+    end: Optional[datetime] = Query(None, description="Range end (default: now); widened to the hour"),
+    granularity: Optional[str] = Query(None, description="hour, day or total (default: hour up to 2 days, else day)"),
+    group_by: str = Query("", description="Comma-separated dimensions: agent, model, provider, user"),
+    agent_id: Optional[str] = Query(None),
+    model: Optional[str] = Query(None),
+    provider: Optional[str] = Query(None),
+    limit: int = Query(1000, ge=1, le=settings.ANALYTICS_MAX_ROWS),
+):
+    """Usage over time, optionally broken down by dimension"""
+    start, end = _range(start, end)
+    if granularity is None:
+        granularity = "hour" if end - start <= timedelta(days=2) else "day"
+    query = _build(
+        request, start, end,
+        granularity=granularity,
+        group_by=tuple(name.strip() for name in group_by.split(",") if name.strip()),
+        filters=_filters(request, agent_id, model, provider),
+        limit=limit,
+    )
+    return await _run(query)
+
+
+@router.get("/analytics/top/{dimension}")
+async def top(
+    request: Request,
+    dimension: str,
+    start: Optional[datetime] = Query(None, description="Range start (default: end - 24h); widened to the hour"),
+    end: Optional[datetime] = Query(None, description="Range end (default: now); widened to the hour"),
+    agent_id: Optional[str] = Query(None),
+    model: Optional[str] = Query(None),
+    provider: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=settings.ANALYTICS_MAX_ROWS),
+):
+    """Totals per dimension value over the range, highest spend first"""
+    if dimension not in DIMENSIONS:
+        raise _invalid(f"Unknown dimension: {dimension} (use {', '.join(DIMENSIONS)})")
+    start, end = _range(start, end)
+    query = _build(
+        request, start, end,
+        granularity="total",
+        group_by=(dimension,),
+        filters=_filters(request, agent_id, model, provider),
+        limit=limit,
+    )
+    return await _run(query)
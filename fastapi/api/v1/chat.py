@@ -15,35 +15,47 @@ Week 2 Features:
 """
 
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse
-import time
+from fastapi.responses import Response, StreamingResponse
 import uuid
 import json
 import asyncio
 import logging
 from decimal import Decimal
 
+import orjson
+
 from models.requests import ChatCompletionRequest
+from models.chat_request import parse_chat_request, openapi_request_body
 from services.openai_proxy import openai_proxy, OpenAIError
 from services.multi_provider import multi_provider_proxy, MultiProviderError, detect_provider, resolve_model
-from services.run_tracker import run_tracker, RunState
-from services.loop_detector import loop_detector
-from services.cost_calculator import calculate_cost
-from services.clickhouse_client import clickhouse_client, RequestLog
+from services.run_tracker import run_tracker, RunState, StepCompletion
+from services.loop_detector import loop_detector, hash_text
+from services.cost_calculator import calculate_cost, estimate_tokens, CHARS_PER_TOKEN
+from services.clickhouse_client import RequestLog, LoopPattern
 from services.dlp import dlp_engine
-from services.laravel_logger import log_to_laravel, laravel_logger
+from services.laravel_logger import LaravelRequestLog
+from services.post_processor import post_processor
 from middleware.budget_enforcer import budget_enforcer, BudgetPolicy
+from middleware.auth import SHARED_TEAMS
+from services.stage_timer import StageTimer
+from services.stream_registry import (
+    stream_registry,
+    StreamAborted,
+    DisconnectAwareResponse,
+    CLIENT_DISCONNECTED,
+    SERVER_DRAINING,
+)
+from services.tool_calls import pending_tool_calls
+from services.rate_limiter import rate_limiter
+from services.scheduler import upstream_scheduler, SchedulerRejected, UpstreamSlot
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
-@router.post("/chat/completions")
-async def chat_completions(
-    request: ChatCompletionRequest,
-    http_request: Request
-):
+@router.post("/chat/completions", openapi_extra=openapi_request_body(ChatCompletionRequest))
+async def chat_completions(http_request: Request):
     """
     OpenAI-compatible chat completions endpoint
     
@@ -57,8 +69,14 @@ async def chat_completions(
     - Step limits (auto-kill runaway agents)
     - Loop detection (detect infinite loops)
     - Cost tracking (per-run budget enforcement)
+    
+    The body is parsed once with orjson and only the fields AgentWall reads
+    are validated (see models.chat_request); the rest is forwarded as-is.
     """
-    start_time = time.perf_counter()
+    # Span recorder started by AuthMiddleware (auth stage already marked)
+    timer = getattr(http_request.state, "timer", None) or StageTimer()
+    request = parse_chat_request(await http_request.body())
+    timer.mark("parse")
     request_id = str(uuid.uuid4())
     
     # Generate or use provided run_id (check header first, then body)
@@ -89,15 +107,18 @@ async def chat_completions(
         if auth_header.startswith("Bearer "):
             openai_api_key = auth_header[7:]
     
-    # Extract prompt for tracking
-    prompt_text = ""
-    if request.messages:
-        last_user_msg = next(
-            (m for m in reversed(request.messages) if m.role == "user"),
-            None
-        )
-        if last_user_msg and last_user_msg.content:
-            prompt_text = last_user_msg.content[:500]
+    # Extract prompt and answered tool calls for tracking
+    prompt_text = request.last_user_content()[:500]
+    tool_calls = pending_tool_calls(request.messages)
+    
+    # Token limits are charged with the body size as the prompt estimate
+    rate_limits = rate_limiter.limits_for(
+        api_key_id=api_key_id,
+        team_id=team_id,
+        model=request.model,
+        estimated_tokens=len(request.upstream_body) // CHARS_PER_TOKEN,
+        plan_limits=user_limits,
+    )
     
     # === RUN-LEVEL GOVERNANCE ===
     run_state, step_result = await run_tracker.process_step(
@@ -107,7 +128,54 @@ async def chat_completions(
         agent_id=agent_id,
         prompt=prompt_text,
         limits=user_limits,
+        tool_calls=tool_calls,
+        rate_limits=rate_limits,
     )
+    timer.mark("admission")
+    http_request.state.rate_limit = step_result.rate_limit
+    
+    rate_limit = step_result.rate_limit
+    if rate_limit and not rate_limit.allowed:
+        logger.info(f"Rate limited: {rate_limit.reason} for run_id={run_id}")
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": {
+                    "message": rate_limit.reason,
+                    "type": "rate_limit_exceeded",
+                    "code": "agentwall_rate_limit",
+                    "run_id": run_id,
+                    "retry_after_ms": rate_limit.retry_after_ms,
+                }
+            },
+            headers=rate_limit.headers(),
+        )
+    
+    # Tool-call loop / spam (run was killed at admission)
+    violation = step_result.tool_violation
+    if violation:
+        logger.warning(f"Tool calls blocked: {violation.message} for run_id={run_id}")
+        await run_tracker.kill_run(run_id, run_state.kill_reason)
+        await post_processor.submit(LoopPattern(
+            run_id=run_id,
+            team_id=team_id,
+            pattern_type=violation.pattern_type,
+            repetition_count=violation.count,
+            tool_name=violation.tool_name,
+        ))
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": {
+                    "message": f"Loop detected: {violation.message}",
+                    "type": "loop_detected",
+                    "code": "agentwall_loop",
+                    "run_id": run_id,
+                    "loop_type": violation.pattern_type,
+                    "tool_name": violation.tool_name,
+                }
+            }
+        )
     
     # Check if step is allowed
     if not step_result.allowed:
@@ -126,17 +194,29 @@ async def chat_completions(
         )
     
     # === LOOP DETECTION (pre-check) ===
-    loop_result = loop_detector.check_loop(
+    loop_result = loop_detector.check_history(
         current_prompt=prompt_text,
         current_response="",  # Pre-check, no response yet
-        recent_prompts=run_state.recent_prompts,
-        recent_responses=run_state.recent_responses,
+        prompt_history=run_state.prompt_history,
+        response_history=run_state.response_history,
+        cycle=run_state.cycle,
     )
+    timer.mark("loop_check")
     
     if loop_result.is_loop and loop_result.confidence >= 0.95:
         # High confidence loop - block request
         logger.warning(f"Loop blocked: {loop_result.message} for run_id={run_id}")
         await run_tracker.kill_run(run_id, f"loop_detected:{loop_result.loop_type}")
+        await post_processor.submit(LoopPattern(
+            run_id=run_id,
+            team_id=team_id,
+            pattern_type=(
+                "state_oscillation" if loop_result.loop_type in ("oscillation", "cycle")
+                else "repetitive_prompt"
+            ),
+            similarity_score=loop_result.confidence,
+            prompt_hash=f"{hash_text(prompt_text):016x}",
+        ))
         raise HTTPException(
             status_code=429,
             detail={
@@ -147,26 +227,46 @@ async def chat_completions(
                     "run_id": run_id,
                     "loop_type": loop_result.loop_type,
                     "confidence": loop_result.confidence,
+                    "period": loop_result.period,
                 }
             }
         )
     
+    # === UPSTREAM SLOT (fair queue per provider/model) ===
+    # Keys of the shared pseudo-teams are separate tenants (one per user)
+    resolved_model = resolve_model(request.model)
+    try:
+        slot = await upstream_scheduler.acquire(
+            tenant=user_id if team_id in SHARED_TEAMS else team_id,
+            provider=detect_provider(resolved_model).value,
+            model=resolved_model,
+        )
+    except SchedulerRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": {
+                    "message": "Upstream capacity exhausted, retry later",
+                    "type": "upstream_busy",
+                    "code": f"agentwall_{e.reason}",
+                    "run_id": run_id,
+                }
+            },
+            headers={"retry-after": str(max(1, round(e.retry_after)))},
+        )
+    timer.mark("queue")
+    
     logger.info(
         f"Chat request: run_id={run_id}, step={step_result.step_number}, "
         f"user={user_id}, model={request.model}, stream={request.stream}"
     )
     
-    # Prepare OpenAI request
-    openai_request = request.model_dump(
-        exclude={"agentwall_run_id", "agentwall_agent_id", "agentwall_metadata"},
-        exclude_none=True
-    )
-    
     try:
         if request.stream:
             # === STREAMING MODE ===
             return await _handle_streaming(
-                openai_request=openai_request,
+                openai_request=request.body,
+                upstream_body=request.upstream_body,
                 run_id=run_id,
                 request_id=request_id,
                 step_number=step_result.step_number,
@@ -176,16 +276,19 @@ async def chat_completions(
                 agent_id=agent_id,
                 model=request.model,
                 openai_api_key=openai_api_key,
-                start_time=start_time,
+                timer=timer,
                 prompt_text=prompt_text,
                 run_state=run_state,
+                rate_limits=rate_limits,
+                slot=slot,
                 loop_warning=loop_result if loop_result.is_loop else None,
                 http_request=http_request,
             )
         else:
             # === NON-STREAMING MODE ===
             return await _handle_non_streaming(
-                openai_request=openai_request,
+                openai_request=request.body,
+                upstream_body=request.upstream_body,
                 run_id=run_id,
                 request_id=request_id,
                 step_number=step_result.step_number,
@@ -195,16 +298,18 @@ async def chat_completions(
                 agent_id=agent_id,
                 model=request.model,
                 openai_api_key=openai_api_key,
-                start_time=start_time,
+                timer=timer,
                 prompt_text=prompt_text,
                 run_state=run_state,
+                rate_limits=rate_limits,
+                slot=slot,
                 loop_warning=loop_result if loop_result.is_loop else None,
                 http_request=http_request,
             )
     
     except (OpenAIError, MultiProviderError) as e:
         # Log error to ClickHouse
-        asyncio.create_task(_log_error(
+        await _log_error(
             run_id=run_id,
             request_id=request_id,
             step_number=step_result.step_number,
@@ -215,9 +320,10 @@ async def chat_completions(
             error_code=e.status_code,
             error_message=e.message,
             http_request=http_request,
-        ))
+        )
         
         provider = getattr(e, 'provider', 'openai')
+        retry_after = getattr(e, 'retry_after', None)
         logger.error(f"{provider} error: {e.status_code} - {e.message}")
         raise HTTPException(
             status_code=e.status_code,
@@ -227,7 +333,8 @@ async def chat_completions(
                     "type": "upstream_error",
                     "code": f"{provider}_error"
                 }
-            }
+            },
+            headers={"retry-after": str(max(1, round(retry_after)))} if retry_after is not None else None,
         )
     
     except HTTPException:
@@ -249,6 +356,7 @@ async def chat_completions(
 
 async def _handle_non_streaming(
     openai_request: dict,
+    upstream_body: bytes,
     run_id: str,
     request_id: str,
     step_number: int,
@@ -258,23 +366,35 @@ async def _handle_non_streaming(
     agent_id: str,
     model: str,
     openai_api_key: str | None,
-    start_time: float,
+    timer: StageTimer,
     prompt_text: str,
     run_state: RunState,
+    rate_limits: list,
+    slot: UpstreamSlot,
     loop_warning,
     http_request: Request,
-) -> JSONResponse:
-    """Handle non-streaming chat completion"""
+) -> Response:
+    """
+    Handle non-streaming chat completion
+    
+    The provider's response bytes are passed through with the agentwall
+    block spliced in; they are only re-serialized if DLP changed the content.
+    """
     
     # Use multi-provider proxy (supports OpenAI, OpenRouter, etc.)
-    response_data = await multi_provider_proxy.chat_completion(
-        request_data=openai_request,
-        run_id=run_id,
-        api_key=openai_api_key,
-    )
+    try:
+        completion = await multi_provider_proxy.chat_completion_raw(
+            request_data=openai_request,
+            run_id=run_id,
+            api_key=openai_api_key,
+            timer=timer,
+            body=upstream_body,
+        )
+    finally:
+        slot.release()
+    response_data = completion.data
     
     # Calculate metrics
-    overhead_ms = (time.perf_counter() - start_time) * 1000
     usage = response_data.get("usage", {})
     prompt_tokens = usage.get("prompt_tokens", 0)
     completion_tokens = usage.get("completion_tokens", 0)
@@ -317,18 +437,22 @@ async def _handle_non_streaming(
                 }
             }
         )
+    timer.mark("budget_check")
     
     # Extract response content
     response_content = ""
+    redacted = False
     if response_data.get("choices"):
         message = response_data["choices"][0].get("message", {})
         response_content = message.get("content", "") or ""
         
         # === DLP: Redact sensitive data from response ===
         redacted_content = dlp_engine.redact(response_content)
+        timer.mark("dlp")
         if redacted_content != response_content:
             logger.info(f"DLP redacted response content for run_id={run_id}")
             response_data["choices"][0]["message"]["content"] = redacted_content
+            redacted = True
             response_content = redacted_content[:500]
         else:
             response_content = response_content[:500]
@@ -336,26 +460,35 @@ async def _handle_non_streaming(
     # Post-response loop check
     loop_detected = False
     if response_content:
-        post_loop = loop_detector.check_loop(
+        post_loop = loop_detector.check_history(
             current_prompt=prompt_text,
             current_response=response_content,
-            recent_prompts=run_state.recent_prompts,
-            recent_responses=run_state.recent_responses,
+            prompt_history=run_state.prompt_history,
+            response_history=run_state.response_history,
         )
         loop_detected = post_loop.is_loop
+    timer.mark("post_check")
     
-    # Update run state (fire-and-forget)
-    asyncio.create_task(run_tracker.complete_step(
+    # Proxy overhead excludes time spent waiting on the provider
+    overhead_ms = timer.overhead_ms
+    latency_ms = timer.total_ms
+    
+    # Run state, token charge and logs are handled after the response
+    step = StepCompletion(
         run_id=run_id,
         tokens=total_tokens,
         cost=cost,
         response=response_content,
         prompt=prompt_text,
         loop_detected=loop_detected,
-    ))
+        rate_limits=rate_limits,
+        charged_tokens=completion_tokens,
+    )
+    
+    provider = completion.provider
     
-    # Log to ClickHouse (fire-and-forget)
-    asyncio.create_task(clickhouse_client.log_request(RequestLog(
+    # Log to ClickHouse (the run summary takes the step from the log)
+    log = RequestLog(
         run_id=run_id,
         step_number=step_number,
         request_id=request_id,
@@ -364,30 +497,29 @@ async def _handle_non_streaming(
         api_key_id=api_key_id,
         model=model,
         endpoint="/v1/chat/completions",
+        provider=provider,
         prompt_tokens=prompt_tokens,
         completion_tokens=completion_tokens,
         total_tokens=total_tokens,
         cost_usd=cost,
-        latency_ms=int(overhead_ms),
+        latency_ms=int(latency_ms),
         overhead_ms=int(overhead_ms),
+        **timer.log_fields(),
         status_code=200,
         loop_detected=loop_detected,
         agent_id=agent_id,
-        request_messages=json.dumps(openai_request.get("messages", []))[:1000],
+        messages=openai_request["messages"],
         response_content=response_content,
         ip_address=http_request.client.host if http_request.client else "",
         user_agent=http_request.headers.get("user-agent", "")[:200],
-    )))
+    )
     
     # Warn if overhead exceeds target
     if overhead_ms > 10:
         logger.warning(f"High overhead: {overhead_ms:.2f}ms for run_id={run_id}")
     
-    # Add AgentWall metadata to response
-    provider = response_data.pop("_agentwall_provider", "openai")
-    
-    # Log to Laravel Dashboard (fire-and-forget, <1ms overhead)
-    asyncio.create_task(log_to_laravel(
+    # Log to Laravel Dashboard
+    dashboard_log = LaravelRequestLog(
         request_id=request_id,
         model=model,
         run_id=run_id,
@@ -398,17 +530,21 @@ async def _handle_non_streaming(
         completion_tokens=completion_tokens,
         total_tokens=total_tokens,
         cost_usd=float(cost),
-        latency_ms=int(overhead_ms),
+        latency_ms=int(latency_ms),
         status_code=200,
         loop_detected=loop_detected,
         ip_address=http_request.client.host if http_request.client else None,
         user_agent=http_request.headers.get("user-agent", "")[:255] or None,
-    ))
+    )
+    await post_processor.submit(step, log, dashboard_log)
+    timer.mark("log_enqueue")
     
-    response_data["agentwall"] = {
+    # Add AgentWall metadata to response
+    agentwall = {
         "run_id": run_id,
         "step": step_number,
-        "overhead_ms": round(overhead_ms, 2),
+        "overhead_ms": round(timer.overhead_ms, 2),
+        "upstream_ms": round(timer.upstream_ms, 2),
         "cost_usd": float(cost),
         "total_run_cost": float(run_state.total_cost + cost),
         "total_run_steps": run_state.step_count,
@@ -417,24 +553,33 @@ async def _handle_non_streaming(
     
     # Add warnings if any
     if loop_warning:
-        response_data["agentwall"]["warning"] = {
+        agentwall["warning"] = {
             "type": "potential_loop",
             "message": loop_warning.message,
             "confidence": loop_warning.confidence,
         }
     
-    return JSONResponse(
-        content=response_data,
+    if redacted:
+        response_data["agentwall"] = agentwall
+        content = orjson.dumps(response_data)
+    else:
+        content = _splice_agentwall(completion.content, agentwall)
+    
+    return Response(
+        content=content,
+        media_type="application/json",
         headers={
             "X-AgentWall-Run-ID": run_id,
             "X-AgentWall-Step": str(step_number),
             "X-AgentWall-Cost": str(float(cost)),
+            "Server-Timing": timer.server_timing(),
         }
     )
 
 
 async def _handle_streaming(
     openai_request: dict,
+    upstream_body: bytes,
     run_id: str,
     request_id: str,
     step_number: int,
@@ -444,60 +589,84 @@ async def _handle_streaming(
     agent_id: str,
     model: str,
     openai_api_key: str | None,
-    start_time: float,
+    timer: StageTimer,
     prompt_text: str,
     run_state: RunState,
+    rate_limits: list,
+    slot: UpstreamSlot,
     loop_warning,
     http_request: Request,
 ) -> StreamingResponse:
     """Handle streaming chat completion"""
     
-    # Use multi-provider proxy (supports OpenAI, OpenRouter, etc.)
-    stream_generator, metrics = await multi_provider_proxy.chat_completion_stream(
-        request_data=openai_request,
-        run_id=run_id,
-        api_key=openai_api_key,
-    )
+    # Registered so a kill (from any worker) can abort this stream mid-flight
+    handle = stream_registry.register(run_id)
     
-    async def wrapped_generator():
-        """Wrap generator to capture metrics after completion"""
-        response_content = ""
-        
-        async for chunk in stream_generator:
-            yield chunk
-            
-            # Try to extract content from chunk for logging
-            try:
-                chunk_str = chunk.decode() if isinstance(chunk, bytes) else chunk
-                if chunk_str.startswith("data: ") and not chunk_str.strip().endswith("[DONE]"):
-                    data = json.loads(chunk_str[6:])
-                    if "choices" in data and data["choices"]:
-                        delta = data["choices"][0].get("delta", {})
-                        content = delta.get("content", "")
-                        if content:
-                            response_content += content
-            except:
-                pass
-        
-        # After stream completes, log metrics
-        overhead_ms = (time.perf_counter() - start_time) * 1000
+    try:
+        # Mid-stream budget: remaining run/daily/monthly budget as a completion
+        # character allowance, checked per chunk by the proxy generator
+        prompt_tokens = sum(
+            estimate_tokens(message["content"])
+            for message in openai_request.get("messages", [])
+            if isinstance(message.get("content"), str)
+        )
+        allowance = budget_enforcer.stream_allowance(
+            model=model,
+            prompt_tokens=prompt_tokens,
+            run_spent=run_state.total_cost,
+            run_limit=run_state.max_budget,
+            daily_spent=run_state.daily_cost,
+            monthly_spent=run_state.monthly_cost,
+        )
+        handle.set_budget(allowance.max_chars, allowance.exceeded_limit)
         
+        # Use multi-provider proxy (supports OpenAI, OpenRouter, etc.)
+        stream_generator, metrics = await multi_provider_proxy.chat_completion_stream(
+            request_data=openai_request,
+            run_id=run_id,
+            api_key=openai_api_key,
+            timer=timer,
+            handle=handle,
+            body=upstream_body,
+        )
+    except BaseException:
+        stream_registry.unregister(handle)
+        slot.release()
+        raise
+    
+    async def record(response_content: str, kill_reason: str):
+        """Update run state, charge tokens and log the (possibly partial) stream"""
+        disconnected = kill_reason == CLIENT_DISCONNECTED
         # Estimate tokens for streaming (actual usage not always available)
         estimated_completion_tokens = len(response_content.split()) * 1.3
-        cost = calculate_cost(model, 0, int(estimated_completion_tokens))
+        cost = calculate_cost(model, prompt_tokens, int(estimated_completion_tokens))
+        timer.mark("post_check")
+        latency_ms = timer.total_ms
         
-        # Update run state
-        asyncio.create_task(run_tracker.complete_step(
+        # Run state update and completion token charge
+        step = StepCompletion(
             run_id=run_id,
             tokens=int(estimated_completion_tokens),
             cost=cost,
             response=response_content[:500],
             prompt=prompt_text,
             loop_detected=False,
-        ))
+            rate_limits=rate_limits,
+            charged_tokens=int(estimated_completion_tokens),
+        )
         
-        # Log to ClickHouse
-        asyncio.create_task(clickhouse_client.log_request(RequestLog(
+        if disconnected:
+            # 499: client closed the request (nginx convention)
+            status_code, error_type, error_message = 499, CLIENT_DISCONNECTED, CLIENT_DISCONNECTED
+        elif kill_reason == SERVER_DRAINING:
+            status_code, error_type, error_message = 503, SERVER_DRAINING, SERVER_DRAINING
+        elif kill_reason:
+            status_code, error_type, error_message = 200, "run_killed", f"run_killed:{kill_reason}"
+        else:
+            status_code, error_type, error_message = 200, None, ""
+        
+        # Log to ClickHouse (the run summary takes the step from the log)
+        log = RequestLog(
             run_id=run_id,
             step_number=step_number,
             request_id=request_id,
@@ -506,35 +675,121 @@ async def _handle_streaming(
             api_key_id=api_key_id,
             model=model,
             endpoint="/v1/chat/completions",
+            provider=metrics.provider,
+            prompt_tokens=prompt_tokens,
             completion_tokens=int(estimated_completion_tokens),
             cost_usd=cost,
-            latency_ms=int(overhead_ms),
+            latency_ms=int(latency_ms),
+            overhead_ms=int(timer.overhead_ms),
             ttfb_ms=int(metrics.first_chunk_ms) if metrics.first_chunk_ms else 0,
-            status_code=200,
+            **timer.log_fields(),
+            status_code=status_code,
+            error_message=error_message,
             agent_id=agent_id,
+            messages=openai_request.get("messages", []),
             response_content=response_content[:500],
             ip_address=http_request.client.host if http_request.client else "",
             user_agent=http_request.headers.get("user-agent", "")[:200],
-        )))
+        )
         
-        # Log to Laravel Dashboard (fire-and-forget)
-        asyncio.create_task(log_to_laravel(
+        # Log to Laravel Dashboard
+        dashboard_log = LaravelRequestLog(
             request_id=request_id,
             model=model,
             run_id=run_id,
             endpoint="/v1/chat/completions",
             stream=True,
+            prompt_tokens=prompt_tokens,
             completion_tokens=int(estimated_completion_tokens),
             cost_usd=float(cost),
-            latency_ms=int(overhead_ms),
+            latency_ms=int(latency_ms),
             ttfb_ms=int(metrics.first_chunk_ms) if metrics.first_chunk_ms else None,
-            status_code=200,
+            status_code=status_code,
+            error_type=error_type,
+            error_message=kill_reason or None,
             ip_address=http_request.client.host if http_request.client else None,
             user_agent=http_request.headers.get("user-agent", "")[:255] or None,
-        ))
+        )
+        await post_processor.submit(step, log, dashboard_log)
+        timer.mark("log_enqueue")
+    
+    async def wrapped_generator():
+        """Wrap generator to capture metrics after completion"""
+        response_content = ""
+        kill_reason = ""
+        
+        try:
+            async for chunk in stream_generator:
+                yield chunk
+                
+                # Try to extract content from chunk for logging
+                try:
+                    chunk_str = chunk.decode() if isinstance(chunk, bytes) else chunk
+                    if chunk_str.startswith("data: ") and not chunk_str.strip().endswith("[DONE]"):
+                        data = orjson.loads(chunk_str[6:])
+                        if "choices" in data and data["choices"]:
+                            delta = data["choices"][0].get("delta", {})
+                            content = delta.get("content", "")
+                            if content:
+                                response_content += content
+                except:
+                    pass
+        
+        except StreamAborted as e:
+            # Run was killed, ran out of budget or lost its client: upstream is closed
+            kill_reason = e.reason
+            if e.reason == CLIENT_DISCONNECTED:
+                pass
+            elif e.reason == SERVER_DRAINING:
+                # Worker shutting down: the run is fine, the step can be retried
+                yield _sse_error(
+                    message="Server restarting, stream interrupted; retry the step",
+                    error_type=SERVER_DRAINING,
+                    code="agentwall_draining",
+                    run_id=run_id,
+                )
+            elif e.budget:
+                logger.warning(f"Budget exceeded mid-stream for run_id={run_id}: {e.reason}")
+                yield _sse_error(
+                    message=(
+                        f"Budget exceeded mid-stream: {allowance.exceeded_limit} "
+                        f"limit ${allowance.limit}"
+                    ),
+                    error_type="budget_exceeded",
+                    code="agentwall_budget",
+                    run_id=run_id,
+                )
+                await run_tracker.kill_run(run_id, e.reason)
+            else:
+                yield _sse_error(
+                    message=f"Run killed: {kill_reason}",
+                    error_type="run_killed",
+                    code="agentwall_killed",
+                    run_id=run_id,
+                )
+        
+        except (asyncio.CancelledError, GeneratorExit):
+            # Response cancelled or closed by DisconnectAwareResponse: the
+            # client is gone. Stop the upstream and bill only what was sent.
+            handle.abort(CLIENT_DISCONNECTED)
+            await stream_generator.aclose()
+            logger.info(f"Client disconnected mid-stream: run_id={run_id}")
+            await record(response_content, CLIENT_DISCONNECTED)
+            raise
+        
+        finally:
+            stream_registry.unregister(handle)
+            slot.release()
+        
+        await record(response_content, kill_reason)
     
-    return StreamingResponse(
-        wrapped_generator(),
+    # The slot is held until the stream ends (or is never consumed)
+    generator = wrapped_generator()
+    slot.release_with(generator)
+    
+    return DisconnectAwareResponse(
+        generator,
+        handle=handle,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -542,10 +797,46 @@ async def _handle_streaming(
             "X-Accel-Buffering": "no",
             "X-AgentWall-Run-ID": run_id,
             "X-AgentWall-Step": str(step_number),
+            # Stages up to upstream_connect (headers go out before the body)
+            "Server-Timing": timer.server_timing(),
         }
     )
 
 
+def _sse_error(message: str, error_type: str, code: str, run_id: str) -> bytes:
+    """Final SSE event for a stream AgentWall terminates (OpenAI error shape)"""
+    payload = {
+        "error": {
+            "message": message,
+            "type": error_type,
+            "code": code,
+            "run_id": run_id,
+        }
+    }
+    return f"data: {json.dumps(payload)}\n\n".encode()
+
+
+def _splice_agentwall(body: bytes, agentwall: dict) -> bytes:
+    """
+    Add the agentwall block to a JSON object response without re-serializing it
+    
+    Inserts `,"agentwall":{...}` before the object's closing brace. Upstream
+    bodies are usually compact with at most trailing whitespace, so this is
+    a scan from the end, not a parse.
+    """
+    end = len(body.rstrip())
+    if end < 2 or body[end - 1:end] != b"}":
+        # Not a JSON object (should not happen for a 200): re-serialize
+        data = orjson.loads(body)
+        data["agentwall"] = agentwall
+        return orjson.dumps(data)
+    
+    block = b'"agentwall":' + orjson.dumps(agentwall)
+    head = body[:end - 1].rstrip()
+    separator = b"" if head.endswith(b"{") else b","
+    return head + separator + block + b"}"
+
+
 async def _log_error(
     run_id: str,
     request_id: str,
@@ -558,8 +849,8 @@ async def _log_error(
     error_message: str,
     http_request: Request,
 ):
-    """Log error to ClickHouse"""
-    await clickhouse_client.log_request(RequestLog(
+    """Log error to ClickHouse (after the response)"""
+    await post_processor.submit(RequestLog(
         run_id=run_id,
         step_number=step_number,
         request_id=request_id,
@@ -0,0 +1,98 @@
+"""
+Internal ops endpoints (per worker)
+
+Authenticated with the X-Internal-Secret header (see AuthMiddleware).
+Each call is served by whichever worker accepted the connection; responses
+include the worker pid so repeated calls can be told apart.
+
+Endpoints:
+- POST /internal/profiler  - Sample the event loop for N seconds (collapsed stacks)
+- GET  /internal/loop-lag  - Current event-loop lag and recent stalls
+- GET  /internal/overload  - In-flight requests, adaptive limit and shed counts
+- POST /internal/runs/{run_id}/kill - Kill a run (aborts its streams on all workers)
+"""
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+import logging
+
+from config import settings
+from services.overload import overload_controller
+from services.profiler import profiler, loop_monitor
+from services.run_tracker import run_tracker
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+@router.post("/profiler")
+async def run_profiler(
+    seconds: float = Query(10.0, gt=0, le=settings.PROFILER_MAX_SECONDS),
+    interval_ms: float = Query(5.0, ge=1.0, le=100.0),
+):
+    """
+    Run a sampling profiler session on this worker
+    
+    Returns collapsed stacks ("task:coro;file:func;... count"), ready for
+    flamegraph.pl or speedscope.
+    """
+    if profiler.is_running:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "error": {
+                    "message": "Profiler session already running on this worker",
+                    "type": "profiler_busy",
+                    "code": "profiler_busy",
+                }
+            }
+        )
+    
+    logger.info(f"Profiler session started: {seconds}s @ {interval_ms}ms")
+    summary = await profiler.profile(seconds, interval_ms)
+    
+    return PlainTextResponse(
+        content=profiler.collapsed(),
+        headers={
+            "X-AgentWall-PID": str(summary["pid"]),
+            "X-Profile-Samples": str(summary["samples"]),
+        }
+    )
+
+
+@router.get("/loop-lag")
+async def loop_lag():
+    """Event-loop lag and recent stalls (with the stack that blocked the loop)"""
+    return loop_monitor.snapshot()
+
+
+@router.get("/overload")
+async def overload():
+    """Overload controller state (requests in flight, limit, shed counts)"""
+    return overload_controller.snapshot()
+
+
+@router.post("/runs/{run_id}/kill")
+async def kill_run(
+    run_id: str,
+    reason: str = Query("manual", max_length=200),
+):
+    """
+    Kill a run
+    
+    Future steps are rejected and in-flight streams are cut off on every
+    worker (the client receives a final SSE error event).
+    """
+    if not await run_tracker.kill_run(run_id, reason):
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": {
+                    "message": f"Run not found: {run_id}",
+                    "type": "not_found",
+                    "code": "run_not_found",
+                }
+            }
+        )
+    
+    return {"run_id": run_id, "status": "killed", "kill_reason": reason}
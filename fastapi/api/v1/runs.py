@@ -0,0 +1,296 @@
+"""
+Run replay / export endpoints
+
+Endpoints:
+- GET /v1/runs/{run_id}        - Run totals and status
+- GET /v1/runs/{run_id}/steps  - Steps of the run as NDJSON (one step per line)
+- GET /v1/runs/{run_id}/messages - Distinct request messages of the run as NDJSON
+
+Live runs (running and within their timeout) are served from the Redis
+run state: ClickHouse only sees steps after the log flush interval.
+Finished runs are served from ClickHouse (run_rollup for totals,
+request_logs via the run-ordered projection for steps) and carry an ETag,
+so re-exporting an unchanged run costs one rollup lookup and a 304.
+
+Steps are streamed straight from ClickHouse without being parsed or
+buffered, so exporting a 10,000-step run uses constant memory. Page with
+`after` (the last step_number received) and `limit`: a page never splits
+a step.
+
+Request messages are stored once per team (services.message_store): a step
+lists its messages as message_hashes, and /messages returns each message
+of the run once, so a conversation is exported in size proportional to
+its distinct content.
+"""
+
+from datetime import datetime
+from typing import Optional
+import hashlib
+import logging
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response
+
+from middleware.auth import SHARED_TEAMS
+from services.clickhouse_client import clickhouse_client
+from services.run_tracker import run_tracker, RunState
+from services.stream_registry import DisconnectAwareResponse
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+NDJSON = "application/x-ndjson"
+
+
+def _not_found(run_id: str) -> HTTPException:
+    return HTTPException(
+        status_code=404,
+        detail={
+            "error": {
+                "message": f"Run not found: {run_id}",
+                "type": "not_found",
+                "code": "run_not_found",
+            }
+        }
+    )
+
+
+def _unavailable(run_id: str) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail={
+            "error": {
+                "message": f"Run history is temporarily unavailable: {run_id}",
+                "type": "service_unavailable",
+                "code": "run_history_unavailable",
+            }
+        },
+        headers={"Retry-After": "5"},
+    )
+
+
+def _owns(request: Request, team_id: str, user_id: str) -> bool:
+    if team_id != request.state.team_id:
+        return False
+    return team_id not in SHARED_TEAMS or user_id == request.state.user_id
+
+
+def _is_live(state: RunState) -> bool:
+    """Still accepting steps (not killed and within its timeout)"""
+    elapsed = (datetime.utcnow() - state.started_at).total_seconds()
+    return state.status == "running" and elapsed <= state.timeout_seconds
+
+
+def _iso(value: str) -> str:
+    """ClickHouse DateTime64 ("2025-01-01 12:00:00.000", UTC) as ISO 8601"""
+    return value.replace(" ", "T") + "Z"
+
+
+def _etag(data: bytes) -> str:
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in tags or "*" in tags
+
+
+class RunLookup:
+    """Where a run's data comes from: Redis state and/or the ClickHouse rollup"""
+
+    __slots__ = ("state", "rollup", "live")
+
+    def __init__(self, state: Optional[RunState], rollup: Optional[dict]):
+        self.state = state
+        self.rollup = rollup
+        self.live = state is not None and _is_live(state)
+
+    @property
+    def status(self) -> str:
+        if self.state is None or self.state.status == "running":
+            return "running" if self.live else "completed"
+        return self.state.status
+
+    @property
+    def cache_headers(self) -> dict:
+        if self.live:
+            return {"Cache-Control": "no-store"}
+        return {"Cache-Control": "private, no-cache"}
+
+
+async def _lookup(request: Request, run_id: str) -> RunLookup:
+    """
+    Load a run visible to the caller
+
+    The rollup is only read for finished runs. Raises 404 for unknown runs
+    (and runs of other teams), 503 when only ClickHouse could answer and
+    it is unreachable.
+    """
+    state = await run_tracker.get_run_state(run_id)
+    if state is not None and not _owns(request, state.team_id, state.user_id):
+        state = None
+    if state is not None and _is_live(state):
+        return RunLookup(state, None)
+
+    try:
+        rollup = await clickhouse_client.get_run_rollup(request.state.team_id, run_id)
+    except Exception as e:
+        logger.warning(f"Run rollup unavailable for run_id={run_id}: {e}")
+        if state is None:
+            raise _unavailable(run_id)
+        rollup = None
+    if rollup is not None and not _owns(request, rollup["team_id"], rollup["user_id"]):
+        rollup = None
+
+    if state is None and rollup is None:
+        raise _not_found(run_id)
+    return RunLookup(state, rollup)
+
+
+def _run_body(run_id: str, lookup: RunLookup) -> dict:
+    state, rollup = lookup.state, lookup.rollup
+    body = {
+        "id": run_id,
+        "object": "run",
+        "status": lookup.status,
+        "live": lookup.live,
+        "kill_reason": state.kill_reason if state else "",
+    }
+    if rollup is None:
+        body.update({
+            "source": "redis",
+            "user_id": state.user_id,
+            "agent_id": state.agent_id,
+            "started_at": state.started_at.isoformat() + "Z",
+            "last_activity": state.last_activity.isoformat() + "Z",
+            "step_count": state.step_count,
+            "total_tokens": state.total_tokens,
+            "total_cost_usd": float(state.total_cost),
+            "loop_detected": state.loop_detected,
+            "budget_exceeded": state.budget_exceeded,
+            "max_steps": state.max_steps,
+            "max_budget_usd": float(state.max_budget),
+        })
+        return body
+
+    p50, p95, p99 = rollup["latency_p50_p95_p99"]
+    body.update({
+        "source": "clickhouse",
+        "user_id": rollup["user_id"],
+        "agent_id": rollup["agent_id"],
+        "started_at": _iso(rollup["started_at"]),
+        "last_activity": _iso(rollup["last_activity"]),
+        "step_count": rollup["last_step"],
+        "request_count": rollup["request_count"],
+        "prompt_tokens": rollup["prompt_tokens"],
+        "completion_tokens": rollup["completion_tokens"],
+        "total_tokens": rollup["prompt_tokens"] + rollup["completion_tokens"],
+        "total_cost_usd": rollup["cost_usd"],
+        "total_latency_ms": rollup["latency_ms"],
+        "total_overhead_ms": rollup["overhead_ms"],
+        "latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+        "error_count": rollup["errors"],
+        "last_status_code": rollup["last_status_code"],
+        "models": sorted(rollup["model_list"]),
+        "loop_detected": bool(rollup["loop"]) or bool(state and state.loop_detected),
+        "dlp_triggered": bool(rollup["dlp"]),
+        "budget_exceeded": bool(state and state.budget_exceeded),
+    })
+    return body
+
+
+@router.get("/runs/{run_id}")
+async def get_run(request: Request, run_id: str):
+    """
+    Run totals and status
+
+    Live runs come from the Redis run state; finished runs from the
+    ClickHouse run rollup (with an ETag).
+    """
+    lookup = await _lookup(request, run_id)
+    content = orjson.dumps(_run_body(run_id, lookup))
+    headers = lookup.cache_headers
+
+    if not lookup.live:
+        etag = _etag(content)
+        headers["ETag"] = etag
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+@router.get("/runs/{run_id}/steps")
+async def get_run_steps(
+    request: Request,
+    run_id: str,
+    after: int = Query(0, ge=0, description="Return steps after this step_number"),
+    limit: int = Query(0, ge=0, description="At most this many steps (0 = all)"),
+    content: bool = Query(True, description="Include request messages and response content"),
+):
+    """
+    Steps of a run as NDJSON, in step order
+
+    Streamed from ClickHouse. For a live run the most recent steps may
+    not be logged yet: X-AgentWall-Run-Steps has the step count from the
+    run state.
+    """
+    lookup = await _lookup(request, run_id)
+    headers = lookup.cache_headers
+    headers["X-AgentWall-Run-Status"] = lookup.status
+    if lookup.state is not None:
+        headers["X-AgentWall-Run-Steps"] = str(lookup.state.step_count)
+
+    if lookup.rollup is not None:
+        rollup = lookup.rollup
+        etag = _etag(orjson.dumps((
+            run_id, rollup["request_count"], rollup["last_step"], rollup["last_activity"],
+            lookup.status, after, limit, content,
+        )))
+        headers["ETag"] = etag
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+
+    try:
+        body = await clickhouse_client.stream_run_steps(
+            request.state.team_id, run_id, after=after, limit=limit, content=content,
+        )
+    except Exception as e:
+        logger.warning(f"Run steps unavailable for run_id={run_id}: {e}")
+        raise _unavailable(run_id)
+
+    return DisconnectAwareResponse(body, media_type=NDJSON, headers=headers)
+
+
+@router.get("/runs/{run_id}/messages")
+async def get_run_messages(request: Request, run_id: str):
+    """
+    Distinct request messages of a run as NDJSON
+
+    Each line is {"message_hash": ..., "message": {...}}; a step's
+    message_hashes lists its messages in order.
+    """
+    lookup = await _lookup(request, run_id)
+    headers = lookup.cache_headers
+
+    if lookup.rollup is not None:
+        rollup = lookup.rollup
+        etag = _etag(orjson.dumps((
+            run_id, "messages", rollup["request_count"], rollup["last_step"], rollup["last_activity"],
+        )))
+        headers["ETag"] = etag
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+
+    try:
+        body = await clickhouse_client.stream_run_messages(request.state.team_id, run_id)
+    except Exception as e:
+        logger.warning(f"Run messages unavailable for run_id={run_id}: {e}")
+        raise _unavailable(run_id)
+
+    return DisconnectAwareResponse(body, media_type=NDJSON, headers=headers)
@@ -4,21 +4,41 @@ Public Status Page for AgentWall API
 Endpoint: /status
 Shows real-time system health for public visibility
 
-Performance: Cached results, <50ms response
+Performance: the page (and /status/json) is rendered once per health
+snapshot (services.health_monitor, every HEALTH_CHECK_INTERVAL seconds)
+and served from memory, gzipped when accepted, with an ETag (304 when
+unchanged) and a short public Cache-Control so crawlers and monitors
+mostly hit caches instead of workers.
+
+The 90-day history is read from Redis and is the same on every worker.
+The ETag is weak and covers only what every worker renders alike
+(statuses and history), not the serving worker's uptime, check time or
+latencies, so revalidation works whichever worker answers.
 """
 
 from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse
-from datetime import datetime, timedelta
-import asyncio
+from fastapi.responses import HTMLResponse, Response
+from datetime import datetime
+from html import escape
+from typing import Callable, Optional
+import gzip
+import hashlib
 import logging
 
+import orjson
+
 from config import settings
-from api.v1.health import _check_dependencies
+from services.health_monitor import HISTORY_DAYS, DayBucket, health_monitor
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# Dependencies with 90-day history on the page (probed by the health monitor)
+HISTORY_SERVICES = {
+    "redis": "Redis (Run Tracking)",
+    "clickhouse": "ClickHouse (Analytics)",
+}
+
 # Track uptime
 _start_time = datetime.utcnow()
 
@@ -57,7 +77,7 @@ def _service_row(name: str, icon: str, check: dict) -> str:
     status = check.get("status", "unknown")
     badge = _status_badge(status)
     error = check.get("error", "")
-    error_html = f'<p class="text-sm text-gray-500 mt-1">{error}</p>' if error else ""
+    error_html = f'<p class="text-sm text-gray-500 mt-1">{escape(error)}</p>' if error else ""
     
     return f'''
     <div class="flex items-center justify-between p-4 bg-white rounded-lg shadow-sm border border-gray-100">
@@ -73,25 +93,113 @@ def _service_row(name: str, icon: str, check: dict) -> str:
     '''
 
 
-@router.get("", response_class=HTMLResponse)
-@router.get("/", response_class=HTMLResponse)
-async def status_page(request: Request):
-    """
-    Public status page showing system health
-    Beautiful HTML page with real-time status
-    """
-    # Get health checks
-    checks = await _check_dependencies(force=False)
+def _overall_status(checks: dict) -> str:
+    statuses = [c.get("status") for c in checks.values()]
+    if all(s in ["healthy", "configured"] for s in statuses):
+        return "operational"
+    if any(s == "unhealthy" for s in statuses):
+        return "partial_outage"
+    return "degraded"
+
+
+def _bar_color(bucket: Optional[DayBucket]) -> str:
+    if bucket is None:
+        return "#e5e7eb"
+    if bucket.uptime >= 99.9:
+        return "#22c55e"
+    if bucket.uptime >= 99.0:
+        return "#eab308"
+    return "#ef4444"
+
+
+def _uptime_bars(series: list[Optional[DayBucket]]) -> str:
+    """One bar per day, colored by uptime (grey: no data)"""
+    bars = []
+    for i, bucket in enumerate(series):
+        if bucket is None:
+            label = "no data"
+        else:
+            date = datetime.utcfromtimestamp(bucket.day * 86400).strftime("%Y-%m-%d")
+            label = f"{date}: {bucket.uptime:.2f}% uptime"
+        bars.append(
+            f'<rect x="{i * 4}" width="3" height="28" rx="1" fill="{_bar_color(bucket)}">'
+            f'<title>{label}</title></rect>'
+        )
+    return (
+        f'<svg viewBox="0 0 {len(series) * 4} 28" preserveAspectRatio="none" '
+        f'class="w-full h-7">{"".join(bars)}</svg>'
+    )
+
+
+def _latency_sparkline(series: list[Optional[DayBucket]]) -> str:
+    """Daily average latency as a line (days without data are skipped)"""
+    points = [
+        (i * 4 + 1.5, bucket.avg_latency_ms)
+        for i, bucket in enumerate(series)
+        if bucket is not None and bucket.avg_latency_ms is not None
+    ]
+    shapes = ""
+    if points:
+        peak = max(latency for _, latency in points) or 1.0
+        coords = [(x, 2 + (1 - latency / peak) * 16) for x, latency in points]
+        line = " ".join(f"{x:.1f},{y:.1f}" for x, y in coords)
+        x, y = coords[-1]
+        shapes = (
+            f'<polyline points="{line}" fill="none" stroke="#3b82f6" stroke-width="1.5"/>'
+            f'<circle cx="{x:.1f}" cy="{y:.1f}" r="1.5" fill="#3b82f6"/>'
+        )
+    return (
+        f'<svg viewBox="0 0 {len(series) * 4} 20" preserveAspectRatio="none" '
+        f'class="w-full h-5">{shapes}</svg>'
+    )
+
+
+def _daily_summary(series: list[Optional[DayBucket]]) -> dict:
+    """Uptime and average latency over the days with data"""
+    checks = sum(b.checks for b in series if b is not None)
+    ok = sum(b.ok for b in series if b is not None)
+    latency = sum(b.latency_ms for b in series if b is not None)
+    return {
+        "uptime": round(100 * ok / checks, 3) if checks else None,
+        "latency_ms": round(latency / ok, 2) if ok else None,
+    }
+
+
+def _history_row(name: str, series: list[Optional[DayBucket]]) -> str:
+    """HTML block with the uptime bars and latency sparkline of a service"""
+    summary = _daily_summary(series)
+    uptime = f"{summary['uptime']:.2f}% uptime" if summary["uptime"] is not None else "no data"
+    latency = f"avg {summary['latency_ms']:.1f} ms" if summary["latency_ms"] is not None else ""
+    return f'''
+    <div class="p-4 bg-white rounded-lg shadow-sm border border-gray-100">
+        <div class="flex justify-between items-center mb-2">
+            <h3 class="font-medium text-gray-900">{name}</h3>
+            <span class="text-sm text-gray-600">{uptime}</span>
+        </div>
+        {_uptime_bars(series)}
+        <div class="flex justify-between text-xs text-gray-400 mt-1 mb-2">
+            <span>{HISTORY_DAYS} days ago</span>
+            <span>Today</span>
+        </div>
+        {_latency_sparkline(series)}
+        <div class="text-xs text-gray-400 mt-1">Latency {latency}</div>
+    </div>
+    '''
+
+
+def _render_html(snapshot: dict) -> bytes:
+    """Full status page for a health snapshot"""
+    checks = snapshot["checks"]
     uptime = _get_uptime()
     
     # Calculate overall status
-    statuses = [c.get("status") for c in checks.values()]
-    if all(s in ["healthy", "configured"] for s in statuses):
+    overall = _overall_status(checks)
+    if overall == "operational":
         overall_status = "operational"
         overall_color = "text-green-600"
         overall_bg = "bg-green-50"
         overall_icon = "✅"
-    elif any(s == "unhealthy" for s in statuses):
+    elif overall == "partial_outage":
         overall_status = "partial outage"
         overall_color = "text-red-600"
         overall_bg = "bg-red-50"
@@ -109,6 +217,14 @@ async def status_page(request: Request):
     services_html += _service_row("ClickHouse (Analytics)", "📊", checks.get("clickhouse", {}))
     services_html += _service_row("OpenAI Connection", "🤖", checks.get("openai", {}))
     
+    history_html = "".join(
+        _history_row(name, health_monitor.daily.series(key))
+        for key, name in HISTORY_SERVICES.items()
+    )
+    
+    checked_at = snapshot.get("checked_at")
+    updated = checked_at[:19].replace("T", " ") if checked_at else "never"
+    
     html = f'''
 <!DOCTYPE html>
 <html lang="en">
@@ -151,9 +267,15 @@ async def status_page(request: Request):
             {services_html}
         </div>
         
+        <!-- 90-day history -->
+        <h3 class="text-lg font-semibold text-gray-900 mt-8 mb-4">Last {HISTORY_DAYS} days</h3>
+        <div class="space-y-3">
+            {history_html}
+        </div>
+        
         <!-- Footer -->
         <div class="mt-8 text-center text-sm text-gray-500">
-            <p>Last updated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC</p>
+            <p>Last updated: {updated} UTC</p>
             <p class="mt-1">Auto-refreshes every 30 seconds</p>
             <p class="mt-4">
                 <a href="https://api.agentwall.io/docs" class="text-blue-600 hover:underline">API Documentation</a>
@@ -167,35 +289,127 @@ async def status_page(request: Request):
 </body>
 </html>
 '''
-    return HTMLResponse(content=html)
+    return html.encode()
 
 
-@router.get("/json")
-async def status_json():
-    """
-    Status page data as JSON
-    For programmatic access and monitoring tools
-    """
-    checks = await _check_dependencies(force=False)
-    uptime = _get_uptime()
-    
-    # Calculate overall status
-    statuses = [c.get("status") for c in checks.values()]
-    if all(s in ["healthy", "configured"] for s in statuses):
-        overall = "operational"
-    elif any(s == "unhealthy" for s in statuses):
-        overall = "partial_outage"
-    else:
-        overall = "degraded"
+def _render_json(snapshot: dict) -> bytes:
+    """Status data for a health snapshot"""
+    checks = snapshot["checks"]
+    history = {}
+    for key in HISTORY_SERVICES:
+        series = health_monitor.daily.series(key)
+        history[key] = {
+            **_daily_summary(series),
+            "days": [
+                None if b is None else {
+                    "date": datetime.utcfromtimestamp(b.day * 86400).strftime("%Y-%m-%d"),
+                    "uptime": round(b.uptime, 3),
+                    "latency_ms": round(b.avg_latency_ms, 2) if b.avg_latency_ms is not None else None,
+                }
+                for b in series
+            ],
+        }
     
-    return {
-        "status": overall,
-        "uptime": uptime,
+    return orjson.dumps({
+        "status": _overall_status(checks),
+        "uptime": _get_uptime(),
         "services": {
             "api": {"status": "healthy", "name": "AgentWall API"},
             "redis": {**checks.get("redis", {}), "name": "Redis (Run Tracking)"},
             "clickhouse": {**checks.get("clickhouse", {}), "name": "ClickHouse (Analytics)"},
             "openai": {**checks.get("openai", {}), "name": "OpenAI Connection"},
         },
+        "history": history,
+        "checked_at": snapshot.get("checked_at"),
         "timestamp": datetime.utcnow().isoformat() + "Z"
+    })
+
+
+def _stable_content(kind: str, snapshot: dict) -> bytes:
+    """What every worker renders alike for a snapshot (the ETag input)"""
+    history = {}
+    for key in HISTORY_SERVICES:
+        history[key] = [
+            None if b is None else (
+                b.day,
+                round(b.uptime, 2),
+                round(b.avg_latency_ms, 1) if b.avg_latency_ms is not None else None,
+            )
+            for b in health_monitor.daily.series(key)
+        ]
+    return orjson.dumps({
+        "kind": kind,
+        "checks": {
+            name: [check.get("status"), check.get("error")]
+            for name, check in snapshot["checks"].items()
+        },
+        "history": history,
+    })
+
+
+class RenderedPage:
+    """A rendered body with its gzip encoding and (weak) ETag"""
+    
+    __slots__ = ("body", "gzipped", "etag")
+    
+    def __init__(self, body: bytes, stable_content: bytes):
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6)
+        self.etag = f'W/"{hashlib.blake2b(stable_content, digest_size=8).hexdigest()}"'
+
+
+# kind -> (snapshot it was rendered from, page); per worker
+_rendered: dict[str, tuple[dict, RenderedPage]] = {}
+
+
+def _page(kind: str, render: Callable[[dict], bytes]) -> RenderedPage:
+    """The page for the current snapshot (rendered on the first hit after a check)"""
+    snapshot = health_monitor.snapshot
+    cached = _rendered.get(kind)
+    if cached is None or cached[0] is not snapshot:
+        cached = (snapshot, RenderedPage(render(snapshot), _stable_content(kind, snapshot)))
+        _rendered[kind] = cached
+    return cached[1]
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """Weak comparison (If-None-Match)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags or "*" in tags
+
+
+def _serve(request: Request, page: RenderedPage, media_type: str) -> Response:
+    """304, gzip or identity response for a rendered page"""
+    headers = {
+        "ETag": page.etag,
+        "Cache-Control": f"public, max-age={int(settings.HEALTH_CHECK_INTERVAL)}",
+        "Vary": "Accept-Encoding",
     }
+    if _not_modified(request, page.etag):
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=page.gzipped, media_type=media_type, headers=headers)
+    return Response(content=page.body, media_type=media_type, headers=headers)
+
+
+@router.get("", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
+async def status_page(request: Request):
+    """
+    Public status page showing system health
+    Beautiful HTML page with real-time status and 90-day history
+    """
+    return _serve(request, _page("html", _render_html), "text/html; charset=utf-8")
+
+
+@router.get("/json")
+async def status_json(request: Request):
+    """
+    Status page data as JSON
+    For programmatic access and monitoring tools
+    """
+    return _serve(request, _page("json", _render_json), "application/json")
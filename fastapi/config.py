@@ -18,6 +18,7 @@ class Settings(BaseSettings):
     # Server
     HOST: str = "0.0.0.0"
     PORT: int = 8000
+    WORKERS: int = 0  # 0 = one worker per CPU core (see gunicorn.conf.py)
     
     # OpenAI
     OPENAI_API_KEY: str = ""  # Required for proxy functionality
@@ -51,6 +52,26 @@ class Settings(BaseSettings):
     # Provider routing: "openai", "openrouter", "groq", "deepseek", "mistral", "ollama", "auto"
     DEFAULT_PROVIDER: str = "auto"
     
+    # Upstream connection pools (per worker, per provider)
+    UPSTREAM_MAX_CONNECTIONS: int = 200
+    UPSTREAM_MAX_KEEPALIVE: int = 50
+    WARM_UPSTREAM_CONNECTIONS: bool = True  # Pre-open connections on worker start
+    
+    # Upstream scheduler (per worker): concurrency caps + fair queuing across teams
+    UPSTREAM_PROVIDER_CONCURRENCY: int = 200  # In-flight requests per provider
+    UPSTREAM_MODEL_CONCURRENCY: int = 100  # In-flight requests per model
+    UPSTREAM_QUEUE_MAX_WAIT: float = 5.0  # seconds before a queued request gets a 429
+    UPSTREAM_QUEUE_MAX_DEPTH: int = 1000  # Waiting requests before new ones get a 429 at once
+    
+    # Provider rate-limit headers: pacing and retries
+    PROVIDER_PACE_THRESHOLD: float = 0.05  # Pace once less than this share of a provider limit is left
+    PROVIDER_MAX_PACE_SECONDS: float = 10.0  # Longer waits get a local 429 instead
+    UPSTREAM_RETRY_MAX_ATTEMPTS: int = 2  # Retries of a 429/503 per request
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.25  # seconds, doubled per attempt (full jitter)
+    UPSTREAM_RETRY_MAX_DELAY: float = 8.0  # Longer retry-after values are returned to the client
+    UPSTREAM_RETRY_BUDGET_RATIO: float = 0.1  # Retries earned per request (per worker)
+    UPSTREAM_RETRY_BUDGET_BURST: float = 20.0
+    
     # ClickHouse
     CLICKHOUSE_HOST: str = "localhost"
     CLICKHOUSE_PORT: int = 9000
@@ -61,6 +82,21 @@ class Settings(BaseSettings):
     # Redis
     REDIS_URL: str = "redis://localhost:6379"
     REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_RECONNECT_INTERVAL: float = 2.0  # seconds between pings while Redis is down
+    
+    # Run state
+    RUN_STATE_TTL_SECONDS: int = 86400  # Expire runs 24h after last activity
+    LOCAL_RUN_STORE_MAX_RUNS: int = 10000  # Per-worker fallback store (LRU) while Redis is down
+    
+    # Rate limiting (GCRA in Redis; 0 = unlimited). Plan limits
+    # "requests_per_second" / "tokens_per_minute" override the per-key values
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_KEY_RPS: int = 10
+    RATE_LIMIT_KEY_TPM: int = 200000
+    RATE_LIMIT_TEAM_RPS: int = 0  # Pass-through keys all share one team: off by default
+    RATE_LIMIT_TEAM_TPM: int = 0
+    RATE_LIMIT_MODEL_RPS: int = 0
+    RATE_LIMIT_MODEL_TPM: int = 0
     
     # Laravel Integration
     LARAVEL_URL: str = "http://localhost:8080"
@@ -69,6 +105,7 @@ class Settings(BaseSettings):
     # Agent Firewall Settings
     MAX_STEPS: int = 30  # Maximum steps per run
     MAX_TOOL_CALLS: int = 10  # Maximum same tool calls per run
+    TOOL_REPEAT_LIMIT: int = 3  # Identical (tool, arguments) calls per run before it is a loop
     TIMEOUT_SECONDS: int = 120  # Maximum run duration
     
     # Loop Detection
@@ -82,10 +119,42 @@ class Settings(BaseSettings):
     # Performance
     LOG_BATCH_SIZE: int = 100  # ClickHouse batch insert size
     LOG_FLUSH_INTERVAL: float = 5.0  # seconds
+    LOG_REQUEUE_MAX_BYTES: int = 67108864  # Failed log batches kept for retry (estimated, 64 MiB per worker)
+    RUN_SUMMARY_FLUSH_INTERVAL: float = 10.0  # seconds between run_summary snapshots
+    RUN_SUMMARY_IDLE_SECONDS: float = 600.0  # Forget a run's totals after this long without steps
+    RUN_SUMMARY_MAX_RUNS: int = 50000  # Runs with totals held per worker
+    POSTPROCESS_WORKERS: int = 4  # Consumers draining post-response work (per worker)
+    POSTPROCESS_QUEUE_SIZE: int = 10000  # Queued post-response jobs per worker (all consumers)
+    POSTPROCESS_BATCH_SIZE: int = 200  # Jobs a consumer takes at once
+    POSTPROCESS_DRAIN_TIMEOUT: float = 10.0  # seconds to drain the queues on shutdown
+    DRAIN_TIMEOUT: float = 120.0  # seconds open requests/streams get to finish on shutdown
+    MESSAGE_STORE_MAX_HASHES: int = 200000  # Written message hashes remembered per worker
+    MESSAGE_STORE_REFRESH_SECONDS: float = 86400.0  # Rewrite remembered messages after this long
+    ANALYTICS_CACHE_TTL: int = 3600  # seconds to cache analytics over closed ranges
+    ANALYTICS_CACHE_LIVE_TTL: int = 60  # max seconds to cache ranges that include now
+    ANALYTICS_MAX_RANGE_DAYS: int = 93
+    ANALYTICS_MAX_ROWS: int = 10000
     
     # Monitoring
     ENABLE_METRICS: bool = True
     METRICS_PORT: int = 9090
+    HEALTH_CHECK_INTERVAL: float = 10.0  # seconds between background dependency checks
+    HEALTH_CHECK_TIMEOUT: float = 2.0  # seconds before a dependency counts as down
+    
+    # Profiling (per-worker, via /internal endpoints)
+    PROFILER_MAX_SECONDS: int = 60  # Longest allowed sampling session
+    LOOP_LAG_INTERVAL_MS: float = 100.0  # Heartbeat interval
+    LOOP_STALL_THRESHOLD_MS: float = 100.0  # Record stalls longer than this
+    
+    # Overload shedding (per worker, see services/overload.py)
+    OVERLOAD_ENABLED: bool = True
+    OVERLOAD_MAX_IN_FLIGHT: int = 1000  # In-flight /v1 requests while the loop keeps up
+    OVERLOAD_MIN_IN_FLIGHT: int = 20  # The adaptive limit never drops below this
+    OVERLOAD_TARGET_LAG_MS: float = 50.0  # Smoothed loop lag above this lowers the limit
+    OVERLOAD_CRITICAL_LAG_MS: float = 250.0  # Above this only priority plans are admitted
+    OVERLOAD_NORMAL_SHARE: float = 0.8  # Share of the limit open to non-priority plans
+    OVERLOAD_PRIORITY_WEIGHT: float = 2.0  # Plan weight from which requests are shed last (no plans yet)
+    OVERLOAD_RETRY_AFTER: int = 1  # seconds (retry-after of the 503)
     
     class Config:
         env_file = ".env"
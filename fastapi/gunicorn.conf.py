@@ -0,0 +1,67 @@
+"""
+Gunicorn configuration - multi-process serving mode
+
+Usage:
+    gunicorn -c gunicorn.conf.py main:app
+
+Process model (shared-nothing):
+- One uvicorn worker per CPU core (override with WORKERS / WEB_CONCURRENCY)
+- Each worker runs its own startup hook: Redis pool, pooled upstream
+  clients (with warm connections), ClickHouse/Laravel log workers
+- Cross-request state that must be global (run state, budgets, kill
+  switch) lives in Redis; everything else is safely per-process
+  (log buffers, health cache, connection pools, profiler)
+- SIGTERM drains each worker before it exits (see uvicorn_worker.py)
+- Prometheus: workers write to PROMETHEUS_MULTIPROC_DIR, the master
+  serves the aggregate on METRICS_PORT
+"""
+
+import multiprocessing
+import os
+import glob
+
+_workers = int(os.environ.get("WORKERS") or os.environ.get("WEB_CONCURRENCY") or 0)
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8000')}"
+workers = _workers or multiprocessing.cpu_count()
+worker_class = "uvicorn_worker.AgentWallWorker"
+
+# Keep-alive long enough for agent SDKs that reuse connections
+keepalive = 75
+
+# Streaming responses can last minutes; the arbiter must not kill them
+timeout = 0
+# Workers drain on SIGTERM (open streams, then post-processing queues):
+# leave them the whole drain before the arbiter kills them
+graceful_timeout = int(
+    float(os.environ.get("DRAIN_TIMEOUT", 120))
+    + float(os.environ.get("POSTPROCESS_DRAIN_TIMEOUT", 10))
+    + 15
+)
+
+accesslog = None  # Request logging is done by LoggingMiddleware
+loglevel = "info"
+
+
+def on_starting(server):
+    """Master boot: reset multi-process metric files from a previous run"""
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+            os.remove(path)
+
+
+def when_ready(server):
+    """Master ready: serve aggregated metrics for all workers"""
+    from services.metrics import start_exporter
+
+    if start_exporter():
+        server.log.info("Metrics exporter started in master")
+
+
+def child_exit(server, worker):
+    """Drop live gauges of a dead worker"""
+    from services.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
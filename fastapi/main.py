@@ -13,9 +13,10 @@ import time
 import logging
 
 from config import settings
-from api.v1 import chat, health, status
+from api.v1 import analytics, chat, health, status, internal, runs
 from middleware.auth import AuthMiddleware
 from middleware.logging import LoggingMiddleware
+from middleware.overload import OverloadMiddleware
 
 # Configure logging
 logging.basicConfig(
@@ -67,8 +68,11 @@ client = OpenAI(
     redoc_url="/redoc",
     openapi_tags=[
         {"name": "openai-compatible", "description": "OpenAI-compatible chat completions API"},
+        {"name": "runs", "description": "Run replay and export"},
+        {"name": "analytics", "description": "Team usage and spend analytics"},
         {"name": "health", "description": "Health check endpoints for monitoring"},
         {"name": "status", "description": "Public status page"},
+        {"name": "internal", "description": "Ops endpoints (X-Internal-Secret)"},
     ],
     contact={
         "name": "AgentWall Support",
@@ -81,6 +85,9 @@ client = OpenAI(
     },
 )
 
+# Overload shedding (innermost: runs after auth has attached the plan limits)
+app.add_middleware(OverloadMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -103,10 +110,14 @@ async def add_process_time_header(request: Request, call_next):
     process_time = (time.perf_counter() - start_time) * 1000  # ms
     response.headers["X-Process-Time"] = f"{process_time:.2f}ms"
     
+    # Prefer the stage breakdown (excludes provider time) when available
+    timer = getattr(request.state, "timer", None)
+    overhead_ms = timer.overhead_ms if timer else process_time
+    
     # Log if overhead exceeds target
-    if process_time > 10:
+    if overhead_ms > 10:
         logger.warning(
-            f"High overhead detected: {process_time:.2f}ms for {request.url.path}"
+            f"High overhead detected: {overhead_ms:.2f}ms for {request.url.path}"
         )
     
     return response
@@ -115,6 +126,9 @@ async def add_process_time_header(request: Request, call_next):
 app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(status.router, prefix="/status", tags=["status"])
 app.include_router(chat.router, prefix="/v1", tags=["openai-compatible"])
+app.include_router(runs.router, prefix="/v1", tags=["runs"])
+app.include_router(analytics.router, prefix="/v1", tags=["analytics"])
+app.include_router(internal.router, prefix="/internal", tags=["internal"])
 
 # Global exception handler
 @app.exception_handler(Exception)
@@ -137,9 +151,17 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 # Import services for lifecycle management
+from services.analytics import analytics_service
 from services.clickhouse_client import clickhouse_client
+from services.run_summary import run_summaries
 from services.run_tracker import run_tracker
 from services.laravel_logger import laravel_logger
+from services.multi_provider import multi_provider_proxy
+from services.post_processor import post_processor
+from services.metrics import start_exporter
+from services.profiler import loop_monitor
+from services.overload import overload_controller
+from services.health_monitor import health_monitor
 
 # Startup event
 @app.on_event("startup")
@@ -157,6 +179,13 @@ async def startup_event():
     except Exception as e:
         logger.warning(f"Redis connection failed (run tracking disabled): {e}")
     
+    # Warm pooled upstream clients (per worker)
+    try:
+        await multi_provider_proxy.start()
+        logger.info("Upstream connection pools ready")
+    except Exception as e:
+        logger.warning(f"Upstream pool warm-up failed: {e}")
+    
     # Initialize ClickHouse client
     try:
         await clickhouse_client.start()
@@ -164,6 +193,9 @@ async def startup_event():
     except Exception as e:
         logger.warning(f"ClickHouse client failed (logging disabled): {e}")
     
+    # Coalesced run_summary snapshots (written through the ClickHouse client)
+    await run_summaries.start()
+    
     # Start Laravel logger worker
     try:
         laravel_logger.start_worker()
@@ -171,6 +203,21 @@ async def startup_event():
     except Exception as e:
         logger.warning(f"Laravel logger failed: {e}")
     
+    # Background dependency checks (over the Redis / ClickHouse pools above)
+    await health_monitor.start()
+    
+    # Post-response work (run state updates, logs), drained by a consumer pool
+    await post_processor.start()
+    
+    # Start Prometheus exporter (first worker to bind METRICS_PORT serves all)
+    start_exporter()
+    
+    # Event-loop lag monitor (records stalls with the blocking stack)
+    loop_monitor.start()
+    
+    # Overload shedding follows the measured lag
+    overload_controller.start()
+    
     logger.info("Startup complete")
 
 # Shutdown event
@@ -179,8 +226,17 @@ async def shutdown_event():
     """Cleanup on shutdown"""
     logger.info("Shutting down...")
     
-    # Flush pending logs to ClickHouse
+    await health_monitor.stop()
+    
+    # Finish queued post-response work while Redis and the log sinks are up
+    try:
+        await post_processor.stop()
+    except Exception as e:
+        logger.error(f"Post-processing shutdown error: {e}")
+    
+    # Flush pending run summaries and logs to ClickHouse
     try:
+        await run_summaries.stop()
         await clickhouse_client.stop()
         logger.info("ClickHouse logs flushed")
     except Exception as e:
@@ -189,6 +245,7 @@ async def shutdown_event():
     # Close Redis connections
     try:
         await run_tracker.disconnect()
+        await analytics_service.close()
         logger.info("Redis disconnected")
     except Exception as e:
         logger.error(f"Redis shutdown error: {e}")
@@ -200,6 +257,14 @@ async def shutdown_event():
     except Exception as e:
         logger.error(f"Laravel logger shutdown error: {e}")
     
+    await loop_monitor.stop()
+    
+    # Close pooled upstream connections
+    try:
+        await multi_provider_proxy.close()
+    except Exception as e:
+        logger.error(f"Upstream pool shutdown error: {e}")
+    
     logger.info("Shutdown complete")
 
 # Root endpoint
@@ -222,12 +287,20 @@ async def root(request: Request):
 
 
 if __name__ == "__main__":
+    import os
     import uvicorn
     
+    # Development: single reloading process
+    # Production: gunicorn -c gunicorn.conf.py main:app (one worker per core)
+    workers = 1 if settings.DEBUG else (settings.WORKERS or os.cpu_count() or 1)
+    
     uvicorn.run(
         "main:app",
         host=settings.HOST,
         port=settings.PORT,
         reload=settings.DEBUG,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
         log_level="debug" if settings.DEBUG else "info"
     )
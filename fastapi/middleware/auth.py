@@ -6,12 +6,21 @@ Validates API keys and attaches user/team info to request
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
+import hmac
 import logging
 
 from config import settings
+from services.stage_timer import StageTimer
 
 logger = logging.getLogger(__name__)
 
+# Pseudo-teams shared by every key of a kind (pass-through and managed keys,
+# see _validate_api_key): data in them is scoped to the user, not the team
+SHARED_TEAMS = frozenset({"passthrough", "managed"})
+
+# Placeholder INTERNAL_SECRET shipped in config.py: never accepted
+DEFAULT_INTERNAL_SECRET = "change-me-in-production"
+
 
 class AuthMiddleware(BaseHTTPMiddleware):
     """
@@ -26,16 +35,41 @@ class AuthMiddleware(BaseHTTPMiddleware):
     # Paths that don't require authentication
     PUBLIC_PATHS = {
         "/", 
-        "/health", "/health/", "/health/ready", "/health/live", "/health/detailed",
+        "/health", "/health/", "/health/ready", "/health/live", "/health/drain", "/health/detailed",
         "/status", "/status/", "/status/json",
         "/docs", "/redoc", "/openapi.json"
     }
     
+    # Ops endpoints: authenticated with X-Internal-Secret, not customer keys
+    INTERNAL_PREFIX = "/internal/"
+    
+    def __init__(self, app):
+        super().__init__(app)
+        # Decided once at startup: with no real secret configured every
+        # /internal request is refused, whatever header it sends
+        self.internal_enabled = settings.INTERNAL_SECRET not in ("", DEFAULT_INTERNAL_SECRET)
+        if not self.internal_enabled:
+            logger.warning("INTERNAL_SECRET is empty or the default: /internal endpoints disabled")
+    
     async def dispatch(self, request: Request, call_next):
         # Skip auth for public paths
         if request.url.path in self.PUBLIC_PATHS:
             return await call_next(request)
         
+        if request.url.path.startswith(self.INTERNAL_PREFIX):
+            if not self._is_internal_request(request):
+                logger.warning(f"Rejected internal request: {request.url.path}")
+                return Response(
+                    content='{"error": {"message": "Invalid internal secret", "type": "invalid_request_error"}}',
+                    status_code=403,
+                    media_type="application/json"
+                )
+            return await call_next(request)
+        
+        # Per-request span recorder (threaded through to the endpoint)
+        timer = StageTimer()
+        request.state.timer = timer
+        
         # Extract API key
         api_key = self._extract_api_key(request)
         
@@ -49,6 +83,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
         
         # Validate API key
         user_info = await self._validate_api_key(api_key)
+        timer.mark("auth")
         
         if not user_info:
             logger.warning(f"Invalid API key: {api_key[:10]}...")
@@ -63,13 +98,27 @@ class AuthMiddleware(BaseHTTPMiddleware):
         request.state.team_id = user_info["team_id"]
         request.state.api_key_id = user_info["api_key_id"]
         request.state.passthrough = user_info.get("passthrough", False)
+        request.state.limits = user_info.get("limits")
         
         logger.debug(
             f"Authenticated: user_id={user_info['user_id']}, "
             f"team_id={user_info['team_id']}"
         )
         
-        return await call_next(request)
+        response = await call_next(request)
+        
+        # x-ratelimit-* headers set by admission (see services.rate_limiter)
+        rate_limit = getattr(request.state, "rate_limit", None)
+        if rate_limit is not None:
+            response.headers.update(rate_limit.headers())
+        return response
+    
+    def _is_internal_request(self, request: Request) -> bool:
+        """Check X-Internal-Secret (constant-time compare)"""
+        if not self.internal_enabled:
+            return False
+        secret = request.headers.get("X-Internal-Secret", "")
+        return bool(secret) and hmac.compare_digest(secret, settings.INTERNAL_SECRET)
     
     def _extract_api_key(self, request: Request) -> str | None:
         """Extract API key from request"""
@@ -152,7 +201,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
             return {
                 "user_id": f"managed-{api_key[-8:]}",
                 "team_id": "managed",
-                "api_key_id": f"server-key",
+                "api_key_id": f"server-key-{api_key[-8:]}",  # Own rate limit bucket per key
                 "passthrough": False,  # Use server's OPENAI_API_KEY
                 "limits": {
                     "max_steps": settings.MAX_STEPS,
@@ -4,10 +4,14 @@ Enforces run-level, daily, and monthly budget limits
 """
 
 import logging
+import sys
+from dataclasses import dataclass
 from typing import Optional
 from decimal import Decimal
 from datetime import datetime, timedelta
 
+from services.cost_calculator import CHARS_PER_TOKEN, resolve_pricing
+
 logger = logging.getLogger(__name__)
 
 
@@ -45,14 +49,24 @@ class BudgetPolicy:
         return cost > self.alert_threshold
 
 
+@dataclass
+class StreamAllowance:
+    """How much completion a stream may generate before it is cut off"""
+    max_chars: int  # completion characters (approximate tokens * CHARS_PER_TOKEN)
+    exceeded_limit: str  # run|per_run|daily|monthly - the tightest limit
+    limit: Decimal
+
+
 class BudgetEnforcer:
-    """Enforces budget policies on agent runs"""
+    """
+    Enforces budget policies on agent runs
+    
+    Stateless by design: spend totals come from RunState (Redis), so the
+    same decision is made whichever worker process serves the request.
+    """
 
     def __init__(self, policy: Optional[BudgetPolicy] = None):
         self.policy = policy or BudgetPolicy()
-        self.run_costs = {}  # run_id -> cost
-        self.daily_costs = {}  # date -> total_cost
-        self.monthly_costs = {}  # month -> total_cost
 
     def check_run_budget(
         self,
@@ -125,6 +139,40 @@ class BudgetEnforcer:
             "limit": None,
         }
 
+    def stream_allowance(
+        self,
+        model: str,
+        prompt_tokens: int,
+        run_spent: Decimal,
+        run_limit: Decimal,
+        daily_spent: Decimal = Decimal("0"),
+        monthly_spent: Decimal = Decimal("0"),
+    ) -> StreamAllowance:
+        """
+        Translate the remaining budgets into a completion character allowance
+        
+        Computed once per stream; the per-chunk check is then a single int
+        comparison against the running character count.
+        """
+        prompt_price, completion_price = resolve_pricing(model)
+        prompt_cost = prompt_price * prompt_tokens
+        
+        remaining = {
+            "run": (run_limit - run_spent, run_limit),
+            "per_run": (self.policy.per_run_limit, self.policy.per_run_limit),
+            "daily": (self.policy.daily_limit - daily_spent, self.policy.daily_limit),
+            "monthly": (self.policy.monthly_limit - monthly_spent, self.policy.monthly_limit),
+        }
+        exceeded_limit, (left, limit) = min(remaining.items(), key=lambda item: item[1][0])
+        
+        left -= prompt_cost
+        if not completion_price:
+            max_chars = sys.maxsize
+        else:
+            max_chars = max(0, int(left / completion_price) * CHARS_PER_TOKEN)
+        
+        return StreamAllowance(max_chars=max_chars, exceeded_limit=exceeded_limit, limit=limit)
+
     def get_remaining_budget(
         self,
         daily_spent: Decimal = Decimal("0"),
@@ -0,0 +1,73 @@
+"""
+Overload shedding middleware
+Refuses new API requests with a fast 503 while the worker is overloaded
+(or draining before shutdown)
+"""
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+from services.drain import drain_controller
+from services.overload import overload_controller
+
+OVERLOADED_BODY = (
+    '{"error": {"message": "Server overloaded, retry later", '
+    '"type": "server_overloaded", "code": "agentwall_overloaded"}}'
+)
+DRAINING_BODY = (
+    '{"error": {"message": "Server restarting, retry the request", '
+    '"type": "server_draining", "code": "agentwall_draining"}}'
+)
+
+
+class OverloadMiddleware:
+    """
+    Admission through the overload controller (services.overload)
+
+    A plain ASGI middleware rather than BaseHTTPMiddleware: the in-flight
+    slot is held until the response body is finished, so a streaming
+    response counts for as long as it streams. It is installed innermost,
+    after AuthMiddleware has attached the plan limits.
+
+    Only /v1 (customer) requests are controlled; health, status and
+    /internal (kill, profiler) requests always pass. While the worker
+    drains (services.drain), every new /v1 request is refused.
+    """
+
+    CONTROLLED_PREFIX = "/v1/"
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.CONTROLLED_PREFIX):
+            await self.app(scope, receive, send)
+            return
+
+        if drain_controller.draining:
+            await self._refuse(DRAINING_BODY, scope, receive, send)
+            return
+
+        limits = getattr(Request(scope).state, "limits", None)
+        priority = overload_controller.priority(limits)
+        if not overload_controller.admit(priority):
+            # Counted in agentwall_overload_shed_requests (no log line per request)
+            await self._refuse(OVERLOADED_BODY, scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            overload_controller.release()
+
+    @staticmethod
+    async def _refuse(body: str, scope: Scope, receive: Receive, send: Send):
+        response = Response(
+            content=body,
+            status_code=503,
+            media_type="application/json",
+            headers={"retry-after": str(settings.OVERLOAD_RETRY_AFTER)},
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,156 @@
+"""
+Fast-path parsing for chat completion requests
+
+The proxy reads only a handful of request fields, so instead of validating
+the whole body into ChatCompletionRequest (nested Message models, then
+model_dump() to rebuild the upstream dict) the body is parsed once with
+orjson and only these fields are checked:
+
+- model, stream
+- messages (must be a list; the last user message is used for tracking)
+- agentwall_* extensions
+
+Everything else is the provider's business and is forwarded untouched:
+when the body carries no agentwall_* keys the original bytes go upstream
+as-is. Invalid input still gets FastAPI's 422 validation error format.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel
+
+# AgentWall extensions (never sent upstream)
+AGENTWALL_FIELDS = ("agentwall_run_id", "agentwall_agent_id", "agentwall_metadata")
+
+
+@dataclass
+class ParsedChatRequest:
+    """The parts of a chat completion request the proxy needs"""
+    body: Dict[str, Any]  # full parsed body, agentwall_* keys removed
+    upstream_body: bytes  # bytes to forward (the original body when unchanged)
+    model: str
+    stream: bool
+    messages: List[Dict[str, Any]]
+    agentwall_run_id: Optional[str] = None
+    agentwall_agent_id: Optional[str] = None
+    agentwall_metadata: Optional[Dict[str, Any]] = None
+
+    def last_user_content(self) -> str:
+        """Text of the last user message ("" if there is none)"""
+        for message in reversed(self.messages):
+            if message.get("role") == "user":
+                return message_text(message.get("content"))
+        return ""
+
+
+def message_text(content: Any) -> str:
+    """Text of a message content (string, or list of content parts)"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(
+            part["text"] for part in content
+            if isinstance(part, dict) and isinstance(part.get("text"), str)
+        )
+    return ""
+
+
+def _error(error_type: str, loc: tuple, msg: str, value: Any = None) -> RequestValidationError:
+    return RequestValidationError([{
+        "type": error_type,
+        "loc": ("body",) + loc,
+        "msg": msg,
+        "input": value,
+    }])
+
+
+def parse_chat_request(raw: bytes) -> ParsedChatRequest:
+    """
+    Parse and minimally validate a chat completion request body
+
+    Raises: RequestValidationError (rendered as 422 by FastAPI)
+    """
+    try:
+        body = orjson.loads(raw)
+    except orjson.JSONDecodeError as e:
+        raise RequestValidationError([{
+            "type": "json_invalid",
+            "loc": ("body", e.pos),
+            "msg": "JSON decode error",
+            "input": {},
+            "ctx": {"error": e.msg},
+        }])
+
+    if not isinstance(body, dict):
+        raise _error("model_attributes_type", (), "Input should be a valid dictionary or object", body)
+
+    model = body.get("model")
+    if model is None:
+        raise _error("missing", ("model",), "Field required", body)
+    if not isinstance(model, str):
+        raise _error("string_type", ("model",), "Input should be a valid string", model)
+
+    messages = body.get("messages")
+    if messages is None:
+        raise _error("missing", ("messages",), "Field required", body)
+    if not isinstance(messages, list):
+        raise _error("list_type", ("messages",), "Input should be a valid list", messages)
+    for i, message in enumerate(messages):
+        if not isinstance(message, dict):
+            raise _error("model_type", ("messages", i), "Input should be a valid dictionary", message)
+
+    stream = body.get("stream")
+    if stream is not None and not isinstance(stream, bool):
+        raise _error("bool_type", ("stream",), "Input should be a valid boolean", stream)
+
+    extensions = {}
+    for name in AGENTWALL_FIELDS:
+        if name in body:
+            extensions[name] = body.pop(name)
+    for name in ("agentwall_run_id", "agentwall_agent_id"):
+        value = extensions.get(name)
+        if value is not None and not isinstance(value, str):
+            raise _error("string_type", (name,), "Input should be a valid string", value)
+    metadata = extensions.get("agentwall_metadata")
+    if metadata is not None and not isinstance(metadata, dict):
+        raise _error("dict_type", ("agentwall_metadata",), "Input should be a valid dictionary", metadata)
+
+    return ParsedChatRequest(
+        body=body,
+        upstream_body=orjson.dumps(body) if extensions else raw,
+        model=model,
+        stream=bool(stream),
+        messages=messages,
+        **extensions,
+    )
+
+
+def openapi_request_body(model: type[BaseModel]) -> dict:
+    """
+    OpenAPI requestBody for an endpoint that reads the raw body itself
+
+    Keeps the documented schema of `model` (with its $defs inlined) even
+    though FastAPI no longer validates the body against it.
+    """
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def inline(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref")
+            if ref and ref.startswith("#/$defs/"):
+                return inline(defs[ref[len("#/$defs/"):]])
+            return {key: inline(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [inline(item) for item in node]
+        return node
+
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": inline(schema)}},
+        }
+    }
@@ -0,0 +1,285 @@
+"""
+AgentWall Multi-Worker Scaling Benchmark
+
+Measures requests/sec of the proxy for 1..N gunicorn workers against a
+local mock upstream, to verify near-linear scaling of the shared-nothing
+worker model.
+
+Setup per worker count:
+1. Mock upstream (OpenAI-compatible, fixed latency) on --upstream-port
+2. gunicorn -c gunicorn.conf.py main:app with WORKERS=n
+3. Closed-loop load: --concurrency clients for --duration seconds
+
+Requires Redis (REDIS_URL) so run admission is exercised as in production.
+
+Usage:
+    python scaling_benchmark.py                  # 1, 2, 4 ... up to cpu_count
+    python scaling_benchmark.py --workers 1 2 4 8
+    python scaling_benchmark.py --upstream-latency-ms 50 --concurrency 256
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+
+FASTAPI_DIR = Path(__file__).parent.parent.parent
+
+# ============================================================================
+# Mock upstream (imported by uvicorn as scaling_benchmark:mock_app)
+# ============================================================================
+
+mock_app = FastAPI()
+MOCK_LATENCY = float(os.environ.get("MOCK_UPSTREAM_LATENCY_MS", "20")) / 1000
+
+MOCK_RESPONSE = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-3.5-turbo",
+    "choices": [
+        {
+            "index": 0,
+            "message": {"role": "assistant", "content": "Benchmark response"},
+            "finish_reason": "stop",
+        }
+    ],
+    "usage": {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15},
+}
+
+
+@mock_app.post("/v1/chat/completions")
+async def mock_chat_completions():
+    await asyncio.sleep(MOCK_LATENCY)
+    return MOCK_RESPONSE
+
+
+@mock_app.head("/")
+async def mock_root():
+    return {}
+
+
+# ============================================================================
+# Benchmark
+# ============================================================================
+
+@dataclass
+class ScalingResult:
+    """Throughput for one worker count"""
+    workers: int
+    requests: int = 0
+    errors: int = 0
+    duration_seconds: float = 0.0
+    rps: float = 0.0
+    p50_ms: float = 0.0
+    p99_ms: float = 0.0
+    efficiency: float = 0.0  # rps / (workers * rps_1)
+
+
+@dataclass
+class ScalingReport:
+    """Complete scaling report"""
+    timestamp: str = ""
+    cpu_count: int = 0
+    concurrency: int = 0
+    upstream_latency_ms: float = 0.0
+    results: list = field(default_factory=list)
+
+
+def _wait_for(url: str, timeout: float = 30.0) -> bool:
+    """Poll until url answers"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def _stop(proc: subprocess.Popen):
+    """Terminate a process group and wait"""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def start_upstream(port: int, latency_ms: float) -> subprocess.Popen:
+    """Start the mock upstream with enough workers to never be the bottleneck"""
+    env = {**os.environ, "MOCK_UPSTREAM_LATENCY_MS": str(latency_ms)}
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "scaling_benchmark:mock_app",
+            "--port", str(port), "--workers", str(os.cpu_count() or 1),
+            "--log-level", "warning",
+        ],
+        cwd=Path(__file__).parent,
+        env=env,
+        start_new_session=True,
+    )
+
+
+def start_proxy(port: int, workers: int, upstream_port: int) -> subprocess.Popen:
+    """Start the AgentWall proxy under gunicorn with `workers` processes"""
+    env = {
+        **os.environ,
+        "WORKERS": str(workers),
+        "PORT": str(port),
+        "DEBUG": "false",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{upstream_port}",
+        "ENABLE_METRICS": "false",
+    }
+    return subprocess.Popen(
+        ["gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+        cwd=FASTAPI_DIR,
+        env=env,
+        start_new_session=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def drive_load(base_url: str, concurrency: int, duration: float) -> ScalingResult:
+    """Closed-loop load generator: each client sends back-to-back requests"""
+    latencies: list[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    payload = {
+        "model": "gpt-3.5-turbo",
+        "messages": [{"role": "user", "content": "scaling benchmark"}],
+    }
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await client.post(
+                    "/v1/chat/completions",
+                    json=payload,
+                    # Fresh run per request: measure throughput, not step limits
+                    headers={"X-AgentWall-Run-ID": str(uuid.uuid4())},
+                )
+                if response.status_code == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        headers={"Authorization": "Bearer aw-benchmark-key"},
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=concurrency),
+    ) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = ScalingResult(workers=0, requests=len(latencies), errors=errors)
+    result.duration_seconds = elapsed
+    result.rps = len(latencies) / elapsed if elapsed else 0.0
+    if latencies:
+        result.p50_ms = latencies[len(latencies) // 2]
+        result.p99_ms = latencies[int(len(latencies) * 0.99) - 1]
+    return result
+
+
+async def run(args) -> ScalingReport:
+    report = ScalingReport(
+        timestamp=datetime.now().isoformat(),
+        cpu_count=os.cpu_count() or 1,
+        concurrency=args.concurrency,
+        upstream_latency_ms=args.upstream_latency_ms,
+    )
+
+    print("\n" + "=" * 60)
+    print("🛡️  AGENTWALL MULTI-WORKER SCALING BENCHMARK")
+    print("=" * 60)
+    print(f"CPU cores: {report.cpu_count}")
+    print(f"Workers: {args.workers}")
+    print(f"Concurrency: {args.concurrency}, duration: {args.duration}s per step")
+    print("=" * 60 + "\n")
+
+    upstream = start_upstream(args.upstream_port, args.upstream_latency_ms)
+    try:
+        if not _wait_for(f"http://127.0.0.1:{args.upstream_port}/docs"):
+            raise RuntimeError("Mock upstream did not start")
+
+        baseline_rps = 0.0
+        for workers in args.workers:
+            proxy = start_proxy(args.port, workers, args.upstream_port)
+            try:
+                base_url = f"http://127.0.0.1:{args.port}"
+                if not _wait_for(f"{base_url}/health"):
+                    raise RuntimeError(f"Proxy with {workers} workers did not start")
+
+                # Warm-up (connection pools, caches) - not measured
+                await drive_load(base_url, args.concurrency, 2.0)
+                result = await drive_load(base_url, args.concurrency, args.duration)
+                result.workers = workers
+
+                if not baseline_rps:
+                    baseline_rps = result.rps / workers
+                result.efficiency = result.rps / (workers * baseline_rps) if baseline_rps else 0.0
+
+                report.results.append(result)
+                print(
+                    f"  {workers:>3} workers: {result.rps:>9.1f} req/s  "
+                    f"p50={result.p50_ms:.1f}ms p99={result.p99_ms:.1f}ms  "
+                    f"errors={result.errors}  efficiency={result.efficiency:.0%}"
+                )
+            finally:
+                _stop(proxy)
+    finally:
+        _stop(upstream)
+
+    return report
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    default_workers = sorted({1, *[2 ** i for i in range(1, 8) if 2 ** i <= cpu_count], cpu_count})
+
+    parser = argparse.ArgumentParser(description="AgentWall multi-worker scaling benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_workers)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--upstream-port", type=int, default=18080)
+    parser.add_argument("--upstream-latency-ms", type=float, default=20.0)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(asdict(report), indent=2))
+        print(f"\n📄 Report saved: {args.output}")
+
+    # Near-linear: every step keeps >= 70% per-worker efficiency
+    scaling_ok = all(r.efficiency >= 0.7 for r in report.results)
+    print(f"\n{'✅' if scaling_ok else '⚠️'} Scaling {'near-linear' if scaling_ok else 'sub-linear'}")
+    sys.exit(0 if scaling_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Analytics - spend, token and latency breakdowns for team dashboards
+
+Queries never scan request_logs. They read the hourly and daily rollups
+(agent_logs_hourly / agent_logs_daily, SummingMergeTree materialized
+views keyed by agent, model, provider and user):
+
+- Rollup choice: the daily rollup answers when the range covers whole
+  (UTC) days and results are bucketed by day or not at all; otherwise
+  the hourly one does. Ranges are widened to whole hours.
+- Cache: results are stored in Redis as the response body. A range that
+  ended before the log flush settles is final and kept for
+  ANALYTICS_CACHE_TTL. A range still open is kept for at most
+  ANALYTICS_CACHE_LIVE_TTL and never past the next bucket boundary, so
+  a new bucket shows up as soon as it starts.
+- Single flight: concurrent identical queries on a worker share one
+  ClickHouse query (and one cache write).
+
+Redis and ClickHouse are optional here: without Redis every query goes to
+ClickHouse; without ClickHouse queries fail (AnalyticsUnavailable).
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+import orjson
+import redis.asyncio as redis
+
+from config import settings
+from services.clickhouse_client import clickhouse_client
+from services.metrics import (
+    ANALYTICS_CACHE_HITS,
+    ANALYTICS_COALESCED,
+    ANALYTICS_CLICKHOUSE_QUERIES,
+)
+from services.run_tracker import REDIS_ERRORS
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "agentwall:analytics:"
+
+GRANULARITIES = ("hour", "day", "total")
+
+# API dimension name -> rollup column
+DIMENSIONS = {
+    "agent": "agent_id",
+    "model": "model",
+    "provider": "provider",
+    "user": "user_id",
+}
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+class AnalyticsUnavailable(Exception):
+    """The rollups could not be queried"""
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """A rollup table and how its rows map to time"""
+    name: str
+    table: str
+    bucket: timedelta
+    # Start of a row's bucket (UTC), per result granularity
+    hour_expr: str
+    day_expr: str
+    # Range predicate on the rollup's key
+    range_sql: str
+
+
+HOURLY = Rollup(
+    name="hourly",
+    table="agent_logs_hourly",
+    bucket=HOUR,
+    hour_expr="toDateTime(date, 'UTC') + toIntervalHour(hour)",
+    day_expr="date",
+    range_sql=(
+        "date >= {start_date:Date} AND date <= {end_date:Date}\n"
+        "  AND toDateTime(date, 'UTC') + toIntervalHour(hour) >= {start:DateTime('UTC')}\n"
+        "  AND toDateTime(date, 'UTC') + toIntervalHour(hour) < {end:DateTime('UTC')}"
+    ),
+)
+
+DAILY = Rollup(
+    name="daily",
+    table="agent_logs_daily",
+    bucket=DAY,
+    hour_expr="",  # never used: hourly results always come from HOURLY
+    day_expr="date",
+    range_sql="date >= {start_date:Date} AND date < {end_date:Date}",
+)
+
+
+def floor_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(value: datetime) -> datetime:
+    floored = floor_hour(value)
+    return floored if floored == value else floored + HOUR
+
+
+def _is_midnight(value: datetime) -> bool:
+    return value.hour == 0 and value == floor_hour(value)
+
+
+@dataclass(frozen=True)
+class AnalyticsQuery:
+    """
+    One dashboard query (times are naive UTC)
+
+    Build with AnalyticsQuery.create() so the range is aligned: equal
+    queries then share a cache entry and a single flight.
+    """
+    team_id: str
+    start: datetime
+    end: datetime
+    granularity: str = "hour"
+    group_by: tuple[str, ...] = ()
+    # (dimension, value) pairs, sorted
+    filters: tuple[tuple[str, str], ...] = ()
+    limit: int = 1000
+
+    @classmethod
+    def create(
+        cls,
+        team_id: str,
+        start: datetime,
+        end: datetime,
+        granularity: str = "hour",
+        group_by: tuple[str, ...] = (),
+        filters: Optional[dict[str, str]] = None,
+        limit: int = 1000,
+    ) -> "AnalyticsQuery":
+        """Validate and align a query (raises ValueError)"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+        for dimension in (*group_by, *(filters or {})):
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Unknown dimension: {dimension} (use {', '.join(DIMENSIONS)})")
+        start, end = floor_hour(start), ceil_hour(end)
+        if end <= start:
+            raise ValueError("end must be after start")
+        if end - start > timedelta(days=settings.ANALYTICS_MAX_RANGE_DAYS):
+            raise ValueError(f"Range is limited to {settings.ANALYTICS_MAX_RANGE_DAYS} days")
+        return cls(
+            team_id=team_id,
+            start=start,
+            end=end,
+            granularity=granularity,
+            group_by=tuple(sorted(set(group_by))),
+            filters=tuple(sorted((filters or {}).items())),
+            limit=limit,
+        )
+
+    @property
+    def rollup(self) -> Rollup:
+        """The coarsest rollup that answers this query exactly"""
+        if self.granularity != "hour" and _is_midnight(self.start) and _is_midnight(self.end):
+            return DAILY
+        return HOURLY
+
+    @property
+    def cache_key(self) -> str:
+        digest = hashlib.blake2b(
+            orjson.dumps([
+                self.team_id, self.start.isoformat(), self.end.isoformat(),
+                self.granularity, self.group_by, self.filters, self.limit,
+            ]),
+            digest_size=16,
+        ).hexdigest()
+        return CACHE_PREFIX + digest
+
+    def cache_ttl(self, now: datetime) -> int:
+        """Seconds to cache the result of this query, computed at `now`"""
+        settle = timedelta(seconds=2 * settings.LOG_FLUSH_INTERVAL)
+        if self.end + settle <= now:
+            return settings.ANALYTICS_CACHE_TTL
+        bucket = self.rollup.bucket
+        epoch = datetime(1970, 1, 1)
+        next_boundary = epoch + ((now - epoch) // bucket + 1) * bucket
+        until_boundary = (next_boundary - now).total_seconds()
+        return max(1, int(min(settings.ANALYTICS_CACHE_LIVE_TTL, until_boundary)))
+
+    def to_sql(self, database: str) -> tuple[str, dict]:
+        """SELECT over the chosen rollup, with server-side parameters"""
+        rollup = self.rollup
+        columns = [DIMENSIONS[dimension] for dimension in self.group_by]
+        select = list(columns)
+        group = list(columns)
+        if self.granularity != "total":
+            bucket = rollup.hour_expr if self.granularity == "hour" else rollup.day_expr
+            select.insert(0, f"{bucket} AS bucket")
+            group.insert(0, "bucket")
+
+        params = {
+            "team_id": self.team_id,
+            "start": self.start.strftime("%Y-%m-%d %H:%M:%S"),
+            "end": self.end.strftime("%Y-%m-%d %H:%M:%S"),
+            "start_date": self.start.date().isoformat(),
+            "end_date": self.end.date().isoformat(),
+            "limit": self.limit,
+        }
+        where = ["team_id = {team_id:String}", rollup.range_sql]
+        for index, (dimension, value) in enumerate(self.filters):
+            where.append(f"{DIMENSIONS[dimension]} = {{f{index}:String}}")
+            params[f"f{index}"] = value
+
+        query = f"""
+SELECT
+    {"".join(f"{expr}, " for expr in select)}sum(request_count) AS requests,
+    sum(total_prompt_tokens) AS prompt_tokens,
+    sum(total_completion_tokens) AS completion_tokens,
+    sum(total_tokens) AS tokens,
+    sum(total_cost) AS cost_usd,
+    sum(total_latency) AS latency_ms_sum,
+    sum(error_count) AS errors,
+    sum(loop_count) AS loops,
+    sum(sensitive_count) AS dlp_events,
+    quantilesMerge(0.5, 0.95, 0.99)(latency_quantiles) AS latency_ms_quantiles
+FROM {database}.{rollup.table}
+WHERE {" AND ".join(where)}
+{"GROUP BY " + ", ".join(group) if group else ""}
+ORDER BY {"bucket, " if "bucket" in group else ""}cost_usd DESC
+LIMIT {{limit:UInt32}}
+"""
+        return query, params
+
+
+def _format_row(row: dict, granularity: str) -> dict:
+    p50, p95, p99 = row.pop("latency_ms_quantiles")
+    latency_sum = row.pop("latency_ms_sum")
+    if granularity == "hour":
+        row["bucket"] = row["bucket"].replace(" ", "T") + "Z"
+    row["cost_usd"] = round(row["cost_usd"], 6)
+    row["latency_ms"] = {
+        "avg": round(latency_sum / row["requests"], 1) if row["requests"] else 0,
+        "p50": p50,
+        "p95": p95,
+        "p99": p99,
+    }
+    return row
+
+
+class AnalyticsService:
+    """Rollup queries behind a Redis cache and a per-worker single flight"""
+
+    def __init__(self):
+        self._redis: Optional[redis.Redis] = None
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def _get_redis(self) -> redis.Redis:
+        if self._redis is None:
+            self._redis = redis.from_url(
+                settings.REDIS_URL,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+            )
+        return self._redis
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    async def query(self, query: AnalyticsQuery) -> bytes:
+        """
+        Run a query; returns the JSON response body
+
+        Raises AnalyticsUnavailable if ClickHouse could not answer.
+        """
+        key = query.cache_key
+        try:
+            cached = await self._get_redis().get(key)
+        except REDIS_ERRORS as e:
+            logger.debug(f"Analytics cache unavailable: {e}")
+            cached = None
+        if cached is not None:
+            ANALYTICS_CACHE_HITS.inc()
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(query, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            ANALYTICS_COALESCED.inc()
+        # Shielded: a caller that goes away does not cancel the others' query
+        return await asyncio.shield(task)
+
+    async def _load(self, query: AnalyticsQuery, key: str) -> bytes:
+        sql, params = query.to_sql(clickhouse_client.database)
+        ANALYTICS_CLICKHOUSE_QUERIES.inc()
+        started = time.perf_counter()
+        try:
+            rows = await clickhouse_client.select(sql, params)
+        except Exception as e:
+            raise AnalyticsUnavailable(str(e)) from e
+
+        body = orjson.dumps({
+            "object": "analytics",
+            "start": query.start.isoformat() + "Z",
+            "end": query.end.isoformat() + "Z",
+            "granularity": query.granularity,
+            "group_by": list(query.group_by),
+            "rollup": query.rollup.name,
+            "data": [_format_row(row, query.granularity) for row in rows],
+        })
+        logger.debug(
+            f"Analytics query ({query.rollup.name}, {len(rows)} rows) "
+            f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+
+        try:
+            await self._get_redis().set(key, body, ex=query.cache_ttl(datetime.utcnow()))
+        except REDIS_ERRORS as e:
+            logger.debug(f"Analytics cache write failed: {e}")
+        return body
+
+
+# Singleton instance (per worker process)
+analytics_service = AnalyticsService()
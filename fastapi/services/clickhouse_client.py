@@ -6,22 +6,41 @@ Design:
 - Async inserts (don't block request)
 - Batch writes (reduce DB round trips)
 - Graceful degradation (if CH down, don't crash proxy)
+
+Schema: clickhouse/init/01-create-database.sql. Run-level reads go to the
+run_rollup view (per-run totals maintained at insert time), never to a
+scan of request_logs. Step exports are streamed (JSONEachRow is passed
+through as NDJSON) and read in run order via the p_run_steps projection.
+
+Request messages are content-addressed (services.message_store): each
+message is written once to `messages`, request_logs keeps their hashes.
 """
 
 import asyncio
 import json
+import time
 import logging
 from datetime import datetime
-from typing import Optional
-from dataclasses import dataclass, asdict
+from typing import AsyncIterator, Optional
+from dataclasses import dataclass, asdict, field
 from decimal import Decimal
 
 import httpx
 
 from config import settings
+from services.message_store import message_store
+from services.metrics import (
+    STAGE_LOG_ENQUEUE,
+    CLICKHOUSE_QUEUE_DEPTH,
+    MESSAGES_STORED,
+    MESSAGES_DEDUPLICATED,
+)
 
 logger = logging.getLogger(__name__)
 
+# Estimated memory of a queued log besides its strings and message rows
+LOG_OVERHEAD_BYTES = 1024
+
 
 @dataclass
 class RequestLog:
@@ -34,6 +53,7 @@ class RequestLog:
     api_key_id: str
     model: str
     endpoint: str
+    provider: str = ""
     prompt_tokens: int = 0
     completion_tokens: int = 0
     total_tokens: int = 0
@@ -41,6 +61,16 @@ class RequestLog:
     latency_ms: int = 0
     overhead_ms: int = 0
     ttfb_ms: int = 0
+    # Stage timing breakdown (ms, see services.stage_timer)
+    auth_ms: float = 0.0
+    admission_ms: float = 0.0
+    loop_check_ms: float = 0.0
+    queue_ms: float = 0.0
+    upstream_connect_ms: float = 0.0
+    upstream_ttfb_ms: float = 0.0
+    upstream_ms: float = 0.0
+    dlp_ms: float = 0.0
+    post_check_ms: float = 0.0
     status_code: int = 200
     error_message: str = ""
     loop_detected: bool = False
@@ -49,19 +79,27 @@ class RequestLog:
     dlp_action: str = ""
     agent_id: str = ""
     agent_name: str = ""
-    request_messages: str = ""  # JSON string
+    # Request messages, hashed into message_hashes on the first flush attempt
+    # and then dropped (see _prepare_logs)
+    messages: Optional[list] = None
+    message_hashes: list[str] = field(default_factory=list)
     response_content: str = ""
     ip_address: str = ""
     user_agent: str = ""
     metadata: str = "{}"
+    # Not written to request_logs: messages rows still to insert and the
+    # estimated size while queued (set by _prepare_logs)
+    pending_messages: dict = field(default_factory=dict)
+    queued_bytes: int = 0
 
 
 @dataclass 
 class RunSummary:
-    """Run-level summary for tracking"""
+    """Run-level summary for tracking (one worker's totals, see services.run_summary)"""
     run_id: str
     team_id: str
     user_id: str
+    segment_id: str = ""
     agent_id: str = ""
     started_at: Optional[datetime] = None
     total_steps: int = 0
@@ -75,6 +113,83 @@ class RunSummary:
     budget_exceeded: bool = False
 
 
+@dataclass
+class LoopPattern:
+    """Loop detection event (loop_patterns table)"""
+    run_id: str
+    team_id: str
+    pattern_type: str  # 'repetitive_prompt', 'tool_spam', 'repetitive_tool_call', 'state_oscillation'
+    similarity_score: float = 1.0
+    repetition_count: int = 0
+    prompt_hash: str = ""
+    tool_name: str = ""
+    action_taken: str = "killed"  # 'killed', 'warned', 'logged'
+    cost_saved: float = 0.0
+
+
+# Per-run totals from run_rollup (parts are merged lazily: always GROUP BY)
+RUN_ROLLUP_SELECT = """
+SELECT
+    run_id,
+    team_id,
+    any(user_id) AS user_id,
+    anyLast(agent_id) AS agent_id,
+    min(started_at) AS started_at,
+    max(last_activity) AS last_activity,
+    sum(request_count) AS request_count,
+    max(last_step) AS last_step,
+    sum(total_prompt_tokens) AS prompt_tokens,
+    sum(total_completion_tokens) AS completion_tokens,
+    sum(total_cost_usd) AS cost_usd,
+    sum(total_latency_ms) AS latency_ms,
+    sum(total_overhead_ms) AS overhead_ms,
+    sum(error_count) AS errors,
+    max(loop_detected) AS loop,
+    max(dlp_triggered) AS dlp,
+    groupUniqArrayArray(models) AS model_list,
+    argMaxMerge(last_status) AS last_status_code,
+    quantilesMerge(0.5, 0.95, 0.99)(latency_quantiles) AS latency_p50_p95_p99
+FROM {database}.run_rollup
+WHERE team_id = {{team_id:String}}
+"""
+
+
+# Columns of one exported step (run replay); content adds the payloads
+RUN_STEP_COLUMNS = (
+    "step_number", "request_id", "timestamp", "agent_id", "model", "endpoint",
+    "prompt_tokens", "completion_tokens", "total_tokens", "cost_usd",
+    "latency_ms", "ttfb_ms", "status_code", "error_message",
+    "loop_detected", "similarity_score", "dlp_triggered", "dlp_action",
+)
+RUN_STEP_CONTENT_COLUMNS = ("message_hashes", "request_messages", "response_content")
+
+# Steps of one run after a cursor, in step order (served by p_run_steps).
+# A page never splits a step: WITH TIES keeps every row of the last step.
+RUN_STEPS_SELECT = """
+SELECT {columns}
+FROM {database}.request_logs
+WHERE run_id = {{run_id:String}}
+  AND team_id = {{team_id:String}}
+  AND step_number > {{after:UInt32}}
+ORDER BY step_number
+"""
+
+# Distinct messages of one run, one JSON object per line. The stored
+# message is already JSON and is spliced in as is (TabSeparatedRaw).
+RUN_MESSAGES_SELECT = """
+SELECT concat('{{"message_hash":"', message_hash, '","message":', any(message), '}}')
+FROM {database}.messages
+WHERE team_id = {{team_id:String}}
+  AND message_hash IN (
+    SELECT arrayJoin(message_hashes)
+    FROM {database}.request_logs
+    WHERE run_id = {{run_id:String}} AND team_id = {{team_id:String}}
+  )
+GROUP BY message_hash
+FORMAT TabSeparatedRaw
+"""
+
+
 class ClickHouseClient:
     """
     Async ClickHouse client with batching
@@ -88,17 +203,33 @@ class ClickHouseClient:
         self.user = settings.CLICKHOUSE_USER
         self.password = settings.CLICKHOUSE_PASSWORD
         
+        # Pooled HTTP client (created per worker in start())
+        self._client: Optional[httpx.AsyncClient] = None
+        
         # Batch queue
         self._log_queue: list[RequestLog] = []
         self._queue_lock = asyncio.Lock()
         self._flush_task: Optional[asyncio.Task] = None
+        # Set when a full batch is queued: wakes the flush loop early
+        self._batch_full = asyncio.Event()
         
         # Health state
         self._healthy = True
         self._last_error: Optional[str] = None
     
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get or create the pooled HTTP client"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=10.0,
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+            )
+        return self._client
+    
     async def start(self):
         """Start background flush task"""
+        self._get_client()
         self._flush_task = asyncio.create_task(self._flush_loop())
         logger.info("ClickHouse client started")
     
@@ -113,13 +244,20 @@ class ClickHouseClient:
         
         # Final flush
         await self._flush_batch()
+        
+        if self._client:
+            await self._client.aclose()
         logger.info("ClickHouse client stopped")
     
     async def _flush_loop(self):
-        """Background task to flush logs periodically"""
+        """Background task to flush logs periodically (or as soon as a batch is full)"""
         while True:
             try:
-                await asyncio.sleep(settings.LOG_FLUSH_INTERVAL)
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), settings.LOG_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._batch_full.clear()
                 await self._flush_batch()
             except asyncio.CancelledError:
                 break
@@ -134,6 +272,7 @@ class ClickHouseClient:
             
             batch = self._log_queue.copy()
             self._log_queue.clear()
+            CLICKHOUSE_QUEUE_DEPTH.set(0)
         
         try:
             await self._insert_logs(batch)
@@ -143,16 +282,75 @@ class ClickHouseClient:
             logger.error(f"Failed to flush {len(batch)} logs: {e}")
             self._healthy = False
             self._last_error = str(e)
-            # Re-queue failed logs (with limit to prevent memory issues)
+            # Re-queue failed logs, up to LOG_REQUEUE_MAX_BYTES held per worker
             async with self._queue_lock:
-                if len(self._log_queue) < 10000:
-                    self._log_queue.extend(batch)
+                budget = settings.LOG_REQUEUE_MAX_BYTES - sum(
+                    log.queued_bytes for log in self._log_queue
+                )
+                kept = 0
+                for log in batch:
+                    budget -= log.queued_bytes
+                    if budget < 0:
+                        break
+                    kept += 1
+                self._log_queue.extend(batch[:kept])
+                CLICKHOUSE_QUEUE_DEPTH.set(len(self._log_queue))
+            if kept < len(batch):
+                logger.error(f"Dropped {len(batch) - kept} logs (re-queue limit reached)")
+
+    async def _prepare_logs(self, logs: list[RequestLog]):
+        """
+        Hash new logs' messages once, keeping only what a retry needs
+
+        Each log keeps its message hashes and the messages rows not yet
+        written (a row shared by several logs of the batch is kept by the
+        first one), and drops the messages list: a re-queued log is not
+        re-hashed and does not pin the request's whole history.
+        """
+        pending = {key for log in logs for key in log.pending_messages}
+        hashed = new = 0
+        for log in logs:
+            if log.queued_bytes:
+                continue
+            if log.messages is not None:
+                rows = {}
+                log.message_hashes = message_store.collect(log.team_id, log.messages, rows)
+                log.pending_messages = {key: row for key, row in rows.items() if key not in pending}
+                pending.update(log.pending_messages)
+                log.messages = None
+                hashed += len(log.message_hashes)
+                new += len(log.pending_messages)
+                # Hashing serializes every message: yield between requests
+                await asyncio.sleep(0)
+            log.queued_bytes = (
+                LOG_OVERHEAD_BYTES
+                + 40 * len(log.message_hashes)
+                + sum(len(row["message"]) for row in log.pending_messages.values())
+                + len(log.response_content)
+                + len(log.error_message)
+                + len(log.user_agent)
+                + len(log.metadata)
+            )
+        MESSAGES_DEDUPLICATED.inc(hashed - new)
 
     async def _insert_logs(self, logs: list[RequestLog]):
         """Insert logs to ClickHouse via HTTP interface"""
         if not logs:
             return
         
+        await self._prepare_logs(logs)
+        
+        # New conversation messages go first, so logged hashes resolve
+        messages = {}
+        for log in logs:
+            messages.update(log.pending_messages)
+        if messages:
+            await self._insert_messages(list(messages.values()))
+            message_store.remember(messages)
+            MESSAGES_STORED.inc(len(messages))
+            for log in logs:
+                log.pending_messages = {}
+        
         # Build INSERT query with JSONEachRow format
         rows = []
         for log in logs:
@@ -164,6 +362,7 @@ class ClickHouseClient:
                 "user_id": log.user_id,
                 "api_key_id": log.api_key_id,
                 "model": log.model,
+                "provider": log.provider,
                 "endpoint": log.endpoint,
                 "prompt_tokens": log.prompt_tokens,
                 "completion_tokens": log.completion_tokens,
@@ -172,6 +371,15 @@ class ClickHouseClient:
                 "latency_ms": log.latency_ms,
                 "overhead_ms": log.overhead_ms,
                 "ttfb_ms": log.ttfb_ms,
+                "auth_ms": log.auth_ms,
+                "admission_ms": log.admission_ms,
+                "loop_check_ms": log.loop_check_ms,
+                "queue_ms": log.queue_ms,
+                "upstream_connect_ms": log.upstream_connect_ms,
+                "upstream_ttfb_ms": log.upstream_ttfb_ms,
+                "upstream_ms": log.upstream_ms,
+                "dlp_ms": log.dlp_ms,
+                "post_check_ms": log.post_check_ms,
                 "status_code": log.status_code,
                 "error_message": log.error_message,
                 "loop_detected": log.loop_detected,
@@ -180,7 +388,7 @@ class ClickHouseClient:
                 "dlp_action": log.dlp_action,
                 "agent_id": log.agent_id,
                 "agent_name": log.agent_name,
-                "request_messages": log.request_messages,
+                "message_hashes": log.message_hashes,
                 "response_content": log.response_content,
                 "ip_address": log.ip_address,
                 "user_agent": log.user_agent,
@@ -190,68 +398,234 @@ class ClickHouseClient:
         
         body = "\n".join(rows)
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                self.base_url,
-                params={
-                    "query": f"INSERT INTO {self.database}.request_logs FORMAT JSONEachRow",
-                    "user": self.user,
-                    "password": self.password,
-                },
-                content=body,
-                headers={"Content-Type": "application/json"},
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"ClickHouse error: {response.text}")
+        response = await self._get_client().post(
+            "/",
+            params={
+                "query": f"INSERT INTO {self.database}.request_logs FORMAT JSONEachRow",
+                "user": self.user,
+                "password": self.password,
+            },
+            content=body,
+            headers={"Content-Type": "application/json"},
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"ClickHouse error: {response.text}")
         
         logger.debug(f"Inserted {len(logs)} logs to ClickHouse")
     
+    async def _insert_messages(self, rows: list[dict]):
+        """Insert conversation messages (duplicates collapse, ReplacingMergeTree)"""
+        response = await self._get_client().post(
+            "/",
+            params={
+                "query": f"INSERT INTO {self.database}.messages FORMAT JSONEachRow",
+                "user": self.user,
+                "password": self.password,
+            },
+            content="\n".join(json.dumps(row) for row in rows),
+            headers={"Content-Type": "application/json"},
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"ClickHouse error: {response.text}")
+        
+        logger.debug(f"Inserted {len(rows)} messages to ClickHouse")
+    
     async def log_request(self, log: RequestLog):
         """Queue a request log (non-blocking)"""
+        await self.log_requests([log])
+    
+    async def log_requests(self, logs: list[RequestLog]):
+        """Queue request logs (the post-processor hands them over in bulk)"""
+        enqueue_start = time.perf_counter()
         async with self._queue_lock:
-            self._log_queue.append(log)
+            self._log_queue.extend(logs)
+            CLICKHOUSE_QUEUE_DEPTH.set(len(self._log_queue))
             
-            # Flush immediately if batch is full
+            # Flush immediately if batch is full (one flush at a time, in the loop)
             if len(self._log_queue) >= settings.LOG_BATCH_SIZE:
-                asyncio.create_task(self._flush_batch())
+                self._batch_full.set()
+        STAGE_LOG_ENQUEUE.observe(time.perf_counter() - enqueue_start)
     
-    async def update_run_summary(self, summary: RunSummary):
-        """Update run summary (upsert via ReplacingMergeTree)"""
-        row = {
-            "run_id": summary.run_id,
-            "team_id": summary.team_id,
-            "user_id": summary.user_id,
-            "agent_id": summary.agent_id,
-            "started_at": summary.started_at.isoformat() if summary.started_at else datetime.utcnow().isoformat(),
-            "total_steps": summary.total_steps,
-            "total_tokens": summary.total_tokens,
-            "total_cost_usd": float(summary.total_cost_usd),
-            "total_latency_ms": summary.total_latency_ms,
-            "status": summary.status,
-            "kill_reason": summary.kill_reason,
-            "loop_detected": summary.loop_detected,
-            "dlp_triggered": summary.dlp_triggered,
-            "budget_exceeded": summary.budget_exceeded,
+    async def insert_run_summaries(self, summaries: list[RunSummary]):
+        """Insert run summary snapshots (latest per segment wins, ReplacingMergeTree)"""
+        if not summaries:
+            return
+        
+        rows = []
+        for summary in summaries:
+            rows.append(json.dumps({
+                "run_id": summary.run_id,
+                "segment_id": summary.segment_id,
+                "team_id": summary.team_id,
+                "user_id": summary.user_id,
+                "agent_id": summary.agent_id,
+                "started_at": (summary.started_at or datetime.utcnow()).isoformat(),
+                "total_steps": summary.total_steps,
+                "total_tokens": summary.total_tokens,
+                "total_cost_usd": float(summary.total_cost_usd),
+                "total_latency_ms": summary.total_latency_ms,
+                "status": summary.status,
+                "kill_reason": summary.kill_reason,
+                "loop_detected": summary.loop_detected,
+                "dlp_triggered": summary.dlp_triggered,
+                "budget_exceeded": summary.budget_exceeded,
+            }))
+        
+        response = await self._get_client().post(
+            "/",
+            params={
+                "query": f"INSERT INTO {self.database}.run_summary FORMAT JSONEachRow",
+                "user": self.user,
+                "password": self.password,
+                "date_time_input_format": "best_effort",
+            },
+            content="\n".join(rows),
+            headers={"Content-Type": "application/json"},
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"ClickHouse error: {response.text}")
+        
+        logger.debug(f"Inserted {len(summaries)} run summaries to ClickHouse")
+    
+    def _select_params(self, params: dict) -> dict:
+        """HTTP parameters for a SELECT with server-side {name:Type} placeholders"""
+        return {
+            "user": self.user,
+            "password": self.password,
+            "output_format_json_quote_64bit_integers": 0,
+            **{f"param_{name}": value for name, value in params.items()},
         }
+    
+    async def ping(self, timeout: float) -> float:
+        """
+        GET /ping over the pooled client (health monitor)
         
+        Returns: round-trip time in ms; raises when ClickHouse is unreachable
+        """
+        start = time.perf_counter()
+        response = await self._get_client().get("/ping", timeout=timeout)
+        if response.status_code != 200:
+            raise Exception(f"HTTP {response.status_code}")
+        return (time.perf_counter() - start) * 1000
+    
+    async def select(self, query: str, params: dict) -> list[dict]:
+        """
+        Run a SELECT with server-side parameters ({name:Type} placeholders)
+        
+        Returns: rows as dicts (JSONEachRow)
+        """
+        response = await self._get_client().post(
+            "/",
+            params=self._select_params(params),
+            content=f"{query} FORMAT JSONEachRow",
+            timeout=5.0,
+        )
+        if response.status_code != 200:
+            raise Exception(f"ClickHouse error: {response.text}")
+        return [json.loads(line) for line in response.text.splitlines() if line]
+    
+    async def stream_run_steps(
+        self,
+        team_id: str,
+        run_id: str,
+        after: int = 0,
+        limit: int = 0,
+        content: bool = True,
+    ) -> AsyncIterator[bytes]:
+        """
+        Steps of a run after step `after`, as NDJSON chunks
+        
+        The query is sent (and its status checked) before this returns, so
+        errors surface here rather than mid-stream. The returned iterator
+        passes ClickHouse's output through without parsing it and must be
+        consumed or closed (it holds a pooled connection).
+        
+        limit: at most this many steps (0 = all of them)
+        """
+        columns = RUN_STEP_COLUMNS + (RUN_STEP_CONTENT_COLUMNS if content else ())
+        query = RUN_STEPS_SELECT.format(database=self.database, columns=", ".join(columns))
+        params = {"team_id": team_id, "run_id": run_id, "after": after}
+        if limit:
+            query += "LIMIT {limit:UInt32} WITH TIES\n"
+            params["limit"] = limit
+        
+        return await self._stream(f"{query}FORMAT JSONEachRow", params)
+    
+    async def stream_run_messages(self, team_id: str, run_id: str) -> AsyncIterator[bytes]:
+        """
+        Distinct messages of a run, as NDJSON chunks (see stream_run_steps)
+        
+        Lines are {"message_hash": ..., "message": {...}}, in no particular
+        order: steps reference them through their message_hashes.
+        """
+        query = RUN_MESSAGES_SELECT.format(database=self.database)
+        return await self._stream(query, {"team_id": team_id, "run_id": run_id})
+    
+    async def _stream(self, query: str, params: dict) -> AsyncIterator[bytes]:
+        """Send a SELECT and return its streamed output once the status is OK"""
+        client = self._get_client()
+        request = client.build_request(
+            "POST",
+            "/",
+            params=self._select_params(params),
+            content=query,
+        )
+        response = await client.send(request, stream=True)
+        if response.status_code != 200:
+            try:
+                error = (await response.aread()).decode(errors="replace")
+            finally:
+                await response.aclose()
+            raise Exception(f"ClickHouse error: {error}")
+        return self._iter_response(response)
+    
+    @staticmethod
+    async def _iter_response(response: httpx.Response) -> AsyncIterator[bytes]:
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                response = await client.post(
-                    self.base_url,
-                    params={
-                        "query": f"INSERT INTO {self.database}.run_summary FORMAT JSONEachRow",
-                        "user": self.user,
-                        "password": self.password,
-                    },
-                    content=json.dumps(row),
-                    headers={"Content-Type": "application/json"},
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"Failed to update run summary: {response.text}")
+            async for chunk in response.aiter_bytes():
+                yield chunk
+        finally:
+            await response.aclose()
+    
+    async def get_run_rollup(self, team_id: str, run_id: str) -> Optional[dict]:
+        """Totals of one run (None if ClickHouse has no rows for it)"""
+        query = RUN_ROLLUP_SELECT.format(database=self.database) + (
+            "AND run_id = {run_id:String}\nGROUP BY team_id, run_id"
+        )
+        rows = await self.select(query, {"team_id": team_id, "run_id": run_id})
+        return rows[0] if rows else None
+    
+    async def list_run_rollups(self, team_id: str, limit: int = 50) -> list[dict]:
+        """A team's most recently active runs with their totals"""
+        query = RUN_ROLLUP_SELECT.format(database=self.database) + (
+            "GROUP BY team_id, run_id\nORDER BY last_activity DESC\nLIMIT {limit:UInt32}"
+        )
+        return await self.select(query, {"team_id": team_id, "limit": limit})
+    
+    async def log_loop_pattern(self, pattern: LoopPattern):
+        """Record a loop detection event (rare, inserted directly)"""
+        row = asdict(pattern)
+        
+        try:
+            response = await self._get_client().post(
+                "/",
+                params={
+                    "query": f"INSERT INTO {self.database}.loop_patterns FORMAT JSONEachRow",
+                    "user": self.user,
+                    "password": self.password,
+                },
+                content=json.dumps(row),
+                headers={"Content-Type": "application/json"},
+                timeout=5.0,
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"Failed to log loop pattern: {response.text}")
         except Exception as e:
-            logger.error(f"Run summary update error: {e}")
+            logger.error(f"Loop pattern log error: {e}")
     
     @property
     def is_healthy(self) -> bool:
@@ -9,6 +9,7 @@ Pricing (as of Jan 2026):
 """
 
 from decimal import Decimal
+from functools import lru_cache
 from typing import Dict, Tuple
 import logging
 
@@ -62,6 +63,18 @@ def get_model_pricing(model: str) -> Dict[str, Decimal]:
     return PRICING["default"]
 
 
+@lru_cache(maxsize=512)
+def resolve_pricing(model: str) -> Tuple[Decimal, Decimal]:
+    """
+    (prompt, completion) price in USD per single token
+    
+    Resolved once per model name (fuzzy matching and logging included), so
+    per-chunk metering never touches the pricing table.
+    """
+    pricing = get_model_pricing(model)
+    return pricing["prompt"] / Decimal(1000), pricing["completion"] / Decimal(1000)
+
+
 def calculate_cost(
     model: str,
     prompt_tokens: int,
@@ -88,6 +101,9 @@ def calculate_cost(
     return total_cost
 
 
+CHARS_PER_TOKEN = 4
+
+
 def estimate_tokens(text: str) -> int:
     """
     Rough estimate of tokens in text
@@ -95,7 +111,7 @@ def estimate_tokens(text: str) -> int:
     Rule of thumb: 1 token ≈ 4 characters or 0.75 words
     """
     # Simple heuristic: 1 token per 4 characters
-    return max(1, len(text) // 4)
+    return max(1, len(text) // CHARS_PER_TOKEN)
 
 
 def format_cost(cost: Decimal) -> str:
@@ -0,0 +1,114 @@
+"""
+Drain Controller - graceful shutdown of a worker (per worker)
+
+Stopping a worker used to cut open SSE streams off mid-generation, after
+their tokens had been paid for. A drain runs before the server exits
+(started on SIGTERM by uvicorn_worker.AgentWallWorker):
+
+1. draining: /health/ready fails so the load balancer stops routing here,
+   and new /v1 requests get a fast 503 (OverloadMiddleware). Requests in
+   flight, streams included, finish normally, for up to DRAIN_TIMEOUT
+   seconds. Streams still open at the deadline are aborted: the client
+   gets a final SSE error event rather than a cut connection.
+2. flushing: the post-processing queues (run state, logs) are drained.
+3. done: the server shuts down (connections closed, lifespan shutdown).
+
+Progress is served by /health/drain (and /health/ready).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+from config import settings
+from services.overload import overload_controller
+from services.post_processor import post_processor
+from services.stream_registry import SERVER_DRAINING, stream_registry
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.1
+# Time for aborted streams to send their final event and log
+ABORT_GRACE = 2.0
+
+
+class DrainController:
+    """Drain state of this worker: serving -> draining -> flushing -> done"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.phase = "serving"
+        self.aborted_streams = 0
+        self._started_at: Optional[datetime] = None
+        self._started = 0.0  # monotonic
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def draining(self) -> bool:
+        return self.phase != "serving"
+
+    @property
+    def done(self) -> bool:
+        return self.phase == "done"
+
+    def start(self) -> asyncio.Task:
+        """Start draining (call from the event loop; idempotent)"""
+        if self._task is None:
+            self.phase = "draining"
+            self._started_at = datetime.utcnow()
+            self._started = time.monotonic()
+            logger.info(
+                f"Draining: {overload_controller.in_flight} requests in flight, "
+                f"{len(stream_registry)} streams (deadline {self.timeout:.0f}s)"
+            )
+            self._task = asyncio.create_task(self._drain())
+        return self._task
+
+    async def _drain(self):
+        deadline = self._started + self.timeout
+        while overload_controller.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+
+        if overload_controller.in_flight:
+            self.aborted_streams = stream_registry.abort_all(SERVER_DRAINING)
+            logger.warning(
+                f"Drain deadline reached: aborted {self.aborted_streams} streams, "
+                f"{overload_controller.in_flight} requests still in flight"
+            )
+            grace = time.monotonic() + ABORT_GRACE
+            while overload_controller.in_flight and time.monotonic() < grace:
+                await asyncio.sleep(POLL_INTERVAL)
+
+        self.phase = "flushing"
+        try:
+            await post_processor.stop()
+        except Exception as e:
+            logger.error(f"Post-processing drain failed: {e}")
+
+        self.phase = "done"
+        logger.info(f"Drained in {time.monotonic() - self._started:.1f}s")
+
+    def progress(self) -> dict:
+        """Drain state for the health endpoints"""
+        progress = {
+            "pid": os.getpid(),
+            "phase": self.phase,
+            "in_flight": overload_controller.in_flight,
+            "streams": len(stream_registry),
+            "postprocess_queued": post_processor.depth,
+        }
+        if self._started_at is not None:
+            progress.update(
+                started_at=self._started_at.isoformat() + "Z",
+                elapsed_seconds=round(time.monotonic() - self._started, 1),
+                deadline_seconds=self.timeout,
+                aborted_streams=self.aborted_streams,
+            )
+        return progress
+
+
+# Singleton instance (per worker process)
+drain_controller = DrainController(timeout=settings.DRAIN_TIMEOUT)
@@ -0,0 +1,299 @@
+"""
+Health Monitor - background dependency checks (per worker)
+
+Health and status endpoints used to probe Redis and ClickHouse inline,
+opening a new client per check, whenever their cache expired. Here a
+background task probes every HEALTH_CHECK_INTERVAL seconds over the
+app's own pooled connections (run_tracker's Redis pool, the ClickHouse
+client), measures the round trip and publishes an immutable snapshot.
+Endpoints only read the snapshot: probe traffic never reaches the
+dependencies.
+
+Each result is also added to a rolling per-minute history (last 24
+hours, per worker since it started) from which the snapshot reports
+uptime and average latency, and to per-day counts in Redis (last 90 days,
+shared by all workers and kept across restarts) behind the status page
+sparklines.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from config import settings
+from services.clickhouse_client import clickhouse_client
+from services.metrics import REDIS_ROUND_TRIPS
+from services.run_tracker import run_tracker
+
+logger = logging.getLogger(__name__)
+
+HISTORY_MINUTES = 24 * 60
+HISTORY_DAYS = 90
+# Rolling windows reported in the snapshot (name -> minutes)
+WINDOWS = {"1h": 60, "24h": HISTORY_MINUTES}
+
+
+@dataclass
+class MinuteBucket:
+    """Check results of one dependency during one minute"""
+    minute: int  # unix time // 60
+    checks: int = 0
+    ok: int = 0
+    latency_ms: float = 0.0  # sum over successful checks
+
+
+class DependencyHistory:
+    """Per-minute results of one dependency (fixed size)"""
+
+    def __init__(self, minutes: int = HISTORY_MINUTES):
+        self.buckets: deque[MinuteBucket] = deque(maxlen=minutes)
+
+    def record(self, at: float, ok: bool, latency_ms: Optional[float] = None):
+        minute = int(at // 60)
+        if not self.buckets or self.buckets[-1].minute != minute:
+            self.buckets.append(MinuteBucket(minute))
+        bucket = self.buckets[-1]
+        bucket.checks += 1
+        if ok:
+            bucket.ok += 1
+            bucket.latency_ms += latency_ms or 0.0
+
+    def window(self, minutes: int, now: float) -> dict:
+        """Uptime (%) and average latency over the last `minutes`"""
+        since = int(now // 60) - minutes
+        checks = ok = 0
+        latency = 0.0
+        for bucket in reversed(self.buckets):
+            if bucket.minute <= since:
+                break
+            checks += bucket.checks
+            ok += bucket.ok
+            latency += bucket.latency_ms
+        return {
+            "uptime": round(100 * ok / checks, 3) if checks else None,
+            "latency_ms": round(latency / ok, 2) if ok else None,
+        }
+
+
+@dataclass
+class DayBucket:
+    """Check results of one dependency during one (UTC) day"""
+    day: int  # unix time // 86400
+    checks: int = 0
+    ok: int = 0
+    latency_ms: float = 0.0  # sum over successful checks
+
+    @property
+    def uptime(self) -> float:
+        return 100 * self.ok / self.checks
+
+    @property
+    def avg_latency_ms(self) -> Optional[float]:
+        return self.latency_ms / self.ok if self.ok else None
+
+
+def _day_key(day: int) -> str:
+    """Redis hash of one day's health checks (all workers)"""
+    return f"agentwall:health:daily:{time.strftime('%Y-%m-%d', time.gmtime(day * 86400))}"
+
+
+class DailyHistory:
+    """
+    Per-day results of the dependencies, shared by all workers in Redis
+
+    Checks are counted locally, then added to one hash per day (see
+    _day_key; fields "{name}:checks", "{name}:ok", "{name}:latency_ms") by
+    sync(). Each dependency keeps the last `days` days in a ring of slots
+    indexed by day: sync() reads back today's hash and the days it just
+    wrote to, and all of them only when the window moves (first sync, new
+    day). Counts Redis could not take are kept for the next sync.
+    """
+
+    def __init__(self, names, days: int = HISTORY_DAYS):
+        self.days = days
+        # (day, name) -> checks not yet added to Redis
+        self._unsent: dict[tuple[int, str], DayBucket] = {}
+        self._slots: dict[str, list[Optional[DayBucket]]] = {name: [None] * days for name in names}
+        self._today: Optional[int] = None  # day of the last sync
+
+    def record(self, name: str, at: float, ok: bool, latency_ms: Optional[float] = None):
+        day = int(at // 86400)
+        bucket = self._unsent.get((day, name))
+        if bucket is None:
+            bucket = self._unsent[(day, name)] = DayBucket(day)
+        bucket.checks += 1
+        if ok:
+            bucket.ok += 1
+            bucket.latency_ms += latency_ms or 0.0
+
+    def series(self, name: str) -> list[Optional[DayBucket]]:
+        """The last `days` days as of the last sync, oldest first (None: no checks)"""
+        if self._today is None:
+            return [None] * self.days
+        slots = self._slots[name]
+        series = []
+        for day in range(self._today - self.days + 1, self._today + 1):
+            bucket = slots[day % self.days]
+            series.append(bucket if bucket is not None and bucket.day == day else None)
+        return series
+
+    async def sync(self, now: float):
+        """Add unsent counts and read changed days back (one round trip; raises when Redis fails)"""
+        client = run_tracker.redis
+        if client is None:
+            raise ConnectionError("Redis client not initialized")
+        today = int(now // 86400)
+        first = today - self.days + 1
+        unsent = {key: bucket for key, bucket in self._unsent.items() if key[0] >= first}
+        self._unsent = {}
+
+        pipe = client.pipeline(transaction=False)
+        for (day, name), bucket in unsent.items():
+            key = _day_key(day)
+            pipe.hincrby(key, f"{name}:checks", bucket.checks)
+            pipe.hincrby(key, f"{name}:ok", bucket.ok)
+            if bucket.ok:
+                pipe.hincrbyfloat(key, f"{name}:latency_ms", bucket.latency_ms)
+            pipe.expire(key, (self.days + 1) * 86400)
+        if today != self._today:
+            days = list(range(first, today + 1))
+        else:
+            days = sorted({today} | {day for day, _ in unsent})
+        for day in days:
+            pipe.hgetall(_day_key(day))
+        REDIS_ROUND_TRIPS.inc()
+        try:
+            replies = await pipe.execute()
+        except BaseException:
+            # Kept (with anything recorded meanwhile) for the next sync
+            for key, bucket in unsent.items():
+                pending = self._unsent.setdefault(key, DayBucket(bucket.day))
+                pending.checks += bucket.checks
+                pending.ok += bucket.ok
+                pending.latency_ms += bucket.latency_ms
+            raise
+
+        for day, counts in zip(days, replies[len(replies) - len(days):]):
+            fields = {field_name.decode(): float(value) for field_name, value in counts.items()}
+            for name, slots in self._slots.items():
+                checks = int(fields.get(f"{name}:checks", 0))
+                slots[day % self.days] = None if not checks else DayBucket(
+                    day,
+                    checks=checks,
+                    ok=int(fields.get(f"{name}:ok", 0)),
+                    latency_ms=fields.get(f"{name}:latency_ms", 0.0),
+                )
+        self._today = today
+
+
+def _check_openai() -> dict:
+    """OpenAI API key configuration (no network call)"""
+    if not settings.OPENAI_API_KEY or settings.OPENAI_API_KEY.startswith("sk-your"):
+        return {"status": "unconfigured", "error": "API key not set"}
+    if settings.OPENAI_API_KEY.startswith("sk-"):
+        return {"status": "configured"}
+    return {"status": "unhealthy", "error": "Invalid API key format"}
+
+
+class HealthMonitor:
+    """Probes dependencies in the background; serves the latest snapshot"""
+
+    def __init__(self, interval: float, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.history = {
+            "redis": DependencyHistory(),
+            "clickhouse": DependencyHistory(),
+        }
+        self.daily = DailyHistory(self.history)
+        self._task: Optional[asyncio.Task] = None
+        self._snapshot = {
+            "checks": {
+                name: {"status": "unknown", "error": "not checked yet"}
+                for name in ("redis", "clickhouse", "openai")
+            },
+            "history": {},
+            "checked_at": None,
+        }
+
+    @property
+    def snapshot(self) -> dict:
+        """Latest results (replaced, never mutated: safe to hand out)"""
+        return self._snapshot
+
+    async def _probe(self, name: str, ping) -> dict:
+        try:
+            latency_ms = await ping(self.timeout)
+        except Exception as e:
+            logger.warning(f"{name} health check failed: {e!r}")
+            return {"status": "unhealthy", "error": str(e) or type(e).__name__}
+        return {"status": "healthy", "latency_ms": round(latency_ms, 2)}
+
+    async def check(self) -> dict:
+        """Probe every dependency once and publish a new snapshot"""
+        redis_check, clickhouse_check = await asyncio.gather(
+            self._probe("Redis", run_tracker.ping),
+            self._probe("ClickHouse", clickhouse_client.ping),
+        )
+        checks = {
+            "redis": redis_check,
+            "clickhouse": clickhouse_check,
+            "openai": _check_openai(),
+        }
+
+        now = time.time()
+        for name, history in self.history.items():
+            check = checks[name]
+            ok = check["status"] == "healthy"
+            history.record(now, ok, check.get("latency_ms"))
+            self.daily.record(name, now, ok, check.get("latency_ms"))
+        if redis_check["status"] == "healthy":
+            try:
+                await asyncio.wait_for(self.daily.sync(now), self.timeout)
+            except Exception as e:
+                logger.warning(f"Daily health history sync failed: {e!r}")
+
+        self._snapshot = {
+            "checks": checks,
+            "history": {
+                name: {window: history.window(minutes, now) for window, minutes in WINDOWS.items()}
+                for name, history in self.history.items()
+            },
+            "checked_at": datetime.utcfromtimestamp(now).isoformat() + "Z",
+        }
+        return self._snapshot
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Health check failed: {e}")
+
+    async def start(self):
+        """First check now (readiness is right after startup), then every interval"""
+        if self._task is not None:
+            return
+        await self.check()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton instance (per worker process)
+health_monitor = HealthMonitor(
+    interval=settings.HEALTH_CHECK_INTERVAL,
+    timeout=settings.HEALTH_CHECK_TIMEOUT,
+)
@@ -15,6 +15,7 @@ from dataclasses import dataclass, asdict
 from decimal import Decimal
 
 from config import settings
+from services.metrics import LARAVEL_QUEUE_DEPTH
 
 logger = logging.getLogger(__name__)
 
@@ -87,9 +88,29 @@ class LaravelLogger:
         try:
             # Non-blocking put with timeout
             self._queue.put_nowait(log)
+            LARAVEL_QUEUE_DEPTH.set(self._queue.qsize())
         except asyncio.QueueFull:
             logger.warning("Laravel log queue full, dropping log")
     
+    def log_requests(self, logs: list[LaravelRequestLog]) -> int:
+        """
+        Queue several request logs (bulk hand-off from the post-processor)
+        
+        Returns: number of logs dropped because the queue was full
+        """
+        if not self._enabled:
+            return 0
+        dropped = 0
+        for log in logs:
+            try:
+                self._queue.put_nowait(log)
+            except asyncio.QueueFull:
+                dropped += 1
+        LARAVEL_QUEUE_DEPTH.set(self._queue.qsize())
+        if dropped:
+            logger.warning(f"Laravel log queue full, dropped {dropped} logs")
+        return dropped
+    
     async def _send_log(self, log: LaravelRequestLog) -> bool:
         """Actually send the log to Laravel"""
         try:
@@ -127,6 +148,7 @@ class LaravelLogger:
         while True:
             try:
                 log = await self._queue.get()
+                LARAVEL_QUEUE_DEPTH.set(self._queue.qsize())
                 await self._send_log(log)
                 self._queue.task_done()
             except asyncio.CancelledError:
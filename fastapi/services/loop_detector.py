@@ -5,6 +5,8 @@ Detects when an agent is stuck in a loop:
 1. Exact repetition (same prompt/response)
 2. Semantic similarity (similar meaning)
 3. Pattern detection (oscillating between states)
+4. Cycles of period k (plan -> search -> read -> plan -> ...), tracked
+   incrementally per step (see CycleState)
 
 MVP: Start with exact + simple similarity
 Future: Add embedding-based semantic similarity
@@ -12,13 +14,139 @@ Future: Add embedding-based semantic similarity
 
 import hashlib
 import logging
-from typing import Optional
+import re
+import zlib
+from typing import Optional, Sequence
 from dataclasses import dataclass
 
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+# Similarity (Jaccard) is only checked against the last N prompts, so only
+# those keep their word hashes in persisted run state
+SIMILARITY_WINDOW = 3
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+# Cycle detection: periods 1..CYCLE_MAX_PERIOD, evidence counted over at
+# most CYCLE_WINDOW steps, reported from CYCLE_MIN_REPEATS repetitions
+CYCLE_MAX_PERIOD = 8
+CYCLE_WINDOW = 64
+CYCLE_MIN_REPEATS = 3
+
+
+def hash_text(text: str) -> int:
+    """64-bit hash of lowercased, stripped text (exact-repetition checks)"""
+    digest = hashlib.blake2b(text.lower().strip().encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop punctuation, collapse whitespace"""
+    return ' '.join(_PUNCTUATION.sub('', text.lower()).split())
+
+
+def word_hashes(text: str) -> frozenset[int]:
+    """32-bit hashes of the distinct words of a text (Jaccard input)"""
+    return frozenset(zlib.crc32(word.encode()) for word in text.lower().split())
+
+
+def step_hash(prompt: str, tool_digests: Sequence[bytes] = ()) -> int:
+    """64-bit hash of what a step does: normalized prompt + tool calls answered"""
+    h = hashlib.blake2b(normalize_text(prompt).encode(), digest_size=8)
+    for digest in sorted(tool_digests):
+        h.update(digest)
+    return int.from_bytes(h.digest(), "little")
+
+
+class CycleState:
+    """
+    Incremental period-k cycle detector over per-step hashes
+    
+    For each period k, matches[k-1] is the number of consecutive most recent
+    steps whose hash equals the hash k steps earlier (capped at
+    CYCLE_WINDOW). A sequence repeating a k-step cycle r times has
+    (r-1)*k such matches, so the repetition count falls out directly.
+    
+    push() is O(CYCLE_MAX_PERIOD) and only the last CYCLE_MAX_PERIOD hashes
+    are kept: the history is never rescanned.
+    """
+    
+    __slots__ = ("recent", "matches")
+    
+    def __init__(self, recent: Optional[list[int]] = None, matches: Optional[list[int]] = None):
+        self.recent = recent or []  # last CYCLE_MAX_PERIOD step hashes, oldest first
+        self.matches = matches or [0] * CYCLE_MAX_PERIOD
+    
+    def push(self, value: int):
+        """Add the hash of a new step"""
+        n = len(self.recent)
+        for k in range(1, CYCLE_MAX_PERIOD + 1):
+            if k <= n and self.recent[n - k] == value:
+                self.matches[k - 1] = min(self.matches[k - 1] + 1, CYCLE_WINDOW)
+            else:
+                self.matches[k - 1] = 0
+        self.recent.append(value)
+        if n >= CYCLE_MAX_PERIOD:
+            del self.recent[0]
+    
+    def detect(self) -> Optional[tuple[int, int]]:
+        """Smallest period repeated at least CYCLE_MIN_REPEATS times: (period, repeats)"""
+        for k in range(1, CYCLE_MAX_PERIOD + 1):
+            repeats = self.matches[k - 1] // k + 1
+            if repeats >= CYCLE_MIN_REPEATS:
+                return k, repeats
+        return None
+    
+    def copy(self) -> "CycleState":
+        return CycleState(list(self.recent), list(self.matches))
+    
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, CycleState)
+            and self.recent == other.recent
+            and self.matches == other.matches
+        )
+    
+    def __repr__(self) -> str:
+        return f"CycleState(matches={self.matches})"
+
+
+class PromptFingerprint:
+    """
+    What loop detection needs to remember about a prompt
+    
+    Replaces the prompt text in run state: two 64-bit hashes plus, for the
+    most recent prompts only, the set of word hashes.
+    """
+    
+    __slots__ = ("exact", "normalized", "words")
+    
+    def __init__(self, exact: int, normalized: int, words: Optional[frozenset[int]] = None):
+        self.exact = exact
+        self.normalized = normalized
+        self.words = words
+    
+    @classmethod
+    def from_text(cls, text: str) -> "PromptFingerprint":
+        return cls(
+            exact=hash_text(text),
+            normalized=hash_text(normalize_text(text)),
+            words=word_hashes(text),
+        )
+    
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, PromptFingerprint)
+            and self.exact == other.exact
+            and self.normalized == other.normalized
+            and self.words == other.words
+        )
+    
+    def __repr__(self) -> str:
+        return f"PromptFingerprint(exact={self.exact:#018x})"
+
 
 @dataclass
 class LoopCheckResult:
@@ -27,6 +155,7 @@ class LoopCheckResult:
     confidence: float = 0.0
     loop_type: str = ""  # exact, similar, pattern
     message: str = ""
+    period: int = 0  # cycle length (loop_type "cycle")
 
 
 class LoopDetector:
@@ -64,25 +193,65 @@ class LoopDetector:
         Returns:
             LoopCheckResult with detection details
         """
+        return self.check_history(
+            current_prompt=current_prompt,
+            current_response=current_response,
+            prompt_history=[PromptFingerprint.from_text(p) for p in recent_prompts],
+            response_history=[hash_text(r) for r in recent_responses],
+        )
+    
+    def check_history(
+        self,
+        current_prompt: str,
+        current_response: str,
+        prompt_history: Sequence[PromptFingerprint],
+        response_history: Sequence[int],
+        cycle: Optional[CycleState] = None,
+    ) -> LoopCheckResult:
+        """
+        Check for a loop against fingerprinted run history (RunState)
+        
+        Same checks as check_loop(), without needing previous texts, plus
+        period-k cycle detection if the run's CycleState is passed. A cycle
+        is reported as such even when a repetition check also fires (short
+        cycles repeat prompts); it takes the stronger confidence of the two.
+        """
+        result = self._check_repetition(current_prompt, current_response, prompt_history, response_history)
+        if cycle:
+            cycle_result = self._check_cycle(cycle)
+            if cycle_result.is_loop:
+                cycle_result.confidence = max(cycle_result.confidence, result.confidence)
+                return cycle_result
+        return result
+    
+    def _check_repetition(
+        self,
+        current_prompt: str,
+        current_response: str,
+        prompt_history: Sequence[PromptFingerprint],
+        response_history: Sequence[int],
+    ) -> LoopCheckResult:
+        """Exact, normalized, similar and oscillating prompts/responses"""
         result = LoopCheckResult()
         
-        if not recent_prompts:
+        if not prompt_history:
             return result
         
         # Check 1: Exact prompt repetition
-        current_hash = self._hash_text(current_prompt)
-        for i, prev_prompt in enumerate(recent_prompts):
-            if self._hash_text(prev_prompt) == current_hash:
+        current_hash = hash_text(current_prompt)
+        for i, prev in enumerate(prompt_history):
+            if prev.exact == current_hash:
                 result.is_loop = True
                 result.confidence = 1.0
                 result.loop_type = "exact_prompt"
-                result.message = f"Exact prompt repetition detected (matches step -{len(recent_prompts)-i})"
+                result.message = f"Exact prompt repetition detected (matches step -{len(prompt_history)-i})"
                 logger.warning(f"Loop detected: exact prompt match")
                 return result
         
         # Check 1.5: Normalized match (handles whitespace/case/punctuation)
-        for i, prev_prompt in enumerate(recent_prompts):
-            if self._normalized_match(current_prompt, prev_prompt):
+        normalized_hash = hash_text(normalize_text(current_prompt))
+        for prev in prompt_history:
+            if prev.normalized == normalized_hash:
                 result.is_loop = True
                 result.confidence = 0.98
                 result.loop_type = "normalized_match"
@@ -91,20 +260,22 @@ class LoopDetector:
                 return result
         
         # Check 2: Exact response repetition (if we have response)
-        if current_response and recent_responses:
-            response_hash = self._hash_text(current_response)
-            for i, prev_response in enumerate(recent_responses):
-                if self._hash_text(prev_response) == response_hash:
-                    result.is_loop = True
-                    result.confidence = 1.0
-                    result.loop_type = "exact_response"
-                    result.message = f"Exact response repetition detected"
-                    logger.warning(f"Loop detected: exact response match")
-                    return result
+        if current_response and response_history:
+            response_hash = hash_text(current_response)
+            if response_hash in response_history:
+                result.is_loop = True
+                result.confidence = 1.0
+                result.loop_type = "exact_response"
+                result.message = f"Exact response repetition detected"
+                logger.warning(f"Loop detected: exact response match")
+                return result
         
         # Check 3: High similarity (Jaccard)
-        for prev_prompt in recent_prompts[-3:]:  # Check last 3
-            similarity = self._jaccard_similarity(current_prompt, prev_prompt)
+        current_words = word_hashes(current_prompt)
+        for prev in prompt_history[-SIMILARITY_WINDOW:]:
+            if not prev.words:
+                continue
+            similarity = self._jaccard_similarity(current_words, prev.words)
             if similarity >= self.similarity_threshold:
                 result.is_loop = True
                 result.confidence = similarity
@@ -114,8 +285,9 @@ class LoopDetector:
                 return result
         
         # Check 4: Oscillation pattern (A->B->A->B)
-        if len(recent_prompts) >= 3:
-            if self._detect_oscillation(recent_prompts + [current_prompt]):
+        if len(prompt_history) >= 3:
+            hashes = [prev.exact for prev in prompt_history[-3:]] + [current_hash]
+            if self._detect_oscillation(hashes):
                 result.is_loop = True
                 result.confidence = 0.9
                 result.loop_type = "oscillation"
@@ -125,66 +297,51 @@ class LoopDetector:
         
         return result
     
-    def _hash_text(self, text: str) -> str:
-        """Create hash of normalized text"""
-        normalized = text.lower().strip()
-        return hashlib.md5(normalized.encode()).hexdigest()
-    
-    def _jaccard_similarity(self, text1: str, text2: str) -> float:
+    def _check_cycle(self, cycle: CycleState) -> LoopCheckResult:
         """
-        Calculate Jaccard similarity between two texts
+        Report the smallest repeating period of the run's steps
         
-        Simple but effective for detecting near-duplicates
+        Confidence grows with the repetition count: 0.90 at 3 repetitions,
+        0.95 (blocking) from 4.
         """
-        # Normalize: lowercase, strip, remove extra whitespace
-        text1 = ' '.join(text1.lower().strip().split())
-        text2 = ' '.join(text2.lower().strip().split())
-        
-        # Tokenize (simple word split)
-        words1 = set(text1.split())
-        words2 = set(text2.split())
-        
-        if not words1 or not words2:
-            return 0.0
-        
-        intersection = words1 & words2
-        union = words1 | words2
+        result = LoopCheckResult()
+        detected = cycle.detect()
+        if detected is None:
+            return result
         
-        return len(intersection) / len(union)
+        period, repeats = detected
+        result.is_loop = True
+        result.confidence = min(0.99, 0.85 + 0.05 * (repeats - 2))
+        result.loop_type = "cycle"
+        result.period = period
+        result.message = f"Cycle of {period} step(s) repeated {repeats} times"
+        logger.warning(f"Loop detected: period-{period} cycle x{repeats}")
+        return result
     
-    def _normalized_match(self, text1: str, text2: str) -> bool:
-        """
-        Check if two texts are essentially the same after normalization
-        Handles whitespace, case, and punctuation differences
+    def _jaccard_similarity(self, words1: frozenset[int], words2: frozenset[int]) -> float:
         """
-        # Normalize both texts
-        import re
+        Jaccard similarity between two word(-hash) sets
         
-        def normalize(t: str) -> str:
-            # Lowercase
-            t = t.lower()
-            # Remove punctuation except numbers
-            t = re.sub(r'[^\w\s]', '', t)
-            # Collapse whitespace
-            t = ' '.join(t.split())
-            return t
+        Simple but effective for detecting near-duplicates
+        """
+        if not words1 or not words2:
+            return 0.0
         
-        return normalize(text1) == normalize(text2)
+        return len(words1 & words2) / len(words1 | words2)
     
-    def _detect_oscillation(self, prompts: list[str]) -> bool:
+    def _detect_oscillation(self, hashes: list[int]) -> bool:
         """
         Detect A->B->A->B pattern
         
-        Returns True if last 4 prompts show oscillation
+        Returns True if the last 4 prompt hashes show oscillation
         """
-        if len(prompts) < 4:
+        if len(hashes) < 4:
             return False
         
-        last_4 = prompts[-4:]
-        hashes = [self._hash_text(p) for p in last_4]
+        last_4 = hashes[-4:]
         
         # Check if pattern is A-B-A-B
-        if hashes[0] == hashes[2] and hashes[1] == hashes[3] and hashes[0] != hashes[1]:
+        if last_4[0] == last_4[2] and last_4[1] == last_4[3] and last_4[0] != last_4[1]:
             return True
         
         return False
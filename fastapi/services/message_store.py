@@ -0,0 +1,85 @@
+"""
+Message Store - content-addressed conversation logging
+
+Agents resend their whole (growing) history on every step, so logging each
+request's messages would store the same messages over and over. Instead
+each message is stored once in the `messages` table, keyed by the hash of
+its canonical JSON, and request_logs.message_hashes records the ordered
+hashes of the request. Conversation storage grows with new content only.
+
+Hashing happens once per log, on its first flush attempt
+(ClickHouseClient._prepare_logs), not on the request path. Each worker
+remembers the hashes it wrote recently and skips them; anything written
+twice (other workers, restarts) collapses in the ReplacingMergeTree. Remembered hashes are rewritten after
+MESSAGE_STORE_REFRESH_SECONDS, which keeps messages still in use from
+reaching the table TTL.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+
+import orjson
+
+from config import settings
+
+
+def hash_message(message: dict) -> tuple[str, bytes]:
+    """Hash and canonical JSON of one message (key order does not matter)"""
+    data = orjson.dumps(message, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(data, digest_size=16).hexdigest(), data
+
+
+class MessageStore:
+    """Per-worker memory of recently written (team_id, hash) pairs"""
+
+    def __init__(self, max_hashes: int, refresh_seconds: float):
+        self.max_hashes = max_hashes
+        self.refresh_seconds = refresh_seconds
+        # (team_id, hash) -> when it was last written (monotonic), oldest first
+        self._written: OrderedDict[tuple[str, str], float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._written)
+
+    def collect(self, team_id: str, messages: list, rows: dict) -> list[str]:
+        """
+        Hash a request's messages; messages to write are added to `rows`
+
+        Returns: the ordered message hashes for the request log
+        rows: (team_id, hash) -> row for the messages table, shared across
+            a batch so a message sent by several requests is written once
+        """
+        now = time.monotonic()
+        hashes = []
+        for message in messages:
+            digest, data = hash_message(message)
+            hashes.append(digest)
+            key = (team_id, digest)
+            written = self._written.get(key)
+            if written is not None and now - written < self.refresh_seconds:
+                continue
+            if key not in rows:
+                rows[key] = {
+                    "team_id": team_id,
+                    "message_hash": digest,
+                    "role": message.get("role", "") if isinstance(message, dict) else "",
+                    "message": data.decode(),
+                }
+        return hashes
+
+    def remember(self, keys):
+        """Record (team_id, hash) pairs as written (after a successful insert)"""
+        now = time.monotonic()
+        for key in keys:
+            self._written[key] = now
+            self._written.move_to_end(key)
+        while len(self._written) > self.max_hashes:
+            self._written.popitem(last=False)
+
+
+# Singleton instance (per worker process)
+message_store = MessageStore(
+    max_hashes=settings.MESSAGE_STORE_MAX_HASHES,
+    refresh_seconds=settings.MESSAGE_STORE_REFRESH_SECONDS,
+)
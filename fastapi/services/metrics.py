@@ -0,0 +1,314 @@
+"""
+Prometheus Metrics
+Per-stage hot-path latency histograms for the proxy engine
+
+Design:
+- Label children are resolved once at import time, so the hot path is a
+  plain attribute/dict lookup + observe() (no per-request label formatting)
+- Multi-process safe: when PROMETHEUS_MULTIPROC_DIR is set, every worker
+  writes to shared mmap files and the exporter aggregates them
+- Exporter runs on METRICS_PORT (not exposed publicly by nginx/compose)
+
+Exported series:
+- agentwall_stage_duration_seconds{stage}       proxy-side stages
+- agentwall_upstream_duration_seconds{provider,phase}  ttfb / total
+- agentwall_provider_requests_total{provider}
+- agentwall_provider_errors_total{provider}
+- agentwall_redis_round_trips_total
+- agentwall_log_queue_depth{sink}               clickhouse / laravel
+- agentwall_event_loop_lag_seconds
+- agentwall_upstream_queue_wait_seconds{provider}  wait for an upstream slot
+- agentwall_upstream_queue_rejections_total{provider,reason}
+- agentwall_upstream_queue_depth                requests waiting for a slot
+- agentwall_upstream_pacing_seconds{provider}   delay added near a provider's limit
+- agentwall_upstream_retries_total{provider,outcome}  retried / budget_exhausted
+"""
+
+import os
+import logging
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    start_http_server,
+)
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+# Proxy stages are expected to be sub-millisecond to a few ms
+STAGE_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 1.0,
+)
+
+# Upstream latency is dominated by the provider (100ms - minutes)
+UPSTREAM_BUCKETS = (
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+# Keep in sync with services.multi_provider.Provider
+PROVIDERS = ("openai", "openrouter", "groq", "deepseek", "mistral", "ollama", "qwen")
+
+
+STAGE_DURATION = Histogram(
+    "agentwall_stage_duration_seconds",
+    "Time spent in each proxy-side stage of a request",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+UPSTREAM_DURATION = Histogram(
+    "agentwall_upstream_duration_seconds",
+    "Upstream provider latency (time to first byte and total)",
+    ["provider", "phase"],
+    buckets=UPSTREAM_BUCKETS,
+)
+
+PROVIDER_REQUESTS = Counter(
+    "agentwall_provider_requests_total",
+    "Requests sent to upstream providers",
+    ["provider"],
+)
+
+PROVIDER_ERRORS = Counter(
+    "agentwall_provider_errors_total",
+    "Upstream provider errors (non-200 or transport failure)",
+    ["provider"],
+)
+
+REDIS_ROUND_TRIPS = Counter(
+    "agentwall_redis_round_trips_total",
+    "Redis round trips issued by the proxy",
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "agentwall_event_loop_lag_seconds",
+    "How late the event loop wakes up a periodic heartbeat",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+QUEUE_WAIT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+UPSTREAM_QUEUE_WAIT_SECONDS = Histogram(
+    "agentwall_upstream_queue_wait_seconds",
+    "Time spent waiting for an upstream concurrency slot",
+    ["provider"],
+    buckets=QUEUE_WAIT_BUCKETS,
+)
+
+UPSTREAM_QUEUE_REJECTIONS_TOTAL = Counter(
+    "agentwall_upstream_queue_rejections",
+    "Requests refused because no upstream slot was free in time",
+    ["provider", "reason"],
+)
+
+UPSTREAM_QUEUE_DEPTH = Gauge(
+    "agentwall_upstream_queue_depth",
+    "Requests waiting for an upstream concurrency slot",
+    multiprocess_mode="livesum",
+)
+
+UPSTREAM_PACING_SECONDS = Histogram(
+    "agentwall_upstream_pacing_seconds",
+    "Delay added before an upstream call because the provider key is near its rate limit",
+    ["provider"],
+    buckets=QUEUE_WAIT_BUCKETS,
+)
+
+UPSTREAM_RETRIES_TOTAL = Counter(
+    "agentwall_upstream_retries",
+    "Retryable provider responses (429/503), retried or not",
+    ["provider", "outcome"],
+)
+
+LOG_QUEUE_DEPTH = Gauge(
+    "agentwall_log_queue_depth",
+    "Pending log entries per sink",
+    ["sink"],
+    multiprocess_mode="livesum",
+)
+
+RUN_SUMMARY_TRACKED = Gauge(
+    "agentwall_run_summary_tracked_runs",
+    "Runs with running totals held in memory for run_summary",
+    multiprocess_mode="livesum",
+)
+
+RUN_SUMMARY_FLUSHED = Counter(
+    "agentwall_run_summary_rows",
+    "run_summary snapshot rows written (one per changed run per flush)",
+)
+
+POSTPROCESS_JOBS = Counter(
+    "agentwall_postprocess_jobs",
+    "Post-processing jobs: queued, or with a full queue run inline / dropped (best-effort jobs)",
+    ["outcome"],
+)
+
+POSTPROCESS_FAILED_JOBS = Counter(
+    "agentwall_postprocess_failed_jobs",
+    "Post-processing jobs a sink failed to take",
+    ["sink"],
+)
+
+POSTPROCESS_DEPTH = Gauge(
+    "agentwall_postprocess_queue_depth",
+    "Jobs waiting in the post-processing queues",
+    multiprocess_mode="livesum",
+)
+
+LOGGED_MESSAGES = Counter(
+    "agentwall_logged_messages",
+    "Request messages logged: stored, or deduplicated (already in the messages table)",
+    ["outcome"],
+)
+
+ANALYTICS_QUERIES = Counter(
+    "agentwall_analytics_queries",
+    "Analytics queries by how they were answered",
+    ["outcome"],
+)
+
+OVERLOAD_SHED_REQUESTS = Counter(
+    "agentwall_overload_shed_requests",
+    "Requests refused with 503 by the overload controller",
+    ["priority"],
+)
+
+OVERLOAD_IN_FLIGHT = Gauge(
+    "agentwall_overload_in_flight",
+    "API requests in flight (admitted by the overload controller)",
+    multiprocess_mode="livesum",
+)
+
+OVERLOAD_LIMIT = Gauge(
+    "agentwall_overload_limit",
+    "Adaptive in-flight request limit (driven by event-loop lag)",
+    multiprocess_mode="livesum",
+)
+
+
+# ============================================================================
+# Preallocated label children (hot path uses these directly)
+# ============================================================================
+
+STAGE_AUTH = STAGE_DURATION.labels(stage="auth")
+STAGE_PARSE = STAGE_DURATION.labels(stage="parse")
+STAGE_ADMISSION = STAGE_DURATION.labels(stage="admission")
+STAGE_LOOP_CHECK = STAGE_DURATION.labels(stage="loop_check")
+STAGE_QUEUE = STAGE_DURATION.labels(stage="queue")
+STAGE_BUDGET_CHECK = STAGE_DURATION.labels(stage="budget_check")
+STAGE_DLP = STAGE_DURATION.labels(stage="dlp")
+STAGE_POST_CHECK = STAGE_DURATION.labels(stage="post_check")
+STAGE_LOG_ENQUEUE = STAGE_DURATION.labels(stage="log_enqueue")
+
+# Stage name -> histogram child, used by StageTimer.mark()
+STAGE_HISTOGRAMS = {
+    "auth": STAGE_AUTH,
+    "parse": STAGE_PARSE,
+    "admission": STAGE_ADMISSION,
+    "loop_check": STAGE_LOOP_CHECK,
+    "queue": STAGE_QUEUE,
+    "budget_check": STAGE_BUDGET_CHECK,
+    "dlp": STAGE_DLP,
+    "post_check": STAGE_POST_CHECK,
+    "log_enqueue": STAGE_LOG_ENQUEUE,
+}
+
+UPSTREAM_TTFB = {p: UPSTREAM_DURATION.labels(provider=p, phase="ttfb") for p in PROVIDERS}
+UPSTREAM_TOTAL = {p: UPSTREAM_DURATION.labels(provider=p, phase="total") for p in PROVIDERS}
+PROVIDER_REQUEST_COUNT = {p: PROVIDER_REQUESTS.labels(provider=p) for p in PROVIDERS}
+PROVIDER_ERROR_COUNT = {p: PROVIDER_ERRORS.labels(provider=p) for p in PROVIDERS}
+UPSTREAM_QUEUE_WAIT = {p: UPSTREAM_QUEUE_WAIT_SECONDS.labels(provider=p) for p in PROVIDERS}
+UPSTREAM_QUEUE_TIMEOUTS = {
+    p: UPSTREAM_QUEUE_REJECTIONS_TOTAL.labels(provider=p, reason="queue_timeout") for p in PROVIDERS
+}
+UPSTREAM_QUEUE_FULL = {
+    p: UPSTREAM_QUEUE_REJECTIONS_TOTAL.labels(provider=p, reason="queue_full") for p in PROVIDERS
+}
+UPSTREAM_PACING = {p: UPSTREAM_PACING_SECONDS.labels(provider=p) for p in PROVIDERS}
+UPSTREAM_RETRIED = {
+    p: UPSTREAM_RETRIES_TOTAL.labels(provider=p, outcome="retried") for p in PROVIDERS
+}
+UPSTREAM_RETRY_EXHAUSTED = {
+    p: UPSTREAM_RETRIES_TOTAL.labels(provider=p, outcome="budget_exhausted") for p in PROVIDERS
+}
+
+CLICKHOUSE_QUEUE_DEPTH = LOG_QUEUE_DEPTH.labels(sink="clickhouse")
+LARAVEL_QUEUE_DEPTH = LOG_QUEUE_DEPTH.labels(sink="laravel")
+
+POSTPROCESS_QUEUED = POSTPROCESS_JOBS.labels(outcome="queued")
+POSTPROCESS_INLINE = POSTPROCESS_JOBS.labels(outcome="inline")
+POSTPROCESS_DROPPED = POSTPROCESS_JOBS.labels(outcome="dropped")
+POSTPROCESS_FAILURES = {
+    sink: POSTPROCESS_FAILED_JOBS.labels(sink=sink) for sink in ("run_state", "clickhouse", "laravel")
+}
+
+MESSAGES_STORED = LOGGED_MESSAGES.labels(outcome="stored")
+MESSAGES_DEDUPLICATED = LOGGED_MESSAGES.labels(outcome="deduplicated")
+
+ANALYTICS_CACHE_HITS = ANALYTICS_QUERIES.labels(outcome="cache_hit")
+ANALYTICS_COALESCED = ANALYTICS_QUERIES.labels(outcome="coalesced")
+ANALYTICS_CLICKHOUSE_QUERIES = ANALYTICS_QUERIES.labels(outcome="clickhouse")
+
+OVERLOAD_SHED = {p: OVERLOAD_SHED_REQUESTS.labels(priority=p) for p in ("normal", "high")}
+
+
+def _registry() -> CollectorRegistry:
+    """Registry to export (aggregated across workers in multi-process mode)"""
+    if not MULTIPROC_DIR:
+        return REGISTRY
+
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Render metrics in Prometheus text format"""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_exporter() -> bool:
+    """
+    Start the metrics exporter on METRICS_PORT
+
+    With several workers only the first one binds the port; in multi-process
+    mode that exporter still serves the aggregate of all workers.
+
+    Returns: True if this process is serving metrics
+    """
+    if not settings.ENABLE_METRICS:
+        return False
+
+    try:
+        start_http_server(settings.METRICS_PORT, registry=_registry())
+        logger.info(f"Metrics exporter listening on :{settings.METRICS_PORT}")
+        return True
+    except OSError as e:
+        # Port already bound by a sibling worker
+        logger.debug(f"Metrics exporter not started in this worker: {e}")
+        return False
+
+
+def mark_process_dead(pid: int) -> None:
+    """Clean up a dead worker's live gauges (multi-process mode only)"""
+    if not MULTIPROC_DIR:
+        return
+
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(pid)
@@ -16,8 +16,9 @@ OpenRouter gives access to:
 - And 100+ more models
 """
 
+import asyncio
 import httpx
-import json
+import orjson
 import time
 import logging
 from typing import AsyncIterator, Optional, Tuple
@@ -25,6 +26,24 @@ from dataclasses import dataclass
 from enum import Enum
 
 from config import settings
+from services.cost_calculator import CHARS_PER_TOKEN
+from services.provider_limits import (
+    RETRYABLE_STATUSES,
+    backoff_delay,
+    parse_retry_after,
+    provider_limits,
+)
+from services.stage_timer import StageTimer
+from services.stream_registry import StreamAborted, StreamHandle
+from services.metrics import (
+    UPSTREAM_TTFB,
+    UPSTREAM_TOTAL,
+    PROVIDER_REQUEST_COUNT,
+    PROVIDER_ERROR_COUNT,
+    UPSTREAM_PACING,
+    UPSTREAM_RETRIED,
+    UPSTREAM_RETRY_EXHAUSTED,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -140,6 +159,25 @@ def resolve_model(model: str) -> str:
     return OPENROUTER_ALIASES.get(model, model)
 
 
+def build_request_body(
+    request_data: dict,
+    model: str,
+    resolved_model: str,
+    body: Optional[bytes] = None,
+) -> bytes:
+    """
+    Serialize the upstream request body
+    
+    A pre-serialized body (the client's original bytes) is sent as-is
+    unless the model alias has to be rewritten.
+    """
+    if body is not None and resolved_model == model:
+        return body
+    if resolved_model != model:
+        request_data = {**request_data, "model": resolved_model}
+    return orjson.dumps(request_data)
+
+
 def get_provider_config(provider: Provider, user_api_key: Optional[str] = None) -> ProviderConfig:
     """Get provider configuration"""
     
@@ -214,12 +252,21 @@ class StreamMetrics:
     completion_tokens: int = 0
 
 
+@dataclass
+class UpstreamCompletion:
+    """Non-streaming provider response"""
+    content: bytes  # response body exactly as the provider sent it
+    data: dict      # parsed body
+    provider: str
+
+
 class MultiProviderError(Exception):
     """Multi-provider API error"""
-    def __init__(self, status_code: int, message: str, provider: str):
+    def __init__(self, status_code: int, message: str, provider: str, retry_after: Optional[float] = None):
         self.status_code = status_code
         self.message = message
         self.provider = provider
+        self.retry_after = retry_after  # seconds, from the provider or local pacing
         super().__init__(f"{provider} API error {status_code}: {message}")
 
 
@@ -232,10 +279,64 @@ class MultiProviderProxy:
         response = await proxy.chat_completion({"model": "gpt-4", ...})
         response = await proxy.chat_completion({"model": "anthropic/claude-3.5-sonnet", ...})
         response = await proxy.chat_completion({"model": "claude-3.5-sonnet", ...})  # alias
+    
+    Connection pooling:
+    - One httpx.AsyncClient per provider base URL, per worker process
+    - Auth headers are set per request (pass-through keys differ per user)
+    - start() creates the pools and pre-opens connections to configured
+      providers so the first requests of a fresh worker skip TCP/TLS setup
+    
+    Provider rate limits (see services.provider_limits):
+    - Requests are paced while the key's reported budget is nearly spent
+    - 429/503 answers are retried with backoff within the retry budget
     """
     
     def __init__(self):
         self.timeout = settings.OPENAI_TIMEOUT
+        self._clients: dict[str, httpx.AsyncClient] = {}
+    
+    def _get_client(self, config: ProviderConfig) -> httpx.AsyncClient:
+        """Get (or lazily create) the pooled client for a provider"""
+        client = self._clients.get(config.base_url)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=config.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE,
+                ),
+            )
+            self._clients[config.base_url] = client
+        return client
+    
+    async def start(self):
+        """Create pooled clients and warm connections (per worker)"""
+        warm = []
+        for provider in Provider:
+            config = get_provider_config(provider)
+            if not config.api_key or provider == Provider.OLLAMA:
+                continue
+            client = self._get_client(config)
+            if settings.WARM_UPSTREAM_CONNECTIONS:
+                warm.append(self._warm(client, provider))
+        
+        if warm:
+            await asyncio.gather(*warm)
+    
+    async def _warm(self, client: httpx.AsyncClient, provider: Provider):
+        """Open a keep-alive connection (any HTTP status is fine)"""
+        try:
+            await client.head("/", timeout=3.0)
+            logger.debug(f"Warmed connection pool for {provider.value}")
+        except httpx.HTTPError as e:
+            logger.debug(f"Connection warm-up failed for {provider.value}: {e}")
+    
+    async def close(self):
+        """Close all pooled clients"""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
     
     def _get_headers(self, config: ProviderConfig) -> dict:
         """Get headers for provider request"""
@@ -247,15 +348,115 @@ class MultiProviderProxy:
             headers.update(config.extra_headers)
         return headers
     
+    async def _pace(
+        self,
+        provider: Provider,
+        config: ProviderConfig,
+        content: bytes,
+        request_data: dict,
+        timer: Optional[StageTimer],
+    ):
+        """
+        Wait while the provider key is close to its rate limit
+        
+        Raises: MultiProviderError (429) if the wait would be too long
+        """
+        tokens = len(content) // CHARS_PER_TOKEN + int(request_data.get("max_tokens") or 0)
+        wait = provider_limits.reserve(provider.value, config.api_key, tokens)
+        if wait <= 0:
+            return
+        if wait > settings.PROVIDER_MAX_PACE_SECONDS:
+            raise MultiProviderError(
+                429,
+                f"{provider.value} rate limit nearly exhausted, retry in {wait:.1f}s",
+                provider.value,
+                retry_after=wait,
+            )
+        UPSTREAM_PACING[provider.value].observe(wait)
+        await asyncio.sleep(wait)
+        if timer:
+            timer.mark("queue")
+    
+    async def _send(
+        self,
+        client: httpx.AsyncClient,
+        provider: Provider,
+        config: ProviderConfig,
+        content: bytes,
+        timeout=httpx.USE_CLIENT_DEFAULT,
+    ) -> httpx.Response:
+        """
+        Send a chat completion (streamed response), retrying 429/503
+        
+        Returns the first response that is not retried; the caller reads or
+        closes it.
+        """
+        attempt = 0
+        while True:
+            response = await client.send(
+                client.build_request(
+                    "POST",
+                    "/v1/chat/completions",
+                    content=content,
+                    headers=self._get_headers(config),
+                    timeout=timeout,
+                ),
+                stream=True,
+            )
+            provider_limits.observe(provider.value, config.api_key, response.status_code, response.headers)
+            if response.status_code not in RETRYABLE_STATUSES or attempt >= settings.UPSTREAM_RETRY_MAX_ATTEMPTS:
+                return response
+            
+            retry_after = parse_retry_after(response.headers)
+            if retry_after is not None and retry_after > settings.UPSTREAM_RETRY_MAX_DELAY:
+                return response
+            if not provider_limits.retry_budget.withdraw():
+                UPSTREAM_RETRY_EXHAUSTED[provider.value].inc()
+                return response
+            
+            attempt += 1
+            UPSTREAM_RETRIED[provider.value].inc()
+            await response.aclose()
+            delay = backoff_delay(attempt, retry_after)
+            logger.info(
+                f"{provider.value} returned {response.status_code}, retry {attempt} in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
+    
     async def chat_completion(
         self,
         request_data: dict,
         run_id: str,
         api_key: Optional[str] = None,
         force_provider: Optional[Provider] = None,
+        timer: Optional[StageTimer] = None,
     ) -> dict:
+        """Non-streaming chat completion, parsed (provider under "_agentwall_provider")"""
+        completion = await self.chat_completion_raw(
+            request_data, run_id, api_key=api_key, force_provider=force_provider, timer=timer,
+        )
+        result = completion.data
+        result["_agentwall_provider"] = completion.provider
+        return result
+    
+    async def chat_completion_raw(
+        self,
+        request_data: dict,
+        run_id: str,
+        api_key: Optional[str] = None,
+        force_provider: Optional[Provider] = None,
+        timer: Optional[StageTimer] = None,
+        body: Optional[bytes] = None,
+    ) -> UpstreamCompletion:
         """
         Non-streaming chat completion with auto provider routing
+        
+        `body` is the pre-serialized request_data, forwarded as-is when the
+        model needs no alias rewrite. The provider's response bytes are
+        returned alongside the parsed body so callers can pass them through.
+        
+        If a StageTimer is passed, marks upstream_connect (headers received)
+        and upstream (body read) so provider time is separated from overhead.
         """
         model = request_data.get("model", "gpt-3.5-turbo")
         resolved_model = resolve_model(model)
@@ -264,36 +465,47 @@ class MultiProviderProxy:
         provider = force_provider or detect_provider(resolved_model)
         config = get_provider_config(provider, api_key)
         
-        # Update model in request if alias was used
-        if resolved_model != model:
-            request_data = {**request_data, "model": resolved_model}
+        # Rewrites the model in the request if an alias was used
+        content = build_request_body(request_data, model, resolved_model, body)
+        await self._pace(provider, config, content, request_data, timer)
         
         start_time = time.perf_counter()
+        PROVIDER_REQUEST_COUNT[provider.value].inc()
         
-        async with httpx.AsyncClient(
-            base_url=config.base_url,
-            timeout=httpx.Timeout(self.timeout),
-            headers=self._get_headers(config),
-        ) as client:
-            response = await client.post("/v1/chat/completions", json=request_data)
-            elapsed_ms = (time.perf_counter() - start_time) * 1000
-            
-            if response.status_code != 200:
-                logger.error(f"{provider.value} error: {response.status_code} - {response.text}")
-                raise MultiProviderError(response.status_code, response.text, provider.value)
-            
-            result = response.json()
+        client = self._get_client(config)
+        try:
+            response = await self._send(client, provider, config, content)
+            UPSTREAM_TTFB[provider.value].observe(time.perf_counter() - start_time)
+            if timer:
+                timer.mark("upstream_connect")
             
-            logger.info(
-                f"Chat completion: provider={provider.value}, model={resolved_model}, "
-                f"run_id={run_id}, tokens={result.get('usage', {}).get('total_tokens', 0)}, "
-                f"latency={elapsed_ms:.1f}ms"
+            # aread() also releases the connection back to the pool
+            await response.aread()
+            if timer:
+                timer.mark("upstream")
+        except httpx.HTTPError:
+            PROVIDER_ERROR_COUNT[provider.value].inc()
+            raise
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        UPSTREAM_TOTAL[provider.value].observe(elapsed_ms / 1000)
+        
+        if response.status_code != 200:
+            PROVIDER_ERROR_COUNT[provider.value].inc()
+            logger.error(f"{provider.value} error: {response.status_code} - {response.text}")
+            raise MultiProviderError(
+                response.status_code, response.text, provider.value,
+                retry_after=parse_retry_after(response.headers),
             )
-            
-            # Add provider info to response
-            result["_agentwall_provider"] = provider.value
-            
-            return result
+        
+        result = orjson.loads(response.content)
+        
+        logger.info(
+            f"Chat completion: provider={provider.value}, model={resolved_model}, "
+            f"run_id={run_id}, tokens={result.get('usage', {}).get('total_tokens', 0)}, "
+            f"latency={elapsed_ms:.1f}ms"
+        )
+        
+        return UpstreamCompletion(content=response.content, data=result, provider=provider.value)
     
     async def chat_completion_stream(
         self,
@@ -301,9 +513,19 @@ class MultiProviderProxy:
         run_id: str,
         api_key: Optional[str] = None,
         force_provider: Optional[Provider] = None,
+        timer: Optional[StageTimer] = None,
+        handle: Optional[StreamHandle] = None,
+        body: Optional[bytes] = None,
     ) -> Tuple[AsyncIterator[bytes], StreamMetrics]:
         """
         Streaming chat completion with auto provider routing
+        
+        `body` is the pre-serialized request_data (see chat_completion_raw).
+        If a StageTimer is passed, marks upstream_connect, upstream_ttfb
+        (first chunk) and upstream (end of stream).
+        If a StreamHandle is passed, the upstream response is attached to it
+        and the generator raises StreamAborted when the handle is aborted or
+        the completion exceeds the handle's budget allowance.
         """
         model = request_data.get("model", "gpt-3.5-turbo")
         resolved_model = resolve_model(model)
@@ -311,78 +533,97 @@ class MultiProviderProxy:
         provider = force_provider or detect_provider(resolved_model)
         config = get_provider_config(provider, api_key)
         
-        if resolved_model != model:
-            request_data = {**request_data, "model": resolved_model}
+        content = build_request_body(request_data, model, resolved_model, body)
+        await self._pace(provider, config, content, request_data, timer)
         
         metrics = StreamMetrics(run_id=run_id, provider=provider.value, model=resolved_model)
         start_time = time.perf_counter()
+        PROVIDER_REQUEST_COUNT[provider.value].inc()
         
-        client = httpx.AsyncClient(
-            base_url=config.base_url,
-            timeout=httpx.Timeout(None, connect=10.0),
-            headers=self._get_headers(config),
-        )
+        client = self._get_client(config)
         
         try:
-            response = await client.send(
-                client.build_request("POST", "/v1/chat/completions", json=request_data),
-                stream=True
+            response = await self._send(
+                client, provider, config, content,
+                # No read timeout: long generations stream for minutes
+                timeout=httpx.Timeout(None, connect=10.0),
             )
+        except httpx.HTTPError:
+            PROVIDER_ERROR_COUNT[provider.value].inc()
+            raise
+        
+        if timer:
+            timer.mark("upstream_connect")
+        
+        if response.status_code != 200:
+            PROVIDER_ERROR_COUNT[provider.value].inc()
+            error_body = await response.aread()
+            raise MultiProviderError(
+                response.status_code, error_body.decode(), provider.value,
+                retry_after=parse_retry_after(response.headers),
+            )
+        
+        if handle:
+            handle.attach(response)
+        
+        async def stream_generator() -> AsyncIterator[bytes]:
+            nonlocal metrics
+            first_chunk = True
             
-            if response.status_code != 200:
-                error_body = await response.aread()
-                await client.aclose()
-                raise MultiProviderError(response.status_code, error_body.decode(), provider.value)
-            
-            async def stream_generator() -> AsyncIterator[bytes]:
-                nonlocal metrics
-                first_chunk = True
-                
-                try:
-                    async for line in response.aiter_lines():
-                        if not line:
-                            continue
+            try:
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    
+                    if first_chunk:
+                        metrics.first_chunk_ms = (time.perf_counter() - start_time) * 1000
+                        UPSTREAM_TTFB[provider.value].observe(metrics.first_chunk_ms / 1000)
+                        if timer:
+                            timer.mark("upstream_ttfb")
+                        first_chunk = False
+                    
+                    metrics.chunk_count += 1
+                    
+                    if line.startswith("data: "):
+                        data_str = line[6:]
                         
-                        if first_chunk:
-                            metrics.first_chunk_ms = (time.perf_counter() - start_time) * 1000
-                            first_chunk = False
+                        if data_str.strip() == "[DONE]":
+                            yield b"data: [DONE]\n\n"
+                            break
                         
-                        metrics.chunk_count += 1
+                        try:
+                            data = orjson.loads(data_str)
+                            if "choices" in data and data["choices"]:
+                                delta = data["choices"][0].get("delta", {})
+                                content = delta.get("content", "")
+                                if content:
+                                    metrics.total_chars += len(content)
+                                    if handle and metrics.total_chars > handle.max_chars:
+                                        raise handle.exceed_budget()
+                        except orjson.JSONDecodeError:
+                            pass
                         
-                        if line.startswith("data: "):
-                            data_str = line[6:]
-                            
-                            if data_str.strip() == "[DONE]":
-                                yield b"data: [DONE]\n\n"
-                                break
-                            
-                            try:
-                                data = json.loads(data_str)
-                                if "choices" in data and data["choices"]:
-                                    delta = data["choices"][0].get("delta", {})
-                                    content = delta.get("content", "")
-                                    if content:
-                                        metrics.total_chars += len(content)
-                            except json.JSONDecodeError:
-                                pass
-                            
-                            yield f"data: {data_str}\n\n".encode()
-                
-                finally:
-                    metrics.total_ms = (time.perf_counter() - start_time) * 1000
-                    await response.aclose()
-                    await client.aclose()
-                    
-                    logger.info(
-                        f"Stream completed: provider={provider.value}, model={resolved_model}, "
-                        f"run_id={run_id}, chunks={metrics.chunk_count}, ttfb={metrics.first_chunk_ms:.1f}ms"
-                    )
+                        yield f"data: {data_str}\n\n".encode()
             
-            return stream_generator(), metrics
+            except httpx.HTTPError:
+                if handle and handle.aborted:
+                    raise StreamAborted(handle.abort_reason) from None
+                raise
             
-        except Exception as e:
-            await client.aclose()
-            raise
+            finally:
+                metrics.total_ms = (time.perf_counter() - start_time) * 1000
+                UPSTREAM_TOTAL[provider.value].observe(metrics.total_ms / 1000)
+                if timer:
+                    timer.mark("upstream")
+                # Releases the connection back to the pool
+                await response.aclose()
+                
+                logger.info(
+                    f"Stream completed: provider={provider.value}, model={resolved_model}, "
+                    f"run_id={run_id}, chunks={metrics.chunk_count}, ttfb={metrics.first_chunk_ms:.1f}ms"
+                )
+        
+        return stream_generator(), metrics
 
 
 # Singleton instance
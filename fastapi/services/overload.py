@@ -0,0 +1,130 @@
+"""
+Overload Controller - adaptive admission for API requests (per worker)
+
+When the event loop saturates (DLP scans of huge payloads, JSON of long
+contexts, thousands of open streams) every request slows down together
+until clients time out. The controller sheds new requests early with a
+fast 503 instead, so the requests already admitted keep their latency.
+
+- Limit: an AIMD in-flight limit driven by event-loop lag. Every lag
+  sample (LoopLagMonitor heartbeat) is smoothed; above
+  OVERLOAD_TARGET_LAG_MS the limit drops to 90% of what is actually in
+  flight, otherwise it grows by 10% back towards OVERLOAD_MAX_IN_FLIGHT.
+- Priority: plans with a "weight" of at least OVERLOAD_PRIORITY_WEIGHT
+  (the plan limits attached by AuthMiddleware) may use the whole limit;
+  everyone else gets OVERLOAD_NORMAL_SHARE of it and is shed outright
+  while lag is above OVERLOAD_CRITICAL_LAG_MS. Health, status and
+  /internal (kill) traffic is never shed (see OverloadMiddleware).
+  Not wired to real plans yet: key validation (AuthMiddleware) does not
+  return a "weight" until it asks the backend for the key's plan, so for
+  now every request is "normal".
+"""
+
+import os
+from typing import Optional
+
+from config import settings
+from services.metrics import OVERLOAD_IN_FLIGHT, OVERLOAD_LIMIT, OVERLOAD_SHED
+
+# Weight of the newest lag sample in the smoothed lag
+LAG_SMOOTHING = 0.3
+BACKOFF = 0.9
+GROWTH = 0.1
+
+PRIORITIES = ("normal", "high")
+
+
+class OverloadController:
+    """In-flight request count and adaptive admission limit"""
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        min_in_flight: int,
+        target_lag_ms: float,
+        critical_lag_ms: float,
+        normal_share: float,
+        priority_weight: float,
+        enabled: bool = True,
+    ):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min(min_in_flight, max_in_flight)
+        self.target_lag = target_lag_ms / 1000
+        self.critical_lag = critical_lag_ms / 1000
+        self.normal_share = normal_share
+        self.priority_weight = priority_weight
+        self.enabled = enabled
+
+        self.in_flight = 0
+        self.limit = float(max_in_flight)
+        self._lag = 0.0  # seconds, smoothed
+        self._shed = dict.fromkeys(PRIORITIES, 0)
+        OVERLOAD_LIMIT.set(self.limit)
+
+    @property
+    def lag_ms(self) -> float:
+        return self._lag * 1000
+
+    def start(self):
+        """Follow the event-loop lag monitor"""
+        from services.profiler import loop_monitor
+        loop_monitor.add_listener(self.observe)
+
+    def observe(self, lag: float):
+        """Adapt the limit to a lag sample (seconds)"""
+        self._lag += LAG_SMOOTHING * (lag - self._lag)
+        if self._lag > self.target_lag:
+            self.limit = max(self.min_in_flight, min(self.limit, self.in_flight) * BACKOFF)
+        else:
+            self.limit = min(self.max_in_flight, self.limit + max(1.0, self.limit * GROWTH))
+        OVERLOAD_LIMIT.set(self.limit)
+
+    def priority(self, limits: Optional[dict]) -> str:
+        """Shedding priority of a request from its plan limits"""
+        weight = float((limits or {}).get("weight", 1.0))
+        return "high" if weight >= self.priority_weight else "normal"
+
+    def admit(self, priority: str) -> bool:
+        """Take an in-flight slot (release() it when the response is done)"""
+        if self.enabled:
+            if priority == "high":
+                capacity = self.limit
+            elif self._lag >= self.critical_lag:
+                capacity = 0
+            else:
+                capacity = self.limit * self.normal_share
+            if self.in_flight >= capacity:
+                self._shed[priority] += 1
+                OVERLOAD_SHED[priority].inc()
+                return False
+        self.in_flight += 1
+        OVERLOAD_IN_FLIGHT.inc()
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        OVERLOAD_IN_FLIGHT.dec()
+
+    def snapshot(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "limit": round(self.limit, 1),
+            "lag_ms": round(self.lag_ms, 2),
+            "target_lag_ms": self.target_lag * 1000,
+            "critical_lag_ms": self.critical_lag * 1000,
+            "shed": dict(self._shed),
+        }
+
+
+# Singleton instance (per worker process)
+overload_controller = OverloadController(
+    max_in_flight=settings.OVERLOAD_MAX_IN_FLIGHT,
+    min_in_flight=settings.OVERLOAD_MIN_IN_FLIGHT,
+    target_lag_ms=settings.OVERLOAD_TARGET_LAG_MS,
+    critical_lag_ms=settings.OVERLOAD_CRITICAL_LAG_MS,
+    normal_share=settings.OVERLOAD_NORMAL_SHARE,
+    priority_weight=settings.OVERLOAD_PRIORITY_WEIGHT,
+    enabled=settings.OVERLOAD_ENABLED,
+)
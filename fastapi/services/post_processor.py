@@ -0,0 +1,168 @@
+"""
+Post-Processor - bounded background stage for work left after a response
+
+A completed request leaves work behind: the run state update and token
+charge, the ClickHouse log (and run summary), the dashboard log and loop
+pattern records. Rather than a task per item, the request submits jobs to
+a bounded per-worker queue and returns; a fixed pool of consumers drains
+it.
+
+- Sharding: jobs are routed by run_id to one of POSTPROCESS_WORKERS
+  queues, so a run's updates are applied in order and never race each
+  other on this worker.
+- Batching: a consumer takes everything queued (up to
+  POSTPROCESS_BATCH_SIZE) at once. Run states are loaded and saved in one
+  Redis round trip each; logs are handed to their sinks in one call.
+- Overflow: with a full queue, jobs that must not be lost (run state,
+  request logs) are processed by the submitting request (backpressure);
+  best-effort ones (dashboard logs, loop patterns) are dropped and counted.
+- Shutdown: stop() lets the consumers drain the queues (bounded by
+  POSTPROCESS_DRAIN_TIMEOUT). Jobs submitted while the stage is not
+  running are processed inline.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Union
+
+from config import settings
+from services.clickhouse_client import LoopPattern, RequestLog, clickhouse_client
+from services.laravel_logger import LaravelRequestLog, laravel_logger
+from services.metrics import (
+    POSTPROCESS_DEPTH,
+    POSTPROCESS_DROPPED,
+    POSTPROCESS_FAILURES,
+    POSTPROCESS_INLINE,
+    POSTPROCESS_QUEUED,
+)
+from services.run_summary import run_summaries
+from services.run_tracker import StepCompletion, run_tracker
+
+logger = logging.getLogger(__name__)
+
+Job = Union[StepCompletion, RequestLog, LaravelRequestLog, LoopPattern]
+
+# What happens to a job submitted to a full queue
+OVERFLOW_POLICY = {
+    StepCompletion: "inline",
+    RequestLog: "inline",
+    LaravelRequestLog: "drop",
+    LoopPattern: "drop",
+}
+
+
+class PostProcessor:
+    """Per-worker bounded job queues drained by a fixed pool of consumers"""
+
+    def __init__(self, workers: int, queue_size: int, batch_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self._queues: list[asyncio.Queue] = []
+        self._consumers: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._consumers)
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting (not counting batches being processed)"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def submit(self, *jobs: Job):
+        """Queue jobs (never blocks unless a job's overflow policy is inline)"""
+        inline = []
+        for job in jobs:
+            if not self._queues:
+                inline.append(job)
+                continue
+            queue = self._queues[hash(job.run_id or "") % len(self._queues)]
+            try:
+                queue.put_nowait(job)
+                POSTPROCESS_QUEUED.inc()
+            except asyncio.QueueFull:
+                if OVERFLOW_POLICY[type(job)] == "drop":
+                    POSTPROCESS_DROPPED.inc()
+                    continue
+                POSTPROCESS_INLINE.inc()
+                inline.append(job)
+        POSTPROCESS_DEPTH.set(self.depth)
+        if inline:
+            await self._process(inline)
+
+    async def _process(self, batch: list[Job]):
+        """Hand a batch to its sinks; a failing sink does not stop the others"""
+        steps = [job for job in batch if isinstance(job, StepCompletion)]
+        logs = [job for job in batch if isinstance(job, RequestLog)]
+        dashboard = [job for job in batch if isinstance(job, LaravelRequestLog)]
+        patterns = [job for job in batch if isinstance(job, LoopPattern)]
+
+        if steps:
+            try:
+                await run_tracker.complete_steps(steps)
+            except Exception as e:
+                POSTPROCESS_FAILURES["run_state"].inc(len(steps))
+                logger.error(f"Failed to apply {len(steps)} completed steps: {e}")
+        if logs:
+            try:
+                for log in logs:
+                    run_summaries.record_step(log)
+                await clickhouse_client.log_requests(logs)
+            except Exception as e:
+                POSTPROCESS_FAILURES["clickhouse"].inc(len(logs))
+                logger.error(f"Failed to queue {len(logs)} request logs: {e}")
+        if dashboard:
+            dropped = laravel_logger.log_requests(dashboard)
+            if dropped:
+                POSTPROCESS_FAILURES["laravel"].inc(dropped)
+        for pattern in patterns:
+            await clickhouse_client.log_loop_pattern(pattern)
+
+    async def _consume(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._process(batch)
+            except Exception as e:
+                logger.error(f"Post-processing batch failed: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+                POSTPROCESS_DEPTH.set(self.depth)
+
+    async def start(self):
+        """Start the consumers"""
+        if self.running:
+            return
+        size = max(1, self.queue_size // self.workers)
+        self._queues = [asyncio.Queue(maxsize=size) for _ in range(self.workers)]
+        self._consumers = [asyncio.create_task(self._consume(queue)) for queue in self._queues]
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Drain the queues (up to `timeout` seconds), then stop the consumers"""
+        if not self.running:
+            return
+        timeout = settings.POSTPROCESS_DRAIN_TIMEOUT if timeout is None else timeout
+        # Detached first: jobs submitted while draining are processed inline
+        queues, self._queues = self._queues, []
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in queues)), timeout)
+        except asyncio.TimeoutError:
+            left = sum(queue.qsize() for queue in queues)
+            logger.error(f"Post-processing drain timed out with {left} jobs left")
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        self._consumers = []
+        POSTPROCESS_DEPTH.set(0)
+
+
+# Singleton instance (per worker process)
+post_processor = PostProcessor(
+    workers=settings.POSTPROCESS_WORKERS,
+    queue_size=settings.POSTPROCESS_QUEUE_SIZE,
+    batch_size=settings.POSTPROCESS_BATCH_SIZE,
+)
@@ -0,0 +1,312 @@
+"""
+Sampling Profiler & Event-Loop Lag Monitor
+
+Answers "what is burning the event loop?" in production workers:
+
+1. SamplingProfiler (opt-in, per worker, N seconds)
+   - Background thread samples the event-loop thread's stack every few ms
+   - Stacks are collapsed ("task:coro;file:func;file:func count") which is
+     the input format of flamegraph.pl / speedscope
+   - Root frame is the asyncio task that was running (async attribution)
+
+2. LoopLagMonitor (always on, cheap)
+   - A heartbeat coroutine measures how late the loop wakes it up
+   - A watchdog thread notices when the heartbeat is overdue and captures
+     the stack that is blocking the loop (e.g. regex DLP on a huge payload,
+     json.dumps of a 100K-token context)
+   - Stalls are kept in a bounded ring buffer
+
+Overhead: the profiler costs one GIL hand-off per sample only while a
+session runs; the lag monitor wakes up every LOOP_LAG_INTERVAL_MS.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import logging
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+
+from config import settings
+from services.metrics import EVENT_LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 64
+
+
+def _frame_label(code, cache: dict) -> str:
+    """file:function label for a code object (cached per code object)"""
+    label = cache.get(code)
+    if label is None:
+        label = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        cache[code] = label
+    return label
+
+
+def _current_task_label(loop: Optional[asyncio.AbstractEventLoop]) -> str:
+    """Name of the coroutine the loop is currently running (if any)"""
+    if loop is None:
+        return "task:?"
+    # Read from another thread: asyncio keeps {loop: task} for running tasks
+    task = getattr(asyncio.tasks, "_current_tasks", {}).get(loop)
+    if task is None:
+        return "task:<loop>"
+    coro = task.get_coro()
+    return f"task:{getattr(coro, '__qualname__', task.get_name())}"
+
+
+def collapse_stack(frame, task_label: str, cache: dict) -> str:
+    """Collapse a frame chain into a root-first ';'-joined stack"""
+    labels = []
+    depth = 0
+    while frame is not None and depth < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame.f_code, cache))
+        frame = frame.f_back
+        depth += 1
+    labels.append(task_label)
+    labels.reverse()
+    return ";".join(labels)
+
+
+class SamplingProfiler:
+    """
+    Thread-based sampling profiler for the event-loop thread
+
+    One session at a time per worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+        self._samples: Counter = Counter()
+        self._sample_count = 0
+        self._started_at: Optional[datetime] = None
+        self._duration = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    async def profile(self, seconds: float, interval_ms: float = 5.0) -> dict:
+        """
+        Profile the current event loop for `seconds`
+
+        Returns: session summary including collapsed stacks
+        """
+        with self._lock:
+            if self._running:
+                raise RuntimeError("Profiler session already running")
+            self._running = True
+            self._samples = Counter()
+            self._sample_count = 0
+
+        loop = asyncio.get_running_loop()
+        target_thread = threading.get_ident()
+        stop = threading.Event()
+        self._started_at = datetime.utcnow()
+        self._duration = seconds
+
+        sampler = threading.Thread(
+            target=self._sample_loop,
+            args=(loop, target_thread, interval_ms / 1000, stop),
+            name="agentwall-profiler",
+            daemon=True,
+        )
+        sampler.start()
+
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            # Joining is quick: the sampler wakes up every interval
+            await asyncio.to_thread(sampler.join, 1.0)
+            self._running = False
+
+        return self.summary()
+
+    def _sample_loop(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        target_thread: int,
+        interval: float,
+        stop: threading.Event,
+    ):
+        """Sampler thread body"""
+        cache: dict = {}
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(target_thread)
+            if frame is None:
+                continue
+            stack = collapse_stack(frame, _current_task_label(loop), cache)
+            self._samples[stack] += 1
+            self._sample_count += 1
+
+    def collapsed(self) -> str:
+        """Collapsed stacks of the last session (flamegraph input)"""
+        return "\n".join(
+            f"{stack} {count}" for stack, count in self._samples.most_common()
+        )
+
+    def summary(self) -> dict:
+        """Last session summary"""
+        return {
+            "pid": os.getpid(),
+            "running": self._running,
+            "started_at": self._started_at.isoformat() + "Z" if self._started_at else None,
+            "duration_seconds": self._duration,
+            "samples": self._sample_count,
+            "unique_stacks": len(self._samples),
+        }
+
+
+@dataclass
+class LoopStall:
+    """An event-loop stall captured by the watchdog"""
+    detected_at: datetime
+    lag_ms: float
+    task: str
+    stack: list[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "detected_at": self.detected_at.isoformat() + "Z",
+            "lag_ms": round(self.lag_ms, 2),
+            "task": self.task,
+            "stack": self.stack,
+        }
+
+
+class LoopLagMonitor:
+    """
+    Event-loop lag monitor with stall stack capture
+
+    - heartbeat coroutine: sleeps `interval`, measures oversleep (lag)
+    - watchdog thread: if the heartbeat is overdue by `threshold`,
+      snapshots the loop thread's stack while it is still blocked
+    """
+
+    def __init__(
+        self,
+        interval_ms: float = settings.LOOP_LAG_INTERVAL_MS,
+        threshold_ms: float = settings.LOOP_STALL_THRESHOLD_MS,
+        max_stalls: int = 50,
+    ):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.stalls: deque[LoopStall] = deque(maxlen=max_stalls)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._last_beat = 0.0
+        self._lag = 0.0  # seconds, last measured
+        self._max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._listeners: list[Callable[[float], None]] = []
+
+    @property
+    def lag_ms(self) -> float:
+        """Most recent loop lag in milliseconds"""
+        return self._lag * 1000
+
+    def add_listener(self, listener: Callable[[float], None]):
+        """Call `listener(lag_seconds)` after every heartbeat"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def start(self):
+        """Start heartbeat + watchdog (call from the event loop)"""
+        if self._task and not self._task.done():
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._stop.clear()
+
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="agentwall-loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+        logger.info(
+            f"Loop lag monitor started (interval={self.interval * 1000:.0f}ms, "
+            f"stall threshold={self.threshold * 1000:.0f}ms)"
+        )
+
+    async def stop(self):
+        """Stop heartbeat + watchdog"""
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        """Measure how late the loop wakes us up"""
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._lag = max(0.0, now - expected)
+            self._max_lag = max(self._max_lag, self._lag)
+            self._last_beat = now
+            EVENT_LOOP_LAG.observe(self._lag)
+            for listener in self._listeners:
+                try:
+                    listener(self._lag)
+                except Exception as e:
+                    logger.error(f"Loop lag listener failed: {e}")
+
+    def _watch(self):
+        """Watchdog thread: capture the blocking stack during a stall"""
+        cache: dict = {}
+        reported_beat = 0.0
+        check_every = max(self.threshold / 2, 0.005)
+
+        while not self._stop.wait(check_every):
+            last_beat = self._last_beat
+            overdue = time.perf_counter() - last_beat - self.interval
+            if overdue < self.threshold or last_beat == reported_beat:
+                continue
+
+            # One record per stall (until the heartbeat runs again)
+            reported_beat = last_beat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+
+            task = _current_task_label(self._loop)
+            stack = collapse_stack(frame, task, cache).split(";")
+            self.stalls.append(LoopStall(
+                detected_at=datetime.utcnow(),
+                lag_ms=overdue * 1000,
+                task=task,
+                stack=stack,
+            ))
+            logger.warning(
+                f"Event loop stalled >{overdue * 1000:.0f}ms in {stack[-1]} ({task})"
+            )
+
+    def snapshot(self) -> dict:
+        """Current lag and recent stalls"""
+        return {
+            "pid": os.getpid(),
+            "lag_ms": round(self.lag_ms, 2),
+            "max_lag_ms": round(self._max_lag * 1000, 2),
+            "threshold_ms": self.threshold * 1000,
+            "stalls": [s.to_dict() for s in reversed(self.stalls)],
+        }
+
+
+# Singleton instances (per worker process)
+profiler = SamplingProfiler()
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,259 @@
+"""
+Provider Limits - pacing and retries driven by upstream rate-limit headers
+
+OpenAI, Groq and OpenRouter report their remaining quota on every response
+(x-ratelimit-remaining-requests / -tokens, reset times, retry-after on
+429). Passing their 429s straight back makes agents retry and dig deeper,
+so per provider API key we track the reported budget and:
+
+- Pace: while the remaining budget is close to zero, requests are spaced
+  out over the time left until the provider's reset (and wait for the
+  reset once it is exhausted); concurrent requests on one worker count
+  against the budget before the provider's answer arrives
+- Refuse quickly (a local 429 with retry-after) when the wait would be
+  longer than PROVIDER_MAX_PACE_SECONDS
+- Retry 429 / 503 answers with jittered exponential backoff that honours
+  retry-after, bounded by a per-worker retry budget: every request earns
+  UPSTREAM_RETRY_BUDGET_RATIO retries, so retries can never multiply the
+  load on a provider that is already refusing it
+
+API keys are tracked by hash and never stored.
+"""
+
+import hashlib
+import random
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Mapping, Optional
+
+from config import settings
+
+# Statuses worth retrying (the request was not processed)
+RETRYABLE_STATUSES = frozenset({429, 503})
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds from a provider duration ("20ms", "1.5s", "6m0s", "7.66s", "2")
+
+    Returns None when the value cannot be read.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _UNIT_SECONDS[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds from retry-after-ms / retry-after (HTTP dates are ignored)"""
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            return None
+    return None
+
+
+def _int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+@dataclass
+class Budget:
+    """Remaining quota of one kind (requests or tokens) for one key"""
+    limit: int
+    remaining: float
+    reset_at: float  # monotonic seconds
+
+    def delay(self, now: float, cost: float, low_water: float) -> tuple[float, float]:
+        """
+        (seconds until `cost` can be spent at all, spacing between requests)
+
+        Once the budget is spent requests wait for the reset; while it is
+        low, what is left is spread over the time until the reset.
+        """
+        if now >= self.reset_at:
+            return 0.0, 0.0
+        if self.remaining < cost:
+            return self.reset_at - now, 0.0
+        if self.remaining - cost < low_water:
+            return 0.0, (self.reset_at - now) / max(self.remaining / cost, 1.0)
+        return 0.0, 0.0
+
+    def spend(self, now: float, cost: float):
+        if now < self.reset_at:
+            self.remaining -= cost
+
+
+class KeyLimits:
+    """Provider-reported limits for one provider API key"""
+
+    __slots__ = ("requests", "tokens", "blocked_until", "next_at")
+
+    def __init__(self):
+        self.requests: Optional[Budget] = None
+        self.tokens: Optional[Budget] = None
+        self.blocked_until = 0.0  # monotonic; set from retry-after
+        self.next_at = 0.0        # monotonic; earliest send time while pacing
+
+    def update(self, headers: Mapping[str, str], now: float):
+        for kind in ("requests", "tokens"):
+            remaining = _int_header(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is None and kind == "requests":
+                # OpenRouter: unsuffixed headers, reset as epoch milliseconds
+                remaining = _int_header(headers, "x-ratelimit-remaining")
+                reset = _int_header(headers, "x-ratelimit-reset")
+                limit = _int_header(headers, "x-ratelimit-limit")
+                reset_in = max(0.0, reset / 1000 - time.time()) if reset else None
+            else:
+                reset_in = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                limit = _int_header(headers, f"x-ratelimit-limit-{kind}")
+            if remaining is None or reset_in is None:
+                continue
+            setattr(self, kind, Budget(
+                limit=limit or remaining,
+                remaining=float(remaining),
+                reset_at=now + reset_in,
+            ))
+
+    def reserve(self, now: float, tokens: int) -> float:
+        """Spend one request and `tokens`; returns seconds to wait before sending"""
+        hold = max(0.0, self.blocked_until - now)
+        interval = 0.0
+        for budget, cost in ((self.requests, 1), (self.tokens, tokens)):
+            if budget is None or not cost:
+                continue
+            budget_hold, budget_interval = budget.delay(
+                now, cost, budget.limit * settings.PROVIDER_PACE_THRESHOLD,
+            )
+            hold = max(hold, budget_hold)
+            interval = max(interval, budget_interval)
+            budget.spend(now, cost)
+
+        send_at = now + hold
+        if interval:
+            # Paced requests leave one interval apart, even when concurrent
+            send_at = max(send_at, self.next_at)
+            self.next_at = send_at + interval
+        return send_at - now
+
+
+class RetryBudget:
+    """
+    Token bucket of retries (per worker)
+
+    Each request deposits `ratio` tokens, each retry withdraws one, and the
+    bucket holds at most `burst` tokens.
+    """
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+
+    @property
+    def available(self) -> float:
+        return self._tokens
+
+    def deposit(self):
+        self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Seconds to wait before retry number `attempt` (1-based)
+
+    Full jitter over an exponential ceiling; a provider's retry-after is a
+    floor, with a little jitter on top so waiting clients don't return in
+    lockstep.
+    """
+    base = settings.UPSTREAM_RETRY_BASE_DELAY
+    if retry_after is not None:
+        return retry_after + random.uniform(0, base)
+    return random.uniform(0, min(settings.UPSTREAM_RETRY_MAX_DELAY, base * 2 ** (attempt - 1)))
+
+
+class ProviderLimitTracker:
+    """Per provider API key view of the provider's rate limits (per worker)"""
+
+    # Keys tracked before the least recently used are dropped
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._keys: OrderedDict[tuple[str, bytes], KeyLimits] = OrderedDict()
+        self.retry_budget = RetryBudget(
+            ratio=settings.UPSTREAM_RETRY_BUDGET_RATIO,
+            burst=settings.UPSTREAM_RETRY_BUDGET_BURST,
+        )
+
+    @staticmethod
+    def _key(provider: str, api_key: str) -> tuple[str, bytes]:
+        return provider, hashlib.blake2b(api_key.encode(), digest_size=8).digest()
+
+    def _get(self, provider: str, api_key: str, create: bool = False) -> Optional[KeyLimits]:
+        key = self._key(provider, api_key)
+        limits = self._keys.get(key)
+        if limits is not None:
+            self._keys.move_to_end(key)
+        elif create:
+            limits = self._keys[key] = KeyLimits()
+            if len(self._keys) > self.MAX_KEYS:
+                self._keys.popitem(last=False)
+        return limits
+
+    def reserve(self, provider: str, api_key: str, tokens: int) -> float:
+        """
+        Count a request against the key's budget
+
+        Returns: seconds to wait before sending it (0 when not pacing)
+        """
+        self.retry_budget.deposit()
+        limits = self._get(provider, api_key)
+        if limits is None:
+            return 0.0
+        return limits.reserve(time.monotonic(), tokens)
+
+    def observe(self, provider: str, api_key: str, status_code: int, headers: Mapping[str, str]):
+        """Record the limits reported on a provider response"""
+        now = time.monotonic()
+        limits = self._get(provider, api_key, create=True)
+        limits.update(headers, now)
+        if status_code == 429:
+            retry_after = parse_retry_after(headers)
+            if retry_after is not None:
+                limits.blocked_until = max(limits.blocked_until, now + retry_after)
+
+
+# Singleton instance (per worker process)
+provider_limits = ProviderLimitTracker()
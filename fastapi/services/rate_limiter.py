@@ -0,0 +1,282 @@
+"""
+Rate Limiter - GCRA in Redis
+
+Requests/sec and tokens/min per API key, team and model, so one
+misbehaving agent cannot eat the upstream quota of every other tenant.
+
+GCRA (generic cell rate algorithm, a token bucket stored as one number):
+per limit Redis holds the "theoretical arrival time" (TAT). A request of
+`cost` units advances it by cost * period / limit; it is rejected if that
+pushes the TAT more than one period ahead of now (burst = limit).
+
+- All limits of a request are checked and applied atomically by one Lua
+  script, pipelined with the run-state GET (see RunTracker.process_step):
+  rate limiting adds no Redis round trip
+- Token limits are charged with an estimate of the prompt at admission;
+  completion tokens are charged after the response (never rejected)
+- Per-worker pre-check: keys rejected by Redis stay rejected locally until
+  their retry time, so an agent hammering past its limit costs no Redis
+  traffic
+- While Redis is down the same algorithm runs per worker
+- Results become OpenAI-style x-ratelimit-* response headers
+"""
+
+import hashlib
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
+
+from config import settings
+
+# KEYS: one TAT key per limit
+# ARGV: now_ms, then per limit: interval_ms, tolerance_ms, cost, force
+# Returns: denied limit (1-based, 0 = allowed), retry_after_ms, then per
+# limit: remaining, reset_ms
+GCRA_SCRIPT = """
+local now = tonumber(ARGV[1])
+local n = #KEYS
+local tats = {}
+local denied = 0
+local retry_after = 0
+for i = 1, n do
+    local base = 2 + (i - 1) * 4
+    local interval = tonumber(ARGV[base])
+    local tolerance = tonumber(ARGV[base + 1])
+    local cost = tonumber(ARGV[base + 2])
+    local tat = tonumber(redis.call('GET', KEYS[i])) or now
+    if tat < now then tat = now end
+    local new_tat = tat + cost * interval
+    if ARGV[base + 3] == '0' and new_tat - now > tolerance and denied == 0 then
+        denied = i
+        retry_after = math.ceil(new_tat - tolerance - now)
+    end
+    tats[i] = {tat, new_tat}
+end
+local result = {denied, retry_after}
+for i = 1, n do
+    local base = 2 + (i - 1) * 4
+    local interval = tonumber(ARGV[base])
+    local tolerance = tonumber(ARGV[base + 1])
+    local tat = tats[i][1]
+    if denied == 0 then
+        tat = tats[i][2]
+        redis.call('SET', KEYS[i], tat, 'PX', math.ceil(tat - now) + 1)
+    end
+    local remaining = math.floor((tolerance - (tat - now)) / interval)
+    if remaining < 0 then remaining = 0 end
+    result[#result + 1] = remaining
+    result[#result + 1] = math.ceil(tat - now)
+end
+return result
+"""
+GCRA_SHA = hashlib.sha1(GCRA_SCRIPT.encode()).hexdigest()
+
+
+@dataclass
+class RateLimit:
+    """One limit applied to a request"""
+    scope: str       # "key", "team", "model"
+    kind: str        # "requests" or "tokens"
+    key: str         # Redis key holding the TAT
+    limit: int       # units per period
+    period_ms: int
+    cost: int = 1
+
+    @property
+    def interval_ms(self) -> float:
+        return self.period_ms / self.limit
+
+    def charged_cost(self) -> int:
+        # A request bigger than the whole bucket can still pass when it is full
+        return min(self.cost, self.limit)
+
+
+@dataclass
+class LimitStatus:
+    """Remaining budget of one limit after a check"""
+    limit: RateLimit
+    remaining: int
+    reset_ms: int
+
+
+@dataclass
+class RateLimitResult:
+    """Outcome of checking all limits of a request"""
+    allowed: bool = True
+    retry_after_ms: int = 0
+    denied: Optional[RateLimit] = None
+    statuses: list[LimitStatus] = field(default_factory=list)
+
+    @property
+    def reason(self) -> str:
+        if self.denied is None:
+            return ""
+        return (
+            f"Rate limit exceeded: {self.denied.limit} {self.denied.kind} per "
+            f"{_format_period(self.denied.period_ms)} ({self.denied.scope})"
+        )
+
+    def headers(self) -> dict[str, str]:
+        """x-ratelimit-* headers for the most restrictive limit of each kind"""
+        headers = {}
+        for kind in ("requests", "tokens"):
+            statuses = [s for s in self.statuses if s.limit.kind == kind]
+            if not statuses:
+                continue
+            tightest = min(statuses, key=lambda s: (s.remaining, -s.reset_ms))
+            headers[f"x-ratelimit-limit-{kind}"] = str(tightest.limit.limit)
+            headers[f"x-ratelimit-remaining-{kind}"] = str(tightest.remaining)
+            headers[f"x-ratelimit-reset-{kind}"] = _format_reset(tightest.reset_ms)
+        if not self.allowed:
+            headers["retry-after"] = str(max(1, math.ceil(self.retry_after_ms / 1000)))
+        return headers
+
+
+def _format_period(period_ms: int) -> str:
+    return "second" if period_ms == 1000 else "minute"
+
+
+def _format_reset(ms: int) -> str:
+    """Reset duration in the OpenAI header style ("20ms", "1.5s", "2m3s")"""
+    if ms < 1000:
+        return f"{ms}ms"
+    seconds = ms / 1000
+    if seconds < 60:
+        return f"{seconds:g}s"
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes)}m{seconds:g}s"
+
+
+class RateLimiter:
+    """
+    Builds the limits of a request and evaluates script results
+
+    The Redis call itself is made by RunTracker (pipelined with admission).
+    """
+
+    # Entries kept by the per-worker pre-check / fallback before pruning
+    MAX_LOCAL_KEYS = 10000
+
+    def __init__(self):
+        self._blocked_until: dict[str, float] = {}  # key -> monotonic ms
+        self._local_tats: dict[str, float] = {}     # fallback TATs (epoch ms)
+
+    def limits_for(
+        self,
+        api_key_id: str,
+        team_id: str,
+        model: str,
+        estimated_tokens: int,
+        plan_limits: Optional[dict] = None,
+    ) -> list[RateLimit]:
+        """Limits for one request (unlimited dimensions are left out)"""
+        if not settings.RATE_LIMIT_ENABLED:
+            return []
+
+        plan = plan_limits or {}
+        limits = []
+        for scope, ident, rps, tpm in (
+            ("key", api_key_id, plan.get("requests_per_second", settings.RATE_LIMIT_KEY_RPS),
+             plan.get("tokens_per_minute", settings.RATE_LIMIT_KEY_TPM)),
+            ("team", team_id, settings.RATE_LIMIT_TEAM_RPS, settings.RATE_LIMIT_TEAM_TPM),
+            ("model", model, settings.RATE_LIMIT_MODEL_RPS, settings.RATE_LIMIT_MODEL_TPM),
+        ):
+            if rps > 0:
+                limits.append(RateLimit(
+                    scope, "requests", f"agentwall:rl:{scope}:{ident}:rps", int(rps), 1000,
+                ))
+            if tpm > 0:
+                limits.append(RateLimit(
+                    scope, "tokens", f"agentwall:rl:{scope}:{ident}:tpm", int(tpm), 60000,
+                    cost=max(1, estimated_tokens),
+                ))
+        return limits
+
+    # ------------------------------------------------------------------
+    # Per-worker pre-check
+    # ------------------------------------------------------------------
+
+    def precheck(self, limits: Sequence[RateLimit]) -> Optional[RateLimitResult]:
+        """Reject without Redis if a limit was recently denied and has not reset"""
+        now = time.monotonic() * 1000
+        for limit in limits:
+            until = self._blocked_until.get(limit.key)
+            if until is None:
+                continue
+            if until > now:
+                return RateLimitResult(
+                    allowed=False,
+                    retry_after_ms=math.ceil(until - now),
+                    denied=limit,
+                    statuses=[LimitStatus(limit, 0, math.ceil(until - now))],
+                )
+            del self._blocked_until[limit.key]
+        return None
+
+    def _block(self, limit: RateLimit, retry_after_ms: int):
+        if len(self._blocked_until) >= self.MAX_LOCAL_KEYS:
+            now = time.monotonic() * 1000
+            self._blocked_until = {k: v for k, v in self._blocked_until.items() if v > now}
+        self._blocked_until[limit.key] = time.monotonic() * 1000 + retry_after_ms
+
+    # ------------------------------------------------------------------
+    # Redis script
+    # ------------------------------------------------------------------
+
+    def script_args(self, limits: Sequence[RateLimit], force: bool = False) -> tuple[list[str], list]:
+        """KEYS and ARGV for GCRA_SCRIPT"""
+        args: list = [int(time.time() * 1000)]
+        for limit in limits:
+            args += [limit.interval_ms, limit.period_ms, limit.charged_cost(), int(force)]
+        return [limit.key for limit in limits], args
+
+    def parse(self, limits: Sequence[RateLimit], raw: Sequence[int]) -> RateLimitResult:
+        """Turn the script's reply into a result (and remember denials)"""
+        denied_index, retry_after = int(raw[0]), int(raw[1])
+        statuses = [
+            LimitStatus(limit, int(raw[2 + 2 * i]), int(raw[3 + 2 * i]))
+            for i, limit in enumerate(limits)
+        ]
+        result = RateLimitResult(statuses=statuses)
+        if denied_index:
+            result.allowed = False
+            result.denied = limits[denied_index - 1]
+            result.retry_after_ms = retry_after
+            self._block(result.denied, retry_after)
+        return result
+
+    # ------------------------------------------------------------------
+    # Fallback while Redis is down (same algorithm, per worker)
+    # ------------------------------------------------------------------
+
+    def check_local(self, limits: Sequence[RateLimit], force: bool = False) -> RateLimitResult:
+        now = time.time() * 1000
+        tats = []
+        result = RateLimitResult()
+        for limit in limits:
+            tat = max(self._local_tats.get(limit.key, now), now)
+            new_tat = tat + limit.charged_cost() * limit.interval_ms
+            if not force and result.allowed and new_tat - now > limit.period_ms:
+                result.allowed = False
+                result.denied = limit
+                result.retry_after_ms = math.ceil(new_tat - limit.period_ms - now)
+            tats.append((tat, new_tat))
+
+        if result.allowed and len(self._local_tats) >= self.MAX_LOCAL_KEYS:
+            self._local_tats = {k: v for k, v in self._local_tats.items() if v > now}
+
+        for limit, (tat, new_tat) in zip(limits, tats):
+            if result.allowed:
+                tat = new_tat
+                self._local_tats[limit.key] = tat
+            remaining = max(0, math.floor((limit.period_ms - (tat - now)) / limit.interval_ms))
+            result.statuses.append(LimitStatus(limit, remaining, math.ceil(tat - now)))
+
+        if not result.allowed:
+            self._block(result.denied, result.retry_after_ms)
+        return result
+
+
+# Singleton instance (per worker process)
+rate_limiter = RateLimiter()
@@ -0,0 +1,279 @@
+"""
+Run State - the per-run record behind run-level governance
+
+RunState is stored in Redis (one key per run) and read/written on every
+step, so it uses a compact versioned binary encoding instead of JSON:
+
+- struct layout, little-endian, version byte first
+- timestamps as epoch milliseconds, costs as integer micro-dollars
+  (rounded up, so budgets never under-count)
+- history as fingerprints (see services.loop_detector.PromptFingerprint):
+  prompt/response text is never stored, only hashes; word hashes are kept
+  for the SIMILARITY_WINDOW most recent prompts only
+- run_id is the Redis key and is not repeated in the value
+
+Layout v2:
+    header    <BBBIIIQqqqqBB  version, status, flags, step_count, max_steps,
+                              timeout_seconds, total_tokens, total_cost_micros,
+                              max_budget_micros, started_at_ms,
+                              last_activity_ms, n_prompts, n_responses
+    strings   <H + utf-8      team_id, user_id, agent_id, kill_reason (each cut
+                              to MAX_STRING_BYTES: agent_id and the tool name
+                              in kill_reason come from the client)
+    prompts   <QQH + <nI      exact hash, normalized hash, n_words, word hashes
+    responses <nQ             response hashes
+    cycle     <B + <nQ + <mB  n_recent, recent step hashes, per-period match
+                              counts (m = CYCLE_MAX_PERIOD)
+
+v1 is v2 without the cycle section. Values written by older versions
+(v1, or JSON with first byte "{") are still read and are rewritten in the
+current format on the next save.
+"""
+
+import json
+import struct
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_CEILING
+
+from config import settings
+from services.loop_detector import (
+    CYCLE_MAX_PERIOD,
+    SIMILARITY_WINDOW,
+    CycleState,
+    PromptFingerprint,
+    hash_text,
+)
+
+# Prompts / responses kept per run for loop detection
+HISTORY_SIZE = 5
+
+ENCODING_VERSION = 2
+
+STATUSES = ("running", "completed", "failed", "killed")
+_STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# Longest stored string (utf-8 bytes); longer values are cut when encoding
+MAX_STRING_BYTES = 1024
+
+FLAG_LOOP_DETECTED = 0x01
+FLAG_BUDGET_EXCEEDED = 0x02
+
+_HEADER = struct.Struct("<BBBIIIQqqqqBB")
+_STR_LEN = struct.Struct("<H")
+_PROMPT = struct.Struct("<QQH")
+_CYCLE_MATCHES = struct.Struct(f"<{CYCLE_MAX_PERIOD}B")
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MS = timedelta(milliseconds=1)
+_MICROS = Decimal(1_000_000)
+
+
+@dataclass
+class RunState:
+    """Current state of an agent run"""
+    run_id: str
+    team_id: str
+    user_id: str
+    agent_id: str = ""
+
+    # Counters
+    step_count: int = 0
+    total_tokens: int = 0
+    total_cost: Decimal = Decimal("0")
+
+    # Budget tracking
+    daily_cost: Decimal = Decimal("0")
+    monthly_cost: Decimal = Decimal("0")
+
+    # Timing
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    last_activity: datetime = field(default_factory=datetime.utcnow)
+
+    # Status
+    status: str = "running"  # running, completed, failed, killed
+    kill_reason: str = ""
+
+    # Flags
+    loop_detected: bool = False
+    budget_exceeded: bool = False
+
+    # History for loop detection (last N prompts / responses, fingerprinted)
+    prompt_history: list[PromptFingerprint] = field(default_factory=list)
+    response_history: list[int] = field(default_factory=list)
+
+    # Per-step hashes for period-k cycle detection
+    cycle: CycleState = field(default_factory=CycleState)
+
+    # Limits (from user's plan)
+    max_steps: int = 30
+    max_budget: Decimal = Decimal("10.0")
+    timeout_seconds: int = 120
+
+
+# ============================================================================
+# Binary encoding
+# ============================================================================
+
+def _to_ms(dt: datetime) -> int:
+    return (dt - _EPOCH) // _ONE_MS
+
+
+def _from_ms(ms: int) -> datetime:
+    return _EPOCH + timedelta(milliseconds=ms)
+
+
+def _to_micros(amount: Decimal) -> int:
+    return int((amount * _MICROS).to_integral_value(ROUND_CEILING))
+
+
+def _from_micros(micros: int) -> Decimal:
+    return Decimal(micros).scaleb(-6)
+
+
+def encode_state(state: RunState) -> bytes:
+    """Encode a run state (layout v2)"""
+    prompts = state.prompt_history[-HISTORY_SIZE:]
+    responses = state.response_history[-HISTORY_SIZE:]
+
+    flags = 0
+    if state.loop_detected:
+        flags |= FLAG_LOOP_DETECTED
+    if state.budget_exceeded:
+        flags |= FLAG_BUDGET_EXCEEDED
+
+    parts = [_HEADER.pack(
+        ENCODING_VERSION,
+        _STATUS_CODES[state.status],
+        flags,
+        state.step_count,
+        state.max_steps,
+        state.timeout_seconds,
+        state.total_tokens,
+        _to_micros(state.total_cost),
+        _to_micros(state.max_budget),
+        _to_ms(state.started_at),
+        _to_ms(state.last_activity),
+        len(prompts),
+        len(responses),
+    )]
+
+    for text in (state.team_id, state.user_id, state.agent_id, state.kill_reason):
+        raw = text.encode()
+        if len(raw) > MAX_STRING_BYTES:
+            # Cut on a character boundary
+            raw = raw[:MAX_STRING_BYTES].decode(errors="ignore").encode()
+        parts.append(_STR_LEN.pack(len(raw)))
+        parts.append(raw)
+
+    keep_words_from = len(prompts) - SIMILARITY_WINDOW
+    for i, prompt in enumerate(prompts):
+        words = prompt.words if prompt.words and i >= keep_words_from else ()
+        parts.append(_PROMPT.pack(prompt.exact, prompt.normalized, len(words)))
+        if words:
+            parts.append(struct.pack(f"<{len(words)}I", *words))
+
+    if responses:
+        parts.append(struct.pack(f"<{len(responses)}Q", *responses))
+
+    recent = state.cycle.recent
+    parts.append(bytes((len(recent),)))
+    parts.append(struct.pack(f"<{len(recent)}Q", *recent))
+    parts.append(_CYCLE_MATCHES.pack(*state.cycle.matches))
+
+    return b"".join(parts)
+
+
+def decode_state(run_id: str, data: bytes) -> RunState:
+    """
+    Decode a stored run state (binary, or legacy JSON)
+
+    Raises: ValueError on an unknown encoding version
+    """
+    if data[:1] == b"{":
+        return _decode_legacy_json(json.loads(data))
+
+    if data[0] not in (1, ENCODING_VERSION):
+        raise ValueError(f"Unsupported run state encoding version: {data[0]}")
+
+    (
+        version, status, flags, step_count, max_steps, timeout_seconds,
+        total_tokens, total_cost, max_budget, started_at, last_activity,
+        n_prompts, n_responses,
+    ) = _HEADER.unpack_from(data)
+    offset = _HEADER.size
+
+    strings = []
+    for _ in range(4):
+        (length,) = _STR_LEN.unpack_from(data, offset)
+        offset += _STR_LEN.size
+        strings.append(data[offset:offset + length].decode())
+        offset += length
+    team_id, user_id, agent_id, kill_reason = strings
+
+    prompts = []
+    for _ in range(n_prompts):
+        exact, normalized, n_words = _PROMPT.unpack_from(data, offset)
+        offset += _PROMPT.size
+        words = None
+        if n_words:
+            words = frozenset(struct.unpack_from(f"<{n_words}I", data, offset))
+            offset += 4 * n_words
+        prompts.append(PromptFingerprint(exact, normalized, words))
+
+    responses = list(struct.unpack_from(f"<{n_responses}Q", data, offset)) if n_responses else []
+    offset += 8 * n_responses
+
+    cycle = CycleState()
+    if version >= 2:
+        n_recent = data[offset]
+        offset += 1
+        recent = list(struct.unpack_from(f"<{n_recent}Q", data, offset))
+        offset += 8 * n_recent
+        cycle = CycleState(recent, list(_CYCLE_MATCHES.unpack_from(data, offset)))
+
+    return RunState(
+        run_id=run_id,
+        team_id=team_id,
+        user_id=user_id,
+        agent_id=agent_id,
+        step_count=step_count,
+        total_tokens=total_tokens,
+        total_cost=_from_micros(total_cost),
+        started_at=_from_ms(started_at),
+        last_activity=_from_ms(last_activity),
+        status=STATUSES[status],
+        kill_reason=kill_reason,
+        loop_detected=bool(flags & FLAG_LOOP_DETECTED),
+        budget_exceeded=bool(flags & FLAG_BUDGET_EXCEEDED),
+        prompt_history=prompts,
+        response_history=responses,
+        cycle=cycle,
+        max_steps=max_steps,
+        max_budget=_from_micros(max_budget),
+        timeout_seconds=timeout_seconds,
+    )
+
+
+def _decode_legacy_json(data: dict) -> RunState:
+    """Migrate a JSON-encoded run state (history texts become fingerprints)"""
+    return RunState(
+        run_id=data["run_id"],
+        team_id=data["team_id"],
+        user_id=data["user_id"],
+        agent_id=data.get("agent_id", ""),
+        step_count=data["step_count"],
+        total_tokens=data["total_tokens"],
+        total_cost=Decimal(data["total_cost"]),
+        started_at=datetime.fromisoformat(data["started_at"]),
+        last_activity=datetime.fromisoformat(data["last_activity"]),
+        status=data["status"],
+        kill_reason=data.get("kill_reason", ""),
+        loop_detected=data.get("loop_detected", False),
+        budget_exceeded=data.get("budget_exceeded", False),
+        prompt_history=[PromptFingerprint.from_text(p) for p in data.get("recent_prompts", [])],
+        response_history=[hash_text(r) for r in data.get("recent_responses", [])],
+        max_steps=data.get("max_steps", settings.MAX_STEPS),
+        max_budget=Decimal(data.get("max_budget", "10.0")),
+        timeout_seconds=data.get("timeout_seconds", 120),
+    )
@@ -0,0 +1,184 @@
+"""
+Run Summary Aggregator - coalesced run_summary writes
+
+Live run dashboards need per-run totals, but one row per step would be the
+request log again. Each worker instead keeps running totals per run in
+memory (steps, tokens, cost, latency, flags and status) and, every
+RUN_SUMMARY_FLUSH_INTERVAL, writes one snapshot row for every run that
+changed since the last flush: many steps collapse into one row per run
+per interval.
+
+A run's steps can land on several workers, so every in-memory accumulation
+has its own segment_id. run_summary (ReplacingMergeTree) keeps the latest
+row per (team_id, run_id, segment_id) and the run_summary_totals view sums
+the segments of a run. Runs that go quiet are dropped from memory after
+their last snapshot; if one resumes it starts a new segment.
+
+A failed flush loses nothing: the totals stay in memory and the next
+flush writes their latest state.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+
+from config import settings
+from services.clickhouse_client import RequestLog, RunSummary, clickhouse_client
+from services.metrics import RUN_SUMMARY_FLUSHED, RUN_SUMMARY_TRACKED
+from services.run_state import RunState
+
+logger = logging.getLogger(__name__)
+
+
+class RunTotals:
+    """One worker's running totals for one run (one segment)"""
+
+    __slots__ = ("summary", "last_change", "dirty")
+
+    def __init__(self, summary: RunSummary, now: float):
+        self.summary = summary
+        self.last_change = now
+        self.dirty = True
+
+
+class RunSummaryAggregator:
+    """Per-worker run totals, flushed to run_summary in batches"""
+
+    def __init__(self, max_runs: int, idle_seconds: float):
+        self.max_runs = max_runs
+        self.idle_seconds = idle_seconds
+        # Segment ids: unique per process, then per accumulation
+        self._prefix = uuid.uuid4().hex[:12]
+        self._segments = itertools.count(1)
+        self._runs: OrderedDict[str, RunTotals] = OrderedDict()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    @property
+    def pending(self) -> int:
+        """Runs changed since the last flush"""
+        return sum(1 for totals in self._runs.values() if totals.dirty)
+
+    def _totals(self, run_id: str, team_id: str, user_id: str) -> RunTotals:
+        now = time.monotonic()
+        totals = self._runs.get(run_id)
+        if totals is None:
+            totals = self._runs[run_id] = RunTotals(RunSummary(
+                run_id=run_id,
+                team_id=team_id,
+                user_id=user_id,
+                segment_id=f"{self._prefix}-{next(self._segments)}",
+                started_at=datetime.utcnow(),
+            ), now)
+            RUN_SUMMARY_TRACKED.set(len(self._runs))
+        else:
+            self._runs.move_to_end(run_id)
+            totals.last_change = now
+            totals.dirty = True
+        return totals
+
+    def record_step(self, log: RequestLog):
+        """Add one logged step to its run's totals"""
+        summary = self._totals(log.run_id, log.team_id, log.user_id).summary
+        summary.total_steps += 1
+        summary.total_tokens += log.prompt_tokens + log.completion_tokens
+        summary.total_cost_usd += Decimal(log.cost_usd)
+        summary.total_latency_ms += log.latency_ms
+        summary.loop_detected = summary.loop_detected or log.loop_detected
+        summary.dlp_triggered = summary.dlp_triggered or log.dlp_triggered
+        if log.agent_id:
+            summary.agent_id = log.agent_id
+
+    def record_state(self, state: RunState):
+        """Take status and flags from a run state (e.g. when it is killed)"""
+        summary = self._totals(state.run_id, state.team_id, state.user_id).summary
+        summary.started_at = min(summary.started_at, state.started_at)
+        summary.status = state.status
+        summary.kill_reason = state.kill_reason
+        summary.loop_detected = summary.loop_detected or state.loop_detected
+        summary.budget_exceeded = summary.budget_exceeded or state.budget_exceeded
+        if state.agent_id:
+            summary.agent_id = state.agent_id
+
+    def _evict(self, now: float):
+        """Drop flushed runs that went quiet (and the oldest beyond max_runs)"""
+        excess = len(self._runs) - self.max_runs
+        for run_id in list(self._runs):
+            totals = self._runs[run_id]
+            if totals.dirty:
+                continue
+            if excess > 0 or now - totals.last_change > self.idle_seconds:
+                del self._runs[run_id]
+                excess -= 1
+            else:
+                # Ordered by last change: the rest are more recent
+                break
+        RUN_SUMMARY_TRACKED.set(len(self._runs))
+
+    async def flush(self) -> int:
+        """
+        Write a snapshot of every run changed since the last flush
+
+        Returns: number of rows written
+        """
+        async with self._flush_lock:
+            changed = [totals for totals in self._runs.values() if totals.dirty]
+            if not changed:
+                self._evict(time.monotonic())
+                return 0
+            for totals in changed:
+                totals.dirty = False
+            # Copies: steps recorded during the insert go to the next flush
+            rows = [RunSummary(**vars(totals.summary)) for totals in changed]
+
+            try:
+                await clickhouse_client.insert_run_summaries(rows)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(rows)} run summaries: {e}")
+                for totals in changed:
+                    totals.dirty = True
+                return 0
+
+            RUN_SUMMARY_FLUSHED.inc(len(rows))
+            self._evict(time.monotonic())
+            return len(rows)
+
+    async def start(self):
+        """Start the background flush task"""
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop and write the final snapshots"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(settings.RUN_SUMMARY_FLUSH_INTERVAL)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Run summary flush loop error: {e}")
+
+
+# Singleton instance (per worker process)
+run_summaries = RunSummaryAggregator(
+    max_runs=settings.RUN_SUMMARY_MAX_RUNS,
+    idle_seconds=settings.RUN_SUMMARY_IDLE_SECONDS,
+)
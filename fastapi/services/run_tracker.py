@@ -8,62 +8,49 @@ This is what differentiates us from LiteLLM/Portkey:
 Key capabilities:
 - Step counting (detect infinite loops)
 - Budget tracking per run
-- Kill switch (stop runaway agents)
+- Kill switch (stop runaway agents, including in-flight streams)
 - Run replay (debug agent behavior)
+
+Redis is the source of truth. While it is unreachable, each worker keeps
+enforcing limits from a bounded local store (LRU + TTL) and writes the
+runs it touched back to Redis once it reconnects (write-behind).
 """
 
 import asyncio
 import json
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+from typing import Optional, Sequence
 from dataclasses import dataclass, field
 from decimal import Decimal
 
 import redis.asyncio as redis
+from redis.exceptions import NoScriptError
 
 from config import settings
+from services.loop_detector import PromptFingerprint, hash_text, step_hash
+from services.metrics import REDIS_ROUND_TRIPS
+from services.rate_limiter import (
+    GCRA_SCRIPT,
+    GCRA_SHA,
+    RateLimit,
+    RateLimitResult,
+    rate_limiter,
+)
+from services.run_state import HISTORY_SIZE, RunState, decode_state, encode_state
+from services.run_summary import run_summaries
+from services.stream_registry import stream_registry
+from services.tool_calls import ToolCall, ToolCallViolation, check_tool_counts
 
 logger = logging.getLogger(__name__)
 
+# Errors that mean "Redis is unreachable" (switch to the local store)
+REDIS_ERRORS = (redis.RedisError, OSError, asyncio.TimeoutError)
 
-@dataclass
-class RunState:
-    """Current state of an agent run"""
-    run_id: str
-    team_id: str
-    user_id: str
-    agent_id: str = ""
-    
-    # Counters
-    step_count: int = 0
-    total_tokens: int = 0
-    total_cost: Decimal = Decimal("0")
-    
-    # Budget tracking
-    daily_cost: Decimal = Decimal("0")
-    monthly_cost: Decimal = Decimal("0")
-    
-    # Timing
-    started_at: datetime = field(default_factory=datetime.utcnow)
-    last_activity: datetime = field(default_factory=datetime.utcnow)
-    
-    # Status
-    status: str = "running"  # running, completed, failed, killed
-    kill_reason: str = ""
-    
-    # Flags
-    loop_detected: bool = False
-    budget_exceeded: bool = False
-    
-    # History for loop detection (last N prompts)
-    recent_prompts: list[str] = field(default_factory=list)
-    recent_responses: list[str] = field(default_factory=list)
-    
-    # Limits (from user's plan)
-    max_steps: int = 30
-    max_budget: Decimal = Decimal("10.0")
-    timeout_seconds: int = 120
+# Pub/sub channel for kill events (all workers subscribe)
+KILL_CHANNEL = "agentwall:kill"
 
 
 @dataclass
@@ -73,6 +60,262 @@ class StepResult:
     reason: str = ""
     step_number: int = 0
     warnings: list[str] = field(default_factory=list)
+    tool_violation: Optional[ToolCallViolation] = None
+    rate_limit: Optional[RateLimitResult] = None
+
+
+@dataclass
+class StepCompletion:
+    """What a finished step adds to its run (applied by complete_steps)"""
+    run_id: str
+    tokens: int = 0
+    cost: Decimal = Decimal("0")
+    response: str = ""
+    prompt: str = ""
+    loop_detected: bool = False
+    # Completion tokens charged to the token rate limits
+    rate_limits: Sequence[RateLimit] = ()
+    charged_tokens: int = 0
+
+    def apply(self, state: RunState):
+        state.total_tokens += self.tokens
+        state.total_cost += self.cost
+        state.last_activity = datetime.utcnow()
+        
+        # Store prompt fingerprint for future loop detection
+        if self.prompt:
+            state.prompt_history.append(PromptFingerprint.from_text(self.prompt[:500]))
+            state.prompt_history = state.prompt_history[-HISTORY_SIZE:]
+        
+        if self.response:
+            state.response_history.append(hash_text(self.response[:500]))
+            state.response_history = state.response_history[-HISTORY_SIZE:]
+        
+        if self.loop_detected:
+            state.loop_detected = True
+
+
+# ============================================================================
+# Local fallback store (per worker)
+# ============================================================================
+
+class LocalRunRecord:
+    """Compact in-memory copy of a RunState (history in ring buffers)"""
+
+    __slots__ = (
+        "run_id", "team_id", "user_id", "agent_id",
+        "step_count", "total_tokens", "total_cost",
+        "started_at", "last_activity",
+        "status", "kill_reason", "loop_detected", "budget_exceeded",
+        "prompt_history", "response_history", "cycle",
+        "max_steps", "max_budget", "timeout_seconds",
+        "expires_at", "dirty", "version",
+    )
+
+    def __init__(self, state: RunState, expires_at: float, dirty: bool):
+        self.prompt_history: deque[PromptFingerprint] = deque(maxlen=HISTORY_SIZE)
+        self.response_history: deque[int] = deque(maxlen=HISTORY_SIZE)
+        self.version = 0
+        self.update(state, expires_at, dirty)
+
+    def update(self, state: RunState, expires_at: float, dirty: bool):
+        """Overwrite the record from a RunState"""
+        self.run_id = state.run_id
+        self.team_id = state.team_id
+        self.user_id = state.user_id
+        self.agent_id = state.agent_id
+        self.step_count = state.step_count
+        self.total_tokens = state.total_tokens
+        self.total_cost = state.total_cost
+        self.started_at = state.started_at
+        self.last_activity = state.last_activity
+        self.status = state.status
+        self.kill_reason = state.kill_reason
+        self.loop_detected = state.loop_detected
+        self.budget_exceeded = state.budget_exceeded
+        self.max_steps = state.max_steps
+        self.max_budget = state.max_budget
+        self.timeout_seconds = state.timeout_seconds
+        self.prompt_history.clear()
+        self.prompt_history.extend(state.prompt_history)
+        self.response_history.clear()
+        self.response_history.extend(state.response_history)
+        self.cycle = state.cycle.copy()
+        self.expires_at = expires_at
+        self.dirty = dirty
+        self.version += 1
+
+    def to_state(self) -> RunState:
+        """Materialize a RunState (fresh object, safe to mutate)"""
+        return RunState(
+            run_id=self.run_id,
+            team_id=self.team_id,
+            user_id=self.user_id,
+            agent_id=self.agent_id,
+            step_count=self.step_count,
+            total_tokens=self.total_tokens,
+            total_cost=self.total_cost,
+            started_at=self.started_at,
+            last_activity=self.last_activity,
+            status=self.status,
+            kill_reason=self.kill_reason,
+            loop_detected=self.loop_detected,
+            budget_exceeded=self.budget_exceeded,
+            prompt_history=list(self.prompt_history),
+            response_history=list(self.response_history),
+            cycle=self.cycle.copy(),
+            max_steps=self.max_steps,
+            max_budget=self.max_budget,
+            timeout_seconds=self.timeout_seconds,
+        )
+
+
+class LocalRunStore:
+    """
+    Bounded LRU + TTL store of run states
+
+    - OrderedDict as LRU: hits move to the end, overflow evicts the front
+    - TTL checked lazily on access (same TTL as the Redis keys)
+    - Records written while Redis is down are dirty until written back
+
+    Not shared between workers: during an outage a run spread over N
+    workers can get up to N times its step budget (accepted degraded mode).
+    """
+
+    def __init__(self, max_runs: int, ttl_seconds: int):
+        self.max_runs = max_runs
+        self.ttl_seconds = ttl_seconds
+        self._records: OrderedDict[str, LocalRunRecord] = OrderedDict()
+        self.evictions = 0
+        self.dirty_evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, run_id: str) -> Optional[RunState]:
+        """Get a run state (None if unknown or expired)"""
+        record = self._records.get(run_id)
+        if record is None:
+            return None
+        if record.expires_at <= time.monotonic():
+            del self._records[run_id]
+            return None
+        self._records.move_to_end(run_id)
+        return record.to_state()
+
+    def put(self, state: RunState, dirty: bool = False):
+        """
+        Insert or update a run state
+
+        Args:
+            dirty: True if Redis has not seen this write yet. A clean write
+                   never clears a pending write-behind (use mark_clean).
+        """
+        expires_at = time.monotonic() + self.ttl_seconds
+        record = self._records.get(state.run_id)
+        if record is None:
+            self._records[state.run_id] = LocalRunRecord(state, expires_at, dirty)
+        else:
+            record.update(state, expires_at, dirty or record.dirty)
+            self._records.move_to_end(state.run_id)
+
+        while len(self._records) > self.max_runs:
+            _, evicted = self._records.popitem(last=False)
+            self.evictions += 1
+            if evicted.dirty:
+                self.dirty_evictions += 1
+
+    def dirty_run_ids(self) -> list[str]:
+        """Runs with writes Redis has not seen yet"""
+        return [run_id for run_id, record in self._records.items() if record.dirty]
+
+    def version(self, run_id: str) -> int:
+        """Write counter of a record (0 if absent)"""
+        record = self._records.get(run_id)
+        return record.version if record else 0
+
+    def mark_clean(self, run_id: str, version: int, state: RunState):
+        """
+        Record that Redis now holds `state` for this run
+
+        Ignored if the record was written again since `version` was read:
+        that newer write is still pending.
+        """
+        record = self._records.get(run_id)
+        if record is None or record.version != version:
+            return
+        record.update(state, record.expires_at, dirty=False)
+
+
+class LocalToolCounters:
+    """
+    Per-run tool-call counters used while Redis is down (LRU-bounded)
+
+    Not written back: after an outage the Redis counters only miss the
+    calls made during it, which can only delay a cap, never trip one.
+    """
+
+    def __init__(self, max_runs: int):
+        self.max_runs = max_runs
+        self._counters: OrderedDict[str, Counter] = OrderedDict()
+
+    def incr(self, run_id: str, increments: Counter) -> dict[bytes, int]:
+        """Add increments, return the updated values of those fields"""
+        counters = self._counters.get(run_id)
+        if counters is None:
+            counters = self._counters[run_id] = Counter()
+            while len(self._counters) > self.max_runs:
+                self._counters.popitem(last=False)
+        else:
+            self._counters.move_to_end(run_id)
+        counters.update(increments)
+        return {key: counters[key] for key in increments}
+
+
+def merge_states(remote: RunState, local: RunState) -> RunState:
+    """
+    Reconcile a run that advanced locally while Redis was down
+
+    Counters take the max of both sides (never forget what either side
+    enforced), a kill on either side wins, and history comes from the side
+    with the most recent activity.
+    """
+    newer = local if local.last_activity >= remote.last_activity else remote
+
+    merged = RunState(
+        run_id=remote.run_id,
+        team_id=remote.team_id,
+        user_id=remote.user_id,
+        agent_id=remote.agent_id or local.agent_id,
+        step_count=max(remote.step_count, local.step_count),
+        total_tokens=max(remote.total_tokens, local.total_tokens),
+        total_cost=max(remote.total_cost, local.total_cost),
+        started_at=min(remote.started_at, local.started_at),
+        last_activity=newer.last_activity,
+        status=newer.status,
+        kill_reason=newer.kill_reason,
+        loop_detected=remote.loop_detected or local.loop_detected,
+        budget_exceeded=remote.budget_exceeded or local.budget_exceeded,
+        prompt_history=list(newer.prompt_history),
+        response_history=list(newer.response_history),
+        cycle=newer.cycle.copy(),
+        max_steps=remote.max_steps,
+        max_budget=remote.max_budget,
+        timeout_seconds=remote.timeout_seconds,
+    )
+
+    for side in (remote, local):
+        if side.status == "killed":
+            merged.status = "killed"
+            merged.kill_reason = side.kill_reason
+            break
+
+    return merged
+
+
+# ============================================================================
+# Run tracker
+# ============================================================================
 
 
 class RunTracker:
@@ -83,19 +326,26 @@ class RunTracker:
     - Redis for fast state access (<1ms)
     - TTL on keys to auto-cleanup old runs
     - Atomic operations for step counting
+    - Local LRU store keeps governance alive while Redis is down
     """
     
     def __init__(self):
         self._redis: Optional[redis.Redis] = None
         self._connected = False
+        self._local = LocalRunStore(
+            max_runs=settings.LOCAL_RUN_STORE_MAX_RUNS,
+            ttl_seconds=settings.RUN_STATE_TTL_SECONDS,
+        )
+        self._local_tool_counts = LocalToolCounters(settings.LOCAL_RUN_STORE_MAX_RUNS)
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._kill_listener_task: Optional[asyncio.Task] = None
     
     async def connect(self):
         """Connect to Redis"""
         try:
+            # Raw bytes: run state uses a binary encoding (services.run_state)
             self._redis = redis.from_url(
                 settings.REDIS_URL,
-                encoding="utf-8",
-                decode_responses=True,
                 max_connections=settings.REDIS_MAX_CONNECTIONS,
             )
             await self._redis.ping()
@@ -104,46 +354,286 @@ class RunTracker:
         except Exception as e:
             logger.warning(f"Redis connection failed (run tracking will use in-memory fallback): {e}")
             self._connected = False
+            self._start_reconnect()
+        
+        if self._redis is not None and self._kill_listener_task is None:
+            self._kill_listener_task = asyncio.create_task(self._kill_listener())
     
     async def disconnect(self):
         """Disconnect from Redis"""
+        for task in (self._reconnect_task, self._kill_listener_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._reconnect_task = None
+        self._kill_listener_task = None
         if self._redis:
             await self._redis.close()
             self._connected = False
     
+    async def ping(self, timeout: float) -> float:
+        """
+        Ping Redis over the pooled connections (health monitor)
+        
+        Returns: round-trip time in ms; raises when Redis is unreachable
+        """
+        if self._redis is None:
+            raise ConnectionError("Redis client not initialized")
+        REDIS_ROUND_TRIPS.inc()
+        start = time.perf_counter()
+        await asyncio.wait_for(self._redis.ping(), timeout)
+        return (time.perf_counter() - start) * 1000
+    
+    @property
+    def redis(self) -> Optional[redis.Redis]:
+        """The pooled client, shared with the health monitor (None before connect())"""
+        return self._redis
+    
     def _run_key(self, run_id: str) -> str:
         return f"agentwall:run:{run_id}"
     
-    async def get_or_create_run(
+    def _tools_key(self, run_id: str) -> str:
+        return f"agentwall:run:{run_id}:tools"
+    
+    # ------------------------------------------------------------------
+    # Redis outage handling
+    # ------------------------------------------------------------------
+    
+    def _on_redis_error(self, e: Exception):
+        """Switch to the local store and start reconnecting"""
+        if self._connected:
+            logger.warning(f"Redis unavailable, run tracking degraded to local store: {e}")
+        self._connected = False
+        self._start_reconnect()
+    
+    def _start_reconnect(self):
+        if self._redis is None:
+            return
+        if self._reconnect_task and not self._reconnect_task.done():
+            return
+        try:
+            self._reconnect_task = asyncio.create_task(self._reconnect_loop())
+        except RuntimeError:
+            # No running loop (e.g. called from sync code); retried on next error
+            self._reconnect_task = None
+    
+    async def _reconnect_loop(self):
+        """Ping Redis until it is back, then write back local changes"""
+        while not self._connected:
+            await asyncio.sleep(settings.REDIS_RECONNECT_INTERVAL)
+            try:
+                REDIS_ROUND_TRIPS.inc()
+                await self._redis.ping()
+                # Flush while requests still use the local store, switch over,
+                # then flush whatever was written in between
+                await self.reconcile()
+                self._connected = True
+                await self.reconcile()
+            except REDIS_ERRORS as e:
+                self._connected = False
+                logger.debug(f"Redis still unavailable: {e}")
+                continue
+            
+            logger.info("Redis reachable again, run tracking back on Redis")
+    
+    async def reconcile(self) -> int:
+        """
+        Write-behind: push runs modified while Redis was down
+        
+        Each dirty run is merged with whatever Redis holds (another worker
+        may have advanced it) so no enforced counter goes backwards.
+        Raises on Redis errors; unflushed runs stay dirty.
+        
+        Returns: number of runs written back
+        """
+        written = 0
+        for run_id in self._local.dirty_run_ids():
+            version = self._local.version(run_id)
+            local = self._local.get(run_id)
+            if local is None:
+                continue
+            remote = await self._load_remote(run_id)
+            merged = merge_states(remote, local) if remote else local
+            await self._write_remote(merged)
+            self._local.mark_clean(run_id, version, merged)
+            written += 1
+        
+        if written:
+            logger.info(f"Reconciled {written} runs with Redis")
+        return written
+    
+    # ------------------------------------------------------------------
+    # State access
+    # ------------------------------------------------------------------
+    
+    async def _load_remote(self, run_id: str) -> Optional[RunState]:
+        REDIS_ROUND_TRIPS.inc()
+        data = await self._redis.get(self._run_key(run_id))
+        if not data:
+            return None
+        return decode_state(run_id, data)
+    
+    async def _write_remote(self, state: RunState):
+        # TTL: 24 hours after last activity
+        REDIS_ROUND_TRIPS.inc()
+        await self._redis.setex(
+            self._run_key(state.run_id),
+            settings.RUN_STATE_TTL_SECONDS,
+            encode_state(state),
+        )
+    
+    async def _run_gcra(self, limits: Sequence[RateLimit], force: bool = False, get_key: Optional[str] = None):
+        """
+        Run the GCRA script, optionally pipelined with a GET (one round trip)
+        
+        The script is loaded on NOSCRIPT (once per Redis restart).
+        Returns: pipeline results (script reply first)
+        """
+        keys, args = rate_limiter.script_args(limits, force=force)
+        for attempt in range(2):
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.evalsha(GCRA_SHA, len(keys), *keys, *args)
+            if get_key:
+                pipe.get(get_key)
+            REDIS_ROUND_TRIPS.inc()
+            results = await pipe.execute(raise_on_error=False)
+            if isinstance(results[0], NoScriptError) and attempt == 0:
+                REDIS_ROUND_TRIPS.inc()
+                await self._redis.script_load(GCRA_SCRIPT)
+                continue
+            for item in results:
+                if isinstance(item, Exception):
+                    raise item
+            return results
+    
+    async def _load_for_admission(
+        self, run_id: str, rate_limits: Sequence[RateLimit]
+    ) -> tuple[Optional[RunState], Optional[RateLimitResult]]:
+        """Load run state and apply rate limits (Redis: one pipelined round trip)"""
+        if not rate_limits:
+            return await self._load_state(run_id), None
+        
+        if self._connected:
+            try:
+                reply, data = await self._run_gcra(rate_limits, get_key=self._run_key(run_id))
+                state = decode_state(run_id, data) if data else None
+                return state, rate_limiter.parse(rate_limits, reply)
+            except REDIS_ERRORS as e:
+                self._on_redis_error(e)
+        
+        return self._local.get(run_id), rate_limiter.check_local(rate_limits)
+    
+    async def charge_tokens(self, rate_limits: Sequence[RateLimit], tokens: int):
+        """Charge tokens known after the response (never rejected)"""
+        await self.charge_tokens_batch([(rate_limits, tokens)])
+    
+    async def charge_tokens_batch(self, charges: Sequence[tuple[Sequence[RateLimit], int]]):
+        """
+        Charge several responses' tokens (one pipelined round trip)
+        
+        Each charge keeps its own script call, so caps apply per response
+        exactly as if they were charged one by one.
+        """
+        groups = []
+        for rate_limits, tokens in charges:
+            limits = [
+                RateLimit(limit.scope, limit.kind, limit.key, limit.limit, limit.period_ms, cost=tokens)
+                for limit in rate_limits
+                if limit.kind == "tokens"
+            ]
+            if limits and tokens > 0:
+                groups.append(limits)
+        if not groups:
+            return
+        
+        if self._connected:
+            try:
+                await self._charge_remote(groups)
+                return
+            except REDIS_ERRORS as e:
+                self._on_redis_error(e)
+        
+        for limits in groups:
+            rate_limiter.check_local(limits, force=True)
+    
+    async def _charge_remote(self, groups: list[list[RateLimit]]):
+        """Forced GCRA charges, pipelined; only calls that hit NOSCRIPT are retried"""
+        for attempt in range(2):
+            pipe = self._redis.pipeline(transaction=False)
+            for limits in groups:
+                keys, args = rate_limiter.script_args(limits, force=True)
+                pipe.evalsha(GCRA_SHA, len(keys), *keys, *args)
+            REDIS_ROUND_TRIPS.inc()
+            results = await pipe.execute(raise_on_error=False)
+            retry = [limits for limits, item in zip(groups, results) if isinstance(item, NoScriptError)]
+            for item in results:
+                if isinstance(item, Exception) and not isinstance(item, NoScriptError):
+                    raise item
+            if not retry:
+                return
+            if attempt == 0:
+                REDIS_ROUND_TRIPS.inc()
+                await self._redis.script_load(GCRA_SCRIPT)
+                groups = retry
+        raise NoScriptError("GCRA script could not be loaded")
+    
+    async def _load_states(self, run_ids: Sequence[str]) -> dict[str, RunState]:
+        """Load several runs (Redis: one MGET), or from the local store if Redis is down"""
+        if self._connected:
+            try:
+                REDIS_ROUND_TRIPS.inc()
+                values = await self._redis.mget([self._run_key(run_id) for run_id in run_ids])
+                return {
+                    run_id: decode_state(run_id, data)
+                    for run_id, data in zip(run_ids, values)
+                    if data
+                }
+            except REDIS_ERRORS as e:
+                self._on_redis_error(e)
+        states = {run_id: self._local.get(run_id) for run_id in run_ids}
+        return {run_id: state for run_id, state in states.items() if state is not None}
+    
+    async def _save_states(self, states: Sequence[RunState]):
+        """Save several runs (Redis: one pipelined round trip), see _save_state"""
+        for state in states:
+            run_summaries.record_state(state)
+        if self._connected:
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for state in states:
+                    pipe.setex(self._run_key(state.run_id), settings.RUN_STATE_TTL_SECONDS, encode_state(state))
+                REDIS_ROUND_TRIPS.inc()
+                await pipe.execute()
+                for state in states:
+                    self._local.put(state)
+                return
+            except REDIS_ERRORS as e:
+                self._on_redis_error(e)
+        
+        for state in states:
+            self._local.put(state, dirty=True)
+    
+    async def _load_state(self, run_id: str) -> Optional[RunState]:
+        """Load run state from Redis, or the local store if Redis is down"""
+        if self._connected:
+            try:
+                return await self._load_remote(run_id)
+            except REDIS_ERRORS as e:
+                self._on_redis_error(e)
+        return self._local.get(run_id)
+    
+    def _new_state(
         self,
         run_id: str,
         team_id: str,
         user_id: str,
-        agent_id: str = "",
-        limits: Optional[dict] = None,
+        agent_id: str,
+        limits: Optional[dict],
     ) -> RunState:
-        """Get existing run or create new one"""
-        if not self._connected:
-            # Fallback: return new state without persistence
-            return RunState(
-                run_id=run_id,
-                team_id=team_id,
-                user_id=user_id,
-                agent_id=agent_id,
-                max_steps=limits.get("max_steps", settings.MAX_STEPS) if limits else settings.MAX_STEPS,
-                max_budget=Decimal(str(limits.get("daily_budget", 10.0))) if limits else Decimal("10.0"),
-            )
-        
-        key = self._run_key(run_id)
-        
-        # Try to get existing run
-        data = await self._redis.get(key)
-        if data:
-            state_dict = json.loads(data)
-            return self._dict_to_state(state_dict)
-        
-        # Create new run
-        state = RunState(
+        return RunState(
             run_id=run_id,
             team_id=team_id,
             user_id=user_id,
@@ -151,65 +641,36 @@ class RunTracker:
             max_steps=limits.get("max_steps", settings.MAX_STEPS) if limits else settings.MAX_STEPS,
             max_budget=Decimal(str(limits.get("daily_budget", 10.0))) if limits else Decimal("10.0"),
         )
+    
+    async def get_or_create_run(
+        self,
+        run_id: str,
+        team_id: str,
+        user_id: str,
+        agent_id: str = "",
+        limits: Optional[dict] = None,
+    ) -> RunState:
+        """Get existing run or create new one"""
+        state = await self._load_state(run_id)
+        if state:
+            return state
         
+        state = self._new_state(run_id, team_id, user_id, agent_id, limits)
         await self._save_state(state)
         return state
 
     async def _save_state(self, state: RunState):
-        """Save run state to Redis"""
-        if not self._connected:
-            return
+        """Save run state to Redis (local store keeps a copy for outages)"""
+        run_summaries.record_state(state)
+        if self._connected:
+            try:
+                await self._write_remote(state)
+                self._local.put(state)
+                return
+            except REDIS_ERRORS as e:
+                self._on_redis_error(e)
         
-        key = self._run_key(state.run_id)
-        data = self._state_to_dict(state)
-        
-        # TTL: 24 hours after last activity
-        ttl = 86400  # 24 hours
-        await self._redis.setex(key, ttl, json.dumps(data))
-    
-    def _state_to_dict(self, state: RunState) -> dict:
-        return {
-            "run_id": state.run_id,
-            "team_id": state.team_id,
-            "user_id": state.user_id,
-            "agent_id": state.agent_id,
-            "step_count": state.step_count,
-            "total_tokens": state.total_tokens,
-            "total_cost": str(state.total_cost),
-            "started_at": state.started_at.isoformat(),
-            "last_activity": state.last_activity.isoformat(),
-            "status": state.status,
-            "kill_reason": state.kill_reason,
-            "loop_detected": state.loop_detected,
-            "budget_exceeded": state.budget_exceeded,
-            "recent_prompts": state.recent_prompts[-5:],  # Keep last 5
-            "recent_responses": state.recent_responses[-5:],
-            "max_steps": state.max_steps,
-            "max_budget": str(state.max_budget),
-            "timeout_seconds": state.timeout_seconds,
-        }
-    
-    def _dict_to_state(self, data: dict) -> RunState:
-        return RunState(
-            run_id=data["run_id"],
-            team_id=data["team_id"],
-            user_id=data["user_id"],
-            agent_id=data.get("agent_id", ""),
-            step_count=data["step_count"],
-            total_tokens=data["total_tokens"],
-            total_cost=Decimal(data["total_cost"]),
-            started_at=datetime.fromisoformat(data["started_at"]),
-            last_activity=datetime.fromisoformat(data["last_activity"]),
-            status=data["status"],
-            kill_reason=data.get("kill_reason", ""),
-            loop_detected=data.get("loop_detected", False),
-            budget_exceeded=data.get("budget_exceeded", False),
-            recent_prompts=data.get("recent_prompts", []),
-            recent_responses=data.get("recent_responses", []),
-            max_steps=data.get("max_steps", settings.MAX_STEPS),
-            max_budget=Decimal(data.get("max_budget", "10.0")),
-            timeout_seconds=data.get("timeout_seconds", 120),
-        )
+        self._local.put(state, dirty=True)
     
     async def process_step(
         self,
@@ -219,6 +680,8 @@ class RunTracker:
         agent_id: str = "",
         prompt: str = "",
         limits: Optional[dict] = None,
+        tool_calls: Sequence[ToolCall] = (),
+        rate_limits: Sequence[RateLimit] = (),
     ) -> tuple[RunState, StepResult]:
         """
         Process a new step in the run
@@ -226,13 +689,30 @@ class RunTracker:
         Returns: (updated state, step result with allowed/denied)
         
         This is the CORE governance logic:
+        0. Rate limits (per-worker pre-check, then GCRA in the same Redis
+           round trip as the state load)
         1. Check if run is killed
         2. Check step limit
         3. Check timeout
-        4. Increment step counter
+        4. Check budget
+        5. Count tool calls (per-tool cap, repeated arguments)
+        6. Increment step counter, record the step hash (cycle detection)
         """
-        state = await self.get_or_create_run(run_id, team_id, user_id, agent_id, limits)
-        result = StepResult(step_number=state.step_count + 1)
+        denied = rate_limiter.precheck(rate_limits) if rate_limits else None
+        if denied:
+            new_state = self._new_state(run_id, team_id, user_id, agent_id, limits)
+            return new_state, StepResult(allowed=False, reason=denied.reason, rate_limit=denied)
+        
+        state, rate = await self._load_for_admission(run_id, rate_limits)
+        if state is None:
+            # Saved below with the step (every path that admits writes it)
+            state = self._new_state(run_id, team_id, user_id, agent_id, limits)
+        result = StepResult(step_number=state.step_count + 1, rate_limit=rate)
+        
+        if rate and not rate.allowed:
+            result.allowed = False
+            result.reason = rate.reason
+            return state, result
         
         # Check 1: Is run already killed?
         if state.status == "killed":
@@ -269,9 +749,29 @@ class RunTracker:
             await self._save_state(state)
             return state, result
         
+        # Check 5: Tool-call caps (one extra Redis round trip, only with tool calls)
+        if tool_calls:
+            counts = await self.record_tool_calls(run_id, tool_calls)
+            violation = check_tool_counts(
+                tool_calls,
+                counts,
+                max_calls_per_tool=(limits or {}).get("max_tool_calls", settings.MAX_TOOL_CALLS),
+                repeat_limit=settings.TOOL_REPEAT_LIMIT,
+            )
+            if violation:
+                result.allowed = False
+                result.reason = violation.message
+                result.tool_violation = violation
+                state.status = "killed"
+                state.kill_reason = f"{violation.pattern_type}:{violation.tool_name}"
+                state.loop_detected = True
+                await self._save_state(state)
+                return state, result
+        
         # All checks passed - increment step
         state.step_count += 1
         state.last_activity = datetime.utcnow()
+        state.cycle.push(step_hash(prompt, [call.digest for call in tool_calls]))
         
         # NOTE: Prompt is NOT added here - it's added in complete_step()
         # This allows loop detection to compare against PREVIOUS prompts only
@@ -283,6 +783,34 @@ class RunTracker:
         await self._save_state(state)
         return state, result
     
+    async def record_tool_calls(self, run_id: str, calls: Sequence[ToolCall]) -> dict[bytes, int]:
+        """
+        Count a step's tool calls in the run's counter hash
+        
+        One pipelined round trip: HINCRBY per distinct field plus EXPIRE.
+        
+        Returns: updated count of every per-tool and per-arguments field touched
+        """
+        increments = Counter()
+        for call in calls:
+            increments[call.tool_field] += 1
+            increments[call.args_field] += 1
+        
+        if self._connected:
+            try:
+                key = self._tools_key(run_id)
+                pipe = self._redis.pipeline(transaction=False)
+                for field_name, amount in increments.items():
+                    pipe.hincrby(key, field_name, amount)
+                pipe.expire(key, settings.RUN_STATE_TTL_SECONDS)
+                REDIS_ROUND_TRIPS.inc()
+                values = await pipe.execute()
+                return dict(zip(increments, values))
+            except REDIS_ERRORS as e:
+                self._on_redis_error(e)
+        
+        return self._local_tool_counts.incr(run_id, increments)
+    
     async def complete_step(
         self,
         run_id: str,
@@ -293,61 +821,103 @@ class RunTracker:
         loop_detected: bool = False,
     ):
         """Update run after step completion"""
-        if not self._connected:
-            return
+        await self.complete_steps([StepCompletion(
+            run_id=run_id,
+            tokens=tokens,
+            cost=cost,
+            response=response,
+            prompt=prompt,
+            loop_detected=loop_detected,
+        )])
+    
+    async def complete_steps(self, steps: Sequence[StepCompletion]):
+        """
+        Apply completed steps to their runs, in order (batched)
         
-        key = self._run_key(run_id)
-        data = await self._redis.get(key)
-        if not data:
+        Every run is loaded in one round trip and written back in one, and
+        the token charges share a third.
+        """
+        if not steps:
             return
+        run_ids = list(dict.fromkeys(step.run_id for step in steps))
+        states = await self._load_states(run_ids)
+        for step in steps:
+            state = states.get(step.run_id)
+            if state is not None:
+                step.apply(state)
+        if states:
+            await self._save_states(list(states.values()))
+        await self.charge_tokens_batch([
+            (step.rate_limits, step.charged_tokens) for step in steps if step.rate_limits
+        ])
+    
+    async def kill_run(self, run_id: str, reason: str) -> bool:
+        """
+        Kill a run (stop all future requests)
         
-        state = self._dict_to_state(json.loads(data))
-        state.total_tokens += tokens
-        state.total_cost += cost
-        state.last_activity = datetime.utcnow()
-        
-        # Store prompt for future loop detection
-        if prompt:
-            state.recent_prompts.append(prompt[:500])
-            state.recent_prompts = state.recent_prompts[-5:]
-        
-        if response:
-            state.recent_responses.append(response[:500])
-            state.recent_responses = state.recent_responses[-5:]
-        
-        if loop_detected:
-            state.loop_detected = True
+        In-flight streams of the run are aborted on this worker right away
+        and on every other worker via the kill channel.
         
-        await self._save_state(state)
-    
-    async def kill_run(self, run_id: str, reason: str):
-        """Kill a run (stop all future requests)"""
-        if not self._connected:
-            return
+        Returns: True if the run exists
+        """
+        stream_registry.abort_run(run_id, reason)
         
-        key = self._run_key(run_id)
-        data = await self._redis.get(key)
-        if not data:
-            return
+        state = await self._load_state(run_id)
+        if not state:
+            return False
         
-        state = self._dict_to_state(json.loads(data))
         state.status = "killed"
         state.kill_reason = reason
         await self._save_state(state)
+        await self._publish_kill(run_id, reason)
         
         logger.warning(f"Run killed: {run_id} - {reason}")
+        return True
+    
+    # ------------------------------------------------------------------
+    # Kill propagation (pub/sub)
+    # ------------------------------------------------------------------
+    
+    async def _publish_kill(self, run_id: str, reason: str):
+        """Broadcast a kill to all workers (best effort)"""
+        if not self._connected:
+            return
+        try:
+            REDIS_ROUND_TRIPS.inc()
+            await self._redis.publish(
+                KILL_CHANNEL, json.dumps({"run_id": run_id, "reason": reason})
+            )
+        except REDIS_ERRORS as e:
+            self._on_redis_error(e)
+    
+    async def _kill_listener(self):
+        """Abort local streams of runs killed by any worker"""
+        while True:
+            if not self._connected:
+                await asyncio.sleep(settings.REDIS_RECONNECT_INTERVAL)
+                continue
+            
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(KILL_CHANNEL)
+                async for message in pubsub.listen():
+                    try:
+                        event = json.loads(message["data"])
+                        stream_registry.abort_run(event["run_id"], event["reason"])
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Malformed kill event: {message.get('data')!r}")
+            except REDIS_ERRORS as e:
+                logger.debug(f"Kill listener disconnected: {e}")
+                await asyncio.sleep(settings.REDIS_RECONNECT_INTERVAL)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except REDIS_ERRORS:
+                    pass
     
     async def get_run_state(self, run_id: str) -> Optional[RunState]:
         """Get current run state"""
-        if not self._connected:
-            return None
-        
-        key = self._run_key(run_id)
-        data = await self._redis.get(key)
-        if not data:
-            return None
-        
-        return self._dict_to_state(json.loads(data))
+        return await self._load_state(run_id)
 
 
 # Singleton instance
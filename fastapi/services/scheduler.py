@@ -0,0 +1,257 @@
+"""
+Upstream Scheduler - fair queuing in front of the providers
+
+Without it, a tenant bursting hundreds of concurrent agent steps takes every
+upstream connection and everyone else's latency suffers. Each upstream
+call first acquires a slot:
+
+- Concurrency caps per provider and per model (per worker process)
+- When a cap is reached, requests wait in per-model queues ordered by a
+  fair-queuing finish tag: each tenant's requests are spaced one unit
+  apart in virtual time, so a bursting tenant queues behind its own
+  backlog while other tenants keep their share. The tenant is the team,
+  or the user for the shared pass-through / managed pseudo-teams (see
+  middleware.auth.SHARED_TEAMS). Shares are equal: key validation does not
+  return plans yet, so there is no per-plan weight to apply.
+- A request waits at most UPSTREAM_QUEUE_MAX_WAIT seconds (or is refused
+  at once when UPSTREAM_QUEUE_MAX_DEPTH requests are already waiting) and
+  then gets a fast 429 instead of a slow timeout
+- Queue wait is exported as agentwall_upstream_queue_wait_seconds and as
+  the "queue" stage of the request timer
+
+Caps are per worker: with N workers the fleet-wide cap is N times higher.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import weakref
+from typing import Optional
+
+from config import settings
+from services.metrics import (
+    UPSTREAM_QUEUE_DEPTH,
+    UPSTREAM_QUEUE_FULL,
+    UPSTREAM_QUEUE_TIMEOUTS,
+    UPSTREAM_QUEUE_WAIT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerRejected(Exception):
+    """No upstream slot within the allowed wait"""
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason  # "queue_full" or "queue_timeout"
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+
+class _Waiter:
+    __slots__ = ("tag", "start", "seq", "tenant", "previous", "provider", "model", "future")
+
+    def __init__(
+        self,
+        tag: float,
+        start: float,
+        seq: int,
+        tenant: str,
+        previous: Optional[float],
+        provider: str,
+        model: str,
+    ):
+        self.tag = tag        # virtual finish time (queue order)
+        self.start = start    # virtual start time
+        self.seq = seq
+        self.tenant = tenant
+        self.previous = previous  # tenant's finish tag before this request (rollback)
+        self.provider = provider
+        self.model = model
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.tag, self.seq) < (other.tag, other.seq)
+
+
+class UpstreamSlot:
+    """A held upstream slot (release exactly once; extra calls are ignored)"""
+
+    __slots__ = ("_scheduler", "provider", "model", "wait_seconds", "_released", "__weakref__")
+
+    def __init__(self, scheduler: "UpstreamScheduler", provider: str, model: str, wait_seconds: float):
+        self._scheduler = scheduler
+        self.provider = provider
+        self.model = model
+        self.wait_seconds = wait_seconds
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self._scheduler._release(self.provider, self.model)
+
+    def release_with(self, owner: object):
+        """Also release when `owner` (e.g. a stream generator) is garbage collected"""
+        weakref.finalize(owner, self.release)
+
+
+class UpstreamScheduler:
+    """Per-provider / per-model concurrency caps with fair queuing across tenants"""
+
+    # Tenant finish tags kept before idle tenants are pruned
+    MAX_TRACKED_TEAMS = 10000
+
+    def __init__(
+        self,
+        provider_limit: int,
+        model_limit: int,
+        max_wait: float,
+        max_queue: int,
+    ):
+        self.provider_limit = provider_limit
+        self.model_limit = model_limit
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._active_provider: dict[str, int] = {}
+        self._active_model: dict[str, int] = {}
+        self._queues: dict[str, list[_Waiter]] = {}  # model -> heap of waiters
+        self._last_finish: dict[str, float] = {}     # tenant -> virtual finish tag
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def active(self, provider: str) -> int:
+        return self._active_provider.get(provider, 0)
+
+    def _has_capacity(self, provider: str, model: str) -> bool:
+        return (
+            self._active_provider.get(provider, 0) < self.provider_limit
+            and self._active_model.get(model, 0) < self.model_limit
+        )
+
+    def _take(self, provider: str, model: str):
+        self._active_provider[provider] = self._active_provider.get(provider, 0) + 1
+        self._active_model[model] = self._active_model.get(model, 0) + 1
+
+    def _tag(self, tenant: str) -> tuple[float, float]:
+        """Fair-queuing tags: start = max(virtual time, tenant's last finish), finish = start + 1"""
+        start = max(self._virtual_time, self._last_finish.get(tenant, 0.0))
+        return start, start + 1.0
+
+    def _record(self, tenant: str, finish: float):
+        """The request took a slot or joined the queue: later ones space after it"""
+        if len(self._last_finish) >= self.MAX_TRACKED_TEAMS:
+            self._last_finish = {
+                key: tag for key, tag in self._last_finish.items() if tag > self._virtual_time
+            }
+        self._last_finish[tenant] = finish
+
+    async def acquire(self, tenant: str, provider: str, model: str) -> UpstreamSlot:
+        """
+        Wait for an upstream slot (tenant: team, or user for shared pseudo-teams)
+
+        Raises: SchedulerRejected when the queue is full or the wait times out
+        """
+        started = time.perf_counter()
+        start, finish = self._tag(tenant)
+
+        if not self._queues.get(model) and self._has_capacity(provider, model):
+            self._take(provider, model)
+            self._record(tenant, finish)
+            self._virtual_time = max(self._virtual_time, start)
+            UPSTREAM_QUEUE_WAIT[provider].observe(0.0)
+            return UpstreamSlot(self, provider, model, 0.0)
+
+        if self._waiting >= self.max_queue:
+            # Refused requests leave the tenant's finish tag alone
+            UPSTREAM_QUEUE_FULL[provider].inc()
+            raise SchedulerRejected("queue_full", retry_after=self.max_wait)
+
+        waiter = _Waiter(
+            finish, start, next(self._seq), tenant, self._last_finish.get(tenant), provider, model,
+        )
+        self._record(tenant, finish)
+        heapq.heappush(self._queues.setdefault(model, []), waiter)
+        self._waiting += 1
+        UPSTREAM_QUEUE_DEPTH.inc()
+
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+        wait_seconds = time.perf_counter() - started
+        UPSTREAM_QUEUE_WAIT[provider].observe(wait_seconds)
+        if not done:
+            self._abandon(waiter)
+            UPSTREAM_QUEUE_TIMEOUTS[provider].inc()
+            logger.warning(
+                f"Upstream queue timeout: tenant={tenant}, provider={provider}, model={model}"
+            )
+            raise SchedulerRejected("queue_timeout", retry_after=self.max_wait)
+
+        return UpstreamSlot(self, provider, model, wait_seconds)
+
+    def _abandon(self, waiter: _Waiter):
+        """Give up waiting (the slot is returned if it was granted meanwhile)"""
+        if waiter.future.done():
+            self._release(waiter.provider, waiter.model)
+            return
+        # Left in the heap and skipped on dispatch
+        waiter.future.cancel()
+        self._waiting -= 1
+        UPSTREAM_QUEUE_DEPTH.dec()
+        # Never served: give the tenant its place back, unless a later request
+        # of the tenant already queued behind this one
+        if self._last_finish.get(waiter.tenant) == waiter.tag:
+            if waiter.previous is None:
+                del self._last_finish[waiter.tenant]
+            else:
+                self._last_finish[waiter.tenant] = waiter.previous
+
+    def _release(self, provider: str, model: str):
+        self._active_provider[provider] -= 1
+        self._active_model[model] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to the waiters with the smallest finish tags"""
+        while True:
+            best: Optional[_Waiter] = None
+            for model, queue in list(self._queues.items()):
+                while queue and queue[0].future.done():
+                    heapq.heappop(queue)  # abandoned
+                if not queue:
+                    del self._queues[model]
+                    continue
+                head = queue[0]
+                if self._has_capacity(head.provider, model) and (best is None or head < best):
+                    best = head
+
+            if best is None:
+                return
+
+            heapq.heappop(self._queues[best.model])
+            self._take(best.provider, best.model)
+            self._virtual_time = max(self._virtual_time, best.start)
+            self._waiting -= 1
+            UPSTREAM_QUEUE_DEPTH.dec()
+            best.future.set_result(None)
+
+
+# Singleton instance (per worker process)
+upstream_scheduler = UpstreamScheduler(
+    provider_limit=settings.UPSTREAM_PROVIDER_CONCURRENCY,
+    model_limit=settings.UPSTREAM_MODEL_CONCURRENCY,
+    max_wait=settings.UPSTREAM_QUEUE_MAX_WAIT,
+    max_queue=settings.UPSTREAM_QUEUE_MAX_DEPTH,
+)
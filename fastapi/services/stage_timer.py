@@ -0,0 +1,124 @@
+"""
+Stage Timer - per-request span recorder
+
+Splits a request's wall time into consecutive stages using monotonic
+timestamps. Each mark() attributes the time since the previous mark to a
+stage, so stages always add up to the total and provider time can be
+separated from AgentWall's own overhead.
+
+Stages (in order):
+- auth              API key extraction + validation (AuthMiddleware)
+- parse             middleware hand-off + request body validation
+- admission         run-level governance (Redis)
+- loop_check        loop detection pre-check
+- queue             waiting for an upstream slot (services.scheduler)
+- upstream_connect  request sent, response headers received
+- upstream_ttfb     headers -> first streamed chunk (streaming only)
+- upstream          response body from provider
+- budget_check      response cost vs. budgets (non-streaming, before dlp)
+- dlp               response redaction
+- post_check        post-response loop check (streaming: cost accounting)
+- log_enqueue       handing logs/state updates to background tasks
+
+Cost: one perf_counter() call and one list append per mark.
+"""
+
+import time
+from typing import Optional
+
+from services.metrics import STAGE_HISTOGRAMS
+
+# Stages spent waiting on the provider (not AgentWall overhead)
+UPSTREAM_STAGES = frozenset({"upstream_connect", "upstream_ttfb", "upstream"})
+
+# Deliberate fair-queuing wait (reported on its own, not as overhead)
+QUEUE_STAGE = "queue"
+
+# Stage -> RequestLog field (precomputed, no per-request formatting)
+LOG_FIELDS = (
+    ("auth", "auth_ms"),
+    ("admission", "admission_ms"),
+    ("loop_check", "loop_check_ms"),
+    ("queue", "queue_ms"),
+    ("upstream_connect", "upstream_connect_ms"),
+    ("upstream_ttfb", "upstream_ttfb_ms"),
+    ("upstream", "upstream_ms"),
+    ("dlp", "dlp_ms"),
+    ("post_check", "post_check_ms"),
+)
+
+
+class StageTimer:
+    """Monotonic span recorder threaded through a single request"""
+    
+    __slots__ = ("started_at", "_last", "_stages")
+    
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self._last = self.started_at
+        self._stages: list[tuple[str, float]] = []
+    
+    def mark(self, stage: str) -> float:
+        """
+        Close the current stage
+        
+        Returns: seconds attributed to the stage
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self._stages.append((stage, elapsed))
+        
+        histogram = STAGE_HISTOGRAMS.get(stage)
+        if histogram is not None:
+            histogram.observe(elapsed)
+        
+        return elapsed
+    
+    def stage_ms(self, stage: str) -> float:
+        """Total milliseconds recorded for a stage (0 if never marked)"""
+        return sum(elapsed for name, elapsed in self._stages if name == stage) * 1000
+    
+    @property
+    def total_ms(self) -> float:
+        """Milliseconds from start to the last mark"""
+        return (self._last - self.started_at) * 1000
+    
+    @property
+    def upstream_ms(self) -> float:
+        """Milliseconds spent waiting on the provider"""
+        return sum(
+            elapsed for name, elapsed in self._stages if name in UPSTREAM_STAGES
+        ) * 1000
+    
+    @property
+    def queue_ms(self) -> float:
+        """Milliseconds spent waiting for an upstream slot"""
+        return self.stage_ms(QUEUE_STAGE)
+    
+    @property
+    def overhead_ms(self) -> float:
+        """True proxy overhead: everything that is not provider time or queuing"""
+        return self.total_ms - self.upstream_ms - self.queue_ms
+    
+    def as_dict(self) -> dict[str, float]:
+        """Stage breakdown in milliseconds (rounded for logging)"""
+        breakdown: dict[str, float] = {}
+        for name, elapsed in self._stages:
+            breakdown[name] = breakdown.get(name, 0.0) + elapsed * 1000
+        return {name: round(ms, 3) for name, ms in breakdown.items()}
+    
+    def log_fields(self) -> dict[str, float]:
+        """Stage breakdown keyed by RequestLog field name"""
+        breakdown = self.as_dict()
+        return {field: breakdown.get(stage, 0.0) for stage, field in LOG_FIELDS}
+    
+    def server_timing(self) -> str:
+        """
+        Render as a Server-Timing header value
+        
+        Example: auth;dur=0.120, admission;dur=0.850, upstream;dur=523.100
+        """
+        return ", ".join(
+            f"{name};dur={ms:.3f}" for name, ms in self.as_dict().items()
+        )
@@ -0,0 +1,191 @@
+"""
+Stream Registry - in-flight streams per run (per worker)
+
+Makes the kill switch take effect mid-stream:
+- Every streaming request registers a StreamHandle for its run
+- The handle holds the upstream httpx response once it is open
+- abort() closes that response: the pending read fails immediately, the
+  stream generator raises StreamAborted and the client gets a final SSE
+  error event instead of more (billed) tokens
+
+Kills reach every worker through Redis pub/sub (see RunTracker).
+
+The same path enforces budgets mid-stream: the handle carries a completion
+character allowance and the proxy generator aborts once it is used up.
+
+And worker drains: streams still open at the drain deadline are aborted
+(see services.drain).
+
+And client disconnects: DisconnectAwareResponse aborts the handle when
+the ASGI http.disconnect message arrives, so a dead agent stops paying for
+the rest of its generation.
+"""
+
+import asyncio
+import logging
+import sys
+from typing import Optional
+
+import httpx
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Abort reason (and logged status) when the client goes away mid-stream
+CLIENT_DISCONNECTED = "client_disconnected"
+# Abort reason when the worker shuts down before the stream finished
+SERVER_DRAINING = "server_draining"
+
+# Pending upstream closes: the loop only keeps weak references to tasks
+_closing: set[asyncio.Task] = set()
+
+
+class StreamAborted(Exception):
+    """Raised inside a stream generator when its run was killed (or its budget ran out)"""
+
+    def __init__(self, reason: str, budget: bool = False):
+        self.reason = reason
+        self.budget = budget  # cut off by the stream's own budget allowance
+        super().__init__(reason)
+
+
+class StreamHandle:
+    """One in-flight upstream stream"""
+
+    __slots__ = ("run_id", "response", "abort_reason", "max_chars", "budget_limit")
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.response: Optional[httpx.Response] = None
+        self.abort_reason: Optional[str] = None
+        # Completion characters allowed before the budget is exceeded
+        self.max_chars = sys.maxsize
+        self.budget_limit = ""
+
+    @property
+    def aborted(self) -> bool:
+        return self.abort_reason is not None
+
+    def attach(self, response: httpx.Response):
+        """Bind the upstream response (closed at once if already aborted)"""
+        self.response = response
+        if self.aborted:
+            self._close()
+
+    def set_budget(self, max_chars: int, limit_name: str):
+        """Cut the stream off after `max_chars` completion characters"""
+        self.max_chars = max_chars
+        self.budget_limit = limit_name
+
+    def exceed_budget(self) -> StreamAborted:
+        """Abort because the allowance is used up (returns the error to raise)"""
+        self.abort(f"budget_exceeded:{self.budget_limit}")
+        return StreamAborted(self.abort_reason, budget=True)
+
+    def abort(self, reason: str):
+        """Stop the stream: closes the upstream connection"""
+        if self.aborted:
+            return
+        self.abort_reason = reason
+        if self.response is not None:
+            self._close()
+
+    def _close(self):
+        # Closing from another task makes the pending read raise ReadError
+        task = asyncio.ensure_future(self.response.aclose())
+        _closing.add(task)
+        task.add_done_callback(_close_done)
+
+
+def _close_done(task: asyncio.Task):
+    _closing.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Closing aborted upstream stream failed: {task.exception()!r}")
+
+
+class StreamRegistry:
+    """run_id -> in-flight stream handles of this worker"""
+
+    def __init__(self):
+        self._streams: dict[str, set[StreamHandle]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(handles) for handles in self._streams.values())
+
+    def register(self, run_id: str) -> StreamHandle:
+        handle = StreamHandle(run_id)
+        self._streams.setdefault(run_id, set()).add(handle)
+        return handle
+
+    def unregister(self, handle: StreamHandle):
+        handles = self._streams.get(handle.run_id)
+        if handles is None:
+            return
+        handles.discard(handle)
+        if not handles:
+            del self._streams[handle.run_id]
+
+    def abort_run(self, run_id: str, reason: str) -> int:
+        """
+        Abort every in-flight stream of a run on this worker
+
+        Returns: number of streams aborted
+        """
+        handles = self._streams.get(run_id)
+        if not handles:
+            return 0
+
+        aborted = 0
+        for handle in handles:
+            if not handle.aborted:
+                handle.abort(reason)
+                aborted += 1
+
+        if aborted:
+            logger.warning(f"Aborted {aborted} in-flight stream(s) for run {run_id}: {reason}")
+        return aborted
+
+    def abort_all(self, reason: str) -> int:
+        """Abort every in-flight stream on this worker (returns how many)"""
+        aborted = 0
+        for handles in self._streams.values():
+            for handle in handles:
+                if not handle.aborted:
+                    handle.abort(reason)
+                    aborted += 1
+        return aborted
+
+
+class DisconnectAwareResponse(StreamingResponse):
+    """
+    Streaming response that aborts its upstream stream when the client disconnects
+
+    Starlette cancels the response task on http.disconnect, which can leave
+    the body generator suspended (and the upstream connection open) until
+    it is garbage collected. Here the handle (if any) is aborted at once,
+    closing the upstream response, and the body generator is closed so its
+    cleanup and logging run.
+    """
+
+    def __init__(self, content, handle: Optional[StreamHandle] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.handle = handle
+
+    async def listen_for_disconnect(self, receive: Receive) -> None:
+        await super().listen_for_disconnect(receive)
+        if self.handle is not None:
+            self.handle.abort(CLIENT_DISCONNECTED)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # No-op when the stream completed; otherwise the client is gone
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+# Singleton instance (per worker process)
+stream_registry = StreamRegistry()
@@ -0,0 +1,138 @@
+"""
+Tool-Call Tracking
+
+Agent loops usually show up as the same tool being called with the same
+arguments, not as identical user prompts. Per run we count:
+
+- calls per tool name (capped by MAX_TOOL_CALLS -> "tool_spam")
+- calls per canonical (tool name, arguments) hash (capped by
+  TOOL_REPEAT_LIMIT -> "repetitive_tool_call")
+
+The calls counted for a step are the ones the client is answering: the
+tool_calls of the last assistant message, when only tool results follow
+it. Counters live in one Redis hash per run (see RunTracker), updated with
+a single pipelined round trip per step.
+"""
+
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+
+import orjson
+
+# Counter fields in the per-run hash
+TOOL_FIELD_PREFIX = b"t:"  # + tool name          -> calls of that tool
+ARGS_FIELD_PREFIX = b"a:"  # + 8-byte digest      -> calls with those arguments
+
+
+@dataclass(frozen=True)
+class ToolCall:
+    """One tool call, identified by its canonical (name, arguments) hash"""
+    name: str
+    digest: bytes  # 8-byte blake2b of name + canonical arguments
+
+    @classmethod
+    def from_message(cls, call: dict) -> Optional["ToolCall"]:
+        function = call.get("function") if isinstance(call, dict) else None
+        if not isinstance(function, dict) or not isinstance(function.get("name"), str):
+            return None
+        name = function["name"]
+        return cls(name=name, digest=tool_call_digest(name, function.get("arguments")))
+
+    @property
+    def tool_field(self) -> bytes:
+        return TOOL_FIELD_PREFIX + self.name.encode()
+
+    @property
+    def args_field(self) -> bytes:
+        return ARGS_FIELD_PREFIX + self.digest
+
+
+@dataclass
+class ToolCallViolation:
+    """A tool-call limit hit at admission"""
+    pattern_type: str  # "tool_spam" or "repetitive_tool_call"
+    tool_name: str
+    count: int
+    limit: int
+
+    @property
+    def message(self) -> str:
+        if self.pattern_type == "tool_spam":
+            return f"Tool '{self.tool_name}' called {self.count} times (limit {self.limit})"
+        return (
+            f"Tool '{self.tool_name}' called {self.count} times with the same arguments "
+            f"(limit {self.limit})"
+        )
+
+
+def canonical_arguments(arguments: Any) -> bytes:
+    """
+    Arguments in a canonical form (key order and whitespace don't matter)
+
+    OpenAI sends arguments as a JSON string; anything that does not parse
+    is compared as stripped text.
+    """
+    if isinstance(arguments, str):
+        try:
+            arguments = orjson.loads(arguments)
+        except orjson.JSONDecodeError:
+            return arguments.strip().encode()
+    try:
+        return orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        return str(arguments).encode()
+
+
+def tool_call_digest(name: str, arguments: Any) -> bytes:
+    """8-byte hash of (tool name, canonical arguments)"""
+    h = hashlib.blake2b(digest_size=8)
+    h.update(name.encode())
+    h.update(b"\0")
+    h.update(canonical_arguments(arguments))
+    return h.digest()
+
+
+def pending_tool_calls(messages: Sequence[dict]) -> list[ToolCall]:
+    """
+    Tool calls answered by this request
+
+    The last assistant message's tool_calls, if everything after it is a
+    tool result. Earlier calls were counted when they were answered.
+    """
+    for message in reversed(messages):
+        role = message.get("role")
+        if role == "tool":
+            continue
+        if role != "assistant":
+            return []
+        calls = message.get("tool_calls") or []
+        if not isinstance(calls, list):
+            return []
+        return [call for call in map(ToolCall.from_message, calls) if call is not None]
+    return []
+
+
+def check_tool_counts(
+    calls: Sequence[ToolCall],
+    counts: dict[bytes, int],
+    max_calls_per_tool: int,
+    repeat_limit: int,
+) -> Optional[ToolCallViolation]:
+    """
+    Check updated counters against the per-run caps
+
+    Repeated arguments are reported before plain volume: they are the
+    stronger loop signal.
+    """
+    for call in calls:
+        count = counts.get(call.args_field, 0)
+        if count > repeat_limit:
+            return ToolCallViolation("repetitive_tool_call", call.name, count, repeat_limit)
+
+    for call in calls:
+        count = counts.get(call.tool_field, 0)
+        if count > max_calls_per_tool:
+            return ToolCallViolation("tool_spam", call.name, count, max_calls_per_tool)
+
+    return None
@@ -0,0 +1,69 @@
+"""
+Auth Middleware Tests
+Tests X-Internal-Secret checks on /internal endpoints and per-key identities
+"""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from config import settings
+from middleware.auth import DEFAULT_INTERNAL_SECRET, AuthMiddleware
+from services.rate_limiter import RateLimiter
+
+
+def make_client() -> TestClient:
+    """App with one internal route (middleware built on first request)"""
+    app = FastAPI()
+    app.add_middleware(AuthMiddleware)
+
+    @app.get("/internal/ping")
+    async def ping():
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+class TestInternalSecret:
+    """Test /internal authentication"""
+
+    def test_configured_secret(self, monkeypatch):
+        monkeypatch.setattr(settings, "INTERNAL_SECRET", "s3cret-for-tests")
+        client = make_client()
+
+        assert client.get("/internal/ping", headers={"X-Internal-Secret": "s3cret-for-tests"}).status_code == 200
+        assert client.get("/internal/ping", headers={"X-Internal-Secret": "wrong"}).status_code == 403
+        assert client.get("/internal/ping").status_code == 403
+
+    @pytest.mark.parametrize("secret", ["", DEFAULT_INTERNAL_SECRET])
+    def test_unset_or_default_secret_refuses_all(self, monkeypatch, secret):
+        monkeypatch.setattr(settings, "INTERNAL_SECRET", secret)
+        client = make_client()
+
+        response = client.get("/internal/ping", headers={"X-Internal-Secret": secret})
+
+        assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+class TestManagedKeys:
+    """Managed (aw-) keys share a team but not a rate limit"""
+
+    async def test_rate_limited_independently(self, monkeypatch):
+        monkeypatch.setattr(settings, "RATE_LIMIT_KEY_RPS", 2)
+        monkeypatch.setattr(settings, "RATE_LIMIT_KEY_TPM", 0)
+        auth = AuthMiddleware(app=None)
+        limiter = RateLimiter()
+        noisy, quiet = [
+            await auth._validate_api_key(key) for key in ("aw-noisy-agent-0001", "aw-quiet-agent-0002")
+        ]
+
+        def check(user_info):
+            limits = limiter.limits_for(
+                user_info["api_key_id"], user_info["team_id"], "gpt-4o", 10, user_info["limits"],
+            )
+            return limiter.check_local(limits).allowed
+
+        assert noisy["team_id"] == quiet["team_id"] == "managed"
+        assert [check(noisy) for _ in range(3)] == [True, True, False]
+        assert check(quiet)
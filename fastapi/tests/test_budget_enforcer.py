@@ -217,3 +217,49 @@ class TestBudgetScenarios:
         result3 = enforcer.check_run_budget("run_3", Decimal("20.0"), daily_spent=Decimal("90.0"))
         assert result3["should_kill"]
         assert result3["exceeded_limit"] == "daily"
+
+
+class TestStreamAllowance:
+    """Test mid-stream budget allowance"""
+    
+    def test_tightest_limit_wins(self):
+        """The smallest remaining budget sets the allowance"""
+        enforcer = BudgetEnforcer(BudgetPolicy(per_run_limit=10.0, daily_limit=100.0))
+        
+        allowance = enforcer.stream_allowance(
+            model="gpt-4",
+            prompt_tokens=0,
+            run_spent=Decimal("0"),
+            run_limit=Decimal("10.0"),
+            daily_spent=Decimal("99.94"),
+        )
+        
+        # $0.06 left at $0.06/1K completion tokens = 1000 tokens
+        assert allowance.exceeded_limit == "daily"
+        assert allowance.max_chars == 1000 * 4
+    
+    def test_prompt_cost_is_deducted(self):
+        enforcer = BudgetEnforcer(BudgetPolicy(per_run_limit=0.06))
+        
+        allowance = enforcer.stream_allowance(
+            model="gpt-4",
+            prompt_tokens=1000,  # $0.03
+            run_spent=Decimal("0"),
+            run_limit=Decimal("10.0"),
+        )
+        
+        assert allowance.exceeded_limit == "per_run"
+        assert allowance.max_chars == 500 * 4
+    
+    def test_exhausted_budget_allows_nothing(self):
+        enforcer = BudgetEnforcer()
+        
+        allowance = enforcer.stream_allowance(
+            model="gpt-4",
+            prompt_tokens=100,
+            run_spent=Decimal("10.0"),
+            run_limit=Decimal("10.0"),
+        )
+        
+        assert allowance.exceeded_limit == "run"
+        assert allowance.max_chars == 0
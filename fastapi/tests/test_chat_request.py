@@ -0,0 +1,89 @@
+"""
+Chat Request Fast Path Tests
+Tests raw-body parsing, upstream pass-through and response splicing
+"""
+
+import orjson
+import pytest
+from fastapi.exceptions import RequestValidationError
+
+from api.v1.chat import _splice_agentwall
+from models.chat_request import parse_chat_request
+from services.multi_provider import build_request_body
+
+
+def body(**fields) -> bytes:
+    data = {"model": "gpt-4", "messages": [{"role": "user", "content": "Hello"}]}
+    data.update(fields)
+    return orjson.dumps(data)
+
+
+class TestParseChatRequest:
+    """Test minimal validation of the fields AgentWall reads"""
+
+    def test_original_bytes_forwarded(self):
+        raw = body(temperature=0.2, some_new_param={"x": 1})
+        request = parse_chat_request(raw)
+
+        assert request.upstream_body is raw
+        assert request.model == "gpt-4"
+        assert not request.stream
+
+    def test_agentwall_fields_stripped(self):
+        request = parse_chat_request(body(stream=True, agentwall_run_id="run-1", agentwall_agent_id="a"))
+
+        assert request.stream
+        assert request.agentwall_run_id == "run-1"
+        assert request.agentwall_agent_id == "a"
+        upstream = orjson.loads(request.upstream_body)
+        assert "agentwall_run_id" not in upstream
+        assert upstream["stream"] is True
+
+    def test_last_user_content(self):
+        request = parse_chat_request(body(messages=[
+            {"role": "user", "content": "first"},
+            {"role": "user", "content": [{"type": "text", "text": "look"}, {"type": "image_url"}]},
+            {"role": "assistant", "content": None},
+        ]))
+
+        assert request.last_user_content() == "look"
+
+    @pytest.mark.parametrize("raw, loc", [
+        (b"{not json", ("body", 1)),
+        (orjson.dumps({"messages": []}), ("body", "model")),
+        (orjson.dumps({"model": "gpt-4"}), ("body", "messages")),
+        (body(messages="hi"), ("body", "messages")),
+        (body(messages=["hi"]), ("body", "messages", 0)),
+        (body(stream="yes"), ("body", "stream")),
+        (body(agentwall_run_id=5), ("body", "agentwall_run_id")),
+    ])
+    def test_invalid_body(self, raw, loc):
+        with pytest.raises(RequestValidationError) as exc_info:
+            parse_chat_request(raw)
+
+        assert exc_info.value.errors()[0]["loc"] == loc
+
+
+class TestUpstreamBody:
+    """Test request body reuse and response splicing"""
+
+    def test_body_reused_without_alias(self):
+        raw = body()
+        assert build_request_body(orjson.loads(raw), "gpt-4", "gpt-4", raw) is raw
+
+    def test_alias_rewrites_model(self):
+        raw = body(model="claude-3.5-sonnet")
+        content = build_request_body(
+            orjson.loads(raw), "claude-3.5-sonnet", "anthropic/claude-3.5-sonnet", raw
+        )
+
+        assert orjson.loads(content)["model"] == "anthropic/claude-3.5-sonnet"
+
+    def test_splice_agentwall(self):
+        upstream = b'{"id": "chatcmpl-1", "choices": []}\n'
+        spliced = orjson.loads(_splice_agentwall(upstream, {"run_id": "run-1"}))
+
+        assert spliced == {"id": "chatcmpl-1", "choices": [], "agentwall": {"run_id": "run-1"}}
+
+    def test_splice_empty_object(self):
+        assert _splice_agentwall(b"{ }", {"step": 1}) == b'{"agentwall":{"step":1}}'
@@ -0,0 +1,227 @@
+"""
+ClickHouse Client Tests
+Tests the request_logs row format, run rollup queries and step streaming
+"""
+
+import asyncio
+import importlib
+import json
+
+import httpx
+import pytest
+
+from services.clickhouse_client import ClickHouseClient, RequestLog
+from services.message_store import MessageStore
+
+
+class FakeResponse:
+    def __init__(self, text: str = "", status_code: int = 200):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeHTTP:
+    """Records posts and answers with a canned body"""
+
+    is_closed = False
+
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.status_code = 200
+        self.posts = []
+
+    async def post(self, url, params=None, content=None, **kwargs):
+        self.posts.append((params, content))
+        return FakeResponse(self.text, self.status_code)
+
+
+def make_client(text: str = "") -> tuple[ClickHouseClient, FakeHTTP]:
+    client = ClickHouseClient()
+    client._client = FakeHTTP(text)
+    return client, client._client
+
+
+@pytest.mark.asyncio
+class TestClickHouseClient:
+    """Test inserts and run-level reads"""
+
+    async def test_rows_match_request_log(self):
+        """Every RequestLog field is written to request_logs (messages as hashes)"""
+        client, http = make_client()
+        log = RequestLog(
+            run_id="run-1", step_number=2, request_id="req-1", team_id="team-1",
+            user_id="user-1", api_key_id="key-1", model="gpt-4o",
+            endpoint="/v1/chat/completions", queue_ms=1.5,
+        )
+
+        await client._insert_logs([log])
+
+        params, body = http.posts[0]
+        row = json.loads(body)
+        assert params["query"].endswith(".request_logs FORMAT JSONEachRow")
+        assert set(row) == set(RequestLog.__dataclass_fields__) - {
+            "messages", "pending_messages", "queued_bytes",
+        }
+        assert row["queue_ms"] == 1.5
+
+    async def test_messages_written_once(self, monkeypatch):
+        """A resent history only writes its new messages, before the logs"""
+        # The module (services re-exports the client singleton under the same name)
+        module = importlib.import_module("services.clickhouse_client")
+        monkeypatch.setattr(module, "message_store", MessageStore(100, 3600))
+        client, http = make_client()
+        history = [{"role": "system", "content": "Be brief"}, {"role": "user", "content": "Hi"}]
+
+        def log(step: int, messages: list) -> RequestLog:
+            return RequestLog(
+                run_id="run-1", step_number=step, request_id=f"req-{step}", team_id="team-1",
+                user_id="user-1", api_key_id="key-1", model="gpt-4o",
+                endpoint="/v1/chat/completions", messages=messages,
+            )
+
+        await client._insert_logs([log(1, history), log(2, history)])
+        await client._insert_logs([log(3, history + [{"role": "user", "content": "More"}])])
+
+        queries = [params["query"] for params, _ in http.posts]
+        assert queries[0].endswith(".messages FORMAT JSONEachRow")
+        assert queries[1].endswith(".request_logs FORMAT JSONEachRow")
+        assert queries[2].endswith(".messages FORMAT JSONEachRow")
+        assert len(http.posts[0][1].splitlines()) == 2
+        assert [json.loads(row)["role"] for row in http.posts[2][1].splitlines()] == ["user"]
+
+        steps = [json.loads(row) for row in http.posts[3][1].splitlines()]
+        first = [json.loads(row) for row in http.posts[1][1].splitlines()]
+        assert steps[0]["message_hashes"][:2] == first[0]["message_hashes"] == first[1]["message_hashes"]
+        assert len(steps[0]["message_hashes"]) == 3
+
+    async def test_retry_does_not_rehash(self, monkeypatch):
+        """A failed batch keeps hashes and unwritten rows, not the messages"""
+        module = importlib.import_module("services.clickhouse_client")
+        store = MessageStore(100, 3600)
+        monkeypatch.setattr(module, "message_store", store)
+        collected = []
+        collect = store.collect
+        monkeypatch.setattr(store, "collect", lambda *args: collected.append(1) or collect(*args))
+        client, http = make_client()
+        http.status_code = 500
+        history = [{"role": "user", "content": "Hi"}]
+        logs = [
+            RequestLog(
+                run_id="run-1", step_number=step, request_id=f"req-{step}", team_id="team-1",
+                user_id="user-1", api_key_id="key-1", model="gpt-4o",
+                endpoint="/v1/chat/completions", messages=history,
+            )
+            for step in (1, 2)
+        ]
+
+        await client.log_requests(logs)
+        await client._flush_batch()
+
+        assert client._log_queue == logs
+        assert all(log.messages is None and log.message_hashes for log in logs)
+        assert len(logs[0].pending_messages) == 1 and not logs[1].pending_messages
+
+        http.status_code = 200
+        await client._flush_batch()
+
+        assert len(collected) == 2
+        assert not client._log_queue
+        assert len(http.posts[-2][1].splitlines()) == 1  # the message, once
+        assert not logs[0].pending_messages
+
+    async def test_requeue_byte_limit(self, monkeypatch):
+        """Failed logs beyond LOG_REQUEUE_MAX_BYTES are dropped"""
+        module = importlib.import_module("services.clickhouse_client")
+        monkeypatch.setattr(module.settings, "LOG_REQUEUE_MAX_BYTES", 3 * module.LOG_OVERHEAD_BYTES)
+        client, http = make_client()
+        http.status_code = 500
+        logs = [
+            RequestLog(
+                run_id="run-1", step_number=step, request_id=f"req-{step}", team_id="team-1",
+                user_id="user-1", api_key_id="key-1", model="gpt-4o",
+                endpoint="/v1/chat/completions",
+            )
+            for step in range(5)
+        ]
+
+        await client.log_requests(logs)
+        await client._flush_batch()
+
+        assert client._log_queue == logs[:2]
+
+    async def test_full_batch_wakes_flush_loop(self, monkeypatch):
+        """A full batch is flushed by the loop at once, not by a detached task"""
+        module = importlib.import_module("services.clickhouse_client")
+        monkeypatch.setattr(module.settings, "LOG_BATCH_SIZE", 2)
+        monkeypatch.setattr(module.settings, "LOG_FLUSH_INTERVAL", 60.0)
+        client, http = make_client()
+        loop = asyncio.create_task(client._flush_loop())
+        logs = [
+            RequestLog(
+                run_id="run-1", step_number=step, request_id=f"req-{step}", team_id="team-1",
+                user_id="user-1", api_key_id="key-1", model="gpt-4o",
+                endpoint="/v1/chat/completions",
+            )
+            for step in (1, 2)
+        ]
+
+        await client.log_requests(logs)
+        await asyncio.sleep(0.01)
+        loop.cancel()
+        await loop
+
+        assert not client._log_queue
+        assert len(http.posts) == 1
+
+    async def test_run_rollup_is_parameterized(self):
+        """Run totals come from run_rollup with server-side parameters"""
+        client, http = make_client('{"run_id":"run-1","request_count":3}\n')
+
+        totals = await client.get_run_rollup("team-1", "run-1'; DROP TABLE x")
+
+        params, query = http.posts[0]
+        assert totals == {"run_id": "run-1", "request_count": 3}
+        assert "FROM agentwall.run_rollup" in query
+        assert "{run_id:String}" in query
+        assert params["param_run_id"] == "run-1'; DROP TABLE x"
+        assert params["param_team_id"] == "team-1"
+
+    async def test_run_rollup_missing(self):
+        client, _ = make_client("")
+
+        assert await client.get_run_rollup("team-1", "run-404") is None
+
+    async def test_stream_run_steps(self):
+        """Steps are passed through as NDJSON, pages keep whole steps"""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, content=b'{"step_number":3}\n{"step_number":4}\n')
+
+        client = ClickHouseClient()
+        client._client = httpx.AsyncClient(
+            base_url=client.base_url, transport=httpx.MockTransport(handler),
+        )
+
+        body = await client.stream_run_steps("team-1", "run-1", after=2, limit=2, content=False)
+        chunks = [chunk async for chunk in body]
+
+        query = requests[0].content.decode()
+        assert b"".join(chunks).splitlines() == [b'{"step_number":3}', b'{"step_number":4}']
+        assert "LIMIT {limit:UInt32} WITH TIES" in query
+        assert "response_content" not in query
+        assert requests[0].url.params["param_after"] == "2"
+        await client._client.aclose()
+
+    async def test_stream_run_steps_error(self):
+        """Query errors are raised before any body is returned"""
+        client = ClickHouseClient()
+        client._client = httpx.AsyncClient(
+            base_url=client.base_url,
+            transport=httpx.MockTransport(lambda request: httpx.Response(500, text="boom")),
+        )
+
+        with pytest.raises(Exception, match="boom"):
+            await client.stream_run_steps("team-1", "run-1")
+        await client._client.aclose()
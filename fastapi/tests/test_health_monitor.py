@@ -0,0 +1,223 @@
+"""
+Health Monitor Tests
+Tests background checks, rolling history and that endpoints never probe
+"""
+
+import asyncio
+
+import pytest
+
+from services import health_monitor as health_monitor_module
+from services.health_monitor import DailyHistory, DependencyHistory, HealthMonitor
+
+
+@pytest.fixture
+def pings(monkeypatch):
+    """Fake pooled pings: Redis answers, ClickHouse is down"""
+    calls = {"redis": 0, "clickhouse": 0}
+
+    async def redis_ping(timeout):
+        calls["redis"] += 1
+        return 0.42
+
+    async def clickhouse_ping(timeout):
+        calls["clickhouse"] += 1
+        raise ConnectionError("connection refused")
+
+    monkeypatch.setattr(health_monitor_module.run_tracker, "ping", redis_ping)
+    monkeypatch.setattr(health_monitor_module.clickhouse_client, "ping", clickhouse_ping)
+    return calls
+
+
+class TestDependencyHistory:
+    """Test per-minute buckets and rolling windows"""
+
+    def test_window_uptime_and_latency(self):
+        history = DependencyHistory()
+        now = 1_000_000 * 60.0
+        history.record(now - 120 * 60, ok=False)  # outside the last hour
+        history.record(now - 30, ok=True, latency_ms=2.0)
+        history.record(now - 20, ok=True, latency_ms=4.0)
+        history.record(now - 10, ok=False)
+
+        hour = history.window(60, now)
+        day = history.window(24 * 60, now)
+
+        assert hour == {"uptime": 66.667, "latency_ms": 3.0}
+        assert day["uptime"] == 50.0
+        assert len(history.buckets) == 2
+
+    def test_fixed_size(self):
+        history = DependencyHistory(minutes=3)
+        for minute in range(10):
+            history.record(minute * 60.0, ok=True, latency_ms=1.0)
+
+        assert [b.minute for b in history.buckets] == [7, 8, 9]
+
+    def test_empty_window(self):
+        assert DependencyHistory().window(60, 0.0) == {"uptime": None, "latency_ms": None}
+
+
+@pytest.mark.asyncio
+class TestHealthMonitor:
+    """Test snapshot publication"""
+
+    async def test_check_measures_and_records(self, pings):
+        monitor = HealthMonitor(interval=10, timeout=1)
+
+        snapshot = await monitor.check()
+
+        assert snapshot["checks"]["redis"] == {"status": "healthy", "latency_ms": 0.42}
+        assert snapshot["checks"]["clickhouse"]["status"] == "unhealthy"
+        assert "connection refused" in snapshot["checks"]["clickhouse"]["error"]
+        assert snapshot["history"]["redis"]["1h"] == {"uptime": 100.0, "latency_ms": 0.42}
+        assert snapshot["history"]["clickhouse"]["1h"]["uptime"] == 0.0
+        assert monitor.snapshot is snapshot
+
+    async def test_background_loop(self, pings):
+        monitor = HealthMonitor(interval=0.01, timeout=1)
+
+        await monitor.start()
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+        assert pings["redis"] >= 3
+
+
+class TestHealthEndpoints:
+    """Endpoints read the snapshot only"""
+
+    def test_ready_does_not_probe(self, client, pings, monkeypatch):
+        monitor = HealthMonitor(interval=10, timeout=1)
+        monitor._snapshot = {
+            "checks": {"redis": {"status": "healthy", "latency_ms": 0.5}},
+            "history": {},
+            "checked_at": "2026-01-06T12:00:00Z",
+        }
+        monkeypatch.setattr("api.v1.health.health_monitor", monitor)
+
+        for _ in range(5):
+            response = client.get("/health/ready")
+
+        assert response.status_code == 200
+        assert response.json()["checks"]["redis"]["latency_ms"] == 0.5
+        assert pings == {"redis": 0, "clickhouse": 0}
+
+
+class FakeRedis:
+    """Hashes only; records the keys read per round trip"""
+
+    def __init__(self):
+        self.hashes: dict[str, dict[bytes, bytes]] = {}
+        self.down = False
+        self.reads: list[list[str]] = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis_):
+        self.redis = redis_
+        self.calls = []
+
+    def hincrby(self, key, field_name, amount):
+        self.calls.append(("incr", key, field_name, amount))
+
+    def hincrbyfloat(self, key, field_name, amount):
+        self.calls.append(("incr", key, field_name, amount))
+
+    def expire(self, key, ttl):
+        self.calls.append(("expire", key, None, ttl))
+
+    def hgetall(self, key):
+        self.calls.append(("hgetall", key, None, None))
+
+    async def execute(self):
+        if self.redis.down:
+            raise ConnectionError("connection refused")
+        replies, reads = [], []
+        for op, key, field_name, amount in self.calls:
+            counts = self.redis.hashes.setdefault(key, {})
+            if op == "incr":
+                value = float(counts.get(field_name.encode(), 0)) + amount
+                counts[field_name.encode()] = str(value).encode()
+                replies.append(value)
+            elif op == "hgetall":
+                reads.append(key)
+                replies.append(dict(counts))
+            else:
+                replies.append(True)
+        self.redis.reads.append(reads)
+        return replies
+
+
+@pytest.fixture
+def shared_redis(monkeypatch):
+    """run_tracker's pooled client, shared by every DailyHistory"""
+    client = FakeRedis()
+    monkeypatch.setattr(health_monitor_module.run_tracker, "_redis", client)
+    return client
+
+
+@pytest.mark.asyncio
+class TestDailyHistory:
+    """Test the 90-day history shared through Redis"""
+
+    async def test_series_oldest_first_with_gaps(self, shared_redis):
+        history = DailyHistory(["redis"], days=5)
+        day = 86400.0
+        history.record("redis", 100 * day, ok=True, latency_ms=2.0)
+        history.record("redis", 100 * day + 60, ok=False)
+        history.record("redis", 102 * day, ok=True, latency_ms=4.0)
+
+        await history.sync(102 * day + 10)
+        series = history.series("redis")
+
+        assert len(series) == 5
+        assert series[:2] == [None, None]
+        assert series[2].uptime == 50.0
+        assert series[3] is None
+        assert series[4].avg_latency_ms == 4.0
+
+    async def test_shared_across_workers_and_restarts(self, shared_redis):
+        now = 100 * 86400.0
+        first, second = DailyHistory(["redis"], days=3), DailyHistory(["redis"], days=3)
+        first.record("redis", now, ok=True, latency_ms=1.0)
+        second.record("redis", now, ok=False)
+        await first.sync(now)
+        await second.sync(now)
+        await first.sync(now)
+
+        restarted = DailyHistory(["redis"], days=3)
+        await restarted.sync(now)
+
+        assert first.series("redis") == second.series("redis") == restarted.series("redis")
+        assert restarted.series("redis")[-1].checks == 2
+        assert restarted.series("redis")[-1].uptime == 50.0
+
+    async def test_unsent_kept_while_redis_fails(self, shared_redis):
+        history = DailyHistory(["redis"], days=3)
+        history.record("redis", 0.0, ok=True, latency_ms=1.0)
+
+        shared_redis.down = True
+        with pytest.raises(ConnectionError):
+            await history.sync(0.0)
+        shared_redis.down = False
+        history.record("redis", 10.0, ok=True, latency_ms=3.0)
+        await history.sync(10.0)
+
+        assert history.series("redis")[-1].checks == 2
+        assert history.series("redis")[-1].avg_latency_ms == 2.0
+
+    async def test_reads_only_changed_days(self, shared_redis):
+        """The whole window is read when it moves; otherwise today's hash only"""
+        history = DailyHistory(["redis"], days=5)
+        day = 86400.0
+        for at in (100 * day, 100 * day + 10, 101 * day):
+            history.record("redis", at, ok=True, latency_ms=1.0)
+            await history.sync(at)
+
+        assert [len(keys) for keys in shared_redis.reads] == [5, 1, 5]
+        assert shared_redis.reads[1] == ["agentwall:health:daily:1970-04-11"]
+        assert [b.checks if b else 0 for b in history.series("redis")] == [0, 0, 0, 2, 1]
@@ -0,0 +1,78 @@
+"""
+Loop Detector Tests
+Tests incremental period-k cycle detection
+"""
+
+from services.loop_detector import (
+    CYCLE_MAX_PERIOD,
+    CYCLE_WINDOW,
+    CycleState,
+    PromptFingerprint,
+    loop_detector,
+    step_hash,
+)
+
+
+def push_all(cycle: CycleState, steps: str) -> CycleState:
+    for step in steps:
+        cycle.push(step_hash(step))
+    return cycle
+
+
+class TestCycleState:
+    """Test per-step match counters"""
+
+    def test_detects_smallest_period(self):
+        cycle = push_all(CycleState(), "xy" + "abc" * 3)
+
+        assert cycle.detect() == (3, 3)
+
+    def test_period_one(self):
+        assert push_all(CycleState(), "aaa").detect() == (1, 3)
+
+    def test_two_repetitions_not_reported(self):
+        assert push_all(CycleState(), "abcdabcd").detect() is None
+
+    def test_broken_cycle_resets(self):
+        cycle = push_all(CycleState(), "abcabcabc")
+        cycle.push(step_hash("z"))
+
+        assert cycle.detect() is None
+
+    def test_state_is_bounded(self):
+        cycle = push_all(CycleState(), "ab" * 100)
+
+        assert len(cycle.recent) == CYCLE_MAX_PERIOD
+        assert max(cycle.matches) == CYCLE_WINDOW
+        assert cycle.detect() == (2, CYCLE_WINDOW // 2 + 1)
+
+    def test_tool_calls_distinguish_steps(self):
+        """Same prompt, different tool calls: different steps"""
+        assert step_hash("go on", [b"search00"]) != step_hash("go on", [b"read0000"])
+
+
+class TestCycleCheck:
+    """Test cycle results from check_history"""
+
+    def test_confidence_grows_with_repeats(self):
+        history = [PromptFingerprint.from_text("unrelated earlier prompt")]
+
+        three = loop_detector.check_history("new prompt", "", history, [], push_all(CycleState(), "pqr" * 3))
+        four = loop_detector.check_history("new prompt", "", history, [], push_all(CycleState(), "pqr" * 4))
+
+        assert three.loop_type == "cycle" and three.period == 3
+        assert three.confidence < 0.95 <= four.confidence
+
+    def test_cycle_reported_over_repeated_prompts(self):
+        """A short cycle repeats prompts: it is still reported as a cycle"""
+        history = [PromptFingerprint.from_text(step) for step in "abcab"]
+
+        result = loop_detector.check_history("c", "", history, [], push_all(CycleState(), "abc" * 3))
+
+        assert result.loop_type == "cycle" and result.period == 3
+        assert result.confidence == 1.0  # the exact repetition still blocks
+
+    def test_no_cycle(self):
+        result = loop_detector.check_history("new prompt", "", [], [], push_all(CycleState(), "abcdefg"))
+
+        assert not result.is_loop
@@ -0,0 +1,53 @@
+"""
+Message Store Tests
+Tests message hashing and per-worker deduplication
+"""
+
+from services.message_store import MessageStore, hash_message
+
+
+class TestMessageStore:
+    """Test content-addressed message collection"""
+
+    def test_hash_ignores_key_order(self):
+        a, data = hash_message({"role": "user", "content": "Hi"})
+        b, _ = hash_message({"content": "Hi", "role": "user"})
+
+        assert a == b
+        assert len(a) == 32
+        assert data == b'{"content":"Hi","role":"user"}'
+
+    def test_written_messages_are_skipped(self):
+        store = MessageStore(max_hashes=100, refresh_seconds=3600)
+        messages = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+        rows = {}
+        hashes = store.collect("team-1", messages, rows)
+        assert len(rows) == 2
+
+        store.remember(rows)
+        again = {}
+        assert store.collect("team-1", messages + [{"role": "user", "content": "Bye"}], again)[:2] == hashes
+        assert [row["role"] for row in again.values()] == ["user"]
+
+    def test_teams_are_separate(self):
+        store = MessageStore(max_hashes=100, refresh_seconds=3600)
+        rows = {}
+        store.collect("team-1", [{"role": "user", "content": "Hi"}], rows)
+        store.remember(rows)
+
+        other = {}
+        store.collect("team-2", [{"role": "user", "content": "Hi"}], other)
+
+        assert len(other) == 1
+
+    def test_refresh_and_bound(self):
+        """Old entries are rewritten; the memory keeps the newest max_hashes"""
+        store = MessageStore(max_hashes=2, refresh_seconds=0)
+        rows = {}
+        store.collect("team-1", [{"content": str(i)} for i in range(3)], rows)
+        store.remember(rows)
+        assert len(store) == 2
+
+        again = {}
+        store.collect("team-1", [{"content": "2"}], again)
+        assert len(again) == 1
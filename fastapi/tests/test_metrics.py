@@ -0,0 +1,36 @@
+"""
+Prometheus metrics tests
+"""
+
+from services.metrics import (
+    render_metrics,
+    STAGE_AUTH,
+    UPSTREAM_TOTAL,
+    PROVIDER_ERROR_COUNT,
+    PROVIDERS,
+)
+from services.multi_provider import Provider
+
+
+class TestMetrics:
+    """Test metric registration and export"""
+    
+    def test_providers_preallocated(self):
+        """Every provider has preallocated label children"""
+        assert set(PROVIDERS) == {p.value for p in Provider}
+        for provider in PROVIDERS:
+            assert provider in UPSTREAM_TOTAL
+            assert provider in PROVIDER_ERROR_COUNT
+    
+    def test_render_includes_stage_histograms(self):
+        """Observed stages show up in the exposition output"""
+        STAGE_AUTH.observe(0.0003)
+        PROVIDER_ERROR_COUNT["groq"].inc()
+        
+        body, content_type = render_metrics()
+        text = body.decode()
+        
+        assert content_type.startswith("text/plain")
+        assert 'agentwall_stage_duration_seconds_count{stage="auth"}' in text
+        assert 'agentwall_provider_errors_total{provider="groq"}' in text
+        assert "agentwall_log_queue_depth" in text
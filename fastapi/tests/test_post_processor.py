@@ -0,0 +1,102 @@
+"""
+Post-Processor Tests
+Tests batching, overflow policies and draining on shutdown
+"""
+
+import pytest
+
+from services import post_processor as post_processor_module
+from services.clickhouse_client import LoopPattern, RequestLog
+from services.laravel_logger import LaravelRequestLog
+from services.post_processor import PostProcessor
+from services.run_tracker import StepCompletion
+
+
+def make_log(run_id: str = "run-1") -> RequestLog:
+    return RequestLog(
+        run_id=run_id, step_number=1, request_id="req", team_id="team-1",
+        user_id="user-1", api_key_id="key-1", model="gpt-4o", endpoint="/v1/chat/completions",
+    )
+
+
+@pytest.fixture
+def sinks(monkeypatch):
+    """Batches handed to each sink"""
+    calls = {"steps": [], "logs": [], "dashboard": [], "patterns": []}
+
+    async def complete_steps(steps):
+        calls["steps"].append(list(steps))
+
+    async def log_requests(logs):
+        calls["logs"].append(list(logs))
+
+    def log_dashboard(logs):
+        calls["dashboard"].append(list(logs))
+        return 0
+
+    async def log_loop_pattern(pattern):
+        calls["patterns"].append(pattern)
+
+    monkeypatch.setattr(post_processor_module.run_tracker, "complete_steps", complete_steps)
+    monkeypatch.setattr(post_processor_module.clickhouse_client, "log_requests", log_requests)
+    monkeypatch.setattr(post_processor_module.clickhouse_client, "log_loop_pattern", log_loop_pattern)
+    monkeypatch.setattr(post_processor_module.laravel_logger, "log_requests", log_dashboard)
+    monkeypatch.setattr(post_processor_module.run_summaries, "record_step", lambda log: None)
+    return calls
+
+
+@pytest.mark.asyncio
+class TestPostProcessor:
+    """Test the bounded post-processing stage"""
+
+    async def test_jobs_are_batched(self, sinks):
+        processor = PostProcessor(workers=1, queue_size=100, batch_size=50)
+        await processor.start()
+
+        for step in range(1, 6):
+            await processor.submit(StepCompletion("run-1", tokens=step), make_log())
+        await processor.stop()
+
+        assert [len(batch) for batch in sinks["steps"]] == [5]
+        assert [step.tokens for step in sinks["steps"][0]] == [1, 2, 3, 4, 5]
+        assert [len(batch) for batch in sinks["logs"]] == [5]
+
+    async def test_overflow_policies(self, sinks):
+        """A full queue runs must-keep jobs inline and drops best-effort ones"""
+        processor = PostProcessor(workers=1, queue_size=1, batch_size=50)
+        await processor.start()
+
+        await processor.submit(
+            StepCompletion("run-1", tokens=1),
+            StepCompletion("run-1", tokens=2),
+            LaravelRequestLog(request_id="req", model="gpt-4o", run_id="run-1"),
+            LoopPattern(run_id="run-1", team_id="team-1", pattern_type="tool_spam"),
+        )
+        # The overflowing step ran in the caller, before the queued one
+        assert [[step.tokens for step in batch] for batch in sinks["steps"]] == [[2]]
+
+        await processor.stop()
+        assert [[step.tokens for step in batch] for batch in sinks["steps"]] == [[2], [1]]
+        assert sinks["dashboard"] == []
+        assert sinks["patterns"] == []
+
+    async def test_inline_when_stopped(self, sinks):
+        processor = PostProcessor(workers=2, queue_size=100, batch_size=50)
+
+        await processor.submit(make_log())
+
+        assert len(sinks["logs"]) == 1
+
+    async def test_failing_sink_does_not_block_others(self, sinks, monkeypatch):
+        async def failing(steps):
+            raise RuntimeError("redis exploded")
+
+        monkeypatch.setattr(post_processor_module.run_tracker, "complete_steps", failing)
+        processor = PostProcessor(workers=1, queue_size=100, batch_size=50)
+        await processor.start()
+
+        await processor.submit(StepCompletion("run-1"), make_log())
+        await processor.stop()
+
+        assert len(sinks["logs"]) == 1
+        assert processor.depth == 0
@@ -0,0 +1,71 @@
+"""
+Profiler and loop lag monitor tests
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from services.profiler import SamplingProfiler, LoopLagMonitor
+
+
+def _busy(ms: float):
+    """Block the event loop thread"""
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+class TestSamplingProfiler:
+    """Test sampling profiler sessions"""
+    
+    @pytest.mark.asyncio
+    async def test_collapsed_stacks_attribute_task(self):
+        """Samples are collapsed with the running task as root frame"""
+        profiler = SamplingProfiler()
+        
+        async def burner():
+            for _ in range(10):
+                _busy(10)
+                await asyncio.sleep(0)
+        
+        task = asyncio.create_task(burner())
+        summary = await profiler.profile(0.15, interval_ms=2)
+        await task
+        
+        assert summary["samples"] > 0
+        collapsed = profiler.collapsed()
+        assert "_busy" in collapsed
+        assert "task:" in collapsed.splitlines()[0]
+    
+    @pytest.mark.asyncio
+    async def test_single_session(self):
+        """A second concurrent session is rejected"""
+        profiler = SamplingProfiler()
+        first = asyncio.create_task(profiler.profile(0.05))
+        await asyncio.sleep(0.01)
+        
+        with pytest.raises(RuntimeError):
+            await profiler.profile(0.05)
+        await first
+
+
+class TestLoopLagMonitor:
+    """Test event-loop stall detection"""
+    
+    @pytest.mark.asyncio
+    async def test_stall_captures_blocking_stack(self):
+        """A blocking call longer than the threshold is recorded"""
+        monitor = LoopLagMonitor(interval_ms=10, threshold_ms=30)
+        monitor.start()
+        await asyncio.sleep(0.03)
+        
+        _busy(120)
+        await asyncio.sleep(0.03)
+        await monitor.stop()
+        
+        snapshot = monitor.snapshot()
+        assert snapshot["stalls"]
+        assert any("_busy" in frame for frame in snapshot["stalls"][0]["stack"])
+        assert snapshot["max_lag_ms"] >= 30
@@ -0,0 +1,178 @@
+"""
+Provider Limits Tests
+Tests header parsing, pacing, the retry budget and proxy retries
+"""
+
+import httpx
+import pytest
+
+from config import settings
+from services.multi_provider import MultiProviderError, MultiProviderProxy
+from services.provider_limits import (
+    KeyLimits,
+    ProviderLimitTracker,
+    RetryBudget,
+    parse_duration,
+    parse_retry_after,
+)
+
+
+class TestParsing:
+    """Test provider header formats"""
+
+    def test_durations(self):
+        assert parse_duration("20ms") == pytest.approx(0.02)
+        assert parse_duration("1.5s") == pytest.approx(1.5)
+        assert parse_duration("6m0s") == pytest.approx(360)
+        assert parse_duration("2") == pytest.approx(2)
+        assert parse_duration("soon") is None
+        assert parse_duration(None) is None
+
+    def test_retry_after(self):
+        assert parse_retry_after({"retry-after": "3"}) == 3
+        assert parse_retry_after({"retry-after-ms": "250", "retry-after": "1"}) == 0.25
+        assert parse_retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) is None
+        assert parse_retry_after({}) is None
+
+    def test_openai_headers(self):
+        limits = KeyLimits()
+        limits.update({
+            "x-ratelimit-limit-requests": "500",
+            "x-ratelimit-remaining-requests": "499",
+            "x-ratelimit-reset-requests": "120ms",
+            "x-ratelimit-limit-tokens": "30000",
+            "x-ratelimit-remaining-tokens": "29000",
+            "x-ratelimit-reset-tokens": "2s",
+        }, now=100.0)
+
+        assert limits.requests.limit == 500
+        assert limits.requests.remaining == 499
+        assert limits.requests.reset_at == pytest.approx(100.12)
+        assert limits.tokens.remaining == 29000
+        assert limits.tokens.reset_at == pytest.approx(102.0)
+
+
+class TestPacing:
+    """Test waits derived from the reported budget"""
+
+    def test_no_wait_with_budget(self):
+        tracker = ProviderLimitTracker()
+        tracker.observe("openai", "sk-1", 200, {
+            "x-ratelimit-limit-requests": "100",
+            "x-ratelimit-remaining-requests": "90",
+            "x-ratelimit-reset-requests": "10s",
+        })
+
+        assert tracker.reserve("openai", "sk-1", tokens=10) == 0.0
+
+    def test_exhausted_waits_for_reset(self):
+        tracker = ProviderLimitTracker()
+        tracker.observe("openai", "sk-1", 200, {
+            "x-ratelimit-limit-requests": "100",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "5s",
+        })
+
+        assert 4.5 < tracker.reserve("openai", "sk-1", tokens=10) <= 5.0
+
+    def test_low_budget_spreads_requests(self):
+        """Near the limit, what is left is spread over the time to reset"""
+        tracker = ProviderLimitTracker()
+        tracker.observe("openai", "sk-1", 200, {
+            "x-ratelimit-limit-requests": "100",
+            "x-ratelimit-remaining-requests": "4",
+            "x-ratelimit-reset-requests": "8s",
+        })
+
+        first = tracker.reserve("openai", "sk-1", tokens=10)
+        second = tracker.reserve("openai", "sk-1", tokens=10)
+        third = tracker.reserve("openai", "sk-1", tokens=10)
+
+        assert first == 0.0
+        assert 1.5 < second <= 2.0           # 8s spread over 4 left
+        assert 3.5 < third <= 2.0 + 8 / 3    # then over 3 left, after the second
+
+    def test_retry_after_blocks_key(self):
+        tracker = ProviderLimitTracker()
+        tracker.observe("groq", "gsk-1", 429, {"retry-after": "3"})
+
+        assert tracker.reserve("groq", "gsk-1", tokens=10) > 2.5
+        assert tracker.reserve("groq", "gsk-2", tokens=10) == 0.0
+
+    def test_keys_are_not_stored(self):
+        tracker = ProviderLimitTracker()
+        tracker.observe("openai", "sk-secret", 200, {})
+
+        assert all(b"sk-secret" not in digest for _, digest in tracker._keys)
+
+
+class TestRetryBudget:
+    """Test the retry token bucket"""
+
+    def test_budget_exhausts_and_refills(self):
+        budget = RetryBudget(ratio=0.5, burst=1)
+
+        assert budget.withdraw()
+        assert not budget.withdraw()
+
+        budget.deposit()
+        budget.deposit()
+        assert budget.withdraw()
+
+
+@pytest.mark.asyncio
+class TestProxyRetries:
+    """Test retries against a mocked provider"""
+
+    def make_proxy(self, handler) -> MultiProviderProxy:
+        proxy = MultiProviderProxy()
+        proxy._clients[settings.OPENAI_BASE_URL] = httpx.AsyncClient(
+            base_url=settings.OPENAI_BASE_URL, transport=httpx.MockTransport(handler),
+        )
+        return proxy
+
+    async def test_retries_429_then_succeeds(self, monkeypatch):
+        monkeypatch.setattr(settings, "UPSTREAM_RETRY_BASE_DELAY", 0.001)
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                return httpx.Response(429, headers={"retry-after-ms": "1"}, json={"error": "slow down"})
+            return httpx.Response(200, json={"choices": [], "usage": {"total_tokens": 1}})
+
+        proxy = self.make_proxy(handler)
+        completion = await proxy.chat_completion_raw(
+            {"model": "gpt-4o", "messages": []}, run_id="run-1", api_key="sk-retry",
+        )
+
+        assert len(calls) == 2
+        assert completion.data["usage"]["total_tokens"] == 1
+        await proxy.close()
+
+    async def test_long_retry_after_is_returned(self):
+        """A retry-after beyond the retry window goes back to the client"""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(429, headers={"retry-after": "60"}, json={"error": "quota"})
+
+        proxy = self.make_proxy(handler)
+        with pytest.raises(MultiProviderError) as exc:
+            await proxy.chat_completion_raw(
+                {"model": "gpt-4o", "messages": []}, run_id="run-1", api_key="sk-quota",
+            )
+
+        assert len(calls) == 1
+        assert exc.value.status_code == 429
+        assert exc.value.retry_after == 60
+
+        # The key is now blocked locally: the next call is refused without a request
+        with pytest.raises(MultiProviderError) as exc:
+            await proxy.chat_completion_raw(
+                {"model": "gpt-4o", "messages": []}, run_id="run-1", api_key="sk-quota",
+            )
+        assert len(calls) == 1
+        assert exc.value.retry_after > 50
+        await proxy.close()
@@ -0,0 +1,109 @@
+"""
+Rate Limiter Tests
+Tests GCRA limits, the per-worker pre-check and x-ratelimit headers
+"""
+
+import pytest
+
+from services.rate_limiter import RateLimit, RateLimiter
+from services.run_tracker import RunTracker
+
+
+def request_limit(limit: int = 3) -> RateLimit:
+    return RateLimit("key", "requests", "agentwall:rl:key:k1:rps", limit, 1000)
+
+
+def token_limit(cost: int, limit: int = 1000) -> RateLimit:
+    return RateLimit("team", "tokens", "agentwall:rl:team:t1:tpm", limit, 60000, cost=cost)
+
+
+class TestLocalGCRA:
+    """Test the in-process algorithm (used while Redis is down)"""
+
+    def test_burst_then_reject(self):
+        limiter = RateLimiter()
+
+        results = [limiter.check_local([request_limit(3)]) for _ in range(4)]
+
+        assert [r.allowed for r in results] == [True, True, True, False]
+        assert 0 < results[-1].retry_after_ms <= 334
+
+    def test_denied_request_consumes_nothing(self):
+        """All-or-nothing: a rejected token charge leaves the request limit untouched"""
+        limiter = RateLimiter()
+        limiter.check_local([token_limit(900)])
+
+        denied = limiter.check_local([request_limit(3), token_limit(200)])
+
+        assert denied.denied.kind == "tokens"
+        assert denied.statuses[0].remaining == 3
+
+    def test_forced_charge_never_rejects(self):
+        limiter = RateLimiter()
+
+        assert limiter.check_local([token_limit(5000)], force=True).allowed
+        assert not limiter.check_local([token_limit(10)]).allowed
+
+
+class TestPrecheck:
+    """Test per-worker rejection of keys known to be over their limit"""
+
+    def test_denial_is_remembered(self):
+        limiter = RateLimiter()
+        limit = request_limit(1)
+        # Script reply: denied=1, retry_after=500ms, remaining/reset per limit
+        limiter.parse([limit], [1, 500, 0, 1500])
+
+        result = limiter.precheck([limit])
+
+        assert not result.allowed
+        assert result.denied is limit
+
+    def test_allowed_not_blocked(self):
+        limiter = RateLimiter()
+        limit = request_limit()
+        limiter.parse([limit], [0, 0, 2, 334])
+
+        assert limiter.precheck([limit]) is None
+
+
+class TestHeaders:
+    """Test x-ratelimit-* headers"""
+
+    def test_tightest_limit_reported(self):
+        limiter = RateLimiter()
+        limits = [request_limit(10), RateLimit("team", "requests", "t", 50, 1000), token_limit(100)]
+
+        headers = limiter.parse(limits, [0, 0, 9, 100, 3, 80, 900, 6000]).headers()
+
+        assert headers["x-ratelimit-limit-requests"] == "50"
+        assert headers["x-ratelimit-remaining-requests"] == "3"
+        assert headers["x-ratelimit-remaining-tokens"] == "900"
+        assert headers["x-ratelimit-reset-tokens"] == "6s"
+        assert "retry-after" not in headers
+
+    def test_retry_after_on_denial(self):
+        limiter = RateLimiter()
+
+        headers = limiter.parse([request_limit()], [1, 1200, 0, 1900]).headers()
+
+        assert headers["retry-after"] == "2"
+
+
+@pytest.mark.asyncio
+class TestRateLimitedAdmission:
+    """Test rate limits applied by RunTracker.process_step"""
+
+    async def test_rejected_step_not_counted(self):
+        tracker = RunTracker()
+        limits = [RateLimit("key", "requests", "agentwall:rl:key:adm:rps", 2, 1000)]
+
+        for _ in range(2):
+            _, result = await tracker.process_step("run-1", "team-1", "user-1", rate_limits=limits)
+            assert result.allowed
+
+        _, result = await tracker.process_step("run-1", "team-1", "user-1", rate_limits=limits)
+
+        assert not result.allowed
+        assert result.rate_limit.denied.scope == "key"
+        assert (await tracker.get_run_state("run-1")).step_count == 2
@@ -0,0 +1,168 @@
+"""
+Run State Encoding Tests
+Tests the binary run-state format and JSON migration
+"""
+
+import json
+import pytest
+from datetime import datetime
+from decimal import Decimal
+
+from services.loop_detector import (
+    CYCLE_MAX_PERIOD,
+    CycleState,
+    PromptFingerprint,
+    hash_text,
+    loop_detector,
+)
+from services.run_state import (
+    HISTORY_SIZE,
+    MAX_STRING_BYTES,
+    RunState,
+    decode_state,
+    encode_state,
+)
+
+
+def make_state(**kwargs) -> RunState:
+    return RunState(
+        run_id="run-1",
+        team_id="team-1",
+        user_id="user-1",
+        agent_id="agent-1",
+        **kwargs,
+    )
+
+
+class TestRunStateEncoding:
+    """Test encode/decode round trips"""
+    
+    def test_round_trip(self):
+        state = make_state(
+            step_count=7,
+            total_tokens=1234,
+            total_cost=Decimal("0.042"),
+            started_at=datetime(2026, 1, 5, 12, 0, 0, 123000),
+            last_activity=datetime(2026, 1, 5, 12, 3, 0),
+            status="killed",
+            kill_reason="loop_detected:exact_prompt",
+            loop_detected=True,
+            prompt_history=[PromptFingerprint.from_text("What is 2+2?")],
+            response_history=[hash_text("4")],
+            cycle=CycleState([11, 22, 11], [0, 1] + [0] * (CYCLE_MAX_PERIOD - 2)),
+            max_steps=50,
+            max_budget=Decimal("25.5"),
+            timeout_seconds=300,
+        )
+        
+        decoded = decode_state("run-1", encode_state(state))
+        
+        assert decoded == state
+    
+    def test_cost_rounds_up_to_micro_dollars(self):
+        """Sub-micro-dollar costs never round down (budgets don't under-count)"""
+        state = make_state(total_cost=Decimal("0.0000015"))
+        
+        decoded = decode_state("run-1", encode_state(state))
+        
+        assert decoded.total_cost == Decimal("0.000002")
+    
+    def test_words_kept_for_similarity_window_only(self):
+        prompts = [PromptFingerprint.from_text(f"prompt number {i}") for i in range(HISTORY_SIZE)]
+        state = make_state(prompt_history=prompts)
+        
+        decoded = decode_state("run-1", encode_state(state))
+        
+        assert [p.words is not None for p in decoded.prompt_history] == [False, False, True, True, True]
+        assert [p.exact for p in decoded.prompt_history] == [p.exact for p in prompts]
+    
+    def test_v1_value_decodes_without_cycle(self):
+        """v1 values (no cycle section) are still readable"""
+        state = make_state(step_count=4, cycle=CycleState([1, 2], [0] * CYCLE_MAX_PERIOD))
+        v2 = encode_state(state)
+        v1 = b"\x01" + v2[1:-(1 + 8 * 2 + CYCLE_MAX_PERIOD)]
+        
+        decoded = decode_state("run-1", v1)
+        
+        assert decoded.step_count == 4
+        assert decoded.cycle == CycleState()
+    
+    def test_long_strings_are_cut(self):
+        """Client-supplied ids longer than the length prefix allows still encode"""
+        state = make_state(kill_reason="tool_spam:" + "t" * 70000)
+        state.agent_id = "é" * 70000
+        
+        decoded = decode_state("run-1", encode_state(state))
+        
+        assert decoded.agent_id == "é" * (MAX_STRING_BYTES // 2)
+        assert decoded.kill_reason == ("tool_spam:" + "t" * 70000)[:MAX_STRING_BYTES]
+        assert decoded.team_id == "team-1"
+    
+    def test_unknown_version_rejected(self):
+        data = bytearray(encode_state(make_state()))
+        data[0] = 99
+        
+        with pytest.raises(ValueError):
+            decode_state("run-1", bytes(data))
+    
+    def test_much_smaller_than_json(self):
+        """Full history: binary value is far smaller than the legacy JSON"""
+        prompts = [f"step {i} " + "please search the web for results " * 14 for i in range(HISTORY_SIZE)]
+        responses = [f"answer {i} " + "x" * 490 for i in range(HISTORY_SIZE)]
+        legacy = _legacy_json(prompts, responses)
+        
+        binary = encode_state(decode_state("run-1", legacy))
+        
+        assert len(binary) * 5 < len(legacy)
+
+
+class TestLegacyMigration:
+    """Test reading run states written as JSON"""
+    
+    def test_json_value_is_migrated(self):
+        data = _legacy_json(["What is 2+2?", "What is 3+3?"], ["4"])
+        
+        state = decode_state("run-1", data)
+        
+        assert state.step_count == 2
+        assert state.total_cost == Decimal("0.0123")
+        assert len(state.prompt_history) == 2
+        assert state.response_history == [hash_text("4")]
+    
+    def test_loop_detection_after_migration(self):
+        """Fingerprinted history detects the same loops as the texts did"""
+        state = decode_state("run-1", _legacy_json(["What is 2+2?", "What is 3+3?"], []))
+        
+        result = loop_detector.check_history(
+            current_prompt="what is 2+2?",
+            current_response="",
+            prompt_history=state.prompt_history,
+            response_history=state.response_history,
+        )
+        
+        assert result.is_loop
+        assert result.loop_type == "exact_prompt"
+
+
+def _legacy_json(prompts: list[str], responses: list[str]) -> bytes:
+    """A run state as stored by the JSON encoding"""
+    return json.dumps({
+        "run_id": "run-1",
+        "team_id": "team-1",
+        "user_id": "user-1",
+        "agent_id": "agent-1",
+        "step_count": 2,
+        "total_tokens": 300,
+        "total_cost": "0.0123",
+        "started_at": "2026-01-05T12:00:00",
+        "last_activity": "2026-01-05T12:01:00",
+        "status": "running",
+        "kill_reason": "",
+        "loop_detected": False,
+        "budget_exceeded": False,
+        "recent_prompts": prompts,
+        "recent_responses": responses,
+        "max_steps": 30,
+        "max_budget": "10.0",
+        "timeout_seconds": 120,
+    }).encode()
@@ -0,0 +1,121 @@
+"""
+Run Summary Aggregator Tests
+Tests step coalescing, status updates and flush/eviction behaviour
+"""
+
+from decimal import Decimal
+
+import pytest
+
+from services import run_summary
+from services.clickhouse_client import RequestLog
+from services.run_state import RunState
+from services.run_summary import RunSummaryAggregator
+
+
+def make_log(run_id: str = "run-1", **kwargs) -> RequestLog:
+    fields = dict(
+        run_id=run_id, step_number=1, request_id="req", team_id="team-1",
+        user_id="user-1", api_key_id="key-1", model="gpt-4o", endpoint="/v1/chat/completions",
+        prompt_tokens=10, completion_tokens=5, cost_usd=Decimal("0.001"), latency_ms=100,
+    )
+    fields.update(kwargs)
+    return RequestLog(**fields)
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    """Batches passed to insert_run_summaries"""
+    batches = []
+
+    async def insert_run_summaries(summaries):
+        batches.append(summaries)
+
+    monkeypatch.setattr(run_summary.clickhouse_client, "insert_run_summaries", insert_run_summaries)
+    return batches
+
+
+@pytest.mark.asyncio
+class TestRunSummaryAggregator:
+    """Test coalesced run_summary snapshots"""
+
+    async def test_steps_collapse_into_one_row(self, inserted):
+        aggregator = RunSummaryAggregator(max_runs=100, idle_seconds=600)
+        for _ in range(10):
+            aggregator.record_step(make_log())
+        aggregator.record_step(make_log(run_id="run-2", dlp_triggered=True))
+
+        assert await aggregator.flush() == 2
+
+        rows = {row.run_id: row for row in inserted[0]}
+        assert rows["run-1"].total_steps == 10
+        assert rows["run-1"].total_tokens == 150
+        assert rows["run-1"].total_cost_usd == Decimal("0.010")
+        assert rows["run-1"].total_latency_ms == 1000
+        assert rows["run-2"].dlp_triggered
+
+    async def test_only_changed_runs_are_rewritten(self, inserted):
+        """Later snapshots carry cumulative totals under the same segment"""
+        aggregator = RunSummaryAggregator(max_runs=100, idle_seconds=600)
+        aggregator.record_step(make_log())
+        aggregator.record_step(make_log(run_id="run-2"))
+        await aggregator.flush()
+
+        aggregator.record_step(make_log())
+        await aggregator.flush()
+        await aggregator.flush()
+
+        assert [len(batch) for batch in inserted] == [2, 1]
+        first = next(row for row in inserted[0] if row.run_id == "run-1")
+        second = inserted[1][0]
+        assert second.total_steps == 2
+        assert second.segment_id == first.segment_id
+
+    async def test_kill_status_from_state(self, inserted):
+        aggregator = RunSummaryAggregator(max_runs=100, idle_seconds=600)
+        aggregator.record_step(make_log())
+        aggregator.record_state(RunState(
+            run_id="run-1", team_id="team-1", user_id="user-1",
+            status="killed", kill_reason="budget_exceeded", budget_exceeded=True,
+        ))
+
+        await aggregator.flush()
+
+        row = inserted[0][0]
+        assert row.total_steps == 1
+        assert row.status == "killed"
+        assert row.kill_reason == "budget_exceeded"
+        assert row.budget_exceeded
+
+    async def test_failed_flush_is_retried(self, monkeypatch):
+        aggregator = RunSummaryAggregator(max_runs=100, idle_seconds=600)
+        batches = []
+
+        async def failing(summaries):
+            raise OSError("connection refused")
+
+        monkeypatch.setattr(run_summary.clickhouse_client, "insert_run_summaries", failing)
+        aggregator.record_step(make_log())
+        assert await aggregator.flush() == 0
+        assert aggregator.pending == 1
+
+        async def insert(summaries):
+            batches.append(summaries)
+
+        monkeypatch.setattr(run_summary.clickhouse_client, "insert_run_summaries", insert)
+        aggregator.record_step(make_log())
+        assert await aggregator.flush() == 1
+        assert batches[0][0].total_steps == 2
+
+    async def test_idle_runs_start_new_segment(self, inserted):
+        """A run dropped from memory comes back as a new segment, not a reset"""
+        aggregator = RunSummaryAggregator(max_runs=100, idle_seconds=0)
+        aggregator.record_step(make_log())
+        await aggregator.flush()
+        assert len(aggregator) == 0
+
+        aggregator.record_step(make_log())
+        await aggregator.flush()
+
+        assert inserted[1][0].total_steps == 1
+        assert inserted[1][0].segment_id != inserted[0][0].segment_id
@@ -0,0 +1,261 @@
+"""
+Run Tracker Tests
+Tests the local fallback store and Redis outage handling
+"""
+
+import pytest
+import redis.asyncio as redis
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from services.loop_detector import PromptFingerprint
+from services.run_tracker import (
+    HISTORY_SIZE,
+    LocalRunStore,
+    RunState,
+    RunTracker,
+    StepCompletion,
+    merge_states,
+)
+
+
+class FakeRedis:
+    """Minimal async Redis stand-in that can be switched off"""
+
+    def __init__(self):
+        self.data = {}
+        self.down = False
+        self.round_trips = 0
+
+    def _check(self):
+        if self.down:
+            raise redis.ConnectionError("Connection refused")
+
+    async def ping(self):
+        self._check()
+        return True
+
+    async def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    async def setex(self, key, ttl, value):
+        self._check()
+        self.data[key] = value
+
+    async def mget(self, keys):
+        self._check()
+        self.round_trips += 1
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def close(self):
+        pass
+
+
+class FakePipeline:
+    """Queues SETEX calls; execute() is one round trip"""
+
+    def __init__(self, redis_):
+        self.redis = redis_
+        self.calls = []
+
+    def setex(self, key, ttl, value):
+        self.calls.append((key, value))
+
+    async def execute(self, raise_on_error=True):
+        self.redis._check()
+        self.redis.round_trips += 1
+        for key, value in self.calls:
+            self.redis.data[key] = value
+        return [True] * len(self.calls)
+
+
+def make_state(run_id: str = "run-1", **kwargs) -> RunState:
+    return RunState(run_id=run_id, team_id="team-1", user_id="user-1", **kwargs)
+
+
+class TestLocalRunStore:
+    """Test the bounded LRU + TTL store"""
+
+    def test_get_returns_copy(self):
+        """Mutating a returned state does not change the store"""
+        store = LocalRunStore(max_runs=10, ttl_seconds=60)
+        store.put(make_state(step_count=3))
+
+        state = store.get("run-1")
+        state.step_count = 99
+
+        assert store.get("run-1").step_count == 3
+
+    def test_lru_eviction(self):
+        """Least recently used run is evicted first"""
+        store = LocalRunStore(max_runs=2, ttl_seconds=60)
+        store.put(make_state("a"))
+        store.put(make_state("b"))
+        store.get("a")  # a is now most recent
+        store.put(make_state("c"))
+
+        assert store.get("b") is None
+        assert store.get("a") is not None
+        assert store.get("c") is not None
+        assert store.evictions == 1
+
+    def test_ttl_expiry(self):
+        """Expired runs are dropped on access"""
+        store = LocalRunStore(max_runs=10, ttl_seconds=0)
+        store.put(make_state())
+
+        assert store.get("run-1") is None
+        assert len(store) == 0
+
+    def test_history_ring_buffer(self):
+        """History is capped at HISTORY_SIZE entries"""
+        store = LocalRunStore(max_runs=10, ttl_seconds=60)
+        prompts = [PromptFingerprint.from_text(f"prompt {i}") for i in range(HISTORY_SIZE + 3)]
+        store.put(make_state(prompt_history=prompts))
+
+        assert store.get("run-1").prompt_history == prompts[-HISTORY_SIZE:]
+
+    def test_clean_write_keeps_dirty_flag(self):
+        """A clean write does not hide a pending write-behind"""
+        store = LocalRunStore(max_runs=10, ttl_seconds=60)
+        store.put(make_state(), dirty=True)
+        store.put(make_state())
+
+        assert store.dirty_run_ids() == ["run-1"]
+
+    def test_mark_clean_ignores_stale_version(self):
+        """A write after the version was read stays dirty"""
+        store = LocalRunStore(max_runs=10, ttl_seconds=60)
+        store.put(make_state(step_count=1), dirty=True)
+        version = store.version("run-1")
+        store.put(make_state(step_count=2), dirty=True)
+
+        store.mark_clean("run-1", version, make_state(step_count=1))
+
+        assert store.dirty_run_ids() == ["run-1"]
+        assert store.get("run-1").step_count == 2
+
+
+class TestMergeStates:
+    """Test write-behind reconciliation"""
+
+    def test_counters_take_max(self):
+        now = datetime.utcnow()
+        remote = make_state(step_count=5, total_tokens=100, total_cost=Decimal("0.5"), last_activity=now)
+        local = make_state(step_count=3, total_tokens=300, total_cost=Decimal("0.2"),
+                           last_activity=now + timedelta(seconds=1))
+
+        merged = merge_states(remote, local)
+
+        assert merged.step_count == 5
+        assert merged.total_tokens == 300
+        assert merged.total_cost == Decimal("0.5")
+
+    def test_kill_wins(self):
+        now = datetime.utcnow()
+        remote = make_state(status="killed", kill_reason="manual", last_activity=now)
+        local = make_state(last_activity=now + timedelta(seconds=1))
+
+        merged = merge_states(remote, local)
+
+        assert merged.status == "killed"
+        assert merged.kill_reason == "manual"
+
+
+@pytest.mark.asyncio
+class TestRedisOutage:
+    """Test governance while Redis is unavailable"""
+
+    async def test_step_limit_enforced_without_redis(self):
+        """Step limits still apply when Redis never connected"""
+        tracker = RunTracker()
+        limits = {"max_steps": 2}
+
+        for _ in range(2):
+            _, result = await tracker.process_step("run-1", "team-1", "user-1", limits=limits)
+            assert result.allowed
+
+        _, result = await tracker.process_step("run-1", "team-1", "user-1", limits=limits)
+        assert not result.allowed
+        assert "Step limit" in result.reason
+
+    async def test_outage_mid_run_keeps_state(self):
+        """A run continues from its last known state when Redis drops"""
+        tracker = RunTracker()
+        fake = FakeRedis()
+        tracker._redis = fake
+        tracker._connected = True
+
+        state, _ = await tracker.process_step("run-1", "team-1", "user-1")
+        assert state.step_count == 1
+
+        fake.down = True
+        state, result = await tracker.process_step("run-1", "team-1", "user-1")
+
+        assert result.allowed
+        assert state.step_count == 2
+        assert not tracker._connected
+        await tracker.disconnect()
+
+    async def test_reconcile_writes_back(self):
+        """Local changes made during an outage reach Redis on reconcile"""
+        tracker = RunTracker()
+        fake = FakeRedis()
+        tracker._redis = fake
+        tracker._connected = True
+
+        await tracker.process_step("run-1", "team-1", "user-1")
+        fake.down = True
+        await tracker.process_step("run-1", "team-1", "user-1")
+        await tracker.kill_run("run-1", "manual")
+        await tracker.disconnect()
+
+        fake.down = False
+        assert await tracker.reconcile() == 1
+
+        tracker._connected = True
+        state = await tracker.get_run_state("run-1")
+        assert state.step_count == 2
+        assert state.status == "killed"
+        assert tracker._local.dirty_run_ids() == []
+
+
+@pytest.mark.asyncio
+class TestCompleteSteps:
+    """Test batched step completion"""
+
+    async def test_batch_is_two_round_trips(self):
+        tracker = RunTracker()
+        fake = FakeRedis()
+        tracker._redis = fake
+        tracker._connected = True
+        await tracker.process_step("run-1", "team-1", "user-1")
+        await tracker.process_step("run-2", "team-1", "user-1")
+        fake.round_trips = 0
+
+        await tracker.complete_steps([
+            StepCompletion("run-1", tokens=10, cost=Decimal("0.01"), prompt="first"),
+            StepCompletion("run-2", tokens=5),
+            StepCompletion("run-1", tokens=20, cost=Decimal("0.02"), prompt="second"),
+            StepCompletion("unknown-run", tokens=1),
+        ])
+
+        assert fake.round_trips == 2
+        state = await tracker.get_run_state("run-1")
+        assert state.total_tokens == 30
+        assert state.total_cost == Decimal("0.03")
+        assert len(state.prompt_history) == 2
+        assert (await tracker.get_run_state("run-2")).total_tokens == 5
+        await tracker.disconnect()
+
+    async def test_batch_without_redis(self):
+        tracker = RunTracker()
+        await tracker.process_step("run-1", "team-1", "user-1")
+
+        await tracker.complete_steps([StepCompletion("run-1", tokens=10), StepCompletion("run-1", tokens=5)])
+
+        assert tracker._local.get("run-1").total_tokens == 15
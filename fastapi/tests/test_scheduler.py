@@ -0,0 +1,162 @@
+"""
+Upstream Scheduler Tests
+Tests concurrency caps, fair ordering and queue limits
+"""
+
+import asyncio
+import gc
+
+import pytest
+
+from services.scheduler import SchedulerRejected, UpstreamScheduler
+
+
+def make_scheduler(**kwargs) -> UpstreamScheduler:
+    options = dict(provider_limit=1, model_limit=1, max_wait=1.0, max_queue=100)
+    options.update(kwargs)
+    return UpstreamScheduler(**options)
+
+
+@pytest.mark.asyncio
+class TestUpstreamScheduler:
+    """Test slot acquisition and dispatch"""
+
+    async def test_fast_path(self):
+        """Free capacity grants a slot without waiting"""
+        scheduler = make_scheduler(provider_limit=2, model_limit=2)
+
+        slot = await scheduler.acquire("team-a", "openai", "gpt-4o")
+
+        assert slot.wait_seconds == 0.0
+        assert scheduler.active("openai") == 1
+
+        slot.release()
+        slot.release()  # idempotent
+        assert scheduler.active("openai") == 0
+
+    async def test_release_dispatches_waiter(self):
+        """A released slot goes to the next waiter"""
+        scheduler = make_scheduler()
+        slot = await scheduler.acquire("team-a", "openai", "gpt-4o")
+
+        waiter = asyncio.create_task(scheduler.acquire("team-b", "openai", "gpt-4o"))
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 1
+
+        slot.release()
+        second = await waiter
+
+        assert scheduler.waiting == 0
+        assert scheduler.active("openai") == 1
+        second.release()
+
+    async def test_fair_order(self):
+        """A bursting tenant does not starve a tenant that arrives later"""
+        scheduler = make_scheduler()
+        holder = await scheduler.acquire("team-a", "openai", "gpt-4o")
+        order = []
+
+        async def request(team: str):
+            slot = await scheduler.acquire(team, "openai", "gpt-4o")
+            order.append(team)
+            await asyncio.sleep(0)
+            slot.release()
+
+        tasks = [asyncio.create_task(request("team-a")) for _ in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("team-b")))
+        await asyncio.sleep(0)
+
+        holder.release()
+        await asyncio.gather(*tasks)
+
+        assert order.index("team-b") <= 1
+
+    async def test_queue_timeout(self):
+        """A request that waits too long is rejected"""
+        scheduler = make_scheduler(max_wait=0.01)
+        slot = await scheduler.acquire("team-a", "openai", "gpt-4o")
+
+        with pytest.raises(SchedulerRejected) as exc:
+            await scheduler.acquire("team-b", "openai", "gpt-4o")
+
+        assert exc.value.reason == "queue_timeout"
+        assert scheduler.waiting == 0
+
+        # The abandoned waiter is skipped; capacity returns to normal
+        slot.release()
+        assert scheduler.active("openai") == 0
+
+    async def test_queue_full(self):
+        """Requests beyond the queue depth are refused at once"""
+        scheduler = make_scheduler(max_queue=1)
+        slot = await scheduler.acquire("team-a", "openai", "gpt-4o")
+        waiter = asyncio.create_task(scheduler.acquire("team-a", "openai", "gpt-4o"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(SchedulerRejected) as exc:
+            await scheduler.acquire("team-b", "openai", "gpt-4o")
+        assert exc.value.reason == "queue_full"
+
+        slot.release()
+        (await waiter).release()
+
+    async def test_rejections_do_not_delay_team(self):
+        """Refused or timed-out requests leave the team's place in line alone"""
+        scheduler = make_scheduler(max_queue=1, max_wait=0.05)
+        holder = await scheduler.acquire("team-h", "openai", "gpt-4o")
+        queued = asyncio.create_task(scheduler.acquire("team-b", "openai", "gpt-4o"))
+        await asyncio.sleep(0)
+
+        for _ in range(3):
+            with pytest.raises(SchedulerRejected) as exc:
+                await scheduler.acquire("team-a", "openai", "gpt-4o")
+            assert exc.value.reason == "queue_full"
+        with pytest.raises(SchedulerRejected) as exc:
+            await queued
+        assert exc.value.reason == "queue_timeout"
+
+        order = []
+
+        async def request(team: str):
+            slot = await scheduler.acquire(team, "openai", "gpt-4o")
+            order.append(team)
+            slot.release()
+
+        scheduler.max_queue = 10
+        scheduler.max_wait = 1.0
+        tasks = [asyncio.create_task(request(team)) for team in ("team-a", "team-b", "team-c")]
+        await asyncio.sleep(0)
+        holder.release()
+        await asyncio.gather(*tasks)
+
+        # Same finish tags: arrival order, no penalty for earlier rejections
+        assert order == ["team-a", "team-b", "team-c"]
+
+    async def test_model_cap_independent(self):
+        """A busy model does not block another model of the same provider"""
+        scheduler = make_scheduler(provider_limit=2, model_limit=1)
+        busy = await scheduler.acquire("team-a", "openai", "gpt-4o")
+
+        other = await asyncio.wait_for(
+            scheduler.acquire("team-a", "openai", "gpt-4o-mini"), timeout=0.1,
+        )
+
+        assert other.wait_seconds == 0.0
+        busy.release()
+        other.release()
+
+    async def test_release_with_owner(self):
+        """A slot tied to an owner is released when the owner is collected"""
+        scheduler = make_scheduler()
+        slot = await scheduler.acquire("team-a", "openai", "gpt-4o")
+
+        async def stream():
+            yield b""
+
+        owner = stream()
+        slot.release_with(owner)
+        del owner
+        gc.collect()
+
+        assert scheduler.active("openai") == 0
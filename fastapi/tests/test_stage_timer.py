@@ -0,0 +1,88 @@
+"""
+Stage timer tests
+Tests per-request stage breakdown and Server-Timing rendering
+"""
+
+import time
+
+from services.stage_timer import StageTimer
+
+
+class TestStageTimer:
+    """Test span recording"""
+    
+    def test_stages_sum_to_total(self):
+        """Consecutive marks partition the request time"""
+        timer = StageTimer()
+        timer.mark("auth")
+        timer.mark("admission")
+        time.sleep(0.005)
+        timer.mark("upstream")
+        timer.mark("dlp")
+        
+        breakdown = timer.as_dict()
+        assert list(breakdown) == ["auth", "admission", "upstream", "dlp"]
+        assert abs(sum(breakdown.values()) - timer.total_ms) < 0.01
+    
+    def test_overhead_excludes_upstream(self):
+        """Provider time is not counted as proxy overhead"""
+        timer = StageTimer()
+        time.sleep(0.005)
+        timer.mark("upstream_connect")
+        timer.mark("post_check")
+        
+        assert timer.upstream_ms >= 5
+        assert timer.overhead_ms < timer.upstream_ms
+        assert abs(timer.overhead_ms + timer.upstream_ms - timer.total_ms) < 0.01
+    
+    def test_repeated_stage_accumulates(self):
+        """Marking the same stage twice sums both spans"""
+        timer = StageTimer()
+        first = timer.mark("post_check")
+        timer.mark("dlp")
+        second = timer.mark("post_check")
+        
+        assert abs(timer.stage_ms("post_check") - (first + second) * 1000) < 1e-6
+    
+    def test_server_timing_header(self):
+        """Server-Timing header lists each stage with a duration"""
+        timer = StageTimer()
+        timer.mark("auth")
+        timer.mark("admission")
+        
+        header = timer.server_timing()
+        assert header.startswith("auth;dur=")
+        assert ", admission;dur=" in header
+    
+    def test_log_fields(self):
+        """Log fields cover every logged stage, defaulting to zero"""
+        timer = StageTimer()
+        timer.mark("auth")
+        
+        fields = timer.log_fields()
+        assert "auth_ms" in fields
+        assert fields["dlp_ms"] == 0.0
+        assert fields["upstream_ms"] == 0.0
+    
+    def test_each_stage_observed_once(self, monkeypatch):
+        """Non-streaming order: budget check and post check are separate stages"""
+        from services import stage_timer
+        
+        observed = []
+        
+        class Histogram:
+            def __init__(self, stage):
+                self.stage = stage
+            
+            def observe(self, elapsed):
+                observed.append(self.stage)
+        
+        monkeypatch.setattr(
+            stage_timer, "STAGE_HISTOGRAMS",
+            {stage: Histogram(stage) for stage in stage_timer.STAGE_HISTOGRAMS},
+        )
+        timer = StageTimer()
+        for stage in ("upstream", "budget_check", "dlp", "post_check"):
+            timer.mark(stage)
+        
+        assert observed == ["budget_check", "dlp", "post_check"]
@@ -0,0 +1,127 @@
+"""
+Status Page Tests
+Tests per-snapshot rendering, ETag/304, gzip and the 90-day history
+"""
+
+import gzip
+import time
+
+import pytest
+
+from api.v1 import status
+from services.health_monitor import DayBucket, HealthMonitor
+
+SNAPSHOT = {
+    "checks": {
+        "redis": {"status": "healthy", "latency_ms": 0.5},
+        "clickhouse": {"status": "unhealthy", "error": "<refused>"},
+        "openai": {"status": "configured"},
+    },
+    "history": {},
+    "checked_at": "2026-01-06T12:00:00.123456Z",
+}
+
+
+@pytest.fixture
+def monitor(monkeypatch):
+    monitor = HealthMonitor(interval=10, timeout=1)
+    monitor._snapshot = dict(SNAPSHOT)
+    # As loaded from Redis by the last sync
+    today = int(time.time() // 86400)
+    monitor.daily._today = today
+    for day in (2, 1, 0):
+        monitor.daily._slots["redis"][(today - day) % 90] = DayBucket(
+            today - day, checks=1, ok=1, latency_ms=1.0 + day,
+        )
+    monkeypatch.setattr(status, "health_monitor", monitor)
+    monkeypatch.setattr(status, "_rendered", {})
+    return monitor
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Count HTML renders"""
+    calls = []
+    render = status._render_html
+
+    def counting(snapshot):
+        calls.append(snapshot)
+        return render(snapshot)
+
+    monkeypatch.setattr(status, "_render_html", counting)
+    return calls
+
+
+class TestStatusPage:
+    """Test /status caching"""
+
+    def test_rendered_once_per_snapshot(self, client, monitor, renders):
+        for _ in range(3):
+            assert client.get("/status").status_code == 200
+        assert len(renders) == 1
+
+        monitor._snapshot = dict(SNAPSHOT)
+        client.get("/status")
+        assert len(renders) == 2
+
+    def test_etag_not_modified(self, client, monitor):
+        first = client.get("/status")
+        etag = first.headers["etag"]
+
+        second = client.get("/status", headers={"If-None-Match": etag})
+        bare = client.get("/status", headers={"If-None-Match": etag.removeprefix("W/")})
+
+        assert second.status_code == 304
+        assert second.content == b""
+        assert bare.status_code == 304
+        assert "max-age" in first.headers["cache-control"]
+
+    def test_etag_same_across_workers(self, client, monitor, monkeypatch):
+        """Worker uptime, check time and latencies do not change the ETag"""
+        first = client.get("/status")
+
+        monitor._snapshot = {
+            **SNAPSHOT,
+            "checks": {**SNAPSHOT["checks"], "redis": {"status": "healthy", "latency_ms": 0.9}},
+            "checked_at": "2026-01-06T12:00:04.5Z",
+        }
+        monkeypatch.setattr(status, "_start_time", status._start_time.replace(year=2020))
+        other = client.get("/status")
+
+        assert other.text != first.text
+        assert other.headers["etag"] == first.headers["etag"]
+        assert other.headers["etag"].startswith('W/"')
+
+    def test_gzip(self, client, monitor):
+        response = client.get("/status", headers={"Accept-Encoding": "gzip"})
+        page = status._rendered["html"][1]
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert gzip.decompress(page.gzipped) == page.body
+        assert "AgentWall Status" in response.text
+
+    def test_history_and_escaping(self, client, monitor):
+        html = client.get("/status", headers={"Accept-Encoding": "identity"}).text
+
+        assert "Last 90 days" in html
+        assert "&lt;refused&gt;" in html
+        assert "<polyline" in html
+        assert "no data" in html
+
+
+class TestStatusJson:
+    """Test /status/json"""
+
+    def test_history_days(self, client, monitor):
+        response = client.get("/status/json")
+
+        assert response.status_code == 200
+        body = response.json()
+        assert body["status"] == "partial_outage"
+        redis = body["history"]["redis"]
+        assert len(redis["days"]) == 90
+        assert redis["uptime"] == 100.0
+        assert redis["latency_ms"] == 2.0
+        assert redis["days"][-1]["latency_ms"] == 1.0
+        assert body["history"]["clickhouse"]["uptime"] is None
@@ -0,0 +1,156 @@
+"""
+Stream Registry Tests
+Tests that kills and client disconnects abort in-flight upstream streams
+"""
+
+import asyncio
+import pytest
+
+from services import stream_registry as stream_registry_module
+from services.stream_registry import CLIENT_DISCONNECTED, DisconnectAwareResponse, StreamRegistry
+
+
+class FakeResponse:
+    """Records aclose() calls"""
+
+    def __init__(self):
+        self.closed = False
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+class TestStreamRegistry:
+    """Test run_id -> stream handle bookkeeping and aborts"""
+
+    async def test_abort_closes_upstream(self):
+        registry = StreamRegistry()
+        handle = registry.register("run-1")
+        response = FakeResponse()
+        handle.attach(response)
+
+        assert registry.abort_run("run-1", "manual") == 1
+        await asyncio.sleep(0)
+
+        assert handle.aborted
+        assert handle.abort_reason == "manual"
+        assert response.closed
+
+    async def test_abort_only_matching_run(self):
+        registry = StreamRegistry()
+        other = registry.register("run-2")
+
+        assert registry.abort_run("run-1", "manual") == 0
+        assert not other.aborted
+
+    async def test_attach_after_abort_closes_immediately(self):
+        """A kill that arrives before the upstream answers still applies"""
+        registry = StreamRegistry()
+        handle = registry.register("run-1")
+        registry.abort_run("run-1", "manual")
+
+        response = FakeResponse()
+        handle.attach(response)
+        await asyncio.sleep(0)
+
+        assert response.closed
+
+    async def test_close_task_referenced_until_done(self):
+        registry = StreamRegistry()
+        handle = registry.register("run-1")
+        response = FakeResponse()
+        handle.attach(response)
+
+        registry.abort_run("run-1", "manual")
+        assert len(stream_registry_module._closing) == 1
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        assert response.closed
+        assert not stream_registry_module._closing
+
+    async def test_abort_is_idempotent(self):
+        registry = StreamRegistry()
+        registry.register("run-1")
+
+        assert registry.abort_run("run-1", "manual") == 1
+        assert registry.abort_run("run-1", "manual") == 0
+
+    async def test_unregister(self):
+        registry = StreamRegistry()
+        handle = registry.register("run-1")
+        registry.unregister(handle)
+
+        assert len(registry) == 0
+        assert registry.abort_run("run-1", "manual") == 0
+
+    async def test_exceed_budget(self):
+        """Budget cutoff aborts the stream and flags the error as budget"""
+        registry = StreamRegistry()
+        handle = registry.register("run-1")
+        handle.set_budget(max_chars=100, limit_name="daily")
+        response = FakeResponse()
+        handle.attach(response)
+
+        error = handle.exceed_budget()
+        await asyncio.sleep(0)
+
+        assert error.budget
+        assert error.reason == "budget_exceeded:daily"
+        assert response.closed
+
+
+@pytest.mark.asyncio
+class TestDisconnectAwareResponse:
+    """Test that a client disconnect stops the upstream stream"""
+
+    async def test_disconnect_aborts_and_closes_generator(self):
+        registry = StreamRegistry()
+        handle = registry.register("run-1")
+        response = FakeResponse()
+        handle.attach(response)
+        closed = asyncio.Event()
+        sent = []
+
+        async def body():
+            try:
+                yield b"data: 1\n\n"
+                await asyncio.sleep(10)  # provider pauses mid-generation
+                yield b"data: 2\n\n"
+            finally:
+                closed.set()
+
+        async def receive():
+            await asyncio.sleep(0.01)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        sse = DisconnectAwareResponse(body(), handle=handle, media_type="text/event-stream")
+        await asyncio.wait_for(sse({"type": "http"}, receive, send), timeout=1)
+        await asyncio.sleep(0)
+
+        assert handle.abort_reason == CLIENT_DISCONNECTED
+        assert response.closed
+        assert closed.is_set()
+        assert [m.get("body") for m in sent if m["type"] == "http.response.body"] == [b"data: 1\n\n"]
+
+    async def test_completed_stream_not_aborted(self):
+        registry = StreamRegistry()
+        handle = registry.register("run-1")
+
+        async def body():
+            yield b"data: [DONE]\n\n"
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def send(message):
+            pass
+
+        sse = DisconnectAwareResponse(body(), handle=handle, media_type="text/event-stream")
+        await asyncio.wait_for(sse({"type": "http"}, receive, send), timeout=1)
+
+        assert not handle.aborted
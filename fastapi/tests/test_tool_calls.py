@@ -0,0 +1,125 @@
+"""
+Tool-Call Tracking Tests
+Tests canonical hashing, pending-call extraction and per-run caps
+"""
+
+import pytest
+
+from services.run_tracker import RunTracker
+from services.tool_calls import (
+    ToolCall,
+    check_tool_counts,
+    pending_tool_calls,
+    tool_call_digest,
+)
+
+
+def assistant_calls(*calls) -> dict:
+    return {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": args}}
+            for i, (name, args) in enumerate(calls)
+        ],
+    }
+
+
+class TestToolCallDigest:
+    """Test canonical (name, arguments) hashing"""
+
+    def test_key_order_and_whitespace_ignored(self):
+        assert tool_call_digest("search", '{"q": "x", "n": 5}') == tool_call_digest("search", '{"n":5,"q":"x"}')
+
+    def test_name_and_arguments_matter(self):
+        assert tool_call_digest("search", '{"q": "x"}') != tool_call_digest("search", '{"q": "y"}')
+        assert tool_call_digest("search", '{"q": "x"}') != tool_call_digest("fetch", '{"q": "x"}')
+
+    def test_invalid_json_arguments(self):
+        assert tool_call_digest("run", " ls -la ") == tool_call_digest("run", "ls -la")
+
+
+class TestPendingToolCalls:
+    """Test which tool calls a request answers"""
+
+    def test_calls_followed_by_results(self):
+        messages = [
+            {"role": "user", "content": "find x"},
+            assistant_calls(("search", '{"q": "x"}'), ("read", '{"id": 1}')),
+            {"role": "tool", "tool_call_id": "call_0", "content": "..."},
+            {"role": "tool", "tool_call_id": "call_1", "content": "..."},
+        ]
+
+        assert [call.name for call in pending_tool_calls(messages)] == ["search", "read"]
+
+    def test_answered_calls_not_recounted(self):
+        messages = [
+            assistant_calls(("search", '{"q": "x"}')),
+            {"role": "tool", "tool_call_id": "call_0", "content": "..."},
+            {"role": "assistant", "content": "Done"},
+            {"role": "user", "content": "thanks"},
+        ]
+
+        assert pending_tool_calls(messages) == []
+
+
+class TestCheckToolCounts:
+    """Test per-tool caps and repeated-argument detection"""
+
+    def test_repeated_arguments(self):
+        call = ToolCall.from_message({"function": {"name": "search", "arguments": "{}"}})
+        counts = {call.tool_field: 4, call.args_field: 4}
+
+        violation = check_tool_counts([call], counts, max_calls_per_tool=10, repeat_limit=3)
+
+        assert violation.pattern_type == "repetitive_tool_call"
+        assert violation.count == 4
+
+    def test_tool_spam(self):
+        call = ToolCall.from_message({"function": {"name": "search", "arguments": '{"q": 11}'}})
+        counts = {call.tool_field: 11, call.args_field: 1}
+
+        violation = check_tool_counts([call], counts, max_calls_per_tool=10, repeat_limit=3)
+
+        assert violation.pattern_type == "tool_spam"
+        assert violation.tool_name == "search"
+
+    def test_within_limits(self):
+        call = ToolCall.from_message({"function": {"name": "search", "arguments": "{}"}})
+        counts = {call.tool_field: 3, call.args_field: 3}
+
+        assert check_tool_counts([call], counts, max_calls_per_tool=10, repeat_limit=3) is None
+
+
+@pytest.mark.asyncio
+class TestToolCallAdmission:
+    """Test tool-call caps enforced by RunTracker.process_step"""
+
+    async def test_repeated_call_kills_run(self):
+        tracker = RunTracker()
+        calls = pending_tool_calls([assistant_calls(("search", '{"q": "x"}'))])
+
+        for _ in range(3):
+            _, result = await tracker.process_step("run-1", "team-1", "user-1", tool_calls=calls)
+            assert result.allowed
+
+        state, result = await tracker.process_step("run-1", "team-1", "user-1", tool_calls=calls)
+
+        assert not result.allowed
+        assert result.tool_violation.pattern_type == "repetitive_tool_call"
+        assert state.status == "killed"
+        assert state.kill_reason == "repetitive_tool_call:search"
+
+    async def test_max_tool_calls_from_limits(self):
+        tracker = RunTracker()
+        limits = {"max_tool_calls": 2}
+
+        for i in range(2):
+            calls = pending_tool_calls([assistant_calls(("search", f'{{"q": {i}}}'))])
+            _, result = await tracker.process_step("run-1", "team-1", "user-1", limits=limits, tool_calls=calls)
+            assert result.allowed
+
+        calls = pending_tool_calls([assistant_calls(("search", '{"q": 2}'))])
+        _, result = await tracker.process_step("run-1", "team-1", "user-1", limits=limits, tool_calls=calls)
+
+        assert result.tool_violation.pattern_type == "tool_spam"
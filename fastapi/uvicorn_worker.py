@@ -0,0 +1,57 @@
+"""
+Gunicorn worker class for AgentWall
+
+Pins the fast event loop and HTTP parser instead of relying on "auto"
+detection, so a missing wheel fails loudly at boot rather than silently
+falling back to asyncio + h11.
+
+Drains before exiting: the first SIGTERM starts a drain (services.drain)
+while the server keeps running (health probes answer, readiness fails);
+the server shuts down once the drain is done. A second SIGTERM, SIGINT
+or SIGQUIT exits at once.
+"""
+
+import signal
+import sys
+
+from gunicorn.arbiter import Arbiter
+from uvicorn.main import Server
+from uvicorn.workers import UvicornWorker
+
+
+class DrainingServer(Server):
+    """uvicorn Server that drains the app before shutting down on SIGTERM"""
+
+    drain_requested = False
+
+    def handle_exit(self, sig, frame):
+        if sig == signal.SIGTERM and not self.drain_requested:
+            # Picked up by on_tick (on the event loop)
+            self.drain_requested = True
+            return
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter: int) -> bool:
+        if self.drain_requested and not self.should_exit:
+            from services.drain import drain_controller
+
+            drain_controller.start()
+            if drain_controller.done:
+                self.should_exit = True
+        return await super().on_tick(counter)
+
+
+class AgentWallWorker(UvicornWorker):
+    CONFIG_KWARGS = {
+        "loop": "uvloop",
+        "http": "httptools",
+        "lifespan": "on",
+    }
+
+    async def _serve(self) -> None:
+        self.config.app = self.wsgi
+        server = DrainingServer(config=self.config)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)